@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'meuprojeto.settings')
 
 application = get_asgi_application()
+
+# Pré-carregar os dados de referência (tipos, feriados, sucursais, ...)
+from meuprojeto.empresa.services.dados_referencia import aquecer  # noqa: E402
+
+aquecer()
@@ -7,4 +7,9 @@ class EmpresaConfig(AppConfig):
     verbose_name = 'Sistema de Gestão de Recursos Humanos'
 
     def ready(self):
+        # Os totais dos documentos primeiro: o índice de requisições (signals) lê-os
+        import meuprojeto.empresa.signals_totais
         import meuprojeto.empresa.signals
+        import meuprojeto.empresa.signals_alertas
+        import meuprojeto.empresa.signals_metricas
+        import meuprojeto.empresa.signals_referencia
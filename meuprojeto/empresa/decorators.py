@@ -1,8 +1,14 @@
 from functools import wraps
+import hashlib
+from datetime import datetime, time as dt_time
 from django.shortcuts import redirect
 from django.contrib import messages
 from django.core.exceptions import PermissionDenied
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
 from .models_rh import PerfilUsuario
+from .services.metricas_cache import alterado_em, versoes
 
 
 def require_sucursal_access(view_func):
@@ -100,6 +106,47 @@ def require_rh_access(view_func):
     return wrapper
 
 
+def resposta_condicional(*dominios, max_age=0):
+    """
+    Decorator de respostas condicionais para APIs JSON de leitura.
+
+    O ETag resume as versões dos `dominios` do cache de métricas, o
+    utilizador, o URL completo (parâmetros incluídos) e o dia corrente (as
+    janelas "últimos N dias" mudam à meia-noite); o Last-Modified é a última
+    invalidação desses domínios. Um If-None-Match / If-Modified-Since que
+    ainda corresponde recebe 304 sem que a view seja executada. As respostas
+    200 e 304 levam Cache-Control privado com `max_age` segundos (0: o browser
+    revalida sempre) e Vary: Cookie. Aplicar depois de login_required e
+    require_stock_access, para que as verificações de acesso corram primeiro.
+    """
+    def etag(request, *args, **kwargs):
+        partes = [versoes(dominios), request.user.pk, request.get_full_path(), timezone.localdate()]
+        return hashlib.sha1('|'.join(str(parte) for parte in partes).encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        inicio_do_dia = timezone.make_aware(datetime.combine(timezone.localdate(), dt_time.min))
+        return max(alterado_em(dominios), inicio_do_dia)
+
+    def decorator(view_func):
+        condicional = condition(etag_func=etag, last_modified_func=last_modified)(view_func)
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            response = condicional(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                patch_cache_control(response, private=True, max_age=max_age)
+                patch_vary_headers(response, ['Cookie'])
+            else:
+                # Erros não devem ser revalidados como se fossem a resposta actual
+                del response['ETag']
+                del response['Last-Modified']
+            return response
+
+        return wrapper
+
+    return decorator
+
+
 def get_user_sucursais(request, for_modification=False):
     """
     Função auxiliar para obter as sucursais que o usuário pode acessar
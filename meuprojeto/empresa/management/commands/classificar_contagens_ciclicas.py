@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from meuprojeto.empresa.services.contagem_ciclica import MESES, classificar
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula a classificação ABC/XYZ de cada item por sucursal e o intervalo da sua contagem cíclica '
+        '(agendar semanal ou mensalmente)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sucursal', type=int, action='append', help='ID da sucursal (pode repetir)')
+        parser.add_argument('--meses', type=int, default=MESES, help='Meses completos de movimentos considerados')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Classificando itens pelos movimentos dos últimos {options["meses"]} meses...')
+        inicio = time.perf_counter()
+        total = classificar(
+            sucursal_ids=options['sucursal'],
+            meses=max(1, options['meses']),
+            ao_progresso=lambda sucursal, itens: self.stdout.write(
+                f'  {sucursal.nome}: {itens} itens ({time.perf_counter() - inicio:.1f}s)'
+            ),
+        )
+        self.stdout.write(self.style.SUCCESS(f'✅ {total} itens classificados em {time.perf_counter() - inicio:.1f}s.'))
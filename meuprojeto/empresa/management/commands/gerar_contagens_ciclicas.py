@@ -0,0 +1,33 @@
+from datetime import datetime
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from meuprojeto.empresa.services.contagem_ciclica import gerar_sessoes
+
+
+class Command(BaseCommand):
+    help = 'Cria as sessões de contagem cíclica do dia em cada sucursal (agendar diariamente)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuario', required=True, help='Username do responsável pelas sessões')
+        parser.add_argument('--dia', help='Dia da sessão (AAAA-MM-DD, padrão: hoje)')
+        parser.add_argument('--sucursal', type=int, action='append', help='ID da sucursal (pode repetir)')
+        parser.add_argument('--limite', type=int, help='Máximo de itens por sessão (padrão: capacidade diária)')
+
+    def handle(self, *args, **options):
+        try:
+            usuario = User.objects.get(username=options['usuario'])
+        except User.DoesNotExist:
+            raise CommandError(f'Utilizador inexistente: {options["usuario"]}')
+        dia = None
+        if options['dia']:
+            try:
+                dia = datetime.strptime(options['dia'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError(f'Data inválida: {options["dia"]} (use AAAA-MM-DD)')
+
+        sessoes = gerar_sessoes(usuario, dia=dia, sucursal_ids=options['sucursal'], limite=options['limite'])
+        for inventario in sessoes:
+            self.stdout.write(f'  {inventario.codigo} {inventario.sucursal.nome}: {inventario.total_itens} itens')
+        self.stdout.write(self.style.SUCCESS(f'✅ {len(sessoes)} sessões de contagem criadas.'))
@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from meuprojeto.empresa.services.stock_snapshots import atualizar_snapshots, materializar_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Materializa os snapshots diários de stock (incremental; agendar diariamente após a meia-noite)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Regenerar a partir desta data (AAAA-MM-DD) em vez de continuar do último snapshot')
+        parser.add_argument('--ate', help='Último dia a regenerar (AAAA-MM-DD, padrão: ontem)')
+        parser.add_argument('--dias-por-lote', type=int, default=31, help='Dias processados por consulta/escrita')
+
+    def handle(self, *args, **options):
+        dias_por_lote = max(1, options['dias_por_lote'])
+
+        if options['desde']:
+            desde = self._data(options['desde'])
+            ate = self._data(options['ate']) if options['ate'] else None
+            self.stdout.write(f'Regenerando snapshots desde {desde}...')
+            total = materializar_snapshots(desde, ate, dias_por_lote=dias_por_lote)
+        else:
+            self.stdout.write('Actualizando snapshots desde o último dia materializado...')
+            total = atualizar_snapshots(dias_por_lote=dias_por_lote)
+
+        self.stdout.write(self.style.SUCCESS(f'✅ {total} snapshots gravados.'))
+
+    def _data(self, valor):
+        try:
+            return datetime.strptime(valor, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'Data inválida: {valor} (use AAAA-MM-DD)')
@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from meuprojeto.empresa.services.particionamento_movimentos import (
+    ESQUEMA_ARQUIVO, arquivar_particoes, converter_para_particionada, criar_particoes_futuras,
+    disponivel, esta_particionada, listar_particoes,
+)
+
+
+class Command(BaseCommand):
+    help = 'Gere as partições mensais de MovimentoItem (PostgreSQL): converter, criar meses futuros, arquivar meses antigos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--converter', action='store_true',
+                            help='Converter a tabela em particionada (bloqueia os movimentos durante a cópia; irreversível)')
+        parser.add_argument('--meses-futuros', type=int, default=3,
+                            help='Garantir partições do mês corrente e dos N meses seguintes')
+        parser.add_argument('--arquivar-antes-de', metavar='AAAA-MM',
+                            help='Desanexar e arquivar as partições dos meses anteriores a este')
+        parser.add_argument('--esquema-arquivo', default=ESQUEMA_ARQUIVO,
+                            help='Esquema para onde vão as partições arquivadas')
+
+    def handle(self, *args, **options):
+        if not disponivel():
+            raise CommandError('O particionamento de movimentos só é suportado em PostgreSQL.')
+
+        if options['converter']:
+            try:
+                convertida = converter_para_particionada(options['meses_futuros'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            if convertida:
+                self.stdout.write(self.style.SUCCESS('✅ Tabela de movimentos convertida em tabela particionada.'))
+        if not esta_particionada():
+            raise CommandError('A tabela de movimentos não está particionada (use --converter).')
+
+        criadas = criar_particoes_futuras(max(0, options['meses_futuros']))
+        self.stdout.write(f'Partições criadas: {", ".join(criadas) if criadas else "nenhuma (já existiam)"}')
+
+        if options['arquivar_antes_de']:
+            try:
+                corte = datetime.strptime(options['arquivar_antes_de'], '%Y-%m').date()
+                arquivadas = arquivar_particoes(corte, esquema=options['esquema_arquivo'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.WARNING(
+                f'Arquivadas em {options["esquema_arquivo"]}: {", ".join(arquivadas) if arquivadas else "nenhuma"}'
+            ))
+
+        self.stdout.write('=== PARTIÇÕES ANEXADAS ===')
+        for particao in listar_particoes():
+            mes = f'{particao.mes:%Y-%m}' if particao.mes else 'DEFAULT'
+            self.stdout.write(f'  {mes:<8} {particao.nome:<40} ~{particao.linhas_estimadas} linhas')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from meuprojeto.empresa.services.reservas_stock import libertar_expiradas
+
+
+class Command(BaseCommand):
+    help = 'Liberta as reservas de stock activas cujo prazo terminou (executar periodicamente, p.ex. por cron)'
+
+    def handle(self, *args, **options):
+        libertadas = libertar_expiradas()
+        if libertadas:
+            self.stdout.write(self.style.WARNING(f'⚠️ {libertadas} reserva(s) expirada(s) libertada(s).'))
+        else:
+            self.stdout.write(self.style.SUCCESS('✅ Nenhuma reserva expirada.'))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from meuprojeto.empresa.models_stock import OrdemCompra, RequisicaoCompraExterna, RequisicaoStock, TransferenciaStock
+
+
+DOCUMENTOS = (OrdemCompra, TransferenciaStock, RequisicaoStock, RequisicaoCompraExterna)
+
+
+class Command(BaseCommand):
+    help = 'Recalcula os totais guardados das ordens de compra, transferências e requisições a partir dos itens'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar', action='store_true',
+            help='Só lista os documentos com totais divergentes, sem gravar (os fechados a preço de custo '
+                 'divergem se o preço do item mudou depois de fechados)',
+        )
+
+    def handle(self, *args, **options):
+        for modelo in DOCUMENTOS:
+            nome = modelo._meta.verbose_name_plural
+            if not options['verificar']:
+                total = modelo.objects.recalcular_totais()
+                self.stdout.write(f'{nome}: {total} recalculados')
+                continue
+
+            divergentes = 0
+            for documento in modelo.objects.with_totals(calculados=True).order_by('pk').iterator():
+                diferencas = [
+                    f'{coluna} {getattr(documento, coluna)} != {getattr(documento, f"{coluna}_calculado")}'
+                    for coluna in modelo.TOTAIS
+                    if getattr(documento, coluna) != getattr(documento, f'{coluna}_calculado')
+                ]
+                if diferencas:
+                    divergentes += 1
+                    self.stdout.write(self.style.WARNING(f'  {documento.codigo}: {"; ".join(diferencas)}'))
+            self.stdout.write(f'{nome}: {divergentes} com totais divergentes')
+
+        self.stdout.write(self.style.SUCCESS('✅ Concluído.'))
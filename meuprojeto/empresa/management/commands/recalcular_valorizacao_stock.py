@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from meuprojeto.empresa.services.valorizacao_stock import recalcular_valorizacao, valor_em_stock
+
+
+class Command(BaseCommand):
+    help = 'Recalcula o custo médio ponderado e o valor de cada stock (item, sucursal) a partir do ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--item', type=int, action='append', help='ID do item (pode repetir)')
+        parser.add_argument('--sucursal', type=int, action='append', help='ID da sucursal (pode repetir)')
+        parser.add_argument('--lote', type=int, default=1000, help='Linhas gravadas por bulk_update')
+
+    def handle(self, *args, **options):
+        sucursal_ids = options['sucursal']
+        valor_antes = valor_em_stock(sucursal_ids)
+
+        self.stdout.write('Recalculando valorização do stock a partir dos movimentos...')
+        total = recalcular_valorizacao(
+            item_ids=options['item'],
+            sucursal_ids=sucursal_ids,
+            lote=max(1, options['lote']),
+        )
+
+        valor_depois = valor_em_stock(sucursal_ids)
+        self.stdout.write(f'Valor em stock: {valor_antes:.2f} MT -> {valor_depois:.2f} MT')
+        self.stdout.write(self.style.SUCCESS(f'✅ {total} linhas de stock revalorizadas.'))
@@ -0,0 +1,88 @@
+import csv
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from meuprojeto.empresa.models_base import Sucursal
+from meuprojeto.empresa.models_stock import Item
+from meuprojeto.empresa.services.reconciliacao_stock import particoes_de_itens, reconciliar_sucursal
+
+
+class Command(BaseCommand):
+    help = 'Compara StockItem com o ledger de MovimentoItem e gera um relatório de divergências (opcionalmente corrige)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sucursal', type=int, action='append', help='ID da sucursal (pode repetir; padrão: todas)')
+        parser.add_argument('--paralelo', type=int, default=4, help='Sucursais processadas em paralelo')
+        parser.add_argument('--particao', type=int, default=5000, help='IDs de item por partição (consulta agrupada)')
+        parser.add_argument('--relatorio', help='Ficheiro CSV do relatório (padrão: reconciliacao_stock_<data>.csv)')
+        parser.add_argument('--reparar', '--repair', dest='reparar', action='store_true',
+                            help='Repor em StockItem os saldos calculados a partir do ledger')
+
+    def handle(self, *args, **options):
+        sucursais = Sucursal.objects.order_by('id')
+        if options['sucursal']:
+            sucursais = sucursais.filter(id__in=options['sucursal'])
+        sucursais = list(sucursais.values_list('id', 'nome'))
+        nomes_sucursais = dict(sucursais)
+
+        particoes = particoes_de_itens(max(1, options['particao']))
+        caminho = options['relatorio'] or f"reconciliacao_stock_{timezone.now():%Y%m%d_%H%M%S}.csv"
+        reparar = options['reparar']
+
+        self.stdout.write(f'=== RECONCILIAÇÃO DO LEDGER DE STOCK{" (COM CORRECÇÃO)" if reparar else ""} ===')
+        self.stdout.write(f'Sucursais: {len(sucursais)} | Partições de itens: {len(particoes)} | Em paralelo: {options["paralelo"]}')
+
+        bloqueio = threading.Lock()
+        inicio = time.perf_counter()
+        total = 0
+
+        with open(caminho, 'w', newline='', encoding='utf-8') as ficheiro:
+            relatorio = csv.writer(ficheiro)
+            relatorio.writerow([
+                'sucursal_id', 'sucursal', 'item_id', 'codigo', 'item',
+                'saldo_registado', 'saldo_ledger', 'diferenca', 'corrigido'
+            ])
+
+            def escrever(divergencias):
+                itens = dict(
+                    (item_id, (codigo, nome))
+                    for item_id, codigo, nome in Item.objects.filter(
+                        id__in=[d.item_id for d in divergencias]
+                    ).values_list('id', 'codigo', 'nome')
+                )
+                with bloqueio:
+                    for d in divergencias:
+                        codigo, nome = itens.get(d.item_id, ('', ''))
+                        relatorio.writerow([
+                            d.sucursal_id, nomes_sucursais.get(d.sucursal_id, ''), d.item_id, codigo, nome,
+                            d.saldo_registado, d.saldo_ledger, d.saldo_ledger - d.saldo_registado,
+                            'sim' if reparar else 'não'
+                        ])
+
+            def processar(sucursal_id):
+                try:
+                    return reconciliar_sucursal(sucursal_id, particoes, reparar=reparar, ao_encontrar=escrever)
+                finally:
+                    connections.close_all()
+
+            with ThreadPoolExecutor(max_workers=max(1, options['paralelo'])) as executor:
+                futuros = {executor.submit(processar, sucursal_id): sucursal_id for sucursal_id, _ in sucursais}
+                for futuro in as_completed(futuros):
+                    sucursal_id = futuros[futuro]
+                    divergencias, _ = futuro.result()
+                    total += divergencias
+                    estilo = self.style.WARNING if divergencias else self.style.SUCCESS
+                    self.stdout.write(estilo(f'  {nomes_sucursais[sucursal_id]}: {divergencias} divergência(s)'))
+
+        duracao = time.perf_counter() - inicio
+        self.stdout.write(f'Relatório: {caminho} ({duracao:.2f}s)')
+        if total:
+            acao = 'corrigidas' if reparar else 'encontradas (use --reparar para corrigir)'
+            self.stdout.write(self.style.WARNING(f'⚠️ {total} divergência(s) {acao}.'))
+        else:
+            self.stdout.write(self.style.SUCCESS('✅ Todos os saldos coincidem com o ledger.'))
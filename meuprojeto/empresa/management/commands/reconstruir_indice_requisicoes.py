@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from meuprojeto.empresa.services.indice_requisicoes import reconstruir_indice
+
+
+class Command(BaseCommand):
+    help = 'Regenera o índice unificado de requisições (IndiceRequisicao) a partir das requisições'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Regenerando o índice de requisições...')
+        total = reconstruir_indice()
+        self.stdout.write(self.style.SUCCESS(f'✅ {total} requisições indexadas.'))
@@ -0,0 +1,29 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from meuprojeto.empresa.services.movimentos_diarios import reconstruir_movimentos_diarios
+
+
+class Command(BaseCommand):
+    help = 'Regenera os totais diários de movimentos (MovimentoDiario) a partir do ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Primeiro dia a regenerar (AAAA-MM-DD, padrão: início do ledger)')
+        parser.add_argument('--ate', help='Último dia a regenerar (AAAA-MM-DD, padrão: sem limite)')
+
+    def handle(self, *args, **options):
+        desde = self._data(options['desde']) if options['desde'] else None
+        ate = self._data(options['ate']) if options['ate'] else None
+        if desde and ate and desde > ate:
+            raise CommandError('--desde é posterior a --ate.')
+
+        self.stdout.write(f'Regenerando movimentos diários ({desde or "início"} a {ate or "hoje"})...')
+        total = reconstruir_movimentos_diarios(desde, ate)
+        self.stdout.write(self.style.SUCCESS(f'✅ {total} linhas de totais diários gravadas.'))
+
+    def _data(self, valor):
+        try:
+            return datetime.strptime(valor, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'Data inválida: {valor} (use AAAA-MM-DD)')
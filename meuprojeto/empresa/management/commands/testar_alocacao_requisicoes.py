@@ -0,0 +1,78 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from meuprojeto.empresa.services.alocacao_requisicoes import alocar
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark: alocação de requisições por várias sucursais fornecedoras (dados sintéticos, '
+        'sem base de dados) comparada com a sucursal única com mais stock do primeiro item'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--linhas', type=int, default=500, help='Linhas (itens distintos) por requisição')
+        parser.add_argument('--sucursais', type=int, default=30, help='Sucursais fornecedoras candidatas')
+        parser.add_argument('--requisicoes', type=int, default=20, help='Requisições sintéticas')
+        parser.add_argument('--presenca', type=float, default=0.5, help='Probabilidade de uma sucursal ter o item')
+        parser.add_argument('--semente', type=int, default=1, help='Semente do gerador aleatório')
+
+    def handle(self, *args, **options):
+        gerador = random.Random(options['semente'])
+        self.stdout.write(
+            f'=== BENCHMARK DE ALOCAÇÃO ({options["requisicoes"]} requisições de {options["linhas"]} linhas, '
+            f'{options["sucursais"]} sucursais) ==='
+        )
+
+        tempos, envios, divididas, por_cobrir, a_descoberto = [], [], [], [], []
+        for _ in range(options['requisicoes']):
+            necessidades, disponibilidade = self._requisicao(gerador, options)
+
+            inicio = time.perf_counter()
+            plano = alocar(necessidades, disponibilidade)
+            tempos.append((time.perf_counter() - inicio) * 1000)
+
+            envios.append(len(plano))
+            partes, alocado = {}, {}
+            for sucursal_id, linhas in plano.items():
+                for item_id, quantidade in linhas.items():
+                    partes[item_id] = partes.get(item_id, 0) + 1
+                    alocado[item_id] = alocado.get(item_id, 0) + quantidade
+                    assert quantidade <= disponibilidade[item_id][sucursal_id]
+            divididas.append(sum(1 for n in partes.values() if n > 1))
+            por_cobrir.append(sum(1 for item_id, q in necessidades.items() if alocado.get(item_id, 0) != q))
+            a_descoberto.append(self._descoberto_sucursal_unica(necessidades, disponibilidade))
+
+        self.stdout.write(f'Tempo de alocação (mediana):        {statistics.median(tempos):.2f}ms (máx. {max(tempos):.2f}ms)')
+        self.stdout.write(f'Transferências por requisição:      {statistics.mean(envios):.1f} (máx. {max(envios)})')
+        self.stdout.write(f'Linhas divididas por sucursais:     {statistics.mean(divididas):.1f}')
+        self.stdout.write(f'Linhas a descoberto:                {max(por_cobrir)}')
+        self.stdout.write(
+            f'Sucursal única (antes): 1 transferência, {statistics.mean(a_descoberto):.1f} linhas a descoberto '
+            f'de {options["linhas"]}'
+        )
+
+    def _requisicao(self, gerador, options):
+        """{item_id: quantidade} e {item_id: {sucursal_id: disponível}} sempre satisfazíveis"""
+        sucursais = range(1, options['sucursais'] + 1)
+        necessidades, disponibilidade = {}, {}
+        for item_id in range(1, options['linhas'] + 1):
+            quantidade = gerador.randint(1, 20)
+            stock = {s: gerador.randint(0, 40) for s in sucursais if gerador.random() < options['presenca']}
+            if sum(stock.values()) < quantidade:
+                stock[gerador.choice(sucursais)] = quantidade
+            necessidades[item_id] = quantidade
+            disponibilidade[item_id] = stock
+        return necessidades, disponibilidade
+
+    def _descoberto_sucursal_unica(self, necessidades, disponibilidade):
+        """Linhas que a sucursal com mais stock do primeiro item não cobre"""
+        primeiro = disponibilidade[min(necessidades)]
+        sucursal_id = max(primeiro, key=primeiro.get)
+        return sum(
+            1 for item_id, quantidade in necessidades.items()
+            if disponibilidade[item_id].get(sucursal_id, 0) < quantidade
+        )
@@ -0,0 +1,134 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from meuprojeto.empresa.models_stock import CodigoMovimento, StockItem, MovimentoItem, Item
+from meuprojeto.empresa.models_base import Sucursal
+from meuprojeto.empresa.services.stock_ledger import (
+    lancar_movimento, obter_tipo_movimento, StockInsuficienteError
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Teste de stress do ledger de stock: vários escritores em paralelo sobre o mesmo (item, sucursal). '
+        'Corre sobre um item e uma sucursal descartáveis criados pelo comando; os dados reais não são tocados'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--escritores', type=int, default=8, help='Número de threads em paralelo')
+        parser.add_argument('--movimentos', type=int, default=100, help='Movimentos por escritor em cada fase')
+        parser.add_argument('--manter', action='store_true',
+                            help='Não apagar o item, a sucursal e os movimentos de teste no fim')
+
+    def handle(self, *args, **options):
+        modelo_item = Item.objects.order_by('id').first()
+        modelo_sucursal = Sucursal.objects.order_by('id').first()
+        if not modelo_item or not modelo_sucursal:
+            raise CommandError('É necessário pelo menos um item e uma sucursal (servem de modelo aos de teste).')
+
+        escritores = options['escritores']
+        por_escritor = options['movimentos']
+        referencia = f'STRESS-{uuid.uuid4().hex[:8]}'
+
+        tipo_entrada = obter_tipo_movimento('ENT_COMPRA', 'Entrada por Compra', True, 'Entrada de stock por compra')
+        tipo_saida = obter_tipo_movimento('SAIDA', 'Saída de Stock', False, 'Saída de stock da sucursal')
+
+        item, sucursal = self._descartaveis(modelo_item, modelo_sucursal, referencia)
+        self.stdout.write(f'=== TESTE DE CONCORRÊNCIA DO LEDGER ({item.codigo} @ {sucursal.nome}) ===')
+        self.stdout.write(f'Escritores: {escritores} | Movimentos por escritor: {por_escritor}')
+
+        try:
+            for fase, tipo in (('Entradas', tipo_entrada), ('Saídas', tipo_saida)):
+                inicio = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=escritores) as executor:
+                    resultados = list(executor.map(
+                        lambda n: self._escrever(n, por_escritor, item, sucursal, tipo, referencia),
+                        range(escritores)
+                    ))
+                duracao = time.perf_counter() - inicio
+                total = sum(ok for ok, _ in resultados)
+                recusados = sum(falhas for _, falhas in resultados)
+                self.stdout.write(
+                    f'{fase}: {total} lançados, {recusados} recusados em {duracao:.2f}s '
+                    f'({total / duracao if duracao else 0:.0f} movimentos/s)'
+                )
+
+            saldo_final = self._saldo(item, sucursal)
+            lancados = MovimentoItem.objects.filter(referencia=referencia)
+            entradas = lancados.filter(tipo_movimento=tipo_entrada).count()
+            saidas = lancados.filter(tipo_movimento=tipo_saida).count()
+            esperado = entradas - saidas
+
+            self.stdout.write(f'Saldo final: {saldo_final} | Esperado pelo ledger: {esperado}')
+            if saldo_final == esperado:
+                self.stdout.write(self.style.SUCCESS('✅ Nenhuma actualização perdida.'))
+            else:
+                self.stdout.write(self.style.ERROR(f'❌ Actualizações perdidas: {esperado - saldo_final}'))
+
+            # Compensar pelo ledger o que sobrou, para o saldo de teste voltar a zero
+            if saldo_final > 0:
+                lancar_movimento(
+                    item=item, sucursal=sucursal, tipo_movimento=tipo_saida, quantidade=int(saldo_final),
+                    preco_unitario=item.preco_custo, referencia=referencia,
+                    observacoes='Teste de stress - compensação do saldo de teste',
+                )
+        finally:
+            if not options['manter']:
+                self._remover(item, sucursal, referencia)
+
+    def _descartaveis(self, modelo_item, modelo_sucursal, referencia):
+        """Item e sucursal inactivos, copiados dos modelos, só para o teste"""
+        sucursal = Sucursal.objects.get(pk=modelo_sucursal.pk)
+        sucursal.pk = sucursal.id = None
+        sucursal.codigo = ''
+        sucursal.nome = f'Teste de stress {referencia}'
+        sucursal.ativa = False
+        sucursal.save()
+
+        item = Item.objects.get(pk=modelo_item.pk)
+        item.pk = item.id = None
+        item.codigo = ''
+        item.nome = f'Teste de stress {referencia}'
+        item.status = 'INATIVO'
+        item.save()
+        return item, sucursal
+
+    def _remover(self, item, sucursal, referencia):
+        """Apaga os movimentos, saldos e agregados do item e da sucursal de teste (em cascata)"""
+        with transaction.atomic():
+            codigos = list(MovimentoItem.objects.filter(referencia=referencia).values_list('codigo', flat=True))
+            item.delete()
+            sucursal.delete()
+            CodigoMovimento.objects.filter(codigo__in=codigos).delete()
+        self.stdout.write('Item, sucursal e movimentos de teste removidos.')
+
+    def _saldo(self, item, sucursal):
+        stock = StockItem.objects.filter(item=item, sucursal=sucursal).values_list('quantidade_atual', flat=True).first()
+        return stock if stock is not None else Decimal('0')
+
+    def _escrever(self, numero, quantidade, item, sucursal, tipo, referencia):
+        lancados = recusados = 0
+        try:
+            for _ in range(quantidade):
+                try:
+                    lancar_movimento(
+                        item=item,
+                        sucursal=sucursal,
+                        tipo_movimento=tipo,
+                        quantidade=1,
+                        preco_unitario=item.preco_custo,
+                        codigo=f'LS{uuid.uuid4().hex[:18]}',
+                        referencia=referencia,
+                        observacoes=f'Teste de stress - escritor {numero}',
+                    )
+                    lancados += 1
+                except StockInsuficienteError:
+                    recusados += 1
+        finally:
+            connections.close_all()
+        return lancados, recusados
@@ -0,0 +1,118 @@
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from meuprojeto.empresa.models_base import Sucursal
+from meuprojeto.empresa.models_stock import (
+    HistoricoContagem, InventarioFisico, Item, ItemInventario, StockItem,
+)
+from meuprojeto.empresa.services import inventarios
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark: criação e submissão da contagem de um inventário de N itens linha a linha (antes) '
+        'e por operações de conjunto (services.inventarios). Corre numa transacção revertida no fim'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--itens', type=int, default=10000, help='Itens com stock na sucursal')
+
+    def handle(self, *args, **options):
+        sucursal = Sucursal.objects.filter(ativa=True).order_by('id').first()
+        if sucursal is None:
+            raise CommandError('É necessária uma sucursal activa.')
+        usuario = User.objects.order_by('id').first()
+        if usuario is None:
+            raise CommandError('É necessário um utilizador.')
+
+        self.stdout.write(f'=== BENCHMARK DE INVENTÁRIO EM LOTE ({options["itens"]} itens) ===')
+        with transaction.atomic():
+            self._stocks(sucursal, options['itens'])
+
+            inventario = self._inventario(sucursal, usuario)
+            criar_antes = self._medir(lambda: self._criar_linha_a_linha(inventario))
+            contar_antes = self._medir(lambda: self._contar_linha_a_linha(inventario, usuario))
+
+            inventario = self._inventario(sucursal, usuario)
+            criar_depois = self._medir(lambda: inventarios.gerar_itens(inventario, ao_progresso=self._progresso))
+            quantidades = dict(inventario.itens_inventario.values_list('id', 'quantidade_sistema'))
+            contar_depois = self._medir(
+                lambda: inventarios.registar_contagens(inventario, quantidades, usuario, ao_progresso=self._progresso)
+            )
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'Criar, linha a linha (antes):  {criar_antes[0]:>6} consultas {criar_antes[1]:>9.1f}ms')
+        self.stdout.write(f'Criar, INSERT ... SELECT:      {criar_depois[0]:>6} consultas {criar_depois[1]:>9.1f}ms')
+        self.stdout.write(f'Contar, linha a linha (antes): {contar_antes[0]:>6} consultas {contar_antes[1]:>9.1f}ms')
+        self.stdout.write(f'Contar, em lote:               {contar_depois[0]:>6} consultas {contar_depois[1]:>9.1f}ms')
+        self.stdout.write(self.style.SUCCESS('✅ Dados de teste revertidos.'))
+
+    def _progresso(self, feitos, total):
+        self.stdout.write(f'  {feitos}/{total}')
+
+    def _stocks(self, sucursal, quantidade):
+        """Garante `quantidade` itens com StockItem na sucursal; os que faltarem são criados (e revertidos)"""
+        itens = list(Item.objects.order_by('id')[:quantidade])
+        if len(itens) < quantidade:
+            modelo = itens[0] if itens else None
+            Item.objects.bulk_create([
+                Item(
+                    tipo='MATERIAL', material_tipo='MATERIA_PRIMA', nome=f'Item de benchmark {n}',
+                    codigo=f'BENCH-INV-{n}', categoria=modelo.categoria if modelo else None,
+                    preco_custo=Decimal('10.00'),
+                )
+                for n in range(quantidade - len(itens))
+            ])
+            itens = list(Item.objects.order_by('id')[:quantidade])
+        com_stock = set(StockItem.objects.filter(sucursal=sucursal).values_list('item_id', flat=True))
+        StockItem.objects.bulk_create([
+            StockItem(item=item, sucursal=sucursal, quantidade_atual=Decimal('5'))
+            for item in itens if item.id not in com_stock
+        ], batch_size=1000)
+
+    def _inventario(self, sucursal, usuario):
+        return InventarioFisico.objects.create(
+            nome='Benchmark', sucursal=sucursal, data_inicio=timezone.now(), observacoes='Benchmark',
+            usuario_responsavel=usuario, usuario_criador=usuario,
+        )
+
+    def _criar_linha_a_linha(self, inventario):
+        """Como a criação fazia: um ItemInventario.objects.create por StockItem"""
+        for stock_item in StockItem.objects.filter(sucursal=inventario.sucursal).select_related('item'):
+            ItemInventario.objects.create(
+                inventario=inventario, item=stock_item.item, quantidade_sistema=stock_item.quantidade_atual
+            )
+
+    def _contar_linha_a_linha(self, inventario, usuario):
+        """Como a submissão fazia: gravar cada linha e criar o seu HistoricoContagem"""
+        for linha in inventario.itens_inventario.all():
+            linha.numero_contagem += 1
+            linha.quantidade_contada = linha.quantidade_sistema
+            linha.diferenca = 0
+            linha.data_contagem = timezone.now()
+            linha.usuario_contador = usuario
+            linha.save()
+            HistoricoContagem.objects.create(
+                item_inventario=linha, numero_contagem=linha.numero_contagem,
+                quantidade_contada=linha.quantidade_contada, diferenca=0, data_contagem=linha.data_contagem,
+                usuario_contador=usuario,
+            )
+
+    def _medir(self, funcao):
+        consultas = []
+
+        def contar(executar, sql, params, many, context):
+            consultas.append(sql)
+            return executar(sql, params, many, context)
+
+        with connection.execute_wrapper(contar):
+            inicio = time.perf_counter()
+            funcao()
+            duracao = (time.perf_counter() - inicio) * 1000
+        return len(consultas), duracao
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from meuprojeto.empresa.models_base import Sucursal
+from meuprojeto.empresa.models_stock import Item, StockItem
+from meuprojeto.empresa.services import matriz_stock
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark: matriz itens × sucursais montada sucursal a sucursal (antes) e a partir dos blocos '
+        'em cache (frio, quente e depois de um lançamento num item)'
+    )
+
+    def handle(self, *args, **options):
+        n_itens = Item.objects.count()
+        n_sucursais = Sucursal.objects.filter(ativa=True).count()
+        self.stdout.write(f'=== BENCHMARK DA MATRIZ DE STOCK ({n_itens} itens × {n_sucursais} sucursais) ===')
+
+        self._relatar('Sucursal a sucursal (antes)', self._por_sucursal)
+
+        matriz_stock.invalidar_itens()
+        self._relatar('Blocos, cache frio', self._percorrer)
+        self._relatar('Blocos, cache quente', self._percorrer)
+
+        item_id = Item.objects.order_by('id').values_list('id', flat=True).first()
+        if item_id is not None:
+            matriz_stock.invalidar_itens([item_id])
+            self._relatar('Depois de lançar num item', self._percorrer)
+
+    def _relatar(self, nome, funcao):
+        with CaptureQueriesContext(connection) as consultas:
+            inicio = time.perf_counter()
+            linhas = funcao()
+            duracao = (time.perf_counter() - inicio) * 1000
+        self.stdout.write(f'{nome:<30} {linhas:>7} linhas {len(consultas):>5} consultas {duracao:>9.1f}ms')
+
+    def _por_sucursal(self):
+        """Como a verificação de stock fazia: os stocks de cada sucursal numa consulta própria"""
+        itens = list(Item.objects.order_by('id').values_list('id', 'codigo', 'nome', 'tipo'))
+        colunas = {}
+        for sucursal in Sucursal.objects.filter(ativa=True).order_by('nome'):
+            colunas[sucursal.id] = {
+                stock.item_id: (stock.quantidade_atual, stock.quantidade_disponivel, stock.valor_estoque)
+                for stock in StockItem.objects.filter(sucursal=sucursal)
+            }
+        return len([(item, [coluna.get(item[0]) for coluna in colunas.values()]) for item in itens])
+
+    def _percorrer(self):
+        _, linhas = matriz_stock.percorrer()
+        return sum(1 for _ in linhas)
@@ -0,0 +1,128 @@
+import re
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+
+ESQUEMA = 'teste_particionamento'
+
+# Consultas equivalentes às da listagem de movimentos, do gráfico do dashboard e dos relatórios
+CONSULTAS = [
+    ('Listagem (sucursal, 1 mês, 50 linhas)',
+     """SELECT id, item_id, quantidade, data_movimento FROM {tabela}
+        WHERE sucursal_id = 1 AND data_movimento >= now() - interval '30 days'
+        ORDER BY data_movimento DESC LIMIT 50"""),
+    ('Gráfico do dashboard (30 dias por dia)',
+     """SELECT date(data_movimento), count(*),
+               sum(CASE WHEN aumenta_estoque THEN 1 ELSE 0 END),
+               sum(CASE WHEN aumenta_estoque THEN 0 ELSE 1 END)
+        FROM {tabela} WHERE data_movimento >= now() - interval '30 days' AND sucursal_id = ANY(ARRAY[1, 2, 3])
+        GROUP BY 1 ORDER BY 1"""),
+    ('Relatório de movimentações (1 trimestre)',
+     """SELECT count(*), sum(quantidade) FROM {tabela}
+        WHERE data_movimento >= date_trunc('month', now()) - interval '3 months'
+          AND data_movimento < date_trunc('month', now())"""),
+    ('Histórico de um item (ano inteiro)',
+     """SELECT count(*), sum(quantidade) FROM {tabela} WHERE item_id = 7 AND sucursal_id = 1"""),
+]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark: latência das consultas ao ledger numa tabela simples vs particionada por mês (dados sintéticos de um ano)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--linhas', type=int, default=2000000, help='Movimentos sintéticos (distribuídos por 365 dias)')
+        parser.add_argument('--itens', type=int, default=5000, help='Número de itens distintos')
+        parser.add_argument('--sucursais', type=int, default=20, help='Número de sucursais distintas')
+        parser.add_argument('--repeticoes', type=int, default=7, help='Execuções por consulta (reporta a mediana)')
+        parser.add_argument('--manter', action='store_true', help=f'Não apagar o esquema {ESQUEMA} no fim')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Este benchmark requer PostgreSQL.')
+
+        self.stdout.write(f'=== BENCHMARK DE PARTICIONAMENTO ({options["linhas"]} movimentos, 1 ano) ===')
+        try:
+            with connection.cursor() as cursor:
+                inicio = time.perf_counter()
+                self._preparar(cursor, options)
+                self.stdout.write(f'Dados gerados e indexados em {time.perf_counter() - inicio:.1f}s')
+
+                self.stdout.write(f'{"Consulta":<42} {"simples":>10} {"particionada":>13} {"partições":>10}')
+                for nome, sql in CONSULTAS:
+                    simples = self._medir(cursor, sql.format(tabela=f'{ESQUEMA}.simples'), options['repeticoes'])
+                    particionada = self._medir(cursor, sql.format(tabela=f'{ESQUEMA}.particionada'), options['repeticoes'])
+                    lidas = self._particoes_lidas(cursor, sql.format(tabela=f'{ESQUEMA}.particionada'))
+                    self.stdout.write(f'{nome:<42} {simples:>8.2f}ms {particionada:>11.2f}ms {lidas:>7}/13')
+        finally:
+            if not options['manter']:
+                with connection.cursor() as cursor:
+                    cursor.execute(f'DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE')
+
+    def _preparar(self, cursor, options):
+        cursor.execute(f'DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE')
+        cursor.execute(f'CREATE SCHEMA {ESQUEMA}')
+        colunas = """
+            id bigint NOT NULL,
+            item_id integer NOT NULL,
+            sucursal_id integer NOT NULL,
+            aumenta_estoque boolean NOT NULL,
+            quantidade numeric(10, 3) NOT NULL,
+            data_movimento timestamptz NOT NULL
+        """
+        cursor.execute(f'CREATE TABLE {ESQUEMA}.simples ({colunas})')
+        cursor.execute(f'CREATE TABLE {ESQUEMA}.particionada ({colunas}) PARTITION BY RANGE (data_movimento)')
+        # 12 meses para trás + mês corrente
+        for n in range(12, -1, -1):
+            cursor.execute(
+                f"""
+                DO $$
+                DECLARE inicio timestamptz := date_trunc('month', now()) - interval '{n} months';
+                BEGIN
+                    EXECUTE format('CREATE TABLE {ESQUEMA}.particionada_%s PARTITION OF {ESQUEMA}.particionada
+                                    FOR VALUES FROM (%L) TO (%L)',
+                                   to_char(inicio, 'YYYYMM'), inicio, inicio + interval '1 month');
+                END $$
+                """
+            )
+
+        cursor.execute(
+            f"""
+            INSERT INTO {ESQUEMA}.simples
+            SELECT g,
+                   1 + (random() * (%s - 1))::int,
+                   1 + (random() * (%s - 1))::int,
+                   random() < 0.5,
+                   round((random() * 100)::numeric, 3),
+                   greatest(now() - random() * interval '365 days', date_trunc('month', now()) - interval '12 months')
+            FROM generate_series(1, %s) g
+            """,
+            [options['itens'], options['sucursais'], options['linhas']],
+        )
+        cursor.execute(f'INSERT INTO {ESQUEMA}.particionada SELECT * FROM {ESQUEMA}.simples')
+
+        # Os mesmos índices do modelo MovimentoItem nas duas tabelas
+        for tabela in ('simples', 'particionada'):
+            cursor.execute(f'ALTER TABLE {ESQUEMA}.{tabela} ADD PRIMARY KEY (id, data_movimento)')
+            cursor.execute(f'CREATE INDEX ON {ESQUEMA}.{tabela} (item_id, sucursal_id)')
+            cursor.execute(f'CREATE INDEX ON {ESQUEMA}.{tabela} (data_movimento)')
+            cursor.execute(f'CREATE INDEX ON {ESQUEMA}.{tabela} (sucursal_id, data_movimento)')
+            cursor.execute(f'ANALYZE {ESQUEMA}.{tabela}')
+
+    def _medir(self, cursor, sql, repeticoes):
+        cursor.execute(sql)  # aquecimento da cache
+        cursor.fetchall()
+        tempos = []
+        for _ in range(max(1, repeticoes)):
+            inicio = time.perf_counter()
+            cursor.execute(sql)
+            cursor.fetchall()
+            tempos.append((time.perf_counter() - inicio) * 1000)
+        return statistics.median(tempos)
+
+    def _particoes_lidas(self, cursor, sql):
+        cursor.execute(f'EXPLAIN {sql}')
+        plano = '\n'.join(linha[0] for linha in cursor.fetchall())
+        return len(set(re.findall(r'particionada_\d{6}', plano)))
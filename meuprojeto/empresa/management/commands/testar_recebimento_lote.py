@@ -0,0 +1,95 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from meuprojeto.empresa.models_base import Sucursal
+from meuprojeto.empresa.models_stock import Item, ItemTransferencia, MovimentoItem, TransferenciaStock
+from meuprojeto.empresa.services.recebimentos import receber_transferencia
+from meuprojeto.empresa.services.stock_ledger import obter_tipo_movimento
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark: recebimento de uma transferência de N linhas linha a linha (antes) e em lote '
+        '(services.recebimentos). Corre numa transacção revertida no fim'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--linhas', type=int, default=1000, help='Linhas da transferência')
+
+    def handle(self, *args, **options):
+        sucursais = list(Sucursal.objects.filter(ativa=True).order_by('id')[:2])
+        if len(sucursais) < 2:
+            raise CommandError('São necessárias duas sucursais activas.')
+        origem, destino = sucursais
+
+        self.stdout.write(f'=== BENCHMARK DE RECEBIMENTO EM LOTE ({options["linhas"]} linhas) ===')
+        with transaction.atomic():
+            itens = self._itens(options['linhas'])
+
+            transferencia = self._transferencia(origem, destino, itens)
+            antes = self._medir(lambda: self._linha_a_linha(transferencia))
+
+            transferencia = self._transferencia(origem, destino, itens)
+            quantidades = {linha_id: 1 for linha_id in transferencia.itens.values_list('id', flat=True)}
+            depois = self._medir(lambda: receber_transferencia(transferencia, quantidades))
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'Linha a linha (antes): {antes[0]:>6} consultas {antes[1]:>9.1f}ms')
+        self.stdout.write(f'Em lote:               {depois[0]:>6} consultas {depois[1]:>9.1f}ms')
+        self.stdout.write(self.style.SUCCESS('✅ Dados de teste revertidos.'))
+
+    def _itens(self, quantidade):
+        """Itens para as linhas; os que faltarem são criados (e revertidos no fim)"""
+        itens = list(Item.objects.order_by('id')[:quantidade])
+        if len(itens) < quantidade:
+            modelo = itens[0] if itens else None
+            Item.objects.bulk_create([
+                Item(
+                    tipo='MATERIAL', material_tipo='MATERIA_PRIMA', nome=f'Item de benchmark {n}',
+                    codigo=f'BENCH-RECEB-{n}', categoria=modelo.categoria if modelo else None,
+                    preco_custo=Decimal('10.00'),
+                )
+                for n in range(quantidade - len(itens))
+            ])
+            itens = list(Item.objects.order_by('id')[:quantidade])
+        return itens
+
+    def _transferencia(self, origem, destino, itens):
+        transferencia = TransferenciaStock.objects.create(
+            sucursal_origem=origem, sucursal_destino=destino, status='ENVIADA', observacoes='Benchmark'
+        )
+        ItemTransferencia.objects.bulk_create([
+            ItemTransferencia(transferencia=transferencia, item=item, quantidade_solicitada=1) for item in itens
+        ])
+        return transferencia
+
+    def _linha_a_linha(self, transferencia):
+        """Como o recebimento fazia: gravar cada linha e criar um MovimentoItem por linha"""
+        tipo_entrada = obter_tipo_movimento('ENT_COMPRA', 'Entrada por Compra', True, 'Entrada de stock por compra')
+        for linha in transferencia.itens.select_related('item'):
+            linha.quantidade_recebida = 1
+            linha.save()
+            MovimentoItem.objects.create(
+                item=linha.item, sucursal=transferencia.sucursal_destino, tipo_movimento=tipo_entrada,
+                quantidade=1, preco_unitario=linha.item.preco_custo,
+                observacoes=f'Recebimento {transferencia.codigo}',
+            )
+        transferencia.status = 'RECEBIDA'
+        transferencia.save()
+
+    def _medir(self, funcao):
+        consultas = []
+
+        def contar(executar, sql, params, many, context):
+            consultas.append(sql)
+            return executar(sql, params, many, context)
+
+        with connection.execute_wrapper(contar):
+            inicio = time.perf_counter()
+            funcao()
+            duracao = (time.perf_counter() - inicio) * 1000
+        return len(consultas), duracao
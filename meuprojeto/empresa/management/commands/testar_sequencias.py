@@ -0,0 +1,79 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from meuprojeto.empresa.models_base import SequenciaDocumento
+from meuprojeto.empresa.services.sequencias import proximo_codigo, proximos_codigos
+
+
+class Command(BaseCommand):
+    help = 'Benchmark das sequências de documentos: vários processos a gerar códigos em paralelo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--escritores', type=int, default=8, help='Número de threads em paralelo')
+        parser.add_argument('--codigos', type=int, default=200, help='Códigos gerados por escritor')
+        parser.add_argument('--lote', type=int, default=50, help='Tamanho do lote no modo de reserva em bloco')
+        parser.add_argument('--manter', action='store_true', help='Não apagar as sequências de teste no fim')
+
+    def handle(self, *args, **options):
+        escritores = options['escritores']
+        por_escritor = options['codigos']
+        lote = max(1, options['lote'])
+        prefixo = f'BENCH{uuid.uuid4().hex[:6].upper()}-'
+
+        self.stdout.write(f'=== BENCHMARK DE SEQUÊNCIAS ({prefixo}) ===')
+        self.stdout.write(f'Escritores: {escritores} | Códigos por escritor: {por_escritor} | Lote: {lote}')
+
+        modos = (
+            ('Unitário (1 reserva por código)', f'{prefixo}U', self._gerar_unitario),
+            (f'Em bloco ({lote} códigos por reserva)', f'{prefixo}B', self._gerar_em_bloco),
+        )
+        for descricao, chave, gerar in modos:
+            inicio = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=escritores) as executor:
+                resultados = list(executor.map(
+                    lambda _: gerar(chave, por_escritor, lote),
+                    range(escritores)
+                ))
+            duracao = time.perf_counter() - inicio
+
+            codigos = [codigo for codigos in resultados for codigo in codigos]
+            numeros = sorted(int(codigo[len(chave):]) for codigo in codigos)
+            duplicados = len(numeros) - len(set(numeros))
+            sem_buracos = numeros == list(range(1, len(numeros) + 1))
+
+            self.stdout.write(
+                f'{descricao}: {len(codigos)} códigos em {duracao:.2f}s '
+                f'({len(codigos) / duracao if duracao else 0:.0f} códigos/s)'
+            )
+            if not duplicados and sem_buracos:
+                self.stdout.write(self.style.SUCCESS('  ✅ Sem duplicados e sem buracos.'))
+            else:
+                self.stdout.write(self.style.ERROR(f'  ❌ Duplicados: {duplicados} | Sequência contínua: {sem_buracos}'))
+
+        if not options['manter']:
+            SequenciaDocumento.objects.filter(chave__startswith=prefixo).delete()
+
+    def _gerar_unitario(self, chave, quantidade, _lote):
+        codigos = []
+        try:
+            for _ in range(quantidade):
+                # Uma transacção por documento, como num save() normal
+                with transaction.atomic():
+                    codigos.append(proximo_codigo(chave, chave=chave))
+        finally:
+            connections.close_all()
+        return codigos
+
+    def _gerar_em_bloco(self, chave, quantidade, lote):
+        codigos = []
+        try:
+            while len(codigos) < quantidade:
+                with transaction.atomic():
+                    codigos.extend(proximos_codigos(chave, min(lote, quantidade - len(codigos)), chave=chave))
+        finally:
+            connections.close_all()
+        return codigos
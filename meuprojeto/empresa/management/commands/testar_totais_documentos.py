@@ -0,0 +1,74 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+
+from meuprojeto.empresa.models_stock import OrdemCompra, RequisicaoCompraExterna, RequisicaoStock, TransferenciaStock
+
+
+LISTAGENS = (
+    ('Ordens de compra', OrdemCompra, ('fornecedor', 'sucursal_destino')),
+    ('Transferências', TransferenciaStock, ('sucursal_origem', 'sucursal_destino')),
+    ('Requisições internas', RequisicaoStock, ('sucursal_origem', 'sucursal_destino')),
+    ('Requisições de compra', RequisicaoCompraExterna, ('sucursal_solicitante',)),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark: consultas e tempo para listar uma página de documentos com número de itens e valores, '
+        'somando os itens por documento (antes) e com with_totals() (totais guardados)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pagina', type=int, default=20, help='Documentos por página')
+
+    def handle(self, *args, **options):
+        tamanho = options['pagina']
+        self.stdout.write(f'=== BENCHMARK DE TOTAIS DOS DOCUMENTOS (páginas de {tamanho}) ===')
+
+        for nome, modelo, relacionados in LISTAGENS:
+            base = modelo.objects.select_related(*relacionados).order_by('-data_criacao')
+            antes = self._medir(lambda: self._por_documento(base[:tamanho], modelo))
+            depois = self._medir(lambda: self._com_totais(base, tamanho, modelo))
+            relatorio = self._medir(lambda: modelo.objects.aggregate(**{
+                coluna: Sum(coluna) for coluna in modelo.TOTAIS
+            }))
+            self.stdout.write(
+                f'{nome:<24} antes: {antes[0]:>4} consultas {antes[1]:>8.1f}ms | '
+                f'with_totals: {depois[0]:>2} consultas {depois[1]:>6.1f}ms | '
+                f'soma do relatório: {relatorio[0]} consulta {relatorio[1]:.1f}ms'
+            )
+
+    def _medir(self, funcao):
+        with CaptureQueriesContext(connection) as consultas:
+            inicio = time.perf_counter()
+            funcao()
+            duracao = (time.perf_counter() - inicio) * 1000
+        return len(consultas), duracao
+
+    def _por_documento(self, documentos, modelo):
+        """Como as listagens faziam: itens.count e os totais somados em Python a partir dos itens"""
+        linhas = []
+        for documento in documentos:
+            itens = list(documento.itens.all())
+            totais = {}
+            for coluna, (quantidade, preco) in modelo.TOTAIS.items():
+                totais[coluna] = sum(
+                    getattr(item, quantidade) * (self._valor(item, preco) or 0) for item in itens
+                )
+            linhas.append((documento.itens.count(), totais))
+        return linhas
+
+    def _com_totais(self, base, tamanho, modelo):
+        return [
+            (documento.total_itens, {coluna: getattr(documento, coluna) for coluna in modelo.TOTAIS})
+            for documento in base.with_totals()[:tamanho]
+        ]
+
+    def _valor(self, objecto, caminho):
+        for campo in caminho.split('__'):
+            objecto = getattr(objecto, campo) if objecto is not None else None
+        return objecto
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('empresa', '0122_alter_eventorastreamento_tipo_evento_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SequenciaDocumento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chave', models.CharField(help_text='Identificador da sequência (ex: MOV, REQ, Departamento:3:ADM)', max_length=100, unique=True)),
+                ('ultimo_valor', models.BigIntegerField(default=0, help_text='Último número atribuído')),
+                ('data_atualizacao', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Sequência de Documento',
+                'verbose_name_plural': 'Sequências de Documentos',
+                'ordering': ['chave'],
+            },
+        ),
+    ]
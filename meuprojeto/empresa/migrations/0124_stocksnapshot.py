@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('empresa', '0123_sequenciadocumento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField(help_text='Dia a que se refere o saldo (fecho do dia)')),
+                ('quantidade', models.DecimalField(decimal_places=3, default=0, help_text='Quantidade em estoque no fecho do dia', max_digits=10)),
+                ('valor', models.DecimalField(decimal_places=2, default=0, help_text='Valor do estoque no fecho do dia', max_digits=15)),
+                ('data_atualizacao', models.DateTimeField(auto_now=True)),
+                ('item', models.ForeignKey(help_text='Item (produto ou material)', on_delete=django.db.models.deletion.CASCADE, related_name='snapshots_stock', to='empresa.item')),
+                ('sucursal', models.ForeignKey(help_text='Sucursal', on_delete=django.db.models.deletion.CASCADE, related_name='snapshots_stock', to='empresa.sucursal')),
+            ],
+            options={
+                'verbose_name': 'Snapshot de Stock',
+                'verbose_name_plural': 'Snapshots de Stock',
+                'ordering': ['-data'],
+                'indexes': [models.Index(fields=['sucursal', 'data'], name='empresa_sto_sucursa_462278_idx'), models.Index(fields=['data'], name='empresa_sto_data_b95509_idx')],
+                'unique_together': {('item', 'sucursal', 'data')},
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:12
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+
+
+def inicializar_custo_medio(apps, schema_editor):
+    """Valorizar o stock existente ao preço de custo actual (recalcular_valorizacao_stock refaz a partir do ledger)"""
+    StockItem = apps.get_model('empresa', 'StockItem')
+    Item = apps.get_model('empresa', 'Item')
+
+    StockItem.objects.update(
+        custo_medio=Subquery(Item.objects.filter(id=OuterRef('item_id')).values('preco_custo')[:1])
+    )
+    StockItem.objects.update(valor_estoque=F('quantidade_atual') * F('custo_medio'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('empresa', '0124_stocksnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockitem',
+            name='custo_medio',
+            field=models.DecimalField(decimal_places=4, default=0, help_text='Custo médio ponderado do stock existente (actualizado a cada entrada)', max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='stockitem',
+            name='valor_estoque',
+            field=models.DecimalField(decimal_places=2, default=0, help_text='Valor do stock existente ao custo médio (quantidade atual x custo médio)', max_digits=15),
+        ),
+        migrations.AddIndex(
+            model_name='stockitem',
+            index=models.Index(fields=['sucursal', 'valor_estoque'], name='empresa_sto_sucursa_e122b0_idx'),
+        ),
+        migrations.RunPython(inicializar_custo_medio, migrations.RunPython.noop),
+    ]
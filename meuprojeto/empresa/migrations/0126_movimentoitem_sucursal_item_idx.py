@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('empresa', '0125_stockitem_custo_medio'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movimentoitem',
+            index=models.Index(fields=['sucursal', 'item'], name='empresa_mov_sucursa_41b07c_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-17 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Prepara empresa_movimentoitem para o particionamento por data_movimento,
+    que continua opcional e é pedido explicitamente (manage.py
+    gerir_particoes_movimentos --converter): a unicidade de `codigo` passa a
+    ser (codigo, data_movimento) e a unicidade global dos códigos fica na
+    tabela CodigoMovimento, preenchida com os códigos existentes.
+    """
+
+    dependencies = [
+        ('empresa', '0126_movimentoitem_sucursal_item_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CodigoMovimento',
+            fields=[
+                ('codigo', models.CharField(max_length=20, primary_key=True, serialize=False)),
+            ],
+            options={
+                'verbose_name': 'Código de Movimento',
+                'verbose_name_plural': 'Códigos de Movimento',
+            },
+        ),
+        migrations.RunSQL(
+            'INSERT INTO empresa_codigomovimento (codigo) SELECT DISTINCT codigo FROM empresa_movimentoitem',
+            migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name='movimentoitem',
+            name='codigo',
+            field=models.CharField(help_text='Código único da movimentação (ver CodigoMovimento)', max_length=20),
+        ),
+        migrations.AddConstraint(
+            model_name='movimentoitem',
+            constraint=models.UniqueConstraint(fields=('codigo', 'data_movimento'), name='empresa_movimentoitem_codigo_data_uniq'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.6 on 2026-10-17 11:05
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def inicializar_abaixo_minimo(apps, schema_editor):
+    """Marcar os stocks que já estão no mínimo ou abaixo (sem gerar notificações)"""
+    StockItem = apps.get_model('empresa', 'StockItem')
+
+    StockItem.objects.filter(
+        item__estoque_minimo__gt=0,
+        quantidade_atual__lte=F('item__estoque_minimo'),
+    ).update(abaixo_minimo=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('empresa', '0127_codigomovimento_unicidade'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockitem',
+            name='abaixo_minimo',
+            field=models.BooleanField(default=False, help_text='Se a quantidade atual está no estoque mínimo do item ou abaixo (mantido por services/alertas_stock.py)'),
+        ),
+        migrations.AlterField(
+            model_name='notificacaostock',
+            name='tipo',
+            field=models.CharField(choices=[('stock_baixo', 'Stock Baixo'), ('stock_reposto', 'Stock Reposto'), ('requisicao_pendente', 'Requisição Pendente'), ('movimentacao_sem_usuario', 'Movimentação sem Usuário'), ('requisicao_antiga', 'Requisição Antiga'), ('sistema', 'Sistema'), ('info', 'Informação'), ('warning', 'Aviso'), ('error', 'Erro')], help_text='Tipo da notificação', max_length=30),
+        ),
+        migrations.AddIndex(
+            model_name='stockitem',
+            index=models.Index(condition=models.Q(('abaixo_minimo', True)), fields=['sucursal', 'item'], name='empresa_sto_abaixo_minimo_idx'),
+        ),
+        migrations.RunPython(inicializar_abaixo_minimo, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-17 14:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('empresa', '0128_stockitem_abaixo_minimo'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservaStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantidade', models.DecimalField(decimal_places=3, help_text='Quantidade reservada', max_digits=10)),
+                ('estado', models.CharField(choices=[('ATIVA', 'Activa'), ('CONSUMIDA', 'Consumida'), ('LIBERTADA', 'Libertada'), ('EXPIRADA', 'Expirada')], default='ATIVA', help_text='Estado da reserva', max_length=10)),
+                ('expira_em', models.DateTimeField(help_text='Data a partir da qual a reserva activa é libertada automaticamente')),
+                ('data_criacao', models.DateTimeField(auto_now_add=True)),
+                ('data_fecho', models.DateTimeField(blank=True, help_text='Data em que a reserva foi consumida, libertada ou expirou', null=True)),
+                ('criado_por', models.ForeignKey(blank=True, help_text='Usuário que criou a reserva', null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('item', models.ForeignKey(help_text='Item reservado', on_delete=django.db.models.deletion.CASCADE, related_name='reservas_stock', to='empresa.item')),
+                ('requisicao', models.ForeignKey(blank=True, help_text='Requisição que originou a reserva', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='empresa.requisicaostock')),
+                ('sucursal', models.ForeignKey(help_text='Sucursal onde a quantidade está reservada', on_delete=django.db.models.deletion.CASCADE, related_name='reservas_stock', to='empresa.sucursal')),
+                ('transferencia', models.ForeignKey(blank=True, help_text='Transferência que originou a reserva', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='empresa.transferenciastock')),
+            ],
+            options={
+                'verbose_name': 'Reserva de Stock',
+                'verbose_name_plural': 'Reservas de Stock',
+                'ordering': ['-data_criacao'],
+                'indexes': [models.Index(fields=['item', 'sucursal'], name='empresa_res_item_id_915131_idx'), models.Index(condition=models.Q(('estado', 'ATIVA')), fields=['expira_em'], name='empresa_res_ativa_expira_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.6 on 2026-10-17 13:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def preencher_movimentos_diarios(apps, schema_editor):
+    """Totais diários dos movimentos já registados"""
+    MovimentoItem = apps.get_model('empresa', 'MovimentoItem')
+    MovimentoDiario = apps.get_model('empresa', 'MovimentoDiario')
+
+    linhas = MovimentoItem.objects.annotate(dia=TruncDate('data_movimento')).values(
+        'dia', 'sucursal_id', 'item__tipo', 'tipo_movimento__aumenta_estoque'
+    ).annotate(n=Count('id'), total_quantidade=Sum('quantidade'), total_valor=Sum('valor_total')).order_by()
+
+    MovimentoDiario.objects.bulk_create([
+        MovimentoDiario(
+            dia=linha['dia'],
+            sucursal_id=linha['sucursal_id'],
+            tipo_item=linha['item__tipo'],
+            aumenta_estoque=linha['tipo_movimento__aumenta_estoque'],
+            movimentos=linha['n'],
+            quantidade=linha['total_quantidade'] or 0,
+            valor=linha['total_valor'] or 0,
+        )
+        for linha in linhas
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('empresa', '0129_reservastock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovimentoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField(help_text='Dia dos movimentos')),
+                ('tipo_item', models.CharField(choices=[('PRODUTO', 'Produto'), ('MATERIAL', 'Material')], help_text='Tipo dos itens movimentados', max_length=20)),
+                ('aumenta_estoque', models.BooleanField(help_text='Entradas (True) ou saídas (False)')),
+                ('movimentos', models.PositiveIntegerField(default=0, help_text='Número de movimentos')),
+                ('quantidade', models.DecimalField(decimal_places=3, default=0, help_text='Quantidade movimentada', max_digits=15)),
+                ('valor', models.DecimalField(decimal_places=2, default=0, help_text='Soma do valor total dos movimentos', max_digits=15)),
+                ('sucursal', models.ForeignKey(help_text='Sucursal', on_delete=django.db.models.deletion.CASCADE, related_name='movimentos_diarios', to='empresa.sucursal')),
+            ],
+            options={
+                'verbose_name': 'Movimento Diário',
+                'verbose_name_plural': 'Movimentos Diários',
+                'ordering': ['-dia'],
+                'unique_together': {('dia', 'sucursal', 'tipo_item', 'aumenta_estoque')},
+            },
+        ),
+        migrations.RunPython(preencher_movimentos_diarios, migrations.RunPython.noop),
+    ]
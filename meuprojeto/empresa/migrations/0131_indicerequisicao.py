@@ -0,0 +1,81 @@
+# Generated by Django 5.2.6 on 2026-10-17 15:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+
+
+def preencher_indice_requisicoes(apps, schema_editor):
+    """Uma linha do índice por requisição interna e de compra externa já existente"""
+    IndiceRequisicao = apps.get_model('empresa', 'IndiceRequisicao')
+    origens = [
+        ('INTERNA', apps.get_model('empresa', 'RequisicaoStock'),
+         'sucursal_origem_id', 'sucursal_destino_id', 'itens__item__preco_custo'),
+        ('EXTERNA', apps.get_model('empresa', 'RequisicaoCompraExterna'),
+         'sucursal_solicitante_id', None, 'itens__preco_unitario_estimado'),
+    ]
+    for tipo, modelo, sucursal, sucursal_destino, preco in origens:
+        linhas = modelo.objects.annotate(
+            n_itens=Count('itens'),
+            valor=Sum(ExpressionWrapper(
+                F('itens__quantidade_solicitada') * F(preco),
+                output_field=DecimalField(max_digits=15, decimal_places=2),
+            )),
+        ).values(
+            'id', 'codigo', 'status', sucursal, *([sucursal_destino] if sucursal_destino else []),
+            'criado_por_id', 'observacoes', 'data_criacao', 'n_itens', 'valor',
+        ).order_by()
+
+        IndiceRequisicao.objects.bulk_create([
+            IndiceRequisicao(
+                tipo=tipo,
+                requisicao_id=linha['id'],
+                codigo=linha['codigo'],
+                status=linha['status'],
+                sucursal_id=linha[sucursal],
+                sucursal_destino_id=linha[sucursal_destino] if sucursal_destino else None,
+                criado_por_id=linha['criado_por_id'],
+                observacoes=linha['observacoes'] or '',
+                data_criacao=linha['data_criacao'],
+                total_itens=linha['n_itens'],
+                valor_total=linha['valor'] or 0,
+            )
+            for linha in linhas
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('empresa', '0130_movimentodiario'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndiceRequisicao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('INTERNA', 'Requisição Interna'), ('EXTERNA', 'Compra Externa')], help_text='Tipo da requisição', max_length=10)),
+                ('requisicao_id', models.PositiveBigIntegerField(help_text='ID da RequisicaoStock ou RequisicaoCompraExterna')),
+                ('codigo', models.CharField(help_text='Código da requisição', max_length=20)),
+                ('status', models.CharField(choices=[('RASCUNHO', 'Rascunho'), ('PENDENTE', 'Pendente'), ('APROVADA', 'Aprovada'), ('REJEITADA', 'Rejeitada'), ('ATENDIDA', 'Atendida'), ('CANCELADA', 'Cancelada'), ('ENVIADA', 'Enviada ao Fornecedor'), ('RECEBIDA', 'Recebida')], help_text='Status da requisição', max_length=20)),
+                ('observacoes', models.TextField(blank=True)),
+                ('data_criacao', models.DateTimeField(help_text='Data de criação da requisição')),
+                ('total_itens', models.PositiveIntegerField(default=0)),
+                ('valor_total', models.DecimalField(decimal_places=2, default=0, help_text='Valor solicitado (preço de custo ou preço estimado)', max_digits=15)),
+                ('criado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('sucursal', models.ForeignKey(help_text='Sucursal que solicita', on_delete=django.db.models.deletion.CASCADE, related_name='+', to='empresa.sucursal')),
+                ('sucursal_destino', models.ForeignKey(blank=True, help_text='Sucursal que fornece (só requisições internas)', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='empresa.sucursal')),
+            ],
+            options={
+                'verbose_name': 'Índice de Requisição',
+                'verbose_name_plural': 'Índice de Requisições',
+                'ordering': ['-data_criacao', '-id'],
+                'indexes': [models.Index(fields=['-data_criacao', '-id'], name='indice_req_data_idx'), models.Index(fields=['status', '-data_criacao'], name='indice_req_status_idx')],
+                'unique_together': {('tipo', 'requisicao_id')},
+            },
+        ),
+        migrations.RunPython(preencher_indice_requisicoes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 5.2.6 on 2026-10-17 16:05
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+# modelo -> (modelo dos itens, campo do documento, {coluna: (quantidade, preço)})
+TOTAIS = {
+    'OrdemCompra': ('ItemOrdemCompra', 'ordem_compra', {
+        'valor_total': ('quantidade_solicitada', 'preco_unitario'),
+    }),
+    'TransferenciaStock': ('ItemTransferencia', 'transferencia', {
+        'valor_total': ('quantidade_solicitada', 'item__preco_custo'),
+        'valor_recebido': ('quantidade_recebida', 'item__preco_custo'),
+    }),
+    'RequisicaoStock': ('ItemRequisicaoStock', 'requisicao', {
+        'valor_total': ('quantidade_solicitada', 'item__preco_custo'),
+        'valor_atendido': ('quantidade_atendida', 'item__preco_custo'),
+    }),
+    'RequisicaoCompraExterna': ('ItemRequisicaoCompraExterna', 'requisicao', {
+        'valor_total': ('quantidade_solicitada', 'preco_unitario_estimado'),
+        'valor_recebido': ('quantidade_recebida', 'preco_unitario_estimado'),
+    }),
+}
+
+
+def preencher_totais(apps, schema_editor):
+    """Totais dos documentos existentes, um UPDATE por modelo"""
+    decimal = DecimalField(max_digits=15, decimal_places=2)
+    for nome, (nome_itens, campo, colunas) in TOTAIS.items():
+        itens = apps.get_model('empresa', nome_itens).objects.filter(**{campo: OuterRef('pk')}).order_by()
+        valores = {}
+        for coluna, (quantidade, preco) in colunas.items():
+            soma = itens.values(campo).annotate(
+                total=Sum(ExpressionWrapper(F(quantidade) * F(preco), output_field=decimal))
+            ).values('total')
+            valores[coluna] = Coalesce(Subquery(soma), Value(Decimal('0')), output_field=decimal)
+        apps.get_model('empresa', nome).objects.update(**valores)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('empresa', '0131_indicerequisicao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ordemcompra',
+            name='valor_total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='requisicaocompraexterna',
+            name='valor_recebido',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='requisicaocompraexterna',
+            name='valor_total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='requisicaostock',
+            name='valor_atendido',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='requisicaostock',
+            name='valor_total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='transferenciastock',
+            name='valor_recebido',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='transferenciastock',
+            name='valor_total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=15),
+        ),
+        migrations.RunPython(preencher_totais, migrations.RunPython.noop),
+    ]
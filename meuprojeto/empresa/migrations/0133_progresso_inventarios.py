@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-17 17:10
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def preencher_progresso(apps, schema_editor):
+    """Contadores dos inventários existentes num UPDATE"""
+    itens = apps.get_model('empresa', 'ItemInventario').objects.filter(
+        inventario=OuterRef('pk')
+    ).order_by().values('inventario')
+
+    def contar(**filtro):
+        return Coalesce(Subquery(itens.filter(**filtro).annotate(total=Count('pk')).values('total')), Value(0))
+
+    apps.get_model('empresa', 'InventarioFisico').objects.update(
+        total_itens=contar(),
+        itens_contados=contar(quantidade_contada__isnull=False),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('empresa', '0132_totais_documentos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventariofisico',
+            name='itens_contados',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Itens já contados'),
+        ),
+        migrations.AddField(
+            model_name='inventariofisico',
+            name='total_itens',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Total de itens no inventário'),
+        ),
+        migrations.RunPython(preencher_progresso, migrations.RunPython.noop),
+    ]
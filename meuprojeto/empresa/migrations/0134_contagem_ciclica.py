@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-17 17:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('empresa', '0133_progresso_inventarios'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClassificacaoContagem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('classe_abc', models.CharField(choices=[('A', 'A - Alto valor'), ('B', 'B - Valor médio'), ('C', 'C - Baixo valor')], help_text='Classe pelo valor das saídas', max_length=1)),
+                ('classe_xyz', models.CharField(choices=[('X', 'X - Consumo regular'), ('Y', 'Y - Consumo variável'), ('Z', 'Z - Consumo esporádico')], help_text='Classe pela regularidade das saídas', max_length=1)),
+                ('valor_saidas', models.DecimalField(decimal_places=2, default=0, help_text='Valor das saídas no período da classificação', max_digits=15)),
+                ('saidas', models.PositiveIntegerField(default=0, help_text='Número de movimentos de saída no período')),
+                ('coeficiente_variacao', models.DecimalField(blank=True, decimal_places=3, help_text='Coeficiente de variação das saídas mensais (vazio sem saídas)', max_digits=8, null=True)),
+                ('intervalo_dias', models.PositiveIntegerField(help_text='Dias entre contagens')),
+                ('ultima_contagem', models.DateField(blank=True, help_text='Dia da última sessão de contagem cíclica que incluiu o item', null=True)),
+                ('proxima_contagem', models.DateField(help_text='Dia a partir do qual o item entra nas sessões de contagem')),
+                ('data_classificacao', models.DateTimeField(default=django.utils.timezone.now, help_text='Quando a classe foi calculada')),
+                ('item', models.ForeignKey(help_text='Item classificado', on_delete=django.db.models.deletion.CASCADE, related_name='classificacoes_contagem', to='empresa.item')),
+                ('sucursal', models.ForeignKey(help_text='Sucursal', on_delete=django.db.models.deletion.CASCADE, related_name='classificacoes_contagem', to='empresa.sucursal')),
+            ],
+            options={
+                'verbose_name': 'Classificação para Contagem Cíclica',
+                'verbose_name_plural': 'Classificações para Contagem Cíclica',
+                'indexes': [models.Index(fields=['sucursal', 'proxima_contagem'], name='empresa_cla_sucursa_ed461b_idx')],
+                'unique_together': {('item', 'sucursal')},
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-17 18:05
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def snapshot_dos_abertos(apps, schema_editor):
+    """Os inventários em aberto copiaram o stock ao serem criados"""
+    apps.get_model('empresa', 'InventarioFisico').objects.filter(
+        status__in=['PLANEJADO', 'EM_ANDAMENTO']
+    ).update(data_snapshot=F('data_criacao'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('empresa', '0134_contagem_ciclica'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventariofisico',
+            name='data_snapshot',
+            field=models.DateTimeField(blank=True, help_text='Momento em que as quantidades do sistema foram copiadas do stock', null=True),
+        ),
+        migrations.AddField(
+            model_name='iteminventario',
+            name='variacao_stock',
+            field=models.IntegerField(default=0, help_text='Saldo dos movimentos lançados entre o snapshot do inventário e a contagem'),
+        ),
+        migrations.AlterField(
+            model_name='iteminventario',
+            name='diferenca',
+            field=models.IntegerField(default=0, help_text='Diferença entre contado e esperado (contado - sistema - variação)'),
+        ),
+        migrations.RunPython(snapshot_dos_abertos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.6 on 2026-10-17 19:40
+
+from django.db import migrations
+
+from meuprojeto.empresa.services.sequencias import maior_numero_existente
+
+
+SEQUENCIA = 'empresa_codigo_mov_seq'
+
+
+def criar_sequencia(apps, schema_editor):
+    """SEQUENCE dos códigos MOV, a continuar do contador e dos códigos já gravados (só PostgreSQL)"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    SequenciaDocumento = apps.get_model('empresa', 'SequenciaDocumento')
+    ultimo = max(
+        SequenciaDocumento.objects.filter(chave='MOV').values_list('ultimo_valor', flat=True).first() or 0,
+        maior_numero_existente(apps.get_model('empresa', 'MovimentoItem').objects, 'codigo', 'MOV'),
+        maior_numero_existente(apps.get_model('empresa', 'MovimentoStock').objects, 'codigo', 'MOV'),
+    )
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'CREATE SEQUENCE IF NOT EXISTS {SEQUENCIA}')
+        cursor.execute('SELECT setval(%s, %s, false)', [SEQUENCIA, ultimo + 1])
+
+
+def remover_sequencia(apps, schema_editor):
+    """Devolve o último número atribuído ao contador MOV e remove a SEQUENCE"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'SELECT CASE WHEN is_called THEN last_value ELSE last_value - 1 END FROM {SEQUENCIA}')
+        ultimo = cursor.fetchone()[0]
+        cursor.execute(f'DROP SEQUENCE {SEQUENCIA}')
+    apps.get_model('empresa', 'SequenciaDocumento').objects.update_or_create(
+        chave='MOV', defaults={'ultimo_valor': ultimo}
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('empresa', '0135_reconciliacao_contagens'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_sequencia, remover_sequencia),
+    ]
@@ -5,6 +5,7 @@ from django.utils import timezone
 from django.db.models.signals import post_save, pre_save
 from django.dispatch import receiver
 from .config_mocambique import TIPOS_SOCIETARIOS_MOZ, ACTIVIDADES_ECONOMICAS
+from .services.sequencias import proximo_codigo, reservar_numeros
 
 class Provincia(models.TextChoices):
     MAPUTO_CIDADE = 'MP', 'Maputo Cidade'
@@ -156,19 +157,18 @@ class DadosEmpresa(models.Model):
         Gera código da empresa no formato: NUMERO_SEQUENCIAL + NOME_EMPRESA
         Exemplo: 001Conception, 002Tecnologia, 003Comercial
         """
-        # Buscar próxima sequência
-        ultima_empresa = DadosEmpresa.objects.filter(
-            codigo_empresa__regex=r'^\d{3}'
-        ).order_by('-codigo_empresa').first()
-        
-        if ultima_empresa and ultima_empresa.codigo_empresa:
+        def maior_sequencia():
+            ultima_empresa = DadosEmpresa.objects.filter(
+                codigo_empresa__regex=r'^\d{3}'
+            ).order_by('-codigo_empresa').first()
             try:
                 # Extrair sequência (ex: 001Conception -> 1)
-                sequencia = int(ultima_empresa.codigo_empresa[:3]) + 1
-            except (ValueError, IndexError):
-                sequencia = 1
-        else:
-            sequencia = 1
+                return int(ultima_empresa.codigo_empresa[:3]) if ultima_empresa else 0
+            except (ValueError, TypeError):
+                return 0
+        
+        # Buscar próxima sequência
+        sequencia = reservar_numeros('EMPRESA', semente=maior_sequencia)[0]
         
         # Limpar nome da empresa (remover espaços e caracteres especiais)
         nome_limpo = ''.join(c for c in self.nome if c.isalnum())
@@ -207,21 +207,10 @@ class DadosEmpresa(models.Model):
                 )
         # Se é um novo registro e não tem código, gera um
         elif not self.codigo_empresa:
-            # Usando select_for_update para evitar duplicação de códigos
-            with transaction.atomic():
-                ultima_empresa = DadosEmpresa.objects.select_for_update().order_by('-id').first()
-                if ultima_empresa and ultima_empresa.codigo_empresa:
-                    try:
-                        # Extrai o número do código e incrementa
-                        ultimo_num = int(ultima_empresa.codigo_empresa[3:])  # Remove o prefixo e converte para inteiro
-                        novo_num = ultimo_num + 1
-                    except (ValueError, IndexError):
-                        novo_num = 1
-                else:
-                    novo_num = 1
-                
-                # Formata o código com 3 dígitos
-                self.codigo_empresa = f"EMP{novo_num:03d}"
+            # Sequência EMP### (reserva atómica, sem varrer a tabela)
+            self.codigo_empresa = proximo_codigo(
+                'EMP', largura=3, existentes=[(DadosEmpresa.objects, 'codigo_empresa')]
+            )
         
         # Salva o modelo
         super().save(*args, **kwargs)
@@ -452,10 +441,11 @@ class Sucursal(models.Model):
                 )
 
     def save(self, *args, **kwargs):
-        # Gerar código automaticamente se não foi fornecido
-        if not self.codigo:
-            self.codigo = self.gerar_codigo_sucursal()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            # Gerar código automaticamente se não foi fornecido
+            if not self.codigo:
+                self.codigo = self.gerar_codigo_sucursal()
+            super().save(*args, **kwargs)
 
     def gerar_codigo_sucursal(self):
         """
@@ -476,23 +466,12 @@ class Sucursal(models.Model):
         if len(iniciais) < 3:
             iniciais = iniciais.ljust(3, 'X')
         
-        # Buscar próxima sequência para esta empresa
+        # Próxima sequência para esta empresa
         prefixo = f"{codigo_empresa}{iniciais}(SUCURSAL)"
-        ultima_sucursal = Sucursal.objects.filter(
-            empresa_sede=self.empresa_sede,
-            codigo__startswith=prefixo
-        ).order_by('-codigo').first()
-        
-        if ultima_sucursal and ultima_sucursal.codigo:
-            try:
-                # Extrair sequência (ex: 001CON(SUCURSAL)001 -> 1)
-                sequencia = int(ultima_sucursal.codigo[-3:]) + 1
-            except (ValueError, IndexError):
-                sequencia = 1
-        else:
-            sequencia = 1
-        
-        return f"{prefixo}{sequencia:03d}"
+        return proximo_codigo(
+            prefixo, largura=3, chave=f'Sucursal:{prefixo}',
+            existentes=[(Sucursal.objects.filter(empresa_sede=self.empresa_sede), 'codigo')]
+        )
 
     class Meta:
         verbose_name = 'Sucursal'
@@ -500,6 +479,35 @@ class Sucursal(models.Model):
         ordering = ['nome']
 
 
+class SequenciaDocumento(models.Model):
+    """
+    Contador por tipo de documento (MOV, REQ, COMP, AJUSTE, CONS, ...).
+
+    Os números são reservados com um UPDATE atómico dentro da transacção de
+    quem grava o documento (ver services/sequencias.py): sem count()+1, sem
+    ciclos de exists() e sem buracos quando a gravação é revertida. Em
+    PostgreSQL os códigos MOV usam uma SEQUENCE e não este contador.
+    """
+    chave = models.CharField(
+        max_length=100,
+        unique=True,
+        help_text='Identificador da sequência (ex: MOV, REQ, Departamento:3:ADM)'
+    )
+    ultimo_valor = models.BigIntegerField(
+        default=0,
+        help_text='Último número atribuído'
+    )
+    data_atualizacao = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.chave} = {self.ultimo_valor}"
+
+    class Meta:
+        verbose_name = 'Sequência de Documento'
+        verbose_name_plural = 'Sequências de Documentos'
+        ordering = ['chave']
+
+
 # Signal para capturar o valor original do codigo_empresa antes do salvamento
 @receiver(pre_save, sender=DadosEmpresa)
 def capturar_codigo_empresa_original(sender, instance, **kwargs):
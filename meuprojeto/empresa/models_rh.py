@@ -1,9 +1,10 @@
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import RegexValidator
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from decimal import Decimal
 from .models_base import Sucursal
+from .services.sequencias import proximo_codigo
 
 def validar_telefone_moz(value):
     """Valida telefone de Moçambique no formato +258XXXXXXXXX.
@@ -121,30 +122,17 @@ class Departamento(models.Model):
 
     def save(self, *args, **kwargs):
         """Override save para gerar código automaticamente"""
-        if not self.codigo or self.codigo.strip() == '':
-            # Gerar código do departamento: TIPO-XXX
-            prefixo = self.tipo if hasattr(self, 'tipo') and self.tipo else 'ADM'
-            
-            # Encontra o próximo número sequencial disponível para esta sucursal
-            ultimo = Departamento.objects.filter(
-                sucursal=self.sucursal,
-                codigo__startswith=prefixo
-            ).order_by('-codigo').first()
-            
-            if ultimo and ultimo.codigo:
-                try:
-                    # Extrai o número do último código
-                    ultimo_num = int(ultimo.codigo.split('-')[-1])
-                    novo_num = ultimo_num + 1
-                except (ValueError, IndexError):
-                    novo_num = 1
-            else:
-                novo_num = 1
+        with transaction.atomic():
+            if not self.codigo or self.codigo.strip() == '':
+                # Gerar código do departamento: TIPO-XXX (sequência por sucursal e tipo)
+                prefixo = self.tipo if hasattr(self, 'tipo') and self.tipo else 'ADM'
+                self.codigo = proximo_codigo(
+                    f"{prefixo}-", largura=3,
+                    chave=f'Departamento:{self.sucursal_id}:{prefixo}',
+                    existentes=[(Departamento.objects.filter(sucursal_id=self.sucursal_id), 'codigo')]
+                )
             
-            # Gera o novo código
-            self.codigo = f"{prefixo}-{novo_num:03d}"
-        
-        super().save(*args, **kwargs)
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.codigo} - {self.nome} ({self.sucursal.nome})"
@@ -305,25 +293,16 @@ class Cargo(models.Model):
     )
 
     def save(self, *args, **kwargs):
-        if not self.codigo_cargo:
-            # Gerar código do cargo: DEPT-NIVEL-XXX
-            ultimo_cargo = Cargo.objects.filter(
-                departamento=self.departamento,
-                nivel=self.nivel
-            ).order_by('-codigo_cargo').first()
-
-            if ultimo_cargo and ultimo_cargo.codigo_cargo:
-                try:
-                    ultimo_num = int(ultimo_cargo.codigo_cargo.split('-')[-1])
-                    novo_num = ultimo_num + 1
-                except (ValueError, IndexError):
-                    novo_num = 1
-            else:
-                novo_num = 1
-
-            self.codigo_cargo = f"{self.departamento.codigo[:3]}-{self.nivel}-{novo_num:03d}"
+        with transaction.atomic():
+            if not self.codigo_cargo:
+                # Gerar código do cargo: DEPT-NIVEL-XXX (sequência por departamento e nível)
+                self.codigo_cargo = proximo_codigo(
+                    f"{self.departamento.codigo[:3]}-{self.nivel}-", largura=3,
+                    chave=f'Cargo:{self.departamento_id}:{self.nivel}',
+                    existentes=[(Cargo.objects.filter(departamento_id=self.departamento_id, nivel=self.nivel), 'codigo_cargo')]
+                )
 
-        super().save(*args, **kwargs)
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.nome} {self.get_nivel_display()} - {self.departamento.nome}"
@@ -475,22 +454,15 @@ class Funcionario(models.Model):
                     funcionario=self,
                     status='AT'
                 ).first()
-        # Se não tem código, gera um novo
-        elif not self.codigo_funcionario:
-            ultimo_funcionario = Funcionario.objects.order_by('-codigo_funcionario').first()
-            
-            if ultimo_funcionario and ultimo_funcionario.codigo_funcionario:
-                try:
-                    ultimo_num = int(ultimo_funcionario.codigo_funcionario[4:])
-                    novo_num = ultimo_num + 1
-                except (ValueError, IndexError):
-                    novo_num = 1
-            else:
-                novo_num = 1
-            
-            self.codigo_funcionario = f"CONS{novo_num:03d}"
         
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            # Se não tem código, gera um novo
+            if not self.id and not self.codigo_funcionario:
+                self.codigo_funcionario = proximo_codigo(
+                    'CONS', largura=3, existentes=[(Funcionario.objects, 'codigo_funcionario')]
+                )
+            
+            super().save(*args, **kwargs)
         
         # Criar histórico APÓS salvar o funcionário
         if criar_historico and salario_anterior:
@@ -942,12 +914,12 @@ class HorasExtras(models.Model):
         Retorna: (tipo_principal, justificativa, sugestao_misto)
         """
         from datetime import time, datetime, date, timedelta
-        from .models_rh import Feriado
+        from .services.dados_referencia import e_feriado
         
         sucursal = funcionario.sucursal
         
         # 1. VERIFICAR SE É FERIADO
-        if Feriado.objects.filter(data=data, ativo=True).exists():
+        if e_feriado(data):
             return 'EX', 'Feriado - Trabalho Extraordinário', None
         
         # 2. VERIFICAR SE É FINAL DE SEMANA
@@ -1276,31 +1248,19 @@ class BeneficioSalarial(models.Model):
         ordering = ['nome']
     
     def save(self, *args, **kwargs):
-        # Se não houver código ou estiver vazio, gera um código automático
-        if not self.codigo or self.codigo.strip() == '':
-            # Pega o prefixo baseado no tipo
-            prefixo = self.tipo if hasattr(self, 'tipo') and self.tipo else 'BN'
-            
-            # Encontra o próximo número sequencial disponível
-            ultimo = BeneficioSalarial.objects.filter(
-                codigo__startswith=prefixo
-            ).order_by('-codigo').first()
-            
-            if ultimo and ultimo.codigo.startswith(prefixo):
-                try:
-                    # Tenta extrair o número e incrementar
-                    num = int(ultimo.codigo[len(prefixo):]) + 1
-                except (ValueError, IndexError):
-                    # Se não conseguir extrair o número, começa do 1
-                    num = 1
-            else:
-                # Primeiro item deste tipo
-                num = 1
+        with transaction.atomic():
+            # Se não houver código ou estiver vazio, gera um código automático
+            if not self.codigo or self.codigo.strip() == '':
+                # Pega o prefixo baseado no tipo
+                prefixo = self.tipo if hasattr(self, 'tipo') and self.tipo else 'BN'
                 
-            # Formata o código (ex: SA001, HE005, etc.)
-            self.codigo = f"{prefixo}{num:03d}"
-        
-        super().save(*args, **kwargs)
+                # Formata o código (ex: SA001, HE005, etc.)
+                self.codigo = proximo_codigo(
+                    prefixo, largura=3, chave=f'BeneficioSalarial:{prefixo}',
+                    existentes=[(BeneficioSalarial.objects, 'codigo')]
+                )
+            
+            super().save(*args, **kwargs)
     
     @property
     def is_nao_monetario(self):
@@ -1393,31 +1353,19 @@ class DescontoSalarial(models.Model):
         ordering = ['nome']
     
     def save(self, *args, **kwargs):
-        # Se não houver código ou estiver vazio, gera um código automático
-        if not self.codigo or self.codigo.strip() == '':
-            # Pega o prefixo baseado no tipo
-            prefixo = self.tipo if hasattr(self, 'tipo') and self.tipo else 'DC'
-            
-            # Encontra o próximo número sequencial disponível
-            ultimo = DescontoSalarial.objects.filter(
-                codigo__startswith=prefixo
-            ).order_by('-codigo').first()
-            
-            if ultimo and ultimo.codigo.startswith(prefixo):
-                try:
-                    # Tenta extrair o número e incrementar
-                    num = int(ultimo.codigo[len(prefixo):]) + 1
-                except (ValueError, IndexError):
-                    # Se não conseguir extrair o número, começa do 1
-                    num = 1
-            else:
-                # Primeiro item deste tipo
-                num = 1
+        with transaction.atomic():
+            # Se não houver código ou estiver vazio, gera um código automático
+            if not self.codigo or self.codigo.strip() == '':
+                # Pega o prefixo baseado no tipo
+                prefixo = self.tipo if hasattr(self, 'tipo') and self.tipo else 'DC'
                 
-            # Formata o código (ex: IR001, IN002, etc.)
-            self.codigo = f"{prefixo}{num:03d}"
-        
-        super().save(*args, **kwargs)
+                # Formata o código (ex: IR001, IN002, etc.)
+                self.codigo = proximo_codigo(
+                    prefixo, largura=3, chave=f'DescontoSalarial:{prefixo}',
+                    existentes=[(DescontoSalarial.objects, 'codigo')]
+                )
+            
+            super().save(*args, **kwargs)
     
     def calcular_valor_desconto(self, salario_base, salario_bruto, salario_liquido):
         """Calcula o valor do desconto baseado no tipo e base de cálculo"""
@@ -2531,6 +2479,7 @@ class FuncionarioFolha(models.Model):
         INSS e IRPS são calculados automaticamente sem depender de configuração
         na tabela DescontoSalarial, tornando-os nativos do sistema.
         """
+        from .services.dados_referencia import desconto_salarial, descontos_automaticos as descontos_automaticos_referencia
         
         total_descontos_automaticos = Decimal('0.00')
         
@@ -2544,8 +2493,8 @@ class FuncionarioFolha(models.Model):
             ).first()
             
             if not inss_existente:
-                # Buscar ou criar desconto INSS (evitar duplicatas)
-                desconto_inss, created = DescontoSalarial.objects.get_or_create(
+                # Buscar (registo de referência) ou criar desconto INSS (evitar duplicatas)
+                desconto_inss = desconto_salarial('IN001') or DescontoSalarial.objects.get_or_create(
                     codigo='IN001',
                     defaults={
                         'nome': 'INSS Moçambique',
@@ -2557,7 +2506,7 @@ class FuncionarioFolha(models.Model):
                         'aplicar_automaticamente': False,  # Não é automático, é nativo
                         'valor_minimo_isencao': Decimal('0.00')
                     }
-                )
+                )[0]
                 
                 # Criar desconto automático na folha
                 DescontoFolha.objects.create(
@@ -2578,8 +2527,8 @@ class FuncionarioFolha(models.Model):
             ).first()
             
             if not irps_existente:
-                # Buscar ou criar desconto IRPS (evitar duplicatas)
-                desconto_irps, created = DescontoSalarial.objects.get_or_create(
+                # Buscar (registo de referência) ou criar desconto IRPS (evitar duplicatas)
+                desconto_irps = desconto_salarial('IR001') or DescontoSalarial.objects.get_or_create(
                     codigo='IR001',
                     defaults={
                         'nome': 'IRPS Moçambique',
@@ -2591,7 +2540,7 @@ class FuncionarioFolha(models.Model):
                         'aplicar_automaticamente': False,  # Não é automático, é nativo
                         'valor_minimo_isencao': Decimal('19000.00')
                     }
-                )
+                )[0]
                 
                 # Criar desconto automático na folha
                 DescontoFolha.objects.create(
@@ -2603,10 +2552,7 @@ class FuncionarioFolha(models.Model):
                 total_descontos_automaticos += irps_valor
         
         # 3. CALCULAR OUTROS DESCONTOS AUTOMÁTICOS (não INSS/IRPS)
-        descontos_automaticos = DescontoSalarial.objects.filter(
-            ativo=True,
-            aplicar_automaticamente=True
-        ).exclude(codigo__in=['IN001', 'IR001'])  # Excluir INSS e IRPS
+        descontos_automaticos = descontos_automaticos_referencia(excluir=('IN001', 'IR001'))  # Excluir INSS e IRPS
         
         for desconto in descontos_automaticos:
             valor_desconto = desconto.calcular_valor_desconto(
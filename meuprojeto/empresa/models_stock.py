@@ -1,4 +1,5 @@
-﻿from django.db import models
+﻿from django.db import models, transaction
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.core.exceptions import ValidationError
 from django.utils import timezone
@@ -6,6 +7,75 @@ from decimal import Decimal
 from django.contrib.auth.models import User
 
 from .models_base import DadosEmpresa, Sucursal
+from .services.sequencias import proximo_codigo
+
+
+def codigos_movimento():
+    """Tabelas com códigos MOV#### (inicialização da sequência MOV)"""
+    return [(MovimentoItem.objects, 'codigo'), (MovimentoStock.objects, 'codigo')]
+
+
+def codigos_compra():
+    """Tabelas com códigos COMP#### (ordens de compra e requisições externas partilham a sequência)"""
+    return [(OrdemCompra.objects, 'codigo'), (RequisicaoCompraExterna.objects, 'codigo')]
+
+
+class DocumentoQuerySet(models.QuerySet):
+    """
+    QuerySet dos documentos com itens (ordens de compra, transferências e
+    requisições) cujos totais ficam guardados em colunas do documento.
+
+    `TOTAIS` no modelo diz como cada coluna se calcula dos itens (relação
+    `itens`): {coluna: (campo de quantidade, campo de preço)}, somando
+    quantidade × preço e ignorando preços nulos. `recalcular_totais` regrava
+    as colunas com um único UPDATE e é chamado pelos signals dos itens
+    (signals_totais); `with_totals` prepara as listagens.
+    """
+
+    def _itens(self):
+        relacao = self.model._meta.get_field('itens')
+        return relacao.related_model, relacao.field.name
+
+    def _por_documento(self):
+        modelo_itens, campo_documento = self._itens()
+        return modelo_itens.objects.filter(**{campo_documento: models.OuterRef('pk')}).order_by().values(
+            campo_documento
+        )
+
+    def expressoes_totais(self):
+        """{coluna: expressão SQL do total calculado dos itens}"""
+        expressoes = {}
+        for coluna, (quantidade, preco) in self.model.TOTAIS.items():
+            soma = self._por_documento().annotate(total=models.Sum(models.ExpressionWrapper(
+                models.F(quantidade) * models.F(preco),
+                output_field=models.DecimalField(max_digits=15, decimal_places=2),
+            ))).values('total')
+            expressoes[coluna] = Coalesce(
+                models.Subquery(soma), models.Value(Decimal('0')),
+                output_field=models.DecimalField(max_digits=15, decimal_places=2),
+            )
+        return expressoes
+
+    def with_totals(self, calculados=False):
+        """
+        Documentos prontos a listar sem consultas por linha: os valores vêm
+        das colunas guardadas e `total_itens` (número de itens) é anotado com
+        uma subconsulta, que não multiplica as linhas como um JOIN. Com
+        `calculados`, anota também `<coluna>_calculado` com o total somado
+        agora dos itens (p.ex. valor_total_calculado).
+        """
+        contagem = self._por_documento().annotate(total=models.Count('pk')).values('total')
+        anotacoes = {'total_itens': Coalesce(models.Subquery(contagem), models.Value(0))}
+        if calculados:
+            anotacoes.update(
+                (f'{coluna}_calculado', expressao) for coluna, expressao in self.expressoes_totais().items()
+            )
+        return self.annotate(**anotacoes)
+
+    def recalcular_totais(self):
+        """Regrava as colunas de TOTAIS dos documentos do queryset. Devolve quantos"""
+        return self.order_by().update(**self.expressoes_totais())
+
 
 class CategoriaProduto(models.Model):
     """Categorias de produtos e materiais para organização"""
@@ -254,10 +324,6 @@ class Item(models.Model):
         return f"{self.codigo} - {self.nome} ({self.get_tipo_display()})"
 
     def save(self, *args, **kwargs):
-        # Gera código automaticamente se não fornecido
-        if not self.codigo:
-            self.codigo = self.gerar_codigo_automatico()
-        
         # Validações específicas por tipo
         if self.tipo == 'PRODUTO':
             if not self.produto_tipo:
@@ -268,18 +334,16 @@ class Item(models.Model):
             if not self.material_tipo:
                 self.material_tipo = 'MATERIA_PRIMA'
         
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            # Gera código automaticamente se não fornecido
+            if not self.codigo:
+                self.codigo = self.gerar_codigo_automatico()
+            super().save(*args, **kwargs)
     
     def gerar_codigo_automatico(self):
         """Gera código automático para o item"""
-        if self.tipo == 'PRODUTO':
-            total_produtos = Item.objects.filter(tipo='PRODUTO').count()
-            proximo_numero = total_produtos + 1
-            return f"PROD{proximo_numero:04d}"
-        else:  # MATERIAL
-            total_materiais = Item.objects.filter(tipo='MATERIAL').count()
-            proximo_numero = total_materiais + 1
-            return f"MAT{proximo_numero:04d}"
+        prefixo = 'PROD' if self.tipo == 'PRODUTO' else 'MAT'
+        return proximo_codigo(prefixo, existentes=[(Item.objects, 'codigo')])
 
     def get_tipo_display_color(self):
         """Retorna cor para exibição do tipo"""
@@ -500,10 +564,11 @@ class Receita(models.Model):
         return f"{self.codigo} - {self.nome}"
 
     def save(self, *args, **kwargs):
-        # Gera código automaticamente se não fornecido
-        if not self.codigo:
-            self.codigo = self.gerar_codigo_automatico()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            # Gera código automaticamente se não fornecido
+            if not self.codigo:
+                self.codigo = self.gerar_codigo_automatico()
+            super().save(*args, **kwargs)
     
     def gerar_codigo_automatico(self):
         """Gera código automático baseado no produto e sequência"""
@@ -515,16 +580,11 @@ class Receita(models.Model):
         else:
             prefixo = 'REC'
         
-        # Conta receitas existentes com o mesmo prefixo
-        ultimo_numero = Receita.objects.filter(
-            codigo__startswith=prefixo
-        ).count()
-        
-        # Gera próximo número
-        proximo_numero = ultimo_numero + 1
-        
-        # Formato: ABC001, XYZ001, etc.
-        return f"{prefixo}{proximo_numero:03d}"
+        # Formato: ABC001, XYZ001, etc. (uma sequência por prefixo)
+        return proximo_codigo(
+            prefixo, largura=3, chave=f'Receita:{prefixo}',
+            existentes=[(Receita.objects, 'codigo')]
+        )
 
     def calcular_custo_total(self):
         """Calcula o custo total da receita"""
@@ -651,6 +711,22 @@ class StockItem(models.Model):
         default=0,
         help_text='Quantidade reservada (não disponível)'
     )
+    custo_medio = models.DecimalField(
+        max_digits=12,
+        decimal_places=4,
+        default=0,
+        help_text='Custo médio ponderado do stock existente (actualizado a cada entrada)'
+    )
+    valor_estoque = models.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        default=0,
+        help_text='Valor do stock existente ao custo médio (quantidade atual x custo médio)'
+    )
+    abaixo_minimo = models.BooleanField(
+        default=False,
+        help_text='Se a quantidade atual está no estoque mínimo do item ou abaixo (mantido por services/alertas_stock.py)'
+    )
     localizacao = models.CharField(
         max_length=100,
         blank=True,
@@ -671,6 +747,8 @@ class StockItem(models.Model):
             models.Index(fields=['quantidade_atual']),
             models.Index(fields=['data_atualizacao']),
             models.Index(fields=['item', 'quantidade_atual']),
+            models.Index(fields=['sucursal', 'valor_estoque']),
+            models.Index(fields=['sucursal', 'item'], condition=models.Q(abaixo_minimo=True), name='empresa_sto_abaixo_minimo_idx'),
         ]
 
     def __str__(self):
@@ -692,6 +770,195 @@ class StockItem(models.Model):
             return 'NORMAL'
 
 
+class StockSnapshot(models.Model):
+    """
+    Saldo de fecho diário de um item numa sucursal.
+
+    Só existe linha nos dias em que o saldo mudou: o saldo numa data é o do
+    snapshot mais recente até essa data (ver services/stock_snapshots.py).
+    """
+    item = models.ForeignKey(
+        Item,
+        on_delete=models.CASCADE,
+        related_name='snapshots_stock',
+        help_text='Item (produto ou material)'
+    )
+    sucursal = models.ForeignKey(
+        Sucursal,
+        on_delete=models.CASCADE,
+        related_name='snapshots_stock',
+        help_text='Sucursal'
+    )
+    data = models.DateField(
+        help_text='Dia a que se refere o saldo (fecho do dia)'
+    )
+    quantidade = models.DecimalField(
+        max_digits=10,
+        decimal_places=3,
+        default=0,
+        help_text='Quantidade em estoque no fecho do dia'
+    )
+    valor = models.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        default=0,
+        help_text='Valor do estoque no fecho do dia'
+    )
+    data_atualizacao = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Snapshot de Stock'
+        verbose_name_plural = 'Snapshots de Stock'
+        unique_together = ['item', 'sucursal', 'data']
+        ordering = ['-data']
+        indexes = [
+            models.Index(fields=['sucursal', 'data']),
+            models.Index(fields=['data']),
+        ]
+
+    def __str__(self):
+        return f"{self.item_id}@{self.sucursal_id} {self.data}: {self.quantidade}"
+
+
+class MovimentoDiario(models.Model):
+    """
+    Totais diários dos movimentos por sucursal, tipo de item e sentido.
+
+    Mantido pelo ledger a cada lançamento (services/movimentos_diarios.py) e
+    regenerável com o comando reconstruir_movimentos_diarios; os gráficos de
+    séries temporais lêem daqui em vez de agrupar MovimentoItem.
+    """
+    dia = models.DateField(
+        help_text='Dia dos movimentos'
+    )
+    sucursal = models.ForeignKey(
+        Sucursal,
+        on_delete=models.CASCADE,
+        related_name='movimentos_diarios',
+        help_text='Sucursal'
+    )
+    tipo_item = models.CharField(
+        max_length=20,
+        choices=Item.TIPO_CHOICES,
+        help_text='Tipo dos itens movimentados'
+    )
+    aumenta_estoque = models.BooleanField(
+        help_text='Entradas (True) ou saídas (False)'
+    )
+    movimentos = models.PositiveIntegerField(
+        default=0,
+        help_text='Número de movimentos'
+    )
+    quantidade = models.DecimalField(
+        max_digits=15,
+        decimal_places=3,
+        default=0,
+        help_text='Quantidade movimentada'
+    )
+    valor = models.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        default=0,
+        help_text='Soma do valor total dos movimentos'
+    )
+
+    class Meta:
+        verbose_name = 'Movimento Diário'
+        verbose_name_plural = 'Movimentos Diários'
+        # A chave única (dia primeiro) serve também as consultas por período
+        unique_together = ['dia', 'sucursal', 'tipo_item', 'aumenta_estoque']
+        ordering = ['-dia']
+
+    def __str__(self):
+        sentido = 'entradas' if self.aumenta_estoque else 'saídas'
+        return f"{self.dia} {self.sucursal_id} {self.tipo_item} {sentido}: {self.movimentos}"
+
+
+class ReservaStock(models.Model):
+    """
+    Reserva de quantidade de um item numa sucursal para uma requisição ou
+    transferência ainda por enviar.
+
+    Enquanto ACTIVA, a quantidade está somada em StockItem.quantidade_reservada
+    (ver services/reservas_stock.py); expira em `expira_em` se não for
+    consumida ou libertada antes.
+    """
+    ESTADO_CHOICES = [
+        ('ATIVA', 'Activa'),
+        ('CONSUMIDA', 'Consumida'),
+        ('LIBERTADA', 'Libertada'),
+        ('EXPIRADA', 'Expirada'),
+    ]
+
+    item = models.ForeignKey(
+        Item,
+        on_delete=models.CASCADE,
+        related_name='reservas_stock',
+        help_text='Item reservado'
+    )
+    sucursal = models.ForeignKey(
+        Sucursal,
+        on_delete=models.CASCADE,
+        related_name='reservas_stock',
+        help_text='Sucursal onde a quantidade está reservada'
+    )
+    quantidade = models.DecimalField(
+        max_digits=10,
+        decimal_places=3,
+        help_text='Quantidade reservada'
+    )
+    estado = models.CharField(
+        max_length=10,
+        choices=ESTADO_CHOICES,
+        default='ATIVA',
+        help_text='Estado da reserva'
+    )
+    requisicao = models.ForeignKey(
+        'RequisicaoStock',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='reservas',
+        help_text='Requisição que originou a reserva'
+    )
+    transferencia = models.ForeignKey(
+        'TransferenciaStock',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='reservas',
+        help_text='Transferência que originou a reserva'
+    )
+    expira_em = models.DateTimeField(
+        help_text='Data a partir da qual a reserva activa é libertada automaticamente'
+    )
+    criado_por = models.ForeignKey(
+        'auth.User',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        help_text='Usuário que criou a reserva'
+    )
+    data_criacao = models.DateTimeField(auto_now_add=True)
+    data_fecho = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text='Data em que a reserva foi consumida, libertada ou expirou'
+    )
+
+    class Meta:
+        verbose_name = 'Reserva de Stock'
+        verbose_name_plural = 'Reservas de Stock'
+        ordering = ['-data_criacao']
+        indexes = [
+            models.Index(fields=['item', 'sucursal']),
+            models.Index(fields=['expira_em'], condition=models.Q(estado='ATIVA'), name='empresa_res_ativa_expira_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.item_id}@{self.sucursal_id}: {self.quantidade} ({self.estado})"
+
+
 # StockSucursal removido - dados migrados para StockItem (modelo unificado)
 
 class TipoMovimentoStock(models.Model):
@@ -727,12 +994,32 @@ class TipoMovimentoStock(models.Model):
         return self.nome
 
 
+class CodigoMovimento(models.Model):
+    """
+    Registo dos códigos de MovimentoItem já atribuídos. Garante a unicidade
+    global de `codigo` também com a tabela de movimentos particionada, onde o
+    PostgreSQL só aceita restrições de unicidade que incluam data_movimento.
+    """
+    codigo = models.CharField(max_length=20, primary_key=True)
+
+    class Meta:
+        verbose_name = 'Código de Movimento'
+        verbose_name_plural = 'Códigos de Movimento'
+
+    def __str__(self):
+        return self.codigo
+
+    @classmethod
+    def registar(cls, codigos):
+        """Regista os códigos; um código repetido faz falhar a transacção com IntegrityError"""
+        cls.objects.bulk_create([cls(codigo=codigo) for codigo in codigos], batch_size=1000)
+
+
 class MovimentoItem(models.Model):
     """Movimentações unificadas de stock para produtos e materiais"""
     codigo = models.CharField(
         max_length=20,
-        unique=True,
-        help_text='Código único da movimentação'
+        help_text='Código único da movimentação (ver CodigoMovimento)'
     )
     item = models.ForeignKey(
         Item,
@@ -796,43 +1083,40 @@ class MovimentoItem(models.Model):
             models.Index(fields=['tipo_movimento']),
             models.Index(fields=['item', 'data_movimento']),
             models.Index(fields=['sucursal', 'data_movimento']),
+            models.Index(fields=['sucursal', 'item']),
+        ]
+        constraints = [
+            # A tabela particionada exige a chave de partição em cada restrição de unicidade
+            models.UniqueConstraint(
+                fields=['codigo', 'data_movimento'], name='empresa_movimentoitem_codigo_data_uniq'
+            ),
         ]
 
     def __str__(self):
         return f"{self.codigo} - {self.item.nome} - {self.tipo_movimento.nome} ({self.quantidade})"
 
     def save(self, *args, **kwargs):
-        # Gera código automaticamente se não fornecido
-        if not self.codigo:
-            self.codigo = self.gerar_codigo_automatico()
-        
         # Calcula valor total automaticamente
         self.valor_total = self.quantidade * self.preco_unitario
-        super().save(*args, **kwargs)
+        
+        # O post_save aplica o movimento ao saldo; a transacção garante que
+        # código, movimento e saldo são gravados (ou revertidos) em conjunto
+        with transaction.atomic():
+            # Gera código automaticamente se não fornecido
+            if not self.codigo:
+                self.codigo = self.gerar_codigo_automatico()
+            if self._state.adding:
+                CodigoMovimento.registar([self.codigo])
+            super().save(*args, **kwargs)
     
     def gerar_codigo_automatico(self):
         """Gera código automático para movimentação"""
-        total_movimentos = MovimentoItem.objects.count()
-        proximo_numero = total_movimentos + 1
-        return f"MOV{proximo_numero:04d}"
+        return proximo_codigo('MOV', existentes=codigos_movimento())
 
     def atualizar_stock_sucursal(self):
-        """Atualiza o stock da sucursal após o movimento"""
-        stock_item, created = StockItem.objects.get_or_create(
-            item=self.item,
-            sucursal=self.sucursal,
-            defaults={'quantidade_atual': 0, 'quantidade_reservada': 0}
-        )
-        
-        if self.tipo_movimento.aumenta_estoque:
-            stock_item.quantidade_atual += self.quantidade
-        else:
-            stock_item.quantidade_atual -= self.quantidade
-            # Garantir que não fique negativo
-            if stock_item.quantidade_atual < 0:
-                stock_item.quantidade_atual = 0
-            
-        stock_item.save()
+        """Atualiza o stock da sucursal após o movimento (UPDATE atómico no ledger)"""
+        from .services.stock_ledger import aplicar_movimento
+        aplicar_movimento(self)
 
 class MovimentoStock(models.Model):
     """Movimentações de stock de produtos"""
@@ -902,20 +1186,19 @@ class MovimentoStock(models.Model):
         return f"{self.codigo} - {self.produto.nome} - {self.tipo_movimento.nome} ({self.quantidade})"
 
     def save(self, *args, **kwargs):
-        # Gera código automaticamente se não fornecido
-        if not self.codigo:
-            self.codigo = self.gerar_codigo_automatico()
-        
         # Calcula valor total automaticamente
         self.valor_total = self.quantidade * self.preco_unitario
-        super().save(*args, **kwargs)
+        
+        with transaction.atomic():
+            # Gera código automaticamente se não fornecido
+            if not self.codigo:
+                self.codigo = self.gerar_codigo_automatico()
+            super().save(*args, **kwargs)
     
     def gerar_codigo_automatico(self):
         """Gera código automático para movimentação de produto"""
-        # Contar movimentações existentes (produtos + materiais)
-        total_movimentos = MovimentoItem.objects.count()
-        proximo_numero = total_movimentos + 1
-        return f"MOV{proximo_numero:04d}"
+        # Mesma sequência MOV das movimentações unificadas
+        return proximo_codigo('MOV', existentes=codigos_movimento())
 
 
 # MovimentoMaterial removido - dados migrados para MovimentoItem (modelo unificado)
@@ -925,6 +1208,7 @@ class NotificacaoStock(models.Model):
     """Sistema de notificações para eventos importantes do stock"""
     TIPOS_NOTIFICACAO = [
         ('stock_baixo', 'Stock Baixo'),
+        ('stock_reposto', 'Stock Reposto'),
         ('requisicao_pendente', 'Requisição Pendente'),
         ('movimentacao_sem_usuario', 'Movimentação sem Usuário'),
         ('requisicao_antiga', 'Requisição Antiga'),
@@ -1024,6 +1308,28 @@ class NotificacaoStock(models.Model):
         return cls.obter_notificacoes_nao_lidas(usuario).count()
 
 
+class InventarioQuerySet(models.QuerySet):
+    """
+    Os contadores de progresso do inventário (total_itens, itens_contados)
+    ficam guardados em colunas; `recalcular_progresso` regrava-os a partir
+    dos itens com um único UPDATE e é chamado pelas gravações dos itens
+    (signals_totais) e no fim das operações em lote (services/inventarios).
+    """
+
+    def recalcular_progresso(self):
+        """Regrava os contadores dos inventários do queryset. Devolve quantos"""
+        itens = ItemInventario.objects.filter(inventario=models.OuterRef('pk')).order_by().values('inventario')
+
+        def contar(**filtro):
+            contagem = itens.filter(**filtro).annotate(total=models.Count('pk')).values('total')
+            return Coalesce(models.Subquery(contagem), models.Value(0))
+
+        return self.order_by().update(
+            total_itens=contar(),
+            itens_contados=contar(quantidade_contada__isnull=False),
+        )
+
+
 class InventarioFisico(models.Model):
     """Inventário físico - contagem manual de stock"""
     STATUS_CHOICES = [
@@ -1083,6 +1389,23 @@ class InventarioFisico(models.Model):
         related_name='inventarios_criados',
         help_text='Usuário que criou o inventário'
     )
+    data_snapshot = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text='Momento em que as quantidades do sistema foram copiadas do stock'
+    )
+    total_itens = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text='Total de itens no inventário'
+    )
+    itens_contados = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text='Itens já contados'
+    )
+
+    objects = InventarioQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Inventário Físico'
@@ -1094,24 +1417,13 @@ class InventarioFisico(models.Model):
 
     def gerar_codigo_automatico(self):
         """Gera código automático para inventário"""
-        total_inventarios = InventarioFisico.objects.count()
-        proximo_numero = total_inventarios + 1
-        return f"INV{proximo_numero:04d}"
+        return proximo_codigo('INV', existentes=[(InventarioFisico.objects, 'codigo')])
 
     def save(self, *args, **kwargs):
-        if not self.codigo:
-            self.codigo = self.gerar_codigo_automatico()
-        super().save(*args, **kwargs)
-
-    @property
-    def total_itens(self):
-        """Total de itens no inventário"""
-        return self.itens_inventario.count()
-
-    @property
-    def itens_contados(self):
-        """Itens já contados"""
-        return self.itens_inventario.filter(quantidade_contada__isnull=False).count()
+        with transaction.atomic():
+            if not self.codigo:
+                self.codigo = self.gerar_codigo_automatico()
+            super().save(*args, **kwargs)
 
     @property
     def progresso_percentual(self):
@@ -1138,6 +1450,10 @@ class ItemInventario(models.Model):
     quantidade_sistema = models.PositiveIntegerField(
         help_text='Quantidade registrada no sistema'
     )
+    variacao_stock = models.IntegerField(
+        default=0,
+        help_text='Saldo dos movimentos lançados entre o snapshot do inventário e a contagem'
+    )
     quantidade_contada = models.PositiveIntegerField(
         null=True,
         blank=True,
@@ -1145,7 +1461,7 @@ class ItemInventario(models.Model):
     )
     diferenca = models.IntegerField(
         default=0,
-        help_text='Diferença entre contado e sistema (contado - sistema)'
+        help_text='Diferença entre contado e esperado (contado - sistema - variação)'
     )
     observacoes = models.TextField(
         blank=True,
@@ -1187,12 +1503,17 @@ class ItemInventario(models.Model):
     def __str__(self):
         return f"{self.inventario.codigo} - {self.item.nome}"
     
+    @property
+    def quantidade_esperada(self):
+        """Quantidade do sistema à data da contagem: o snapshot mais os movimentos lançados entretanto"""
+        return max(self.quantidade_sistema + self.variacao_stock, 0)
+
     @property
     def tem_diferenca(self):
-        """Verifica se há diferença entre contado e sistema"""
+        """Verifica se há diferença entre contado e esperado"""
         if self.quantidade_contada is None:
             return False
-        return self.quantidade_contada != self.quantidade_sistema
+        return self.quantidade_contada != self.quantidade_esperada
     
     @property
     def pode_recontar(self):
@@ -1240,9 +1561,9 @@ class HistoricoContagem(models.Model):
         return f"{self.item_inventario.item.nome} - Contagem {self.numero_contagem}"
     
     def calcular_diferenca(self):
-        """Calcula a diferença entre quantidade contada e sistema"""
+        """Calcula a diferença entre quantidade contada e esperada (sistema mais movimentos entretanto)"""
         if self.quantidade_contada is not None:
-            self.diferenca = self.quantidade_contada - self.item_inventario.quantidade_sistema
+            self.diferenca = self.quantidade_contada - self.item_inventario.quantidade_esperada
         else:
             self.diferenca = 0
         return self.diferenca
@@ -1343,60 +1664,146 @@ class AjusteInventario(models.Model):
 
     def gerar_codigo_automatico(self):
         """Gera código automático para ajuste"""
-        total_ajustes = AjusteInventario.objects.count()
-        proximo_numero = total_ajustes + 1
-        return f"AJUSTE{proximo_numero:04d}"
+        return proximo_codigo('AJUSTE', existentes=[(AjusteInventario.objects, 'codigo')])
 
     def save(self, *args, **kwargs):
-        if not self.codigo:
-            self.codigo = self.gerar_codigo_automatico()
         self.diferenca = self.quantidade_nova - self.quantidade_anterior
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            if not self.codigo:
+                self.codigo = self.gerar_codigo_automatico()
+            super().save(*args, **kwargs)
 
     def aplicar_ajuste(self):
         """Aplica o ajuste no stock da sucursal"""
         if not self.aprovado:
             return False
         
+        if not self.diferenca:
+            return True
+
         try:
-            stock_item, created = StockItem.objects.get_or_create(
-                item=self.item,
-                sucursal=self.sucursal,
-                defaults={'quantidade_atual': 0, 'quantidade_reservada': 0}
-            )
-            stock_item.quantidade_atual = self.quantidade_nova
-            stock_item.save()
-            
-            # Criar movimento de ajuste
-            from .models_stock import MovimentoItem, TipoMovimentoStock
-            
-            tipo_ajuste, created = TipoMovimentoStock.objects.get_or_create(
-                nome='Ajuste de Inventário',
-                defaults={
-                    'descricao': 'Ajuste baseado em inventário físico',
-                    'aumenta_estoque': True
-                }
-            )
-            
-            MovimentoItem.objects.create(
-                codigo=f"AJ{self.codigo}",
+            # O movimento de ajuste (entrada ou saída conforme o sinal da
+            # diferença) actualiza o saldo no ledger; não se grava o StockItem
+            # directamente para não aplicar a diferença duas vezes
+            from .services.stock_ledger import lancar_movimento, obter_tipo_movimento
+
+            if self.diferenca > 0:
+                tipo_ajuste = obter_tipo_movimento(
+                    'AJUSTE_POS', 'Ajuste de Inventário (Entrada)', True,
+                    'Ajuste positivo baseado em inventário físico'
+                )
+            else:
+                tipo_ajuste = obter_tipo_movimento(
+                    'AJUSTE_NEG', 'Ajuste de Inventário (Saída)', False,
+                    'Ajuste negativo baseado em inventário físico'
+                )
+
+            lancar_movimento(
                 item=self.item,
                 sucursal=self.sucursal,
                 tipo_movimento=tipo_ajuste,
                 quantidade=abs(self.diferenca),
-                preco_unitario=0,  # Ajuste não tem preço
-                valor_total=0,
+                preco_unitario=None,  # ao custo médio da sucursal
+                usuario=self.usuario_ajuste,
+                respeitar_reservas=False,  # a contagem manda no saldo
+                codigo=f"AJ{self.codigo}",
                 referencia=self.codigo,
                 observacoes=f"Ajuste de inventário: {self.motivo}",
-                usuario=self.usuario_ajuste
             )
-            
+
             return True
         except Exception as e:
             print(f"Erro ao aplicar ajuste: {e}")
             return False
 
 
+class ClassificacaoContagem(models.Model):
+    """
+    Classe ABC/XYZ de um item numa sucursal e o plano da sua contagem
+    cíclica.
+
+    ABC ordena os itens pelo valor das saídas no período (A: os que somam os
+    primeiros 80%, B: até 95%, C: o resto); XYZ pela regularidade das saídas
+    mensais (X: estáveis, Z: esporádicas). A classe define de quantos em
+    quantos dias o item é contado (ver services/contagem_ciclica.py).
+    """
+    CLASSE_ABC_CHOICES = [
+        ('A', 'A - Alto valor'),
+        ('B', 'B - Valor médio'),
+        ('C', 'C - Baixo valor'),
+    ]
+    CLASSE_XYZ_CHOICES = [
+        ('X', 'X - Consumo regular'),
+        ('Y', 'Y - Consumo variável'),
+        ('Z', 'Z - Consumo esporádico'),
+    ]
+
+    item = models.ForeignKey(
+        Item,
+        on_delete=models.CASCADE,
+        related_name='classificacoes_contagem',
+        help_text='Item classificado'
+    )
+    sucursal = models.ForeignKey(
+        Sucursal,
+        on_delete=models.CASCADE,
+        related_name='classificacoes_contagem',
+        help_text='Sucursal'
+    )
+    classe_abc = models.CharField(
+        max_length=1,
+        choices=CLASSE_ABC_CHOICES,
+        help_text='Classe pelo valor das saídas'
+    )
+    classe_xyz = models.CharField(
+        max_length=1,
+        choices=CLASSE_XYZ_CHOICES,
+        help_text='Classe pela regularidade das saídas'
+    )
+    valor_saidas = models.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        default=0,
+        help_text='Valor das saídas no período da classificação'
+    )
+    saidas = models.PositiveIntegerField(
+        default=0,
+        help_text='Número de movimentos de saída no período'
+    )
+    coeficiente_variacao = models.DecimalField(
+        max_digits=8,
+        decimal_places=3,
+        null=True,
+        blank=True,
+        help_text='Coeficiente de variação das saídas mensais (vazio sem saídas)'
+    )
+    intervalo_dias = models.PositiveIntegerField(
+        help_text='Dias entre contagens'
+    )
+    ultima_contagem = models.DateField(
+        null=True,
+        blank=True,
+        help_text='Dia da última sessão de contagem cíclica que incluiu o item'
+    )
+    proxima_contagem = models.DateField(
+        help_text='Dia a partir do qual o item entra nas sessões de contagem'
+    )
+    data_classificacao = models.DateTimeField(
+        default=timezone.now,
+        help_text='Quando a classe foi calculada'
+    )
+
+    class Meta:
+        verbose_name = 'Classificação para Contagem Cíclica'
+        verbose_name_plural = 'Classificações para Contagem Cíclica'
+        unique_together = ['item', 'sucursal']
+        indexes = [
+            models.Index(fields=['sucursal', 'proxima_contagem']),
+        ]
+
+    def __str__(self):
+        return f"{self.item_id}@{self.sucursal_id} {self.classe_abc}{self.classe_xyz} / {self.intervalo_dias}d"
+
 class FornecedorProduto(models.Model):
     """Relacionamento entre fornecedores e produtos/materiais"""
     fornecedor = models.ForeignKey(
@@ -1516,7 +1923,14 @@ class OrdemCompra(models.Model):
     numero_fatura = models.CharField(max_length=50, help_text='Número da fatura', default='PENDENTE')
     data_cotacao = models.DateTimeField(null=True, blank=True, help_text='Data da cotação')
     data_fatura = models.DateField(null=True, blank=True, help_text='Data da fatura')
-    
+
+    # Totais guardados, recalculados pelos signals dos itens (ver DocumentoQuerySet)
+    valor_total = models.DecimalField(max_digits=15, decimal_places=2, default=0, editable=False)
+
+    TOTAIS = {'valor_total': ('quantidade_solicitada', 'preco_unitario')}
+
+    objects = DocumentoQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Ordem de Compra'
         verbose_name_plural = 'Ordens de Compra'
@@ -1525,58 +1939,15 @@ class OrdemCompra(models.Model):
     def __str__(self):
         return f"{self.codigo} - {self.fornecedor.nome}"
     
-    @property
-    def valor_total(self):
-        """Calcula o valor total da ordem de compra"""
-        return sum(item.preco_total for item in self.itens.all())
-    
     def save(self, *args, **kwargs):
-        if not self.codigo:
-            self.codigo = self.gerar_codigo()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            if not self.codigo:
+                self.codigo = self.gerar_codigo()
+            super().save(*args, **kwargs)
     
     def gerar_codigo(self):
         """Gera código único para a ordem de compra"""
-        from django.db import transaction
-        import time
-        
-        with transaction.atomic():
-            # Buscar o último código existente que segue o padrão COMP####
-            ultima_ordem = OrdemCompra.objects.filter(
-                codigo__regex=r'^COMP\d{4}$'
-            ).order_by('-codigo').first()
-            
-            if ultima_ordem:
-                # Extrair número do último código
-                try:
-                    ultimo_numero = int(ultima_ordem.codigo[4:])
-                    proximo_numero = ultimo_numero + 1
-                except (ValueError, IndexError):
-                    proximo_numero = 1
-            else:
-                proximo_numero = 1
-            
-            # Verificar se o código já existe e incrementar se necessário
-            tentativas = 0
-            while tentativas < 100:  # Limite de tentativas
-                codigo_tentativa = f"COMP{proximo_numero:04d}"
-                if not OrdemCompra.objects.filter(codigo=codigo_tentativa).exists():
-                    return codigo_tentativa
-                proximo_numero += 1
-                tentativas += 1
-            
-            # Se chegou ao limite de tentativas, usar timestamp
-            timestamp = int(time.time())
-            return f"COMP{timestamp}"
-    
-    @property
-    def valor_total(self):
-        """Calcula o valor total da ordem de compra"""
-        total = Decimal('0.00')
-        for item in self.itens.all():
-            if item.preco_unitario:
-                total += item.quantidade_solicitada * item.preco_unitario
-        return total
+        return proximo_codigo('COMP', existentes=codigos_compra())
 
 
 class HistoricoEnvioEmail(models.Model):
@@ -1742,30 +2113,30 @@ class TransferenciaStock(models.Model):
         help_text='Usuário que confirmou o recebimento'
     )
 
+    # Totais guardados (solicitado e recebido, a preço de custo), recalculados pelos signals
+    valor_total = models.DecimalField(max_digits=15, decimal_places=2, default=0, editable=False)
+    valor_recebido = models.DecimalField(max_digits=15, decimal_places=2, default=0, editable=False)
+
+    TOTAIS = {
+        'valor_total': ('quantidade_solicitada', 'item__preco_custo'),
+        'valor_recebido': ('quantidade_recebida', 'item__preco_custo'),
+    }
+
+    objects = DocumentoQuerySet.as_manager()
+
     def __str__(self):
         return f"TRF-{self.codigo} - {self.sucursal_origem.nome} → {self.sucursal_destino.nome}"
 
-    @property
-    def valor_total(self):
-        """Calcula o valor total da transferência (solicitado)"""
-        return sum(item.valor_total for item in self.itens.all())
-    
-    @property
-    def valor_recebido(self):
-        """Calcula o valor total da transferência recebida"""
-        return sum(item.valor_recebido for item in self.itens.all())
-
     class Meta:
         verbose_name = 'Transferência de Stock'
         verbose_name_plural = 'Transferências de Stock'
         ordering = ['-data_criacao']
 
     def save(self, *args, **kwargs):
-        if not self.codigo:
-            # Gerar código simples até corrigir método completo
-            import time
-            self.codigo = f"TRF{int(time.time())}"
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            if not self.codigo:
+                self.codigo = proximo_codigo('TRF', existentes=[(TransferenciaStock.objects, 'codigo')])
+            super().save(*args, **kwargs)
 
     @property
     def pode_cancelar(self):
@@ -1917,19 +2288,20 @@ class RequisicaoStock(models.Model):
         help_text='Usuário que aprovou a requisição'
     )
 
+    # Totais guardados (solicitado e atendido, a preço de custo), recalculados pelos signals
+    valor_total = models.DecimalField(max_digits=15, decimal_places=2, default=0, editable=False)
+    valor_atendido = models.DecimalField(max_digits=15, decimal_places=2, default=0, editable=False)
+
+    TOTAIS = {
+        'valor_total': ('quantidade_solicitada', 'item__preco_custo'),
+        'valor_atendido': ('quantidade_atendida', 'item__preco_custo'),
+    }
+
+    objects = DocumentoQuerySet.as_manager()
+
     def __str__(self):
         destino = self.sucursal_destino.nome if self.sucursal_destino else "Por definir"
         return f"REQ-{self.codigo} - {self.sucursal_origem.nome} -> {destino}"
-    
-    @property
-    def valor_total(self):
-        """Calcula o valor total da requisição (solicitado)"""
-        return sum(item.valor_total for item in self.itens.all())
-    
-    @property
-    def valor_atendido(self):
-        """Calcula o valor total da requisição atendida"""
-        return sum(item.valor_atendido for item in self.itens.all())
 
     class Meta:
         verbose_name = 'Requisição de Stock'
@@ -1937,42 +2309,11 @@ class RequisicaoStock(models.Model):
         ordering = ['-data_criacao']
 
     def save(self, *args, **kwargs):
-        if not self.codigo:
-            # Gerar código automático sequencial único
-            import time
-            from django.db import transaction
-            
-            with transaction.atomic():
-                # Buscar o último código existente
-                ultima_requisicao = RequisicaoStock.objects.filter(
-                    codigo__startswith='REQ'
-                ).order_by('-codigo').first()
-                
-                if ultima_requisicao:
-                    # Extrair número do último código
-                    try:
-                        ultimo_numero = int(ultima_requisicao.codigo[3:])
-                        proximo_numero = ultimo_numero + 1
-                    except (ValueError, IndexError):
-                        proximo_numero = 1
-                else:
-                    proximo_numero = 1
-                
-                # Verificar se o código já existe e incrementar se necessário
-                while True:
-                    codigo_tentativa = f"REQ{proximo_numero:04d}"
-                    if not RequisicaoStock.objects.filter(codigo=codigo_tentativa).exists():
-                        self.codigo = codigo_tentativa
-                        break
-                    proximo_numero += 1
-                    
-                    # Proteção contra loop infinito
-                    if proximo_numero > 9999:
-                        # Se chegou ao limite, usar timestamp
-                        self.codigo = f"REQ{int(time.time())}"
-                        break
-                        
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            if not self.codigo:
+                # Código sequencial único
+                self.codigo = proximo_codigo('REQ', existentes=[(RequisicaoStock.objects, 'codigo')])
+            super().save(*args, **kwargs)
 
     def promover_para_pendente(self):
         """Promove a requisição de RASCUNHO para PENDENTE"""
@@ -2109,19 +2450,20 @@ class RequisicaoCompraExterna(models.Model):
         help_text='Usuário que aprovou a requisição de compra'
     )
 
+    # Totais guardados (a preço estimado), recalculados pelos signals dos itens
+    valor_total = models.DecimalField(max_digits=15, decimal_places=2, default=0, editable=False)
+    valor_recebido = models.DecimalField(max_digits=15, decimal_places=2, default=0, editable=False)
+
+    TOTAIS = {
+        'valor_total': ('quantidade_solicitada', 'preco_unitario_estimado'),
+        'valor_recebido': ('quantidade_recebida', 'preco_unitario_estimado'),
+    }
+
+    objects = DocumentoQuerySet.as_manager()
+
     def __str__(self):
         fornecedor_nome = self.fornecedor.nome if self.fornecedor else 'Sem fornecedor'
         return f"COMP-{self.codigo} - {self.sucursal_solicitante.nome} → {fornecedor_nome}"
-    
-    @property
-    def valor_total(self):
-        """Calcula o valor total da requisição de compra"""
-        return sum(item.valor_total for item in self.itens.all())
-    
-    @property
-    def valor_recebido(self):
-        """Calcula o valor total recebido"""
-        return sum(item.valor_recebido for item in self.itens.all())
 
     class Meta:
         verbose_name = 'Requisição de Compra Externa'
@@ -2129,42 +2471,11 @@ class RequisicaoCompraExterna(models.Model):
         ordering = ['-data_criacao']
 
     def save(self, *args, **kwargs):
-        if not self.codigo:
-            # Gerar código automático sequencial único
-            import time
-            from django.db import transaction
-            
-            with transaction.atomic():
-                # Buscar o último código existente
-                ultima_requisicao = RequisicaoCompraExterna.objects.filter(
-                    codigo__startswith='COMP'
-                ).order_by('-codigo').first()
-                
-                if ultima_requisicao:
-                    # Extrair número do último código
-                    try:
-                        ultimo_numero = int(ultima_requisicao.codigo[4:])
-                        proximo_numero = ultimo_numero + 1
-                    except (ValueError, IndexError):
-                        proximo_numero = 1
-                else:
-                    proximo_numero = 1
-                
-                # Verificar se o código já existe e incrementar se necessário
-                while True:
-                    codigo_tentativa = f"COMP{proximo_numero:04d}"
-                    if not RequisicaoCompraExterna.objects.filter(codigo=codigo_tentativa).exists():
-                        self.codigo = codigo_tentativa
-                        break
-                    proximo_numero += 1
-                    
-                    # Proteção contra loop infinito
-                    if proximo_numero > 9999:
-                        # Se chegou ao limite, usar timestamp
-                        self.codigo = f"COMP{int(time.time())}"
-                        break
-                        
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            if not self.codigo:
+                # Código sequencial único
+                self.codigo = proximo_codigo('COMP', existentes=codigos_compra())
+            super().save(*args, **kwargs)
 
     def promover_para_pendente(self):
         """Promove a requisição de RASCUNHO para PENDENTE"""
@@ -2243,6 +2554,95 @@ class ItemRequisicaoCompraExterna(models.Model):
         return self.quantidade_recebida * self.preco_unitario_estimado
 
 
+class IndiceRequisicao(models.Model):
+    """
+    Índice unificado das requisições internas e de compra externa.
+
+    Uma linha por requisição com os campos da listagem (código, estado,
+    sucursais, data, número de itens e valor), mantida por signals ao gravar
+    a requisição ou os seus itens (services/indice_requisicoes.py) e
+    regenerável com o comando reconstruir_indice_requisicoes. A listagem de
+    requisições filtra, conta e pagina por chave (data_criacao, id) numa só
+    consulta sobre os dois tipos.
+    """
+    TIPO_CHOICES = [
+        ('INTERNA', 'Requisição Interna'),
+        ('EXTERNA', 'Compra Externa'),
+    ]
+    STATUS_CHOICES = list(dict(RequisicaoStock.STATUS_CHOICES + RequisicaoCompraExterna.STATUS_CHOICES).items())
+
+    tipo = models.CharField(
+        max_length=10,
+        choices=TIPO_CHOICES,
+        help_text='Tipo da requisição'
+    )
+    requisicao_id = models.PositiveBigIntegerField(
+        help_text='ID da RequisicaoStock ou RequisicaoCompraExterna'
+    )
+    codigo = models.CharField(
+        max_length=20,
+        help_text='Código da requisição'
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        help_text='Status da requisição'
+    )
+    sucursal = models.ForeignKey(
+        Sucursal,
+        on_delete=models.CASCADE,
+        related_name='+',
+        help_text='Sucursal que solicita'
+    )
+    sucursal_destino = models.ForeignKey(
+        Sucursal,
+        on_delete=models.CASCADE,
+        related_name='+',
+        null=True,
+        blank=True,
+        help_text='Sucursal que fornece (só requisições internas)'
+    )
+    criado_por = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        related_name='+',
+        null=True,
+        blank=True
+    )
+    observacoes = models.TextField(
+        blank=True
+    )
+    data_criacao = models.DateTimeField(
+        help_text='Data de criação da requisição'
+    )
+    total_itens = models.PositiveIntegerField(
+        default=0
+    )
+    valor_total = models.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        default=0,
+        help_text='Valor solicitado (preço de custo ou preço estimado)'
+    )
+
+    class Meta:
+        verbose_name = 'Índice de Requisição'
+        verbose_name_plural = 'Índice de Requisições'
+        unique_together = ['tipo', 'requisicao_id']
+        ordering = ['-data_criacao', '-id']
+        indexes = [
+            models.Index(fields=['-data_criacao', '-id'], name='indice_req_data_idx'),
+            models.Index(fields=['status', '-data_criacao'], name='indice_req_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.codigo} ({self.status})"
+
+    @property
+    def externa(self):
+        return self.tipo == 'EXTERNA'
+
+
 # =============================================================================
 # MODELOS DE RASTREAMENTO LOGÍSTICO
 # =============================================================================
@@ -2370,16 +2770,15 @@ class VeiculoInterno(models.Model):
         return f"{self.codigo} - {self.nome} ({self.placa})"
 
     def save(self, *args, **kwargs):
-        # Gera código automaticamente se não fornecido
-        if not self.codigo:
-            self.codigo = self.gerar_codigo_automatico()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            # Gera código automaticamente se não fornecido
+            if not self.codigo:
+                self.codigo = self.gerar_codigo_automatico()
+            super().save(*args, **kwargs)
     
     def gerar_codigo_automatico(self):
         """Gera código automático para veículo interno"""
-        total_veiculos = VeiculoInterno.objects.count()
-        proximo_numero = total_veiculos + 1
-        return f"VIAT{proximo_numero:04d}"
+        return proximo_codigo('VIAT', existentes=[(VeiculoInterno.objects, 'codigo')])
 
 
 class ChecklistViatura(models.Model):
@@ -2594,20 +2993,18 @@ class ChecklistViatura(models.Model):
         return f"{self.codigo} - {self.veiculo.nome} ({self.get_tipo_display()})"
 
     def save(self, *args, **kwargs):
-        # Gera código automaticamente se não fornecido
-        if not self.codigo:
-            self.codigo = self.gerar_codigo_automatico()
-        
         # Calcula status final baseado nos itens
         self.status_final = self.calcular_status_final()
         
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            # Gera código automaticamente se não fornecido
+            if not self.codigo:
+                self.codigo = self.gerar_codigo_automatico()
+            super().save(*args, **kwargs)
     
     def gerar_codigo_automatico(self):
         """Gera código automático para checklist"""
-        total_checklists = ChecklistViatura.objects.count()
-        proximo_numero = total_checklists + 1
-        return f"CHK{proximo_numero:04d}"
+        return proximo_codigo('CHK', existentes=[(ChecklistViatura.objects, 'codigo')])
     
     def calcular_status_final(self):
         """Calcula o status final baseado nos itens do checklist"""
@@ -2832,16 +3229,15 @@ class Transportadora(models.Model):
         return f"{self.codigo} - {self.nome}"
 
     def save(self, *args, **kwargs):
-        # Gera código automaticamente se não fornecido
-        if not self.codigo:
-            self.codigo = self.gerar_codigo_automatico()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            # Gera código automaticamente se não fornecido
+            if not self.codigo:
+                self.codigo = self.gerar_codigo_automatico()
+            super().save(*args, **kwargs)
     
     def gerar_codigo_automatico(self):
         """Gera código automático para transportadora"""
-        total_transportadoras = Transportadora.objects.count()
-        proximo_numero = total_transportadoras + 1
-        return f"TRANS{proximo_numero:04d}"
+        return proximo_codigo('TRANS', existentes=[(Transportadora.objects, 'codigo')])
     
     def gerar_nome_automatico(self):
         """Gera nome automático para viatura baseado na sucursal, categoria e número sequencial"""
@@ -3044,20 +3440,20 @@ class RastreamentoEntrega(models.Model):
             raise ValidationError('Selecione apenas um tipo de transporte.')
 
     def save(self, *args, **kwargs):
-        # Gera código de rastreamento automaticamente se não fornecido
-        if not self.codigo_rastreamento:
-            self.codigo_rastreamento = self.gerar_codigo_rastreamento()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            # Gera código de rastreamento automaticamente se não fornecido
+            if not self.codigo_rastreamento:
+                self.codigo_rastreamento = self.gerar_codigo_rastreamento()
+            super().save(*args, **kwargs)
     
     def gerar_codigo_rastreamento(self):
         """Gera código único de rastreamento"""
-        import time
-        import random
-        
-        # Formato: TRANS + timestamp + random
-        timestamp = int(time.time())
-        random_num = random.randint(100, 999)
-        return f"TRANS{timestamp}{random_num}"
+        # Formato: TRANS + 8 dígitos (sequência própria, distinta dos códigos
+        # TRANS#### das transportadoras)
+        return proximo_codigo(
+            'TRANS', largura=8, chave='RASTREAMENTO',
+            existentes=[(RastreamentoEntrega.objects, 'codigo_rastreamento')]
+        )
     
     @property
     def documento_origem(self):
@@ -0,0 +1,137 @@
+"""
+Contagens por estado numa única consulta.
+
+Os painéis de estatísticas das listagens contam o mesmo conjunto de linhas
+por vários estados. `contar_por_filtro` junta essas contagens num só
+aggregate(Count(filter=...)), ou seja, uma ida à base de dados por modelo
+em vez de um count() por estado. As funções `estatisticas_*` declaram os
+painéis de cada listagem e recebem os querysets já filtrados pela view.
+"""
+from django.db.models import Avg, Count, F, Q
+
+
+def contar_por_filtro(queryset, **contagens):
+    """
+    Calcula todas as `contagens` de `queryset` num único aggregate().
+
+    Cada valor é um Q (conta as linhas que o satisfazem), None (conta todas
+    as linhas) ou uma expressão de agregação já construída (p.ex. Avg), que
+    é calculada na mesma consulta. Os filtros devem usar colunas do modelo
+    ou relações para um: uma relação para muitos duplica linhas na junção.
+    Devolve {nome: valor}.
+    """
+    expressoes = {}
+    for nome, filtro in contagens.items():
+        if filtro is None:
+            expressoes[nome] = Count('pk')
+        elif isinstance(filtro, Q):
+            expressoes[nome] = Count('pk', filter=filtro)
+        else:
+            expressoes[nome] = filtro
+    return queryset.aggregate(**expressoes)
+
+
+def somar_contagens(*resultados):
+    """Soma, por nome, os resultados de contar_por_filtro de vários modelos"""
+    total = {}
+    for resultado in resultados:
+        for nome, valor in resultado.items():
+            total[nome] = total.get(nome, 0) + (valor or 0)
+    return total
+
+
+def estatisticas_operacoes_logisticas(notificacoes):
+    """Painel da lista de operações logísticas (NotificacaoLogisticaUnificada)"""
+    return contar_por_filtro(
+        notificacoes,
+        total=None,
+        pendentes=Q(status='PENDENTE'),
+        atribuidas=Q(status='ATRIBUIDA'),
+        em_andamento=Q(status__in=['COLETADA', 'EM_TRANSITO']),
+        concluidas=Q(status='CONCLUIDA'),
+        urgentes=Q(prioridade='URGENTE'),
+        transferencias=Q(tipo_operacao='TRANSFERENCIA'),
+        coletas=Q(tipo_operacao='COLETA'),
+    )
+
+
+def estatisticas_avaliacoes(avaliacoes):
+    """Painel da lista de avaliações de desempenho, com a nota média das concluídas"""
+    stats = contar_por_filtro(
+        avaliacoes,
+        total_avaliacoes=None,
+        planejadas=Q(status='PLANEJADA'),
+        em_andamento=Q(status='EM_ANDAMENTO'),
+        concluidas=Q(status='CONCLUIDA'),
+        canceladas=Q(status='CANCELADA'),
+        nota_media=Avg('nota_geral', filter=Q(status='CONCLUIDA')),
+    )
+    stats['nota_media'] = stats['nota_media'] or 0
+    return stats
+
+
+def estatisticas_requisicoes(requisicoes_stock, requisicoes_compra, pendentes_antes_de=None):
+    """
+    Painel das requisições internas e de compra externa: uma consulta por
+    modelo. Com `pendentes_antes_de`, conta também as pendentes criadas antes
+    dessa data ('antigas'). Devolve (por_stock, por_compra, soma).
+    """
+    antigas = {}
+    if pendentes_antes_de is not None:
+        antigas = {'antigas': Q(status='PENDENTE', data_criacao__lt=pendentes_antes_de)}
+
+    por_stock = contar_por_filtro(
+        requisicoes_stock,
+        total=None,
+        pendentes=Q(status='PENDENTE'),
+        aprovadas=Q(status='APROVADA'),
+        atendidas=Q(status='ATENDIDA'),
+        **antigas,
+    )
+    por_compra = contar_por_filtro(
+        requisicoes_compra,
+        total=None,
+        pendentes=Q(status='PENDENTE'),
+        aprovadas=Q(status='APROVADA'),
+        atendidas=Q(status='FINALIZADA'),
+        **antigas,
+    )
+    return por_stock, por_compra, somar_contagens(por_stock, por_compra)
+
+
+def estatisticas_notificacoes(notificacoes):
+    """Painel da lista de notificações de stock"""
+    return contar_por_filtro(
+        notificacoes,
+        total_notificacoes=None,
+        nao_lidas=Q(lida=False),
+        criticas_count=Q(lida=False, tipo__in=['stock_baixo', 'error', 'warning'], prioridade__gte=3),
+    )
+
+
+def estatisticas_movimentos(movimentos):
+    """Totais de movimentos por sentido e movimentos sem utilizador (dashboard de stock)"""
+    return contar_por_filtro(
+        movimentos,
+        total_movimentacoes=None,
+        movimentacoes_entrada=Q(tipo_movimento__nome__icontains='entrada'),
+        movimentacoes_saida=Q(tipo_movimento__nome__icontains='saída'),
+        movimentacoes_sem_usuario=Q(usuario__isnull=True),
+    )
+
+
+def estatisticas_estado(queryset, status_field='status', com_estoque_baixo=False):
+    """
+    Contagens ATIVO/INATIVO/PENDENTE de `status_field` e, para modelos com
+    quantidade_atual e estoque_minimo, as linhas no mínimo ou abaixo dele.
+    """
+    contagens = {
+        'ativos': Q(**{status_field: 'ATIVO'}),
+        'inativos': Q(**{status_field: 'INATIVO'}),
+        'pendentes': Q(**{status_field: 'PENDENTE'}),
+    }
+    if com_estoque_baixo:
+        contagens['estoque_baixo'] = Q(quantidade_atual__lte=F('estoque_minimo'))
+    stats = contar_por_filtro(queryset, **contagens)
+    stats.setdefault('estoque_baixo', 0)
+    return stats
@@ -0,0 +1,88 @@
+"""
+Estado de stock baixo por (item, sucursal).
+
+StockItem.abaixo_minimo regista se o saldo está no estoque mínimo do item ou
+abaixo dele (itens com mínimo 0 nunca estão em stock baixo). O estado é
+sincronizado após cada escrita no saldo e só as transições geram
+notificação: uma ao entrar em stock baixo e outra quando o stock é reposto,
+em vez de um alerta por cada gravação. As listagens de stock baixo filtram
+por abaixo_minimo=True, servido por um índice parcial.
+"""
+import logging
+
+from django.db.models import F, Q
+
+from .metricas_cache import invalidar
+
+
+logger = logging.getLogger(__name__)
+
+
+def condicao_stock_baixo():
+    """Q que define stock baixo a partir da quantidade e do mínimo do item"""
+    return Q(item__estoque_minimo__gt=0, quantidade_atual__lte=F('item__estoque_minimo'))
+
+
+def _transitar(ids, abaixo_minimo):
+    """
+    Muda o estado linha a linha com um UPDATE condicional: só a escrita que
+    efectivamente muda o estado conta como transição, mesmo com lançamentos
+    concorrentes sobre o mesmo stock.
+    """
+    from ..models_stock import StockItem
+
+    return [
+        stock_id for stock_id in ids
+        if StockItem.objects.filter(id=stock_id, abaixo_minimo=not abaixo_minimo).update(abaixo_minimo=abaixo_minimo)
+    ]
+
+
+def _notificar(ids, abaixo_minimo):
+    from ..models_stock import NotificacaoStock, StockItem
+
+    notificacoes = []
+    for stock in StockItem.objects.filter(id__in=ids).select_related('item', 'sucursal'):
+        item = stock.item
+        if abaixo_minimo:
+            notificacoes.append(NotificacaoStock(
+                tipo='stock_baixo',
+                titulo=f'Estoque Baixo: {item.nome}',
+                mensagem=f'O item {item.nome} ({item.codigo}) está com estoque baixo na sucursal {stock.sucursal.nome}. Quantidade atual: {stock.quantidade_atual}, Mínimo: {item.estoque_minimo}',
+                url='/stock/requisicoes/verificar-stock-baixo/',
+                usuario_destinatario=None,  # Notificação geral
+                prioridade=3,
+                dados_extras={'item_id': item.id, 'sucursal_id': stock.sucursal_id},
+            ))
+        else:
+            notificacoes.append(NotificacaoStock(
+                tipo='stock_reposto',
+                titulo=f'Estoque Reposto: {item.nome}',
+                mensagem=f'O item {item.nome} ({item.codigo}) voltou a ficar acima do mínimo na sucursal {stock.sucursal.nome}. Quantidade atual: {stock.quantidade_atual}, Mínimo: {item.estoque_minimo}',
+                url='/stock/requisicoes/verificar-stock-baixo/',
+                usuario_destinatario=None,
+                dados_extras={'item_id': item.id, 'sucursal_id': stock.sucursal_id},
+            ))
+    NotificacaoStock.objects.bulk_create(notificacoes)
+    invalidar('notificacoes')
+
+
+def sincronizar_stock_baixo(stocks):
+    """
+    Actualiza abaixo_minimo nas linhas de `stocks` (QuerySet de StockItem) e
+    notifica as transições. Sem transições custa duas leituras de IDs.
+    Devolve (entraram, sairam) em stock baixo.
+    """
+    entrar = list(stocks.filter(condicao_stock_baixo(), abaixo_minimo=False).values_list('id', flat=True))
+    sair = list(stocks.filter(abaixo_minimo=True).exclude(condicao_stock_baixo()).values_list('id', flat=True))
+
+    entraram = _transitar(entrar, True)
+    sairam = _transitar(sair, False)
+    if entraram:
+        _notificar(entraram, True)
+    if sairam:
+        _notificar(sairam, False)
+
+    if entraram or sairam:
+        invalidar('stock')
+        logger.info('Stock baixo: %s entraram, %s saíram', len(entraram), len(sairam))
+    return len(entraram), len(sairam)
@@ -0,0 +1,270 @@
+"""
+Alocação de requisições internas por várias sucursais fornecedoras.
+
+Uma requisição era fornecida por uma única sucursal (a com mais stock do
+primeiro item), pelo que as linhas que essa sucursal não cobria ficavam a
+descoberto. Aqui a disponibilidade de todos os itens em todas as sucursais
+é lida numa só consulta (`matriz_disponibilidade`) e `alocar` reparte as
+linhas pelo menor número de sucursais: procura o menor conjunto de sucursais
+que cobre por inteiro as linhas que alguma sucursal cobre sozinha (busca
+exaustiva por tamanho, limitada a LIMITE_COMBINACOES; acima disso fica a
+solução gulosa) e só entre conjuntos do mesmo tamanho usa as sucursais
+preferidas (a indicada na requisição e as que já têm reservas dela) como
+desempate. As linhas que nenhuma sucursal cobre sozinha são divididas,
+começando pelas sucursais já escolhidas. Se a soma do disponível não chegar
+para alguma linha nada é alocado (AlocacaoIncompletaError).
+
+`criar_transferencias` cria uma TransferenciaStock por sucursal do plano e
+lança todas as saídas num único lote do ledger; a entrada na sucursal
+solicitante é lançada quando cada transferência é recebida
+(services/recebimentos.receber_transferencia).
+"""
+from collections import defaultdict
+from decimal import Decimal
+from itertools import combinations
+import logging
+import math
+
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .stock_ledger import lancar_movimentos_em_lote, obter_tipo_movimento
+
+
+logger = logging.getLogger(__name__)
+
+# Combinações de sucursais avaliadas na procura da cobertura mínima
+LIMITE_COMBINACOES = 20000
+
+
+class AlocacaoIncompletaError(ValueError):
+    """O disponível de todas as sucursais não cobre uma ou mais linhas"""
+
+    def __init__(self, faltas):
+        self.faltas = faltas
+        super().__init__(
+            'Stock disponível insuficiente em todas as sucursais para '
+            + ', '.join(f'item {item_id} (faltam {quantidade})' for item_id, quantidade in sorted(faltas.items()))
+        )
+
+
+def matriz_disponibilidade(item_ids, excluir_sucursal_id=None, requisicao=None):
+    """
+    {item_id: {sucursal_id: disponível}} das sucursais activas, numa consulta.
+    O disponível é o saldo menos as reservas activas; as reservas da própria
+    `requisicao` contam como disponíveis para ela.
+    """
+    from ..models_stock import ReservaStock, StockItem
+
+    stocks = StockItem.objects.filter(item_id__in=item_ids, sucursal__ativa=True)
+    if excluir_sucursal_id is not None:
+        stocks = stocks.exclude(sucursal_id=excluir_sucursal_id)
+
+    disponivel = F('quantidade_atual') - F('quantidade_reservada')
+    if requisicao is not None:
+        reservado = ReservaStock.objects.filter(
+            requisicao=requisicao, estado='ATIVA', item_id=OuterRef('item_id'), sucursal_id=OuterRef('sucursal_id'),
+        ).values('item_id').annotate(total=Sum('quantidade')).values('total').order_by()
+        disponivel = disponivel + Coalesce(
+            Subquery(reservado), Value(Decimal('0')), output_field=DecimalField(max_digits=10, decimal_places=3)
+        )
+
+    matriz = defaultdict(dict)
+    for item_id, sucursal_id, quantidade in stocks.annotate(disponivel=disponivel).values_list(
+        'item_id', 'sucursal_id', 'disponivel'
+    ):
+        matriz[item_id][sucursal_id] = quantidade
+    return dict(matriz)
+
+
+def _cobertura_gulosa(linhas_da_sucursal, ordem_preferida):
+    """A sucursal que cobre mais linhas ainda a descoberto, até as cobrir todas"""
+    por_cobrir = set().union(*linhas_da_sucursal.values())
+    escolhidas = []
+    while por_cobrir:
+        melhor = max(linhas_da_sucursal, key=lambda s: (
+            len(linhas_da_sucursal[s] & por_cobrir), -ordem_preferida.get(s, len(ordem_preferida)), -s
+        ))
+        escolhidas.append(melhor)
+        por_cobrir -= linhas_da_sucursal[melhor]
+    return escolhidas
+
+
+def _cobertura_minima(linhas_da_sucursal, ordem_preferida):
+    """
+    Menor conjunto de sucursais cujas linhas cobertas ({sucursal_id: {item_id}})
+    incluem todas as linhas. Entre conjuntos do mesmo tamanho fica o com mais
+    sucursais preferidas (e as mais à frente em `ordem_preferida`). Se a busca
+    passar de LIMITE_COMBINACOES combinações devolve a solução gulosa.
+    """
+    if not linhas_da_sucursal:
+        return []
+    gulosa = _cobertura_gulosa(linhas_da_sucursal, ordem_preferida)
+    todas = set().union(*linhas_da_sucursal.values())
+    candidatas = sorted(linhas_da_sucursal)
+
+    def preferencia(conjunto):
+        posicoes = sorted(ordem_preferida[s] for s in conjunto if s in ordem_preferida)
+        return (len(posicoes), [-p for p in posicoes], [-s for s in conjunto])
+
+    if math.comb(len(candidatas), len(gulosa)) > LIMITE_COMBINACOES:
+        return gulosa
+    for tamanho in range(1, len(gulosa) + 1):
+        cobrem = [
+            conjunto for conjunto in combinations(candidatas, tamanho)
+            if set().union(*(linhas_da_sucursal[s] for s in conjunto)) == todas
+        ]
+        if cobrem:
+            return list(max(cobrem, key=preferencia))
+    return gulosa
+
+
+def alocar(necessidades, disponibilidade, preferidas=()):
+    """
+    Reparte `necessidades` ({item_id: quantidade}) pelas sucursais de
+    `disponibilidade` ({item_id: {sucursal_id: disponível}}), minimizando o
+    número de sucursais (`preferidas` só desempatam entre planos com o mesmo
+    número). As quantidades alocadas são inteiras (unidades
+    inteiras do disponível). Devolve {sucursal_id: {item_id: quantidade}} ou
+    levanta AlocacaoIncompletaError com as quantidades em falta por item.
+    """
+    restantes = {item_id: quantidade for item_id, quantidade in necessidades.items() if quantidade > 0}
+
+    faltas = {}
+    for item_id, quantidade in restantes.items():
+        total = sum(math.floor(d) for d in disponibilidade.get(item_id, {}).values() if d > 0)
+        if total < quantidade:
+            faltas[item_id] = quantidade - total
+    if faltas:
+        raise AlocacaoIncompletaError(faltas)
+
+    # Sucursais que cobrem cada linha por inteiro e linhas que cada sucursal cobre
+    linhas_da_sucursal = defaultdict(set)
+    for item_id, quantidade in restantes.items():
+        for sucursal_id, d in disponibilidade.get(item_id, {}).items():
+            if d >= quantidade:
+                linhas_da_sucursal[sucursal_id].add(item_id)
+
+    ordem_preferida = {s: n for n, s in enumerate(dict.fromkeys(preferidas))}
+    escolhidas = _cobertura_minima(dict(linhas_da_sucursal), ordem_preferida)
+
+    # Cada linha vai para uma das escolhidas que a cobre: preferida, depois a que cobre mais linhas
+    plano = defaultdict(dict)
+    for item_id in sorted(set().union(*(linhas_da_sucursal[s] for s in escolhidas))):
+        sucursal_id = min(
+            (s for s in escolhidas if item_id in linhas_da_sucursal[s]),
+            key=lambda s: (ordem_preferida.get(s, len(ordem_preferida)), -len(linhas_da_sucursal[s]), s),
+        )
+        plano[sucursal_id][item_id] = restantes.pop(item_id)
+
+    # Linhas que nenhuma sucursal cobre sozinha: divididas, sucursais já escolhidas primeiro
+    for item_id, quantidade in sorted(restantes.items()):
+        disponivel = disponibilidade[item_id]
+        for sucursal_id in sorted(disponivel, key=lambda s: (s not in plano, -disponivel[s], s)):
+            parte = min(quantidade, math.floor(disponivel[sucursal_id]))
+            if parte <= 0:
+                continue
+            plano[sucursal_id][item_id] = parte
+            quantidade -= parte
+            if not quantidade:
+                break
+
+    return dict(plano)
+
+
+def planear(requisicao, quantidades, disponibilidade=None):
+    """
+    Plano {sucursal_id: {item_id: quantidade}} para fornecer `quantidades`
+    ({item_id: quantidade}) à sucursal solicitante da requisição. Entre
+    planos com o mesmo número de sucursais prefere a sucursal fornecedora
+    indicada e as que já têm reservas dela.
+    `disponibilidade` evita reler a matriz quando o chamador já a tem.
+    """
+    preferidas = [requisicao.sucursal_destino_id] if requisicao.sucursal_destino_id else []
+    if requisicao.pk:
+        preferidas += list(
+            requisicao.reservas.filter(estado='ATIVA').values('sucursal_id').annotate(
+                total=Sum('quantidade')
+            ).order_by('-total').values_list('sucursal_id', flat=True)
+        )
+    if disponibilidade is None:
+        disponibilidade = matriz_disponibilidade(
+            list(quantidades), excluir_sucursal_id=requisicao.sucursal_origem_id,
+            requisicao=requisicao if requisicao.pk else None,
+        )
+    return alocar(quantidades, disponibilidade, preferidas)
+
+
+def ordenar_plano(plano):
+    """Sucursais do plano por número de linhas (a principal primeiro)"""
+    return sorted(plano, key=lambda s: (-len(plano[s]), s))
+
+
+def criar_transferencias(requisicao, plano, usuario=None):
+    """
+    Cria uma TransferenciaStock (ENVIADA) por sucursal do `plano`, os seus
+    itens e os movimentos de saída de todas num único lote, e consome as
+    reservas da requisição. A entrada no destino fica para o recebimento.
+    A principal (mais linhas) fica com o código TRF<código da requisição>;
+    as restantes com -2, -3, ... Devolve as transferências, a principal
+    primeiro.
+    """
+    from ..models_base import Sucursal
+    from ..models_stock import Item, ItemTransferencia, TransferenciaStock
+
+    ordem = ordenar_plano(plano)
+    sucursais = Sucursal.objects.in_bulk(ordem)
+    itens = Item.objects.in_bulk({item_id for linhas in plano.values() for item_id in linhas})
+    tipo_saida = obter_tipo_movimento('SAIDA', 'Saída de Stock', False, 'Saída de stock da sucursal')
+
+    with transaction.atomic():
+        transferencias = []
+        linhas_transferencia = []
+        movimentos = []
+        for n, sucursal_id in enumerate(ordem, start=1):
+            transferencia = TransferenciaStock.objects.create(
+                codigo=f'TRF{requisicao.codigo}' if n == 1 else f'TRF{requisicao.codigo}-{n}',
+                sucursal_origem=sucursais[sucursal_id],
+                sucursal_destino_id=requisicao.sucursal_origem_id,
+                status='ENVIADA',
+                data_envio=timezone.now(),
+                observacoes=f'Transferência baseada na requisição {requisicao.codigo}',
+                criado_por=usuario,
+            )
+            transferencias.append(transferencia)
+
+            for item_id, quantidade in sorted(plano[sucursal_id].items()):
+                item = itens[item_id]
+                linhas_transferencia.append(ItemTransferencia(
+                    transferencia=transferencia,
+                    item=item,
+                    quantidade_solicitada=quantidade,
+                    quantidade_recebida=0,
+                    observacoes=f'Transferência para requisição {requisicao.codigo}',
+                ))
+                movimentos.append({
+                    'item': item,
+                    'quantidade': quantidade,
+                    'preco_unitario': None,  # ao custo médio da sucursal de origem
+                    'referencia': f'Transferência {transferencia.codigo}',
+                    'tipo_movimento': tipo_saida,
+                    'sucursal': sucursais[sucursal_id],
+                    'observacoes': f'Saída para requisição {requisicao.codigo}',
+                })
+
+        ItemTransferencia.objects.bulk_create(linhas_transferencia, batch_size=500)
+        # bulk_create não dispara os signals dos itens: totais guardados num UPDATE
+        criadas = TransferenciaStock.objects.filter(pk__in=[t.pk for t in transferencias])
+        criadas.recalcular_totais()
+        totais = {pk: valores for pk, *valores in criadas.values_list('pk', *TransferenciaStock.TOTAIS)}
+        for transferencia in transferencias:
+            for coluna, valor in zip(TransferenciaStock.TOTAIS, totais[transferencia.pk]):
+                setattr(transferencia, coluna, valor)
+        # As reservas da aprovação dão lugar à saída efectiva
+        lancar_movimentos_em_lote(movimentos, usuario=usuario, reservas=requisicao.reservas.all())
+
+    logger.info('Requisição %s: %s transferência(s), %s linhas, %s movimentos', requisicao.codigo,
+                len(transferencias), len(linhas_transferencia), len(movimentos))
+    return transferencias
@@ -0,0 +1,76 @@
+"""
+Matriz de indicadores por sucursal.
+
+Uma linha por sucursal com os itens em stock (produtos e materiais), o valor
+do stock (valor_estoque mantido pelo ledger) e as requisições feitas e
+recebidas. Cada modelo é lido com uma única consulta agrupada por sucursal,
+pelo que o custo não cresce com o número de sucursais. A matriz completa é
+guardada no cache de métricas e cada página filtra as sucursais que o
+utilizador pode ver.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, Q, Sum
+
+from .metricas_cache import obter
+
+
+COLUNAS_MATRIZ = (
+    'produtos', 'materiais', 'total_itens', 'valor_estoque',
+    'requisicoes_internas', 'requisicoes_externas', 'requisicoes_feitas', 'requisicoes_recebidas',
+)
+
+
+def _agrupar(queryset, campo, **agregados):
+    """{sucursal_id: {nome: valor}} de uma consulta agrupada por `campo`"""
+    return {
+        linha.pop(campo): linha
+        for linha in queryset.filter(**{f'{campo}__isnull': False}).values(campo).annotate(**agregados).order_by()
+    }
+
+
+def calcular_matriz():
+    """Matriz de todas as sucursais (ordenadas por nome): cinco consultas no total"""
+    from ..models_base import Sucursal
+    from ..models_stock import RequisicaoCompraExterna, RequisicaoStock, StockItem
+
+    stock = _agrupar(
+        StockItem.objects.filter(quantidade_atual__gt=0), 'sucursal_id',
+        produtos=Count('id', filter=Q(item__tipo='PRODUTO')),
+        materiais=Count('id', filter=Q(item__tipo='MATERIAL')),
+        valor_estoque=Sum('valor_estoque'),
+    )
+    internas = _agrupar(RequisicaoStock.objects.all(), 'sucursal_origem_id', total=Count('id'))
+    recebidas = _agrupar(RequisicaoStock.objects.all(), 'sucursal_destino_id', total=Count('id'))
+    externas = _agrupar(RequisicaoCompraExterna.objects.all(), 'sucursal_solicitante_id', total=Count('id'))
+
+    matriz = []
+    for sucursal_id, nome, ativa in Sucursal.objects.order_by('nome').values_list('id', 'nome', 'ativa'):
+        linha_stock = stock.get(sucursal_id, {})
+        produtos = linha_stock.get('produtos', 0)
+        materiais = linha_stock.get('materiais', 0)
+        n_internas = internas.get(sucursal_id, {}).get('total', 0)
+        n_externas = externas.get(sucursal_id, {}).get('total', 0)
+        matriz.append({
+            'sucursal_id': sucursal_id,
+            'sucursal': nome,
+            'ativa': ativa,
+            'produtos': produtos,
+            'materiais': materiais,
+            'total_itens': produtos + materiais,
+            'valor_estoque': linha_stock.get('valor_estoque') or Decimal('0'),
+            'requisicoes_internas': n_internas,
+            'requisicoes_externas': n_externas,
+            'requisicoes_feitas': n_internas + n_externas,
+            'requisicoes_recebidas': recebidas.get(sucursal_id, {}).get('total', 0),
+        })
+    return matriz
+
+
+def matriz_sucursais(sucursais_ids=None):
+    """Linhas da matriz (do cache) das sucursais em `sucursais_ids`, ou de todas"""
+    matriz = obter('matriz_sucursais', calcular_matriz, ['stock', 'requisicoes', 'sucursais', 'catalogo'])
+    if sucursais_ids is None:
+        return matriz
+    sucursais_ids = set(sucursais_ids)
+    return [linha for linha in matriz if linha['sucursal_id'] in sucursais_ids]
@@ -0,0 +1,287 @@
+"""
+Contagem cíclica: classificação ABC/XYZ e sessões diárias de contagem.
+
+Em vez de parar a sucursal para contar tudo, cada (item, sucursal) é contado
+de INTERVALO_DIAS em INTERVALO_DIAS dias conforme a sua classe:
+
+- ABC pelo valor das saídas nos últimos meses (A: os itens que somam os
+  primeiros 80% do valor, B: até 95%, C: o resto, incluindo os sem saídas);
+- XYZ pelo coeficiente de variação das quantidades saídas por mês (X até
+  0,5, Y até 1, Z acima ou sem saídas). Os itens A e B com consumo
+  esporádico (Z) são contados com o dobro da frequência.
+
+A classificação (ClassificacaoContagem) é recalculada por `classificar`,
+sucursal a sucursal: uma consulta agrupada por (item, mês) aos movimentos de
+saída do período, servida pelo índice (sucursal, data_movimento), e um
+upsert por lote. O tempo e a memória crescem com os itens da sucursal, não
+com o número de movimentos.
+
+`gerar_sessao` cria a sessão do dia como um InventarioFisico normal, só com
+os itens cuja próxima contagem já chegou (primeiro os mais atrasados e os de
+classe A), até à capacidade diária da sucursal: a soma de 1/intervalo de
+todos os itens, isto é, o que é preciso contar por dia para cumprir o ciclo.
+A primeira contagem dos itens novos é distribuída pelo seu intervalo para
+que a carga diária fique nivelada.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+from decimal import Decimal
+import logging
+import math
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .inventarios import criar_inventario
+from .particionamento_movimentos import filtrar_periodo
+
+
+logger = logging.getLogger(__name__)
+
+# Fracção acumulada do valor das saídas até à qual os itens são A e B
+LIMITES_ABC = (Decimal('0.80'), Decimal('0.95'))
+
+# Coeficiente de variação das saídas mensais até ao qual os itens são X e Y
+LIMITES_XYZ = (Decimal('0.5'), Decimal('1.0'))
+
+INTERVALO_DIAS = {'A': 30, 'B': 90, 'C': 180}
+
+MESES = 12
+
+TAMANHO_LOTE = 1000
+
+CAMPOS_CLASSIFICACAO = [
+    'classe_abc', 'classe_xyz', 'valor_saidas', 'saidas', 'coeficiente_variacao',
+    'intervalo_dias', 'proxima_contagem', 'data_classificacao',
+]
+
+
+def classes_abc(valores):
+    """{chave: 'A' | 'B' | 'C'} pelo valor acumulado de `valores` ({chave: valor}), do maior para o menor"""
+    total = sum(valores.values())
+    classes, acumulado = {}, Decimal('0')
+    for chave, valor in sorted(valores.items(), key=lambda par: par[1], reverse=True):
+        if valor <= 0:
+            classes[chave] = 'C'
+            continue
+        # A classe é a da fracção acumulada antes do item: o item que cruza o limite ainda conta
+        if acumulado < LIMITES_ABC[0] * total:
+            classes[chave] = 'A'
+        elif acumulado < LIMITES_ABC[1] * total:
+            classes[chave] = 'B'
+        else:
+            classes[chave] = 'C'
+        acumulado += valor
+    return classes
+
+
+def classe_xyz(quantidades_mensais):
+    """(classe, coeficiente de variação ou None) das quantidades saídas em cada mês, zeros incluídos"""
+    n = len(quantidades_mensais)
+    media = sum(quantidades_mensais) / n if n else 0
+    if not media:
+        return 'Z', None
+    variancia = sum((quantidade - media) ** 2 for quantidade in quantidades_mensais) / n
+    coeficiente = Decimal(math.sqrt(variancia) / media).quantize(Decimal('0.001'))
+    if coeficiente <= LIMITES_XYZ[0]:
+        return 'X', coeficiente
+    if coeficiente <= LIMITES_XYZ[1]:
+        return 'Y', coeficiente
+    return 'Z', coeficiente
+
+
+def intervalo_de_contagem(abc, xyz):
+    """Dias entre contagens de um item das classes `abc` e `xyz`"""
+    dias = INTERVALO_DIAS[abc]
+    if xyz == 'Z' and abc != 'C':
+        dias //= 2
+    return dias
+
+
+def _meses(hoje, meses):
+    """Primeiros dias dos `meses` meses completos antes do mês de `hoje`, do mais antigo para o mais recente"""
+    primeiro = hoje.replace(day=1)
+    resultado = []
+    for _ in range(meses):
+        primeiro = (primeiro - timedelta(days=1)).replace(day=1)
+        resultado.append(primeiro)
+    return resultado[::-1]
+
+
+def saidas_mensais(sucursal_id, inicio, fim):
+    """
+    {item_id: (valor, movimentos, {mês: quantidade})} das saídas da sucursal
+    nos dias [inicio, fim], numa consulta agrupada; os meses são o primeiro
+    dia de cada um. Os ajustes de inventário não contam como consumo.
+    """
+    from ..models_stock import MovimentoItem
+
+    movimentos = filtrar_periodo(
+        MovimentoItem.objects.filter(sucursal_id=sucursal_id, tipo_movimento__aumenta_estoque=False),
+        inicio, fim,
+    ).exclude(tipo_movimento__codigo__startswith='AJUSTE')
+
+    resultado = defaultdict(lambda: [Decimal('0'), 0, {}])
+    for item_id, mes, quantidade, valor, n in movimentos.annotate(
+        mes=TruncMonth('data_movimento')
+    ).values('item_id', 'mes').annotate(
+        total_quantidade=Sum('quantidade'), total_valor=Sum('valor_total'), n=Count('id'),
+    ).values_list('item_id', 'mes', 'total_quantidade', 'total_valor', 'n').order_by():
+        linha = resultado[item_id]
+        linha[0] += valor or 0
+        linha[1] += n
+        mes = mes.date() if hasattr(mes, 'date') else mes
+        linha[2][mes] = linha[2].get(mes, 0) + quantidade
+    return {item_id: tuple(linha) for item_id, linha in resultado.items()}
+
+
+def classificar_sucursal(sucursal_id, hoje=None, meses=MESES):
+    """
+    Recalcula a classificação dos itens com stock na sucursal. Mantém o
+    plano já existente: a próxima contagem é a última mais o (novo)
+    intervalo ou, para os itens ainda não contados, a já marcada (antecipada
+    se o intervalo encurtou); os itens novos são distribuídos pelo seu
+    intervalo a partir de `hoje`. Devolve o número de itens classificados.
+    """
+    from ..models_stock import ClassificacaoContagem, StockItem
+
+    hoje = hoje or timezone.localdate()
+    periodo = _meses(hoje, meses)
+    item_ids = list(StockItem.objects.filter(sucursal_id=sucursal_id).values_list('item_id', flat=True))
+    saidas = saidas_mensais(sucursal_id, periodo[0], hoje.replace(day=1) - timedelta(days=1))
+    planos = {
+        item_id: (ultima, proxima)
+        for item_id, ultima, proxima in ClassificacaoContagem.objects.filter(sucursal_id=sucursal_id).values_list(
+            'item_id', 'ultima_contagem', 'proxima_contagem'
+        )
+    }
+
+    sem_saidas = (Decimal('0'), 0, {})
+    abc = classes_abc({item_id: saidas.get(item_id, sem_saidas)[0] for item_id in item_ids})
+    agora = timezone.now()
+    novos = Counter()
+    linhas = []
+    for item_id in sorted(item_ids):
+        valor, n, por_mes = saidas.get(item_id, sem_saidas)
+        xyz, coeficiente = classe_xyz([por_mes.get(mes, 0) for mes in periodo])
+        intervalo = intervalo_de_contagem(abc[item_id], xyz)
+        ultima, proxima = planos.get(item_id, (None, None))
+        if ultima:
+            proxima = ultima + timedelta(days=intervalo)
+        elif proxima:
+            proxima = min(proxima, hoje + timedelta(days=intervalo))
+        else:
+            proxima = hoje + timedelta(days=novos[intervalo] % intervalo)
+            novos[intervalo] += 1
+        linhas.append(ClassificacaoContagem(
+            item_id=item_id, sucursal_id=sucursal_id, classe_abc=abc[item_id], classe_xyz=xyz,
+            valor_saidas=valor, saidas=n, coeficiente_variacao=coeficiente, intervalo_dias=intervalo,
+            ultima_contagem=ultima, proxima_contagem=proxima, data_classificacao=agora,
+        ))
+
+    with transaction.atomic():
+        for inicio in range(0, len(linhas), TAMANHO_LOTE):
+            ClassificacaoContagem.objects.bulk_create(
+                linhas[inicio:inicio + TAMANHO_LOTE],
+                update_conflicts=True,
+                unique_fields=['item', 'sucursal'],
+                update_fields=CAMPOS_CLASSIFICACAO,
+            )
+        ClassificacaoContagem.objects.filter(sucursal_id=sucursal_id).exclude(item_id__in=item_ids).delete()
+
+    logger.info('Sucursal %s: %s itens classificados (%s)', sucursal_id, len(linhas),
+                dict(Counter(linha.classe_abc for linha in linhas)))
+    return len(linhas)
+
+
+def classificar(sucursal_ids=None, hoje=None, meses=MESES, ao_progresso=None):
+    """
+    Recalcula a classificação das sucursais activas em `sucursal_ids` (todas
+    se for None), uma de cada vez; `ao_progresso(sucursal, itens)` é chamado
+    depois de cada uma. Devolve o total de itens classificados.
+    """
+    from .dados_referencia import sucursais_ativas
+
+    total = 0
+    for sucursal in sucursais_ativas():
+        if sucursal_ids is not None and sucursal.id not in sucursal_ids:
+            continue
+        itens = classificar_sucursal(sucursal.id, hoje=hoje, meses=meses)
+        total += itens
+        if ao_progresso:
+            ao_progresso(sucursal, itens)
+    return total
+
+
+def capacidade_diaria(sucursal_id):
+    """Itens a contar por dia para cumprir o ciclo: soma de 1/intervalo, arredondada para cima"""
+    from ..models_stock import ClassificacaoContagem
+
+    por_intervalo = ClassificacaoContagem.objects.filter(sucursal_id=sucursal_id).values_list(
+        'intervalo_dias'
+    ).annotate(n=Count('id')).order_by()
+    return math.ceil(sum(n / intervalo for intervalo, n in por_intervalo))
+
+
+def gerar_sessao(sucursal, usuario, dia=None, limite=None):
+    """
+    Cria a sessão de contagem cíclica de `dia` na sucursal: um
+    InventarioFisico com os itens em atraso (próxima contagem até `dia`),
+    até `limite` itens (por omissão, a capacidade diária). Os itens incluídos
+    passam a ter a última contagem em `dia` e a próxima um intervalo depois;
+    os que ficarem de fora entram nas sessões seguintes. Devolve o
+    inventário, ou None se não houver itens ou a sessão do dia já existir.
+    """
+    from ..models_stock import ClassificacaoContagem
+
+    dia = dia or timezone.localdate()
+    planos = ClassificacaoContagem.objects.filter(sucursal=sucursal)
+    if planos.filter(ultima_contagem=dia).exists():
+        return None
+    limite = capacidade_diaria(sucursal.id) if limite is None else limite
+    devidos = list(planos.filter(proxima_contagem__lte=dia).order_by(
+        'proxima_contagem', 'classe_abc', 'item_id'
+    ).values_list('item_id', 'intervalo_dias', 'classe_abc')[:limite])
+    if not devidos:
+        return None
+
+    por_intervalo = defaultdict(list)
+    for item_id, intervalo, _ in devidos:
+        por_intervalo[intervalo].append(item_id)
+    classes = Counter(classe for _, _, classe in devidos)
+
+    with transaction.atomic():
+        inventario = criar_inventario(
+            item_ids=[item_id for item_id, _, _ in devidos],
+            nome=f'Contagem cíclica {dia:%d/%m/%Y}',
+            sucursal=sucursal,
+            data_inicio=timezone.now(),
+            usuario_responsavel=usuario,
+            usuario_criador=usuario,
+            observacoes='Sessão de contagem cíclica: ' + ', '.join(
+                f'{classes[classe]} itens {classe}' for classe in 'ABC' if classes[classe]
+            ),
+        )
+        for intervalo, item_ids in por_intervalo.items():
+            planos.filter(item_id__in=item_ids).update(
+                ultima_contagem=dia, proxima_contagem=dia + timedelta(days=intervalo)
+            )
+
+    logger.info('Contagem cíclica %s na sucursal %s: %s itens', inventario.codigo, sucursal.id, len(devidos))
+    return inventario
+
+
+def gerar_sessoes(usuario, dia=None, sucursal_ids=None, limite=None):
+    """Sessões de `dia` das sucursais activas em `sucursal_ids` (todas se for None). Devolve as criadas"""
+    from .dados_referencia import sucursais_ativas
+
+    sessoes = []
+    for sucursal in sucursais_ativas():
+        if sucursal_ids is not None and sucursal.id not in sucursal_ids:
+            continue
+        inventario = gerar_sessao(sucursal, usuario, dia=dia, limite=limite)
+        if inventario:
+            sessoes.append(inventario)
+    return sessoes
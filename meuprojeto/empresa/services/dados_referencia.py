@@ -0,0 +1,239 @@
+"""
+Registo de dados de referência.
+
+Tabelas pequenas e que raramente mudam (tipos de movimento e de presença,
+descontos salariais, feriados, departamentos, cargos, sucursais) são lidas
+por inteiro na primeira utilização e servidas da memória do processo. Cada
+conjunto tem um carimbo de versão no cache partilhado (CACHES 'default'): as
+gravações nos modelos de um conjunto (signals_referencia) sobem o carimbo
+depois do commit e descartam a cópia local; os outros processos comparam o
+carimbo, no máximo a cada REFERENCIA_VERIFICACAO segundos, e recarregam
+quando mudou. `aquecer` carrega todos os conjuntos no arranque (wsgi/asgi).
+
+As instâncias devolvidas são partilhadas entre pedidos: servem para leitura
+e para chaves estrangeiras, nunca para alterar e gravar.
+"""
+import logging
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SynchronousOnlyOperation
+from django.db import DatabaseError, transaction
+
+
+logger = logging.getLogger(__name__)
+
+PREFIXO = 'referencia'
+
+# nome -> (carregador, rótulos dos modelos de que depende)
+_CONJUNTOS = {}
+# nome -> (carimbo, dados, instante da última verificação)
+_carregados = {}
+_trinco = threading.RLock()
+
+
+def intervalo_verificacao():
+    return getattr(settings, 'REFERENCIA_VERIFICACAO', 5)
+
+
+def conjunto(nome, *modelos):
+    """Regista o carregador de um conjunto e os modelos ('app.Modelo') que o invalidam"""
+    def registar(carregador):
+        _CONJUNTOS[nome] = (carregador, modelos)
+        return carregador
+    return registar
+
+
+def conjuntos_do_modelo(modelo):
+    """Nomes dos conjuntos invalidados por gravações em `modelo`"""
+    rotulo = modelo._meta.label
+    return [nome for nome, (_, modelos) in _CONJUNTOS.items() if rotulo in modelos]
+
+
+def modelos_registados():
+    return {apps.get_model(rotulo) for _, modelos in _CONJUNTOS.values() for rotulo in modelos}
+
+
+def _chave_carimbo(nome):
+    return f'{PREFIXO}:carimbo:{nome}'
+
+
+def _carimbo(nome):
+    chave = _chave_carimbo(nome)
+    carimbo = cache.get(chave)
+    if carimbo is None:
+        cache.add(chave, time.time_ns(), None)
+        carimbo = cache.get(chave)
+    return carimbo
+
+
+def _subir_carimbo(nomes):
+    with _trinco:
+        for nome in nomes:
+            _carregados.pop(nome, None)
+    for nome in nomes:
+        try:
+            cache.incr(_chave_carimbo(nome))
+        except ValueError:
+            cache.set(_chave_carimbo(nome), time.time_ns(), None)
+
+
+def invalidar(*nomes):
+    """Descarta os conjuntos neste e nos outros processos (após o commit da transacção corrente)"""
+    desconhecidos = set(nomes) - set(_CONJUNTOS)
+    if desconhecidos:
+        raise ValueError(f'Conjunto(s) de referência desconhecido(s): {", ".join(sorted(desconhecidos))}')
+    transaction.on_commit(lambda: _subir_carimbo(nomes))
+
+
+def dados(nome):
+    """Dados do conjunto `nome`, carregados (ou recarregados) se necessário"""
+    agora = time.monotonic()
+    with _trinco:
+        carregado = _carregados.get(nome)
+    if carregado and agora - carregado[2] < intervalo_verificacao():
+        return carregado[1]
+
+    carimbo = _carimbo(nome)
+    with _trinco:
+        carregado = _carregados.get(nome)
+        if carregado and carregado[0] == carimbo:
+            _carregados[nome] = (carimbo, carregado[1], agora)
+            return carregado[1]
+
+        carregador, _ = _CONJUNTOS[nome]
+        valor = carregador()
+        _carregados[nome] = (carimbo, valor, agora)
+    logger.debug('Dados de referência %s carregados (carimbo %s)', nome, carimbo)
+    return valor
+
+
+def aquecer():
+    """Carrega todos os conjuntos; sem base de dados disponível fica para o primeiro uso"""
+    try:
+        for nome in _CONJUNTOS:
+            dados(nome)
+    except (DatabaseError, SynchronousOnlyOperation) as e:
+        logger.warning(f'Dados de referência não pré-carregados: {e}')
+
+
+def limpar():
+    """Descarta as cópias locais (os carimbos partilhados ficam)"""
+    with _trinco:
+        _carregados.clear()
+
+
+# =============================================================================
+# CONJUNTOS
+# =============================================================================
+
+@conjunto('tipos_movimento', 'empresa.TipoMovimentoStock')
+def _tipos_movimento():
+    from ..models_stock import TipoMovimentoStock
+
+    tipos = list(TipoMovimentoStock.objects.order_by('nome'))
+    return {'todos': tipos, 'por_codigo': {tipo.codigo: tipo for tipo in tipos}}
+
+
+@conjunto('tipos_presenca', 'empresa.TipoPresenca')
+def _tipos_presenca():
+    from ..models_rh import TipoPresenca
+
+    tipos = list(TipoPresenca.objects.order_by('nome'))
+    return {'todos': tipos, 'por_codigo': {tipo.codigo: tipo for tipo in tipos}}
+
+
+@conjunto('descontos_salariais', 'empresa.DescontoSalarial')
+def _descontos_salariais():
+    from ..models_rh import DescontoSalarial
+
+    descontos = list(DescontoSalarial.objects.order_by('nome'))
+    return {'todos': descontos, 'por_codigo': {desconto.codigo: desconto for desconto in descontos}}
+
+
+@conjunto('feriados', 'empresa.Feriado')
+def _feriados():
+    from ..models_rh import Feriado
+
+    return frozenset(Feriado.objects.filter(ativo=True).values_list('data', flat=True))
+
+
+@conjunto('departamentos', 'empresa.Departamento', 'empresa.Sucursal')
+def _departamentos():
+    from ..models_rh import Departamento
+
+    return list(Departamento.objects.filter(ativo=True).select_related('sucursal').order_by('nome'))
+
+
+@conjunto('cargos', 'empresa.Cargo', 'empresa.Departamento')
+def _cargos():
+    from ..models_rh import Cargo
+
+    return list(Cargo.objects.filter(ativo=True).select_related('departamento').order_by('nome'))
+
+
+@conjunto('sucursais', 'empresa.Sucursal')
+def _sucursais():
+    from ..models_base import Sucursal
+
+    return list(Sucursal.objects.filter(ativa=True).order_by('nome'))
+
+
+# =============================================================================
+# ACESSO
+# =============================================================================
+
+def tipo_movimento(codigo):
+    """TipoMovimentoStock com o código, ou None"""
+    return dados('tipos_movimento')['por_codigo'].get(codigo)
+
+
+def tipos_movimento():
+    """Todos os TipoMovimentoStock, por nome"""
+    return list(dados('tipos_movimento')['todos'])
+
+
+def tipo_presenca(codigo):
+    """TipoPresenca com o código, ou None"""
+    return dados('tipos_presenca')['por_codigo'].get(codigo)
+
+
+def tipos_presenca(ativos=True):
+    """TipoPresenca por nome (só os activos, por omissão)"""
+    return [tipo for tipo in dados('tipos_presenca')['todos'] if tipo.ativo or not ativos]
+
+
+def desconto_salarial(codigo):
+    """DescontoSalarial com o código, ou None"""
+    return dados('descontos_salariais')['por_codigo'].get(codigo)
+
+
+def descontos_automaticos(excluir=()):
+    """DescontoSalarial activos e de aplicação automática, sem os códigos em `excluir`"""
+    return [
+        desconto for desconto in dados('descontos_salariais')['todos']
+        if desconto.ativo and desconto.aplicar_automaticamente and desconto.codigo not in excluir
+    ]
+
+
+def e_feriado(data):
+    """Se `data` é um feriado activo"""
+    return data in dados('feriados')
+
+
+def departamentos_ativos():
+    """Departamento activos, por nome"""
+    return list(dados('departamentos'))
+
+
+def cargos_ativos():
+    """Cargo activos, por nome"""
+    return list(dados('cargos'))
+
+
+def sucursais_ativas():
+    """Sucursal activas, por nome"""
+    return list(dados('sucursais'))
@@ -0,0 +1,129 @@
+"""
+Eventos dos dashboards (Server-Sent Events).
+
+Em vez de cada browser repetir as consultas dos painéis a intervalos fixos,
+cada ligação SSE (views_dashboard.dashboard_eventos, servida em ASGI) fica à
+espera de alterações e só envia um painel quando a versão dos seus domínios
+no cache de métricas muda. Os valores vêm de metricas_cache.obter, pelo que
+cada alteração é calculada uma vez e partilhada por todas as ligações: a
+carga na base de dados acompanha o número de eventos e não o número de
+clientes.
+
+`publicar` é chamado por metricas_cache sempre que uma versão sobe (depois
+do commit) e acorda as ligações deste processo de imediato. Alterações
+feitas noutros processos são apanhadas na verificação periódica das versões
+(`intervalo_eventos`), que só lê o cache. Sem ASGI a view responde 204 e a
+página volta a consultar os endpoints dos gráficos periodicamente.
+"""
+import asyncio
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .metricas_cache import metricas_dashboard_executivo, metricas_logistica, metricas_notificacoes, versoes
+
+
+logger = logging.getLogger(__name__)
+
+# Eventos por entregar numa ligação; acima disto descarta-se o mais antigo
+# (cada evento só acorda a ligação, que relê as versões).
+LIMITE_FILA = 16
+
+_subscritores = set()
+_trinco = threading.Lock()
+
+
+def intervalo_eventos():
+    """Segundos entre verificações de versões (e comentários keep-alive)"""
+    return getattr(settings, 'DASHBOARD_SSE_INTERVALO', 15)
+
+
+def duracao_ligacao():
+    """Segundos até a ligação ser fechada; o EventSource volta a ligar"""
+    return getattr(settings, 'DASHBOARD_SSE_DURACAO', 600)
+
+
+# =============================================================================
+# DISTRIBUIÇÃO NO PROCESSO
+# =============================================================================
+
+def subscrever():
+    """Regista uma fila para a ligação que corre no event loop actual"""
+    fila = asyncio.Queue(maxsize=LIMITE_FILA)
+    with _trinco:
+        _subscritores.add((asyncio.get_running_loop(), fila))
+    return fila
+
+
+def cancelar(fila):
+    with _trinco:
+        for subscritor in [s for s in _subscritores if s[1] is fila]:
+            _subscritores.discard(subscritor)
+
+
+def _entregar(fila, dominios):
+    if fila.full():
+        fila.get_nowait()
+    fila.put_nowait(dominios)
+
+
+def publicar(dominios):
+    """Acorda as ligações deste processo (pode ser chamado de qualquer thread)"""
+    with _trinco:
+        subscritores = list(_subscritores)
+    for loop, fila in subscritores:
+        try:
+            loop.call_soon_threadsafe(_entregar, fila, tuple(dominios))
+        except RuntimeError:
+            # Event loop já fechado: a ligação terminou sem cancelar
+            cancelar(fila)
+
+
+def total_subscritores():
+    with _trinco:
+        return len(_subscritores)
+
+
+# =============================================================================
+# PAINÉIS
+# =============================================================================
+
+def _painel_graficos(usuario, sucursais_ids):
+    # Os gráficos dependem de parâmetros da página: o cliente volta a pedi-los
+    return {}
+
+
+PAINEIS = {
+    'executivo': (
+        ('catalogo', 'movimentos', 'stock', 'notificacoes'),
+        lambda usuario, sucursais_ids: metricas_dashboard_executivo(usuario, sucursais_ids),
+    ),
+    'notificacoes': (
+        ('notificacoes',),
+        lambda usuario, sucursais_ids: metricas_notificacoes(usuario),
+    ),
+    'logistica': (('logistica',), lambda usuario, sucursais_ids: metricas_logistica()),
+    'graficos': (('movimentos', 'stock', 'catalogo', 'requisicoes', 'sucursais'), _painel_graficos),
+}
+
+
+def paineis_validos(nomes):
+    """Os nomes de `nomes` que correspondem a painéis, pela ordem recebida"""
+    return [nome for nome in dict.fromkeys(nomes) if nome in PAINEIS]
+
+
+def versoes_paineis(paineis):
+    """{painel: versão dos seus domínios} (só leituras do cache)"""
+    return {nome: versoes(PAINEIS[nome][0]) for nome in paineis}
+
+
+def calcular_painel(nome, usuario, sucursais_ids):
+    return PAINEIS[nome][1](usuario, sucursais_ids)
+
+
+def formatar_evento(nome, dados, versao):
+    """Um evento SSE com `dados` em JSON e a versão como id"""
+    return f'id: {versao}\nevent: {nome}\ndata: {json.dumps(dados, cls=DjangoJSONEncoder)}\n\n'
@@ -0,0 +1,216 @@
+"""
+Índice unificado de requisições (IndiceRequisicao).
+
+A listagem de requisições junta as internas (RequisicaoStock) e as de compra
+externa (RequisicaoCompraExterna). Em vez de carregar as duas tabelas e os
+itens para mostrar 20 linhas, lê de IndiceRequisicao: uma linha por
+requisição com código, tipo, estado, sucursais, data, número de itens e
+valor. Filtrar, contar e paginar passa a ser uma consulta cada, com
+paginação por chave (data_criacao, id) em vez de OFFSET.
+
+As gravações e remoções de requisições e dos seus itens (signals) marcam a
+requisição e o índice é recalculado uma vez por requisição depois do commit.
+O valor é o total guardado na requisição (ver signals_totais);
+`reconstruir_indice` regenera tudo a partir das requisições.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+import logging
+import threading
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .agregacao import contar_por_filtro
+
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_PAGINA = 20
+
+CAMPOS_INDICE = (
+    'codigo', 'status', 'sucursal', 'sucursal_destino', 'criado_por',
+    'observacoes', 'data_criacao', 'total_itens', 'valor_total',
+)
+
+_EPOCA = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_UM_MICROSSEGUNDO = timedelta(microseconds=1)
+
+_pendentes = threading.local()
+
+
+def _modelos():
+    from ..models_stock import RequisicaoCompraExterna, RequisicaoStock
+
+    return {'INTERNA': RequisicaoStock, 'EXTERNA': RequisicaoCompraExterna}
+
+
+def _linhas(tipo, requisicao_ids=None):
+    """IndiceRequisicao (por gravar) das requisições `tipo`, com o número de itens numa consulta"""
+    from ..models_stock import IndiceRequisicao
+
+    if tipo == 'INTERNA':
+        sucursal, sucursal_destino = 'sucursal_origem_id', 'sucursal_destino_id'
+    else:
+        sucursal, sucursal_destino = 'sucursal_solicitante_id', None
+
+    requisicoes = _modelos()[tipo].objects.all()
+    if requisicao_ids is not None:
+        requisicoes = requisicoes.filter(id__in=requisicao_ids)
+    requisicoes = requisicoes.annotate(n_itens=Count('itens')).values(
+        'id', 'codigo', 'status', sucursal, *([sucursal_destino] if sucursal_destino else []),
+        'criado_por_id', 'observacoes', 'data_criacao', 'n_itens', 'valor_total',
+    ).order_by()
+
+    return [
+        IndiceRequisicao(
+            tipo=tipo,
+            requisicao_id=linha['id'],
+            codigo=linha['codigo'],
+            status=linha['status'],
+            sucursal_id=linha[sucursal],
+            sucursal_destino_id=linha[sucursal_destino] if sucursal_destino else None,
+            criado_por_id=linha['criado_por_id'],
+            observacoes=linha['observacoes'] or '',
+            data_criacao=linha['data_criacao'],
+            total_itens=linha['n_itens'],
+            valor_total=linha['valor_total'],
+        )
+        for linha in requisicoes
+    ]
+
+
+def indexar(tipo, requisicao_ids):
+    """
+    Recalcula as linhas das requisições `tipo` em `requisicao_ids`: um upsert
+    para as existentes e remoção das que já não existem.
+    """
+    from ..models_stock import IndiceRequisicao
+
+    requisicao_ids = set(requisicao_ids)
+    linhas = _linhas(tipo, requisicao_ids)
+    IndiceRequisicao.objects.bulk_create(
+        linhas,
+        update_conflicts=True,
+        unique_fields=['tipo', 'requisicao_id'],
+        update_fields=CAMPOS_INDICE,
+    )
+    removidas = requisicao_ids - {linha.requisicao_id for linha in linhas}
+    if removidas:
+        IndiceRequisicao.objects.filter(tipo=tipo, requisicao_id__in=removidas).delete()
+    return len(linhas)
+
+
+def _processar_pendentes():
+    marcadas = getattr(_pendentes, 'marcadas', None) or {}
+    _pendentes.marcadas = {}
+    for tipo, requisicao_ids in marcadas.items():
+        indexar(tipo, requisicao_ids)
+
+
+def marcar(tipo, requisicao_id):
+    """
+    Agenda a reindexação da requisição para o commit da transacção corrente.
+    O primeiro callback a correr processa todas as marcadas, pelo que cada
+    requisição é recalculada uma vez por muitas que sejam as gravações
+    (p.ex. itens); as marcas de uma transacção revertida são recalculadas
+    no commit seguinte, o que só relê o estado real.
+    """
+    marcadas = getattr(_pendentes, 'marcadas', None)
+    if marcadas is None:
+        marcadas = _pendentes.marcadas = {}
+    marcadas.setdefault(tipo, set()).add(requisicao_id)
+    transaction.on_commit(_processar_pendentes)
+
+
+def reconstruir_indice():
+    """Regenera o índice inteiro a partir das requisições. Devolve o número de linhas"""
+    from ..models_stock import IndiceRequisicao
+
+    with transaction.atomic():
+        IndiceRequisicao.objects.all().delete()
+        total = 0
+        for tipo in _modelos():
+            linhas = _linhas(tipo)
+            IndiceRequisicao.objects.bulk_create(linhas, batch_size=1000)
+            total += len(linhas)
+
+    logger.info('Índice de requisições reconstruído: %s linhas', total)
+    return total
+
+
+# =============================================================================
+# LISTAGEM
+# =============================================================================
+
+def filtrar(queryset, pesquisa='', status='', sucursal_id=''):
+    """Os filtros da listagem de requisições sobre IndiceRequisicao"""
+    if pesquisa:
+        queryset = queryset.filter(
+            Q(codigo__icontains=pesquisa) |
+            Q(sucursal__nome__icontains=pesquisa) |
+            Q(sucursal_destino__nome__icontains=pesquisa) |
+            Q(observacoes__icontains=pesquisa)
+        )
+    if status:
+        queryset = queryset.filter(status=status)
+    if sucursal_id:
+        queryset = queryset.filter(Q(sucursal_id=sucursal_id) | Q(sucursal_destino_id=sucursal_id))
+    return queryset
+
+
+def estatisticas(queryset):
+    """Painel da listagem (totais por tipo e estado) numa consulta"""
+    return contar_por_filtro(
+        queryset,
+        total=None,
+        total_internas=Q(tipo='INTERNA'),
+        total_externas=Q(tipo='EXTERNA'),
+        pendentes=Q(status='PENDENTE'),
+        aprovadas=Q(status='APROVADA'),
+        atendidas=Q(tipo='INTERNA', status='ATENDIDA') | Q(tipo='EXTERNA', status='FINALIZADA'),
+    )
+
+
+def codificar_cursor(linha):
+    """Cursor ('<microssegundos>.<id>') que aponta para `linha`"""
+    return f'{(linha.data_criacao - _EPOCA) // _UM_MICROSSEGUNDO}.{linha.pk}'
+
+
+def descodificar_cursor(cursor):
+    """(data_criacao, id) de um cursor, ou None se for inválido"""
+    try:
+        microssegundos, pk = cursor.split('.')
+        return _EPOCA + timedelta(microseconds=int(microssegundos)), int(pk)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+def pagina(queryset, depois='', antes='', tamanho=TAMANHO_PAGINA):
+    """
+    Página de `queryset` por ordem (-data_criacao, -id): a seguir ao cursor
+    `depois`, a anterior ao cursor `antes` (a primeira se não houver), ou a
+    primeira. Uma consulta de tamanho+1 linhas, sem OFFSET. Devolve (linhas,
+    cursor_anterior, cursor_seguinte), com None quando não há página nesse
+    sentido.
+    """
+    posicao = descodificar_cursor(antes) if antes else None
+    if posicao:
+        data, pk = posicao
+        linhas = list(queryset.filter(
+            Q(data_criacao__gt=data) | Q(data_criacao=data, id__gt=pk)
+        ).order_by('data_criacao', 'id')[:tamanho + 1])
+        mais = len(linhas) > tamanho
+        linhas = linhas[:tamanho][::-1]
+        if linhas:
+            anterior = codificar_cursor(linhas[0]) if mais else None
+            return linhas, anterior, codificar_cursor(linhas[-1])
+
+    posicao = descodificar_cursor(depois) if depois else None
+    if posicao:
+        data, pk = posicao
+        queryset = queryset.filter(Q(data_criacao__lt=data) | Q(data_criacao=data, id__lt=pk))
+    linhas = list(queryset.order_by('-data_criacao', '-id')[:tamanho + 1])
+    mais = len(linhas) > tamanho
+    linhas = linhas[:tamanho]
+    anterior = codificar_cursor(linhas[0]) if posicao and linhas else None
+    return linhas, anterior, codificar_cursor(linhas[-1]) if mais else None
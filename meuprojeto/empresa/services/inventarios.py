@@ -0,0 +1,373 @@
+"""
+Inventários físicos por operações de conjunto.
+
+Criar um inventário copia o saldo de cada StockItem da sucursal para
+ItemInventario com INSERT ... SELECT, sem trazer as linhas para Python. Uma
+contagem submetida é validada inteira e gravada, por lote, com um UPDATE das
+linhas (cada campo é um CASE pelos valores distintos, não por linha, como
+faria bulk_update) e bulk_create do histórico (HistoricoContagem). A
+conclusão cria os ajustes com bulk_create e, se pedido, lança-os num único
+lote do ledger.
+
+O inventário não obriga a parar a sucursal: o snapshot fica datado
+(InventarioFisico.data_snapshot), com as linhas de saldo da sucursal
+bloqueadas em modo partilhado enquanto são datadas e copiadas, e cada
+contagem é comparada com o esperado no momento em que é registada, isto é,
+a quantidade do sistema mais o saldo dos movimentos lançados entretanto
+(ItemInventario.variacao_stock), obtido numa consulta agrupada ao ledger
+por lote. Os movimentos feitos durante a contagem deixam de aparecer como
+diferenças e de obrigar a recontagens.
+
+As contagens correm por lotes de TAMANHO_LOTE itens (a cópia do snapshot é
+uma só instrução); `ao_progresso(feitos, total)` é chamado depois de cada
+lote. Os contadores de progresso guardados no inventário (total_itens,
+itens_contados) são recalculados com um UPDATE no fim de cada operação.
+"""
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+import logging
+
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Cast, Greatest
+from django.utils import timezone
+
+from .sequencias import proximos_codigos
+from .stock_ledger import lancar_movimentos_em_lote, obter_tipo_movimento
+
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_LOTE = 2000
+
+MAX_CONTAGENS = 3
+
+CAMPOS_CONTAGEM = [
+    'quantidade_contada', 'variacao_stock', 'diferenca', 'data_contagem', 'usuario_contador',
+    'numero_contagem', 'contagem_finalizada', 'precisa_recontagem',
+]
+
+Contagem = namedtuple('Contagem', 'contados erros')
+
+
+class InventarioFechadoError(ValueError):
+    """O inventário já não está num estado que permita a operação"""
+
+
+def _lotes(sequencia, tamanho=None):
+    tamanho = tamanho or TAMANHO_LOTE
+    for inicio in range(0, len(sequencia), tamanho):
+        yield sequencia[inicio:inicio + tamanho]
+
+
+def _delta_movimento():
+    return Case(
+        When(tipo_movimento__aumenta_estoque=True, then=F('quantidade')),
+        default=F('quantidade') * -1,
+    )
+
+
+def _recalcular_progresso(inventario):
+    from ..models_stock import InventarioFisico
+
+    InventarioFisico.objects.filter(pk=inventario.pk).recalcular_progresso()
+    inventario.refresh_from_db(fields=['total_itens', 'itens_contados'])
+
+
+def _gravar_por_valor(modelo, objectos, campos):
+    """
+    Grava os `campos` dos `objectos` num único UPDATE: cada campo com um só
+    valor é atribuído directamente, os restantes com um CASE de um WHEN
+    (pk IN ...) por valor distinto.
+    """
+    valores = {}
+    for campo in campos:
+        grupos = defaultdict(list)
+        for objecto in objectos:
+            grupos[getattr(objecto, modelo._meta.get_field(campo).attname)].append(objecto.pk)
+        if len(grupos) == 1:
+            valores[campo] = Value(next(iter(grupos)), output_field=modelo._meta.get_field(campo))
+        else:
+            valores[campo] = Case(
+                *[When(pk__in=pks, then=Value(valor)) for valor, pks in grupos.items()],
+                output_field=modelo._meta.get_field(campo),
+            )
+    return modelo.objects.filter(pk__in=[objecto.pk for objecto in objectos]).update(**valores)
+
+
+def gerar_itens(inventario, ao_progresso=None, item_ids=None):
+    """
+    Cria uma linha de ItemInventario por StockItem da sucursal do
+    inventário (só dos `item_ids`, se indicados), com o saldo actual como
+    quantidade do sistema (negativos contam como 0), num único INSERT ...
+    SELECT. Devolve o número de linhas criadas.
+
+    A cópia tem de bater com data_snapshot: um movimento datado depois do
+    snapshot conta na variação e não pode estar já no saldo copiado. Por
+    isso as linhas de StockItem são bloqueadas FOR SHARE antes de datar: os
+    lançamentos que já as alteraram terminaram (e foram datados) antes; os
+    seguintes esperam pelo fim desta transacção e são datados depois dela
+    (o ledger data os lotes depois de actualizar os saldos).
+    """
+    from ..models_stock import ItemInventario, StockItem
+
+    stocks = StockItem.objects.filter(sucursal_id=inventario.sucursal_id)
+    if item_ids is not None:
+        stocks = stocks.filter(item_id__in=item_ids)
+
+    # Colunas de ItemInventario -> expressão sobre StockItem, pela ordem do INSERT
+    valores = {
+        'inventario': Value(inventario.pk),
+        'item': F('item_id'),
+        'quantidade_sistema': Cast(Greatest(F('quantidade_atual'), Value(Decimal('0'))), IntegerField()),
+        'variacao_stock': Value(0),
+        'diferenca': Value(0),
+        'observacoes': Value(''),
+        'numero_contagem': Value(0),
+        'precisa_recontagem': Value(False),
+        'contagem_finalizada': Value(False),
+    }
+    opcoes = ItemInventario._meta
+    colunas = ', '.join(connection.ops.quote_name(opcoes.get_field(nome).column) for nome in valores)
+    anotacoes = {f'snapshot_{nome}': expressao for nome, expressao in valores.items()}
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Por ordem de item, como o ledger, para não criar ciclos de espera
+            sql, params = stocks.order_by('item_id').values('pk').query.sql_with_params()
+            cursor.execute(f'{sql} FOR SHARE', params)
+        # Nos outros motores este UPDATE já impede escritas concorrentes até ao fim da transacção
+        inventario.data_snapshot = timezone.now()
+        type(inventario).objects.filter(pk=inventario.pk).update(data_snapshot=inventario.data_snapshot)
+
+        sql, params = stocks.order_by().annotate(**anotacoes).values_list(*anotacoes).query.sql_with_params()
+        cursor.execute(f'INSERT INTO {connection.ops.quote_name(opcoes.db_table)} ({colunas}) {sql}', params)
+        criados = cursor.rowcount
+        _recalcular_progresso(inventario)
+    if ao_progresso:
+        ao_progresso(criados, criados)
+
+    logger.info('Inventário %s: %s itens gerados', inventario.codigo, criados)
+    return criados
+
+
+def criar_inventario(ao_progresso=None, item_ids=None, **campos):
+    """Cria o InventarioFisico com `campos` e gera os seus itens (ver `gerar_itens`)"""
+    from ..models_stock import InventarioFisico
+
+    with transaction.atomic():
+        inventario = InventarioFisico.objects.create(**campos)
+        gerar_itens(inventario, ao_progresso=ao_progresso, item_ids=item_ids)
+    return inventario
+
+
+def validar_quantidade(valor):
+    """Quantidade contada (inteiro >= 0) de `valor`, texto ou número, ou ValueError com o motivo"""
+    try:
+        quantidade = int(str(valor).strip())
+    except ValueError:
+        raise ValueError('Quantidade inválida')
+    if quantidade < 0:
+        raise ValueError('Quantidade não pode ser negativa')
+    return quantidade
+
+
+def variacoes_do_ledger(inventario, item_ids, ate):
+    """
+    {item_id: saldo dos movimentos} dos `item_ids` na sucursal do inventário
+    lançados depois do snapshot e até `ate`, numa consulta agrupada. Os itens
+    sem movimentos na janela não aparecem; sem data de snapshot (inventários
+    antigos) não há janela e o resultado é vazio.
+    """
+    from ..models_stock import MovimentoItem
+
+    if inventario.data_snapshot is None or not item_ids:
+        return {}
+    return dict(MovimentoItem.objects.filter(
+        sucursal_id=inventario.sucursal_id,
+        item_id__in=item_ids,
+        data_movimento__gt=inventario.data_snapshot,
+        data_movimento__lte=ate,
+    ).values('item_id').annotate(delta=Sum(_delta_movimento())).values_list('item_id', 'delta').order_by())
+
+
+def aplicar_contagem(linha, quantidade, usuario=None, agora=None, variacao=0):
+    """
+    Regista em `linha` (ItemInventario) mais uma contagem de `quantidade`,
+    com `variacao` o saldo dos movimentos lançados desde o snapshot:
+    diferença para o esperado, número da contagem e se precisa de ser
+    recontada (com diferença e antes da última contagem).
+    """
+    linha.numero_contagem += 1
+    linha.quantidade_contada = quantidade
+    linha.variacao_stock = variacao
+    linha.diferenca = quantidade - max(linha.quantidade_sistema + variacao, 0)
+    linha.data_contagem = agora or timezone.now()
+    linha.usuario_contador = usuario
+    linha.contagem_finalizada = linha.numero_contagem >= MAX_CONTAGENS
+    linha.precisa_recontagem = not linha.contagem_finalizada and linha.diferenca != 0
+
+
+def _historico(linha):
+    from ..models_stock import HistoricoContagem
+
+    return HistoricoContagem(
+        item_inventario=linha,
+        numero_contagem=linha.numero_contagem,
+        quantidade_contada=linha.quantidade_contada,
+        diferenca=linha.diferenca,
+        observacoes=linha.observacoes,
+        data_contagem=linha.data_contagem,
+        usuario_contador=linha.usuario_contador,
+    )
+
+
+def registar_contagens(inventario, quantidades, usuario=None, observacoes=None, ao_progresso=None):
+    """
+    Regista as `quantidades` contadas ({id do ItemInventario: quantidade},
+    ids e quantidades podem vir como texto). As entradas inválidas e as
+    linhas que já atingiram MAX_CONTAGENS ficam de fora, com o motivo em
+    `erros` ({chave: mensagem}); as restantes são gravadas por lotes.
+    `observacoes`, se indicado, substitui as observações das linhas
+    contadas. Devolve Contagem(contados=[ItemInventario], erros).
+    """
+    from ..models_stock import HistoricoContagem, InventarioFisico, ItemInventario
+
+    erros, validas = {}, {}
+    for chave, valor in quantidades.items():
+        try:
+            linha_id = int(chave)
+        except (TypeError, ValueError):
+            erros[chave] = 'Linha inválida'
+            continue
+        try:
+            validas[linha_id] = validar_quantidade(valor)
+        except ValueError as e:
+            erros[linha_id] = str(e)
+
+    agora = timezone.now()
+    ids = sorted(validas)
+    contados = []
+    with transaction.atomic():
+        estado = InventarioFisico.objects.select_for_update().filter(pk=inventario.pk).values_list(
+            'status', flat=True
+        ).first()
+        if estado not in ('PLANEJADO', 'EM_ANDAMENTO'):
+            raise InventarioFechadoError(f'O inventário {inventario.codigo} está {estado}')
+
+        for n, lote in enumerate(_lotes(ids), start=1):
+            linhas = {linha.pk: linha for linha in inventario.itens_inventario.filter(id__in=lote)}
+            variacoes = variacoes_do_ledger(inventario, [linha.item_id for linha in linhas.values()], agora)
+            alteradas, historico = [], []
+            for linha_id in lote:
+                linha = linhas.get(linha_id)
+                if linha is None:
+                    erros[linha_id] = 'A linha não pertence ao inventário'
+                elif linha.numero_contagem >= MAX_CONTAGENS:
+                    erros[linha_id] = f'Já atingiu o limite de {MAX_CONTAGENS} contagens'
+                else:
+                    if observacoes is not None:
+                        linha.observacoes = observacoes
+                    aplicar_contagem(linha, validas[linha_id], usuario, agora, variacoes.get(linha.item_id, 0))
+                    historico.append(_historico(linha))
+                    alteradas.append(linha)
+
+            campos = CAMPOS_CONTAGEM + (['observacoes'] if observacoes is not None else [])
+            if alteradas:
+                _gravar_por_valor(ItemInventario, alteradas, campos)
+            HistoricoContagem.objects.bulk_create(historico, batch_size=500)
+            contados += alteradas
+            if ao_progresso:
+                ao_progresso(min(n * TAMANHO_LOTE, len(ids)), len(ids))
+
+        if contados and estado == 'PLANEJADO':
+            InventarioFisico.objects.filter(pk=inventario.pk).update(status='EM_ANDAMENTO')
+            inventario.status = 'EM_ANDAMENTO'
+        _recalcular_progresso(inventario)
+
+    logger.info('Inventário %s: %s contagens registadas, %s recusadas', inventario.codigo, len(contados), len(erros))
+    return Contagem(contados, erros)
+
+
+def concluir(inventario, usuario, gerar_ajustes=True, aplicar=False):
+    """
+    Conclui o inventário. Com `gerar_ajustes`, cria um AjusteInventario por
+    linha contada com diferença; com `aplicar`, os ajustes ficam aprovados
+    e são lançados no ledger num único lote (AJUSTE_POS / AJUSTE_NEG). A
+    diferença é para o esperado à data da contagem, pelo que os movimentos
+    lançados depois da contagem ficam no saldo. Devolve os ajustes criados.
+    """
+    from ..models_stock import AjusteInventario, InventarioFisico
+
+    with transaction.atomic():
+        estado = InventarioFisico.objects.select_for_update().filter(pk=inventario.pk).values_list(
+            'status', flat=True
+        ).first()
+        if estado not in ('PLANEJADO', 'EM_ANDAMENTO'):
+            raise InventarioFechadoError(f'O inventário {inventario.codigo} está {estado}')
+
+        ajustes = []
+        if gerar_ajustes:
+            linhas = list(
+                inventario.itens_inventario.filter(quantidade_contada__isnull=False).exclude(diferenca=0)
+                .select_related('item').order_by('item_id')
+            )
+            codigos = proximos_codigos('AJUSTE', len(linhas), existentes=[(AjusteInventario.objects, 'codigo')])
+            agora = timezone.now()
+            ajustes = [
+                AjusteInventario(
+                    codigo=codigo,
+                    inventario=inventario,
+                    item=linha.item,
+                    sucursal=inventario.sucursal,
+                    tipo_ajuste='INVENTARIO',
+                    quantidade_anterior=linha.quantidade_esperada,
+                    quantidade_nova=linha.quantidade_contada,
+                    diferenca=linha.diferenca,
+                    motivo=f'Inventário físico {inventario.codigo} - {linha.numero_contagem}ª contagem',
+                    data_ajuste=agora,
+                    usuario_ajuste=usuario,
+                    aprovado=aplicar,
+                    usuario_aprovacao=usuario if aplicar else None,
+                    data_aprovacao=agora if aplicar else None,
+                )
+                for linha, codigo in zip(linhas, codigos)
+            ]
+            AjusteInventario.objects.bulk_create(ajustes, batch_size=500)
+            if aplicar:
+                lancar_ajustes(ajustes, usuario)
+
+        inventario.status = 'CONCLUIDO'
+        inventario.data_fim = timezone.now()
+        inventario.save()
+
+    logger.info('Inventário %s concluído: %s ajustes (%s)', inventario.codigo, len(ajustes),
+                'aplicados' if aplicar else 'por aprovar')
+    return ajustes
+
+
+def lancar_ajustes(ajustes, usuario=None):
+    """
+    Lança os `ajustes` aprovados no ledger, num único lote, ao custo médio da
+    sucursal (um ajuste não altera a valorização do stock). A contagem física
+    manda no saldo: os ajustes negativos podem levar stock reservado. Devolve
+    os movimentos.
+    """
+    tipo_entrada = obter_tipo_movimento(
+        'AJUSTE_POS', 'Ajuste de Inventário (Entrada)', True, 'Ajuste positivo baseado em inventário físico'
+    )
+    tipo_saida = obter_tipo_movimento(
+        'AJUSTE_NEG', 'Ajuste de Inventário (Saída)', False, 'Ajuste negativo baseado em inventário físico'
+    )
+    return lancar_movimentos_em_lote([
+        {
+            'item': ajuste.item,
+            'sucursal': ajuste.sucursal,
+            'tipo_movimento': tipo_entrada if ajuste.diferenca > 0 else tipo_saida,
+            'quantidade': abs(ajuste.diferenca),
+            'preco_unitario': None,
+            'referencia': ajuste.codigo,
+            'observacoes': f'Ajuste de inventário: {ajuste.motivo}',
+        }
+        for ajuste in ajustes if ajuste.diferenca
+    ], usuario=usuario, respeitar_reservas=False)
@@ -0,0 +1,223 @@
+"""
+Matriz itens × sucursais do stock: quantidade, disponível e valor de cada
+item em cada sucursal activa.
+
+A matriz é guardada no cache em blocos de ITENS_POR_BLOCO itens consecutivos
+(por id). Cada bloco tem a lista das sucursais, os itens (id, código, nome,
+tipo) e um array('q') com as três colunas de cada célula, por item e por
+sucursal, em unidades inteiras (milésimas nas quantidades, cêntimos no
+valor, as casas decimais de StockItem) para não perder precisão; os blocos
+em falta são calculados juntos, com uma consulta agrupada a StockItem e
+outra a Item, por muitos que sejam os itens.
+
+A invalidação é incremental: cada bloco tem a sua versão e os lançamentos do
+ledger, as reservas e as gravações de StockItem e Item sobem (depois do
+commit) só a versão dos blocos dos itens afectados (ver signals_metricas e
+reservas_stock). Uma alteração das sucursais (versão do domínio 'sucursais'
+do cache de métricas) ou `invalidar_itens()` sem itens renovam todos os
+blocos.
+"""
+from array import array
+from decimal import Decimal
+from itertools import islice
+import logging
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, Q, Sum
+
+from .dados_referencia import sucursais_ativas
+from .metricas_cache import obter, ttl_metricas, versoes
+
+
+logger = logging.getLogger(__name__)
+
+PREFIXO = 'matriz_stock'
+
+ITENS_POR_BLOCO = 500
+
+# Blocos lidos do cache (e calculados) de cada vez ao percorrer a matriz
+BLOCOS_POR_LEITURA = 20
+
+COLUNAS = ('quantidade', 'disponivel', 'valor')
+
+# Casas decimais de cada coluna (as de StockItem), guardadas como inteiros
+CASAS = (3, 3, 2)
+
+
+def _bloco(item_id):
+    return item_id // ITENS_POR_BLOCO
+
+
+def _chave_versao(bloco):
+    return f'{PREFIXO}:versao:{bloco}'
+
+
+_CHAVE_GERAL = f'{PREFIXO}:versao:geral'
+
+
+def _versoes(chaves):
+    """Versão de cada chave; as em falta recomeçam num valor derivado do relógio (ver metricas_cache)"""
+    encontradas = cache.get_many(chaves)
+    for chave in chaves:
+        if chave not in encontradas:
+            cache.add(chave, time.time_ns(), None)
+            encontradas[chave] = cache.get(chave)
+    return encontradas
+
+
+def _subir(chaves):
+    for chave in chaves:
+        try:
+            cache.incr(chave)
+        except ValueError:
+            cache.set(chave, time.time_ns(), None)
+
+
+def invalidar_itens(item_ids=None):
+    """
+    Renova, depois do commit, os blocos dos `item_ids` (todos os blocos se
+    for None).
+    """
+    if item_ids is None:
+        chaves = [_CHAVE_GERAL]
+    else:
+        chaves = sorted({_chave_versao(_bloco(item_id)) for item_id in item_ids})
+    if chaves:
+        transaction.on_commit(lambda: _subir(chaves))
+
+
+def intervalos(blocos):
+    """[(primeiro id, último id)] que cobrem `blocos`, com os blocos consecutivos juntos"""
+    resultado = []
+    for bloco in sorted(set(blocos)):
+        inicio, fim = bloco * ITENS_POR_BLOCO, (bloco + 1) * ITENS_POR_BLOCO - 1
+        if resultado and resultado[-1][1] == inicio - 1:
+            resultado[-1] = (resultado[-1][0], fim)
+        else:
+            resultado.append((inicio, fim))
+    return resultado
+
+
+def calcular_blocos(blocos, sucursais_ids):
+    """
+    {bloco: (sucursais_ids, itens, valores)} dos `blocos`, em duas consultas.
+    `valores[(i * len(sucursais_ids) + j) * 3 + k]` é a coluna COLUNAS[k] do
+    item i na sucursal j, em unidades de 10**-CASAS[k].
+    """
+    from ..models_stock import Item, StockItem
+
+    filtro, filtro_itens = Q(), Q()
+    for inicio, fim in intervalos(blocos):
+        filtro |= Q(item_id__gte=inicio, item_id__lte=fim)
+        filtro_itens |= Q(id__range=(inicio, fim))
+    n_sucursais = len(sucursais_ids)
+    posicao_sucursal = {sucursal_id: j for j, sucursal_id in enumerate(sucursais_ids)}
+
+    celulas = {}
+    for item_id, sucursal_id, quantidade, reservada, valor in StockItem.objects.filter(
+        filtro, sucursal_id__in=sucursais_ids
+    ).values('item_id', 'sucursal_id').annotate(
+        quantidade=Sum('quantidade_atual'), reservada=Sum('quantidade_reservada'), valor=Sum('valor_estoque'),
+    ).values_list('item_id', 'sucursal_id', 'quantidade', 'reservada', 'valor').order_by():
+        celulas[item_id, sucursal_id] = tuple(
+            round(Decimal(total).scaleb(casas)) for total, casas in zip((quantidade, quantidade - reservada, valor), CASAS)
+        )
+
+    resultado = {bloco: (tuple(sucursais_ids), [], array('q')) for bloco in blocos}
+    vazia = (0, 0, 0)
+    for item in Item.objects.filter(filtro_itens).order_by('id').values_list('id', 'codigo', 'nome', 'tipo'):
+        _, itens, valores = resultado[_bloco(item[0])]
+        itens.append(item)
+        linha = [vazia] * n_sucursais
+        for sucursal_id, j in posicao_sucursal.items():
+            linha[j] = celulas.get((item[0], sucursal_id), vazia)
+        for celula in linha:
+            valores.extend(celula)
+    return resultado
+
+
+def _carregar(blocos, sucursais_ids):
+    """Blocos do cache, calculando de uma vez os que faltam"""
+    versoes_blocos = _versoes([_CHAVE_GERAL] + [_chave_versao(bloco) for bloco in blocos])
+    base = f'{PREFIXO}:blocos_q:{versoes(["sucursais"])}.{versoes_blocos[_CHAVE_GERAL]}'
+    chaves = {bloco: f'{base}:{bloco}:{versoes_blocos[_chave_versao(bloco)]}' for bloco in blocos}
+
+    encontrados = cache.get_many(list(chaves.values()))
+    resultado = {bloco: encontrados[chave] for bloco, chave in chaves.items() if chave in encontrados}
+    em_falta = [bloco for bloco in blocos if bloco not in resultado]
+    if em_falta:
+        calculados = calcular_blocos(em_falta, sucursais_ids)
+        cache.set_many({chaves[bloco]: valor for bloco, valor in calculados.items()}, ttl_metricas())
+        resultado.update(calculados)
+        logger.debug('Matriz de stock: %s blocos recalculados', len(em_falta))
+    return resultado
+
+
+def _ultimo_item_id():
+    from ..models_stock import Item
+
+    return Item.objects.aggregate(ultimo=Max('id'))['ultimo'] or 0
+
+
+def linhas_do_bloco(bloco, sucursais_ids, depois=0):
+    """
+    (item, quantidades, disponíveis, valores) de cada item do `bloco` com id
+    acima de `depois`, com uma posição (Decimal) por sucursal de
+    `sucursais_ids` (zero nas que o bloco não tem).
+    """
+    ids_bloco, itens, valores = bloco
+    largura = len(ids_bloco) * len(COLUNAS)
+    posicoes = [ids_bloco.index(sucursal_id) if sucursal_id in ids_bloco else None for sucursal_id in sucursais_ids]
+    for i, item in enumerate(itens):
+        if item[0] <= depois:
+            continue
+        celulas = [
+            valores[i * largura + j * 3:i * largura + j * 3 + 3] if j is not None else (0, 0, 0)
+            for j in posicoes
+        ]
+        yield (item, *(
+            [Decimal(celula[k]).scaleb(-casas) for celula in celulas] for k, casas in enumerate(CASAS)
+        ))
+
+
+def percorrer(sucursais_ids=None, depois=0):
+    """
+    Linhas da matriz (ver `linhas_do_bloco`) dos itens com id acima de
+    `depois`, por id. Devolve (sucursais, linhas): as Sucursal activas em
+    `sucursais_ids` (todas se for None), por nome, e um iterador que lê os
+    blocos do cache BLOCOS_POR_LEITURA de cada vez.
+    """
+    todas = sucursais_ativas()
+    if sucursais_ids is None:
+        sucursais = todas
+    else:
+        sucursais_ids = set(sucursais_ids)
+        sucursais = [sucursal for sucursal in todas if sucursal.id in sucursais_ids]
+    ids_todas = [sucursal.id for sucursal in todas]
+    ids_pedidas = [sucursal.id for sucursal in sucursais]
+
+    def gerar():
+        ultimo = obter('matriz_stock_ultimo_item', _ultimo_item_id, ['catalogo'])
+        blocos = iter(range(_bloco(depois + 1), _bloco(ultimo) + 1))
+        while True:
+            leitura = list(islice(blocos, BLOCOS_POR_LEITURA))
+            if not leitura:
+                return
+            carregados = _carregar(leitura, ids_todas)
+            for bloco in leitura:
+                yield from linhas_do_bloco(carregados[bloco], ids_pedidas, depois)
+
+    return sucursais, gerar()
+
+
+def pagina(sucursais_ids=None, depois=0, tamanho=200):
+    """
+    Página de `tamanho` itens da matriz a seguir ao item `depois` (paginação
+    por id). Devolve (sucursais, linhas, cursor seguinte ou None).
+    """
+    sucursais, linhas = percorrer(sucursais_ids, depois)
+    linhas = list(islice(linhas, tamanho + 1))
+    seguinte = linhas[tamanho - 1][0][0] if len(linhas) > tamanho else None
+    return sucursais, linhas[:tamanho], seguinte
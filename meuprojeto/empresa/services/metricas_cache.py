@@ -0,0 +1,324 @@
+"""
+Cache versionado das métricas (KPIs) das páginas de stock.
+
+Cada métrica é calculada uma vez e guardada no cache do Django (CACHES
+'default', locmem por omissão) sob uma chave que inclui a versão de cada
+domínio de que depende (catalogo, stock, movimentos, ...). As gravações nos
+modelos de um domínio incrementam a sua versão (signals_metricas), pelo que
+as métricas afectadas passam a ser procuradas numa chave nova e recalculadas
+no pedido seguinte; as restantes continuam a ser servidas do cache. As
+entradas antigas expiram pelo TTL. As versões só sobem depois do commit,
+para que um pedido concorrente não guarde na versão nova valores lidos antes
+da gravação ficar visível.
+
+As mesmas versões servem de validadores HTTP: `versoes` entra no ETag das
+APIs JSON e `alterado_em` dá o Last-Modified (ver
+decorators.resposta_condicional).
+
+Os contadores de acertos/falhas são por processo (ver `estatisticas`).
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .agregacao import contar_por_filtro, estatisticas_movimentos, estatisticas_requisicoes
+
+
+logger = logging.getLogger(__name__)
+
+PREFIXO = 'metricas'
+
+DOMINIOS = ('catalogo', 'stock', 'movimentos', 'notificacoes', 'requisicoes', 'logistica', 'sucursais')
+
+_AUSENTE = object()
+_contadores = {}
+_trinco = threading.Lock()
+
+
+def ttl_metricas():
+    return getattr(settings, 'STOCK_METRICAS_TTL', 300)
+
+
+def _chave_versao(dominio):
+    return f'{PREFIXO}:versao:{dominio}'
+
+
+def _chave_alterado(dominio):
+    return f'{PREFIXO}:alterado:{dominio}'
+
+
+def _versoes(dominios):
+    """
+    Versão actual de cada domínio. Uma versão em falta (cache reiniciado ou
+    entrada despejada) recomeça num valor derivado do relógio, e não em 1,
+    para nunca reencontrar entradas guardadas com uma versão anterior.
+    """
+    chaves = [_chave_versao(dominio) for dominio in dominios]
+    versoes = cache.get_many(chaves)
+    for chave in chaves:
+        if chave not in versoes:
+            cache.add(chave, time.time_ns(), None)
+            versoes[chave] = cache.get(chave)
+    return [versoes[chave] for chave in chaves]
+
+
+def versoes(dominios):
+    """Versões actuais dos `dominios`, por ordem, numa string ('v1.v2...')"""
+    return '.'.join(str(versao) for versao in _versoes(dominios))
+
+
+def alterado_em(dominios):
+    """
+    Instante (datetime UTC, ao segundo) da última invalidação de qualquer dos
+    `dominios`. Um domínio sem registo (cache reiniciado) conta como alterado
+    agora, tal como a sua versão recomeça.
+    """
+    chaves = [_chave_alterado(dominio) for dominio in dominios]
+    instantes = cache.get_many(chaves)
+    for chave in chaves:
+        if chave not in instantes:
+            cache.add(chave, int(time.time()), None)
+            instantes[chave] = cache.get(chave)
+    return datetime.fromtimestamp(max(instantes.values()), tz=dt_timezone.utc)
+
+
+def _incrementar(dominios):
+    from .eventos_dashboard import publicar
+
+    agora = int(time.time())
+    for dominio in dominios:
+        chave = _chave_versao(dominio)
+        try:
+            cache.incr(chave)
+        except ValueError:
+            cache.set(chave, time.time_ns(), None)
+        cache.set(_chave_alterado(dominio), agora, None)
+    publicar(dominios)
+
+
+def invalidar(*dominios):
+    """Marca as métricas dos domínios como desactualizadas (após o commit da transacção corrente)"""
+    desconhecidos = set(dominios) - set(DOMINIOS)
+    if desconhecidos:
+        raise ValueError(f'Domínio(s) de métricas desconhecido(s): {", ".join(sorted(desconhecidos))}')
+    transaction.on_commit(lambda: _incrementar(dominios))
+
+
+def _contar(nome, resultado):
+    with _trinco:
+        contador = _contadores.setdefault(nome, {'acertos': 0, 'falhas': 0})
+        contador[resultado] += 1
+
+
+def obter(nome, calcular, dominios, variante=''):
+    """
+    Devolve a métrica `nome` do cache ou, numa falha, `calcular()` (guardado
+    para os pedidos seguintes). `dominios` são os domínios cujas gravações a
+    invalidam; `variante` distingue valores da mesma métrica (p.ex. por
+    utilizador).
+    """
+    chave = f'{PREFIXO}:{nome}:{variante}:{versoes(dominios)}'
+
+    valor = cache.get(chave, _AUSENTE)
+    if valor is not _AUSENTE:
+        _contar(nome, 'acertos')
+        return valor
+
+    valor = calcular()
+    cache.set(chave, valor, ttl_metricas())
+    _contar(nome, 'falhas')
+    logger.debug('Métrica %s recalculada (%s)', nome, chave)
+    return valor
+
+
+def estatisticas():
+    """Acertos, falhas e taxa de acerto por métrica desde o arranque do processo"""
+    with _trinco:
+        copia = {nome: dict(contador) for nome, contador in _contadores.items()}
+    for contador in copia.values():
+        total = contador['acertos'] + contador['falhas']
+        contador['taxa_acerto'] = round(contador['acertos'] / total, 3) if total else None
+    return copia
+
+
+def reiniciar_estatisticas():
+    with _trinco:
+        _contadores.clear()
+
+
+# =============================================================================
+# MÉTRICAS DAS PÁGINAS
+# =============================================================================
+
+def _catalogo():
+    from ..models_stock import CategoriaProduto, Fornecedor, Item, Receita
+
+    return {
+        **contar_por_filtro(
+            Item.objects.filter(status='ATIVO'),
+            total_produtos=Q(tipo='PRODUTO'),
+            total_materiais=Q(tipo='MATERIAL'),
+        ),
+        'total_fornecedores': Fornecedor.objects.filter(status='ATIVO').count(),
+        'total_receitas': Receita.objects.filter(status='ATIVA').count(),
+        'total_categorias': CategoriaProduto.objects.filter(ativa=True).count(),
+    }
+
+
+def _stock_baixo():
+    from ..models_stock import StockItem
+
+    return contar_por_filtro(
+        StockItem.objects.filter(abaixo_minimo=True),
+        itens_stock_baixo=None,
+        produtos_baixo_estoque=Q(item__tipo='PRODUTO'),
+        materiais_baixo_estoque=Q(item__tipo='MATERIAL'),
+    )
+
+
+def _movimentos_30_dias():
+    from ..models_stock import MovimentoItem
+
+    ultimos_30_dias = timezone.now() - timedelta(days=30)
+    metricas = contar_por_filtro(
+        MovimentoItem.objects.filter(data_movimento__gte=ultimos_30_dias),
+        total_movimentos=None,
+        valor_movimentacoes=Sum('valor_total'),
+    )
+    metricas['valor_movimentacoes'] = metricas['valor_movimentacoes'] or 0
+    return metricas
+
+
+def _notificacoes(usuario_id):
+    from ..models_stock import NotificacaoStock
+
+    return contar_por_filtro(
+        NotificacaoStock.objects.filter(Q(usuario_destinatario_id=usuario_id) | Q(usuario_destinatario__isnull=True)),
+        total_notificacoes=None,
+        notificacoes_nao_lidas=Q(lida=False),
+    )
+
+
+def _logistica():
+    from ..models_stock import RastreamentoEntrega
+
+    return contar_por_filtro(
+        RastreamentoEntrega.objects.all(),
+        rastreamentos_em_transito=Q(status_atual__in=['COLETADO', 'EM_TRANSITO', 'EM_DISTRIBUICAO']),
+        entregas_pendentes=Q(status_atual='PENDENTE', data_criacao__gte=timezone.now() - timedelta(days=7)),
+    )
+
+
+def _logistica_dashboard():
+    from ..models_stock import RastreamentoEntrega, Transportadora
+
+    return {
+        'transportadoras_ativas': Transportadora.objects.filter(status='ATIVA').count(),
+        **contar_por_filtro(
+            RastreamentoEntrega.objects.all(),
+            entregas_em_andamento=Q(status_atual__in=['COLETADO', 'EM_TRANSITO', 'EM_DISTRIBUICAO']),
+            entregas_concluidas=Q(status_atual='ENTREGUE'),
+            entregas_pendentes=Q(status_atual='PREPARANDO'),
+        ),
+    }
+
+
+def _sucursais(sucursais_ids):
+    from ..models_stock import MovimentoItem, StockItem
+
+    stocks = contar_por_filtro(
+        StockItem.objects.filter(sucursal_id__in=sucursais_ids),
+        estoque_baixo=Q(abaixo_minimo=True),
+        valor_total_estoque=Sum('valor_estoque'),
+    )
+    return {
+        'total_movimentos': MovimentoItem.objects.filter(
+            data_movimento__gte=timezone.now() - timedelta(days=30),
+            sucursal_id__in=sucursais_ids,
+        ).count(),
+        'estoque_baixo': stocks['estoque_baixo'],
+        'valor_total_estoque': stocks['valor_total_estoque'] or 0,
+    }
+
+
+def _variante_sucursais(sucursais_ids):
+    ids = ','.join(str(sucursal_id) for sucursal_id in sorted(sucursais_ids))
+    return hashlib.sha1(ids.encode()).hexdigest()[:16]
+
+
+def _requisicoes():
+    from ..models_stock import RequisicaoCompraExterna, RequisicaoStock
+
+    _, _, estatisticas = estatisticas_requisicoes(
+        RequisicaoStock.objects.all(),
+        RequisicaoCompraExterna.objects.all(),
+        pendentes_antes_de=timezone.now() - timedelta(days=7),
+    )
+    return {
+        'total_requisicoes': estatisticas['total'],
+        'requisicoes_pendentes': estatisticas['pendentes'],
+        'requisicoes_aprovadas': estatisticas['aprovadas'],
+        'requisicoes_finalizadas': estatisticas['atendidas'],
+        'requisicoes_antigas': estatisticas['antigas'],
+    }
+
+
+def _movimentos_totais():
+    from ..models_stock import MovimentoItem
+
+    return estatisticas_movimentos(MovimentoItem.objects.all())
+
+
+def metricas_stock_main(usuario):
+    """KPIs da página principal do stock (as notificações dependem do utilizador)"""
+    metricas = {}
+    metricas.update(obter('catalogo', _catalogo, ['catalogo']))
+    metricas.update(obter('stock_baixo', _stock_baixo, ['stock', 'catalogo']))
+    metricas.update(obter('movimentos_30_dias', _movimentos_30_dias, ['movimentos']))
+    metricas.update(metricas_notificacoes(usuario))
+    metricas.update(obter('logistica', _logistica, ['logistica']))
+    return metricas
+
+
+def metricas_dashboard_stock():
+    """KPIs do dashboard executivo de stock"""
+    metricas = {}
+    metricas.update(obter('requisicoes', _requisicoes, ['requisicoes']))
+    metricas.update(obter('movimentos_totais', _movimentos_totais, ['movimentos']))
+    metricas.update(obter('movimentos_30_dias', _movimentos_30_dias, ['movimentos']))
+    metricas['itens_stock_baixo'] = obter('stock_baixo', _stock_baixo, ['stock', 'catalogo'])['itens_stock_baixo']
+    return metricas
+
+
+def metricas_notificacoes(usuario):
+    """Total e não lidas das notificações visíveis para o utilizador"""
+    return obter('notificacoes', lambda: _notificacoes(usuario.pk), ['notificacoes'], variante=usuario.pk)
+
+
+def metricas_logistica():
+    """Contadores do dashboard de logística (transportadoras e entregas)"""
+    return obter('logistica_dashboard', _logistica_dashboard, ['logistica'])
+
+
+def metricas_dashboard_executivo(usuario, sucursais_ids):
+    """Estatísticas do dashboard executivo, restritas às sucursais do utilizador"""
+    catalogo = obter('catalogo', _catalogo, ['catalogo'])
+    metricas = {
+        'total_produtos': catalogo['total_produtos'],
+        'total_materiais': catalogo['total_materiais'],
+        'total_fornecedores': catalogo['total_fornecedores'],
+        'total_notificacoes': metricas_notificacoes(usuario)['notificacoes_nao_lidas'],
+    }
+    metricas.update(obter(
+        'sucursais', lambda: _sucursais(sucursais_ids), ['movimentos', 'stock', 'catalogo'],
+        variante=_variante_sucursais(sucursais_ids),
+    ))
+    return metricas
@@ -0,0 +1,155 @@
+"""
+Totais diários de movimentos (MovimentoDiario).
+
+Cada lançamento no ledger soma os seus movimentos às linhas (dia, sucursal,
+tipo de item, sentido) correspondentes, na mesma transacção, através de
+`movimentos_lancados`: um UPDATE incremental por linha e, para linhas
+novas, um INSERT que absorve a corrida com outro lançamento tal como em
+aplicar_delta_stock. `reconstruir_movimentos_diarios` regenera um período a
+partir de MovimentoItem. Os gráficos lêem só desta tabela.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+import logging
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .metricas_cache import invalidar
+
+
+logger = logging.getLogger(__name__)
+
+
+def agrupar_por_dia(movimentos, tipos_item):
+    """
+    Soma os movimentos por (dia, sucursal_id, tipo_item, aumenta_estoque).
+    `tipos_item` é {item_id: tipo}. Devolve {chave: [movimentos, quantidade, valor]}.
+    """
+    totais = defaultdict(lambda: [0, Decimal('0'), Decimal('0')])
+    for movimento in movimentos:
+        chave = (
+            timezone.localdate(movimento.data_movimento),
+            movimento.sucursal_id,
+            tipos_item[movimento.item_id],
+            movimento.tipo_movimento.aumenta_estoque,
+        )
+        total = totais[chave]
+        total[0] += 1
+        total[1] += Decimal(movimento.quantidade)
+        total[2] += Decimal(movimento.valor_total or 0)
+    return dict(totais)
+
+
+def acumular_movimentos(movimentos):
+    """Soma `movimentos` (já gravados) aos totais diários, por ordem de chave"""
+    from ..models_stock import Item, MovimentoDiario
+
+    tipos_item = dict(Item.objects.filter(id__in={m.item_id for m in movimentos}).values_list('id', 'tipo'))
+    for chave, (n, quantidade, valor) in sorted(agrupar_por_dia(movimentos, tipos_item).items()):
+        dia, sucursal_id, tipo_item, aumenta_estoque = chave
+        linhas = MovimentoDiario.objects.filter(
+            dia=dia, sucursal_id=sucursal_id, tipo_item=tipo_item, aumenta_estoque=aumenta_estoque
+        )
+        incremento = {
+            'movimentos': F('movimentos') + n,
+            'quantidade': F('quantidade') + quantidade,
+            'valor': F('valor') + valor,
+        }
+        if linhas.update(**incremento):
+            continue
+        try:
+            with transaction.atomic():
+                MovimentoDiario.objects.create(
+                    dia=dia, sucursal_id=sucursal_id, tipo_item=tipo_item, aumenta_estoque=aumenta_estoque,
+                    movimentos=n, quantidade=quantidade, valor=valor,
+                )
+        except IntegrityError:
+            linhas.update(**incremento)
+
+
+def reconstruir_movimentos_diarios(data_inicio=None, data_fim=None):
+    """
+    Regenera os totais diários de [data_inicio, data_fim] (por omissão, todo
+    o ledger) a partir de MovimentoItem. Os dias de partições arquivadas não
+    são tocados (os movimentos já não estão no ledger). Em PostgreSQL a
+    tabela fica bloqueada para escrita até ao fim, pelo que os lançamentos
+    concorrentes esperam e somam depois da reconstrução. Devolve o número de
+    linhas gravadas.
+    """
+    from ..models_stock import MovimentoDiario, MovimentoItem
+    from .particionamento_movimentos import data_corte_arquivo, filtrar_periodo
+
+    corte = data_corte_arquivo()
+    if corte and (data_inicio is None or data_inicio < corte):
+        data_inicio = corte
+
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'LOCK TABLE {MovimentoDiario._meta.db_table} IN EXCLUSIVE MODE')
+
+        existentes = MovimentoDiario.objects.all()
+        if data_inicio:
+            existentes = existentes.filter(dia__gte=data_inicio)
+        if data_fim:
+            existentes = existentes.filter(dia__lte=data_fim)
+        existentes.delete()
+
+        linhas = filtrar_periodo(MovimentoItem.objects.all(), data_inicio, data_fim).annotate(
+            dia=TruncDate('data_movimento')
+        ).values(
+            'dia', 'sucursal_id', 'item__tipo', 'tipo_movimento__aumenta_estoque'
+        ).annotate(
+            n=Count('id'), total_quantidade=Sum('quantidade'), total_valor=Sum('valor_total')
+        ).order_by()
+
+        totais = [
+            MovimentoDiario(
+                dia=linha['dia'],
+                sucursal_id=linha['sucursal_id'],
+                tipo_item=linha['item__tipo'],
+                aumenta_estoque=linha['tipo_movimento__aumenta_estoque'],
+                movimentos=linha['n'],
+                quantidade=linha['total_quantidade'] or 0,
+                valor=linha['total_valor'] or 0,
+            )
+            for linha in linhas
+        ]
+        MovimentoDiario.objects.bulk_create(totais, batch_size=1000)
+        invalidar('movimentos')
+
+    logger.info('Movimentos diários reconstruídos (%s a %s): %s linhas', data_inicio, data_fim, len(totais))
+    return len(totais)
+
+
+def serie_movimentos(dias, sucursal_ids, tipo_item=None):
+    """
+    Entradas e saídas (número de movimentos) por dia nos últimos `dias` dias,
+    incluindo hoje, com zeros nos dias sem movimentos: [(dia, entradas, saidas)].
+    """
+    from ..models_stock import MovimentoDiario
+
+    fim = timezone.localdate()
+    inicio = fim - timedelta(days=dias - 1)
+
+    totais = MovimentoDiario.objects.filter(dia__gte=inicio, dia__lte=fim, sucursal_id__in=sucursal_ids)
+    if tipo_item:
+        totais = totais.filter(tipo_item=tipo_item)
+    por_dia = {
+        linha['dia']: linha
+        for linha in totais.values('dia').annotate(
+            entradas=Sum('movimentos', filter=Q(aumenta_estoque=True)),
+            saidas=Sum('movimentos', filter=Q(aumenta_estoque=False)),
+        ).order_by()
+    }
+
+    serie = []
+    for n in range(dias):
+        dia = inicio + timedelta(days=n)
+        linha = por_dia.get(dia, {})
+        serie.append((dia, linha.get('entradas') or 0, linha.get('saidas') or 0))
+    return serie
@@ -0,0 +1,103 @@
+"""
+Paginação por chave (keyset / seek) para listagens grandes.
+
+Cada página é pedida a partir da chave (campo, id) da última linha da página
+anterior (ou da primeira, ao recuar), em vez de um OFFSET: o custo de uma
+página não depende da sua posição e só as linhas da página são lidas. A
+ordem é descendente por (campo, id), com `id` a desempatar valores iguais.
+"""
+from datetime import datetime
+
+
+def _chave(objeto, campo):
+    return f'{getattr(objeto, campo).isoformat()}|{objeto.pk}'
+
+
+def _ler_chave(chave):
+    valor, pk = chave.rsplit('|', 1)
+    return datetime.fromisoformat(valor), int(pk)
+
+
+class PaginaKeyset:
+    """Página com a mesma interface usada pelos templates para Page do Django"""
+
+    def __init__(self, objetos, numero, total, tamanho, tem_anterior, tem_seguinte, campo):
+        self.object_list = objetos
+        self.number = numero
+        self.count = total
+        self.num_pages = max(1, (total + tamanho - 1) // tamanho)
+        self._tem_anterior = tem_anterior
+        self._tem_seguinte = tem_seguinte
+        self.chave_anterior = _chave(objetos[0], campo) if objetos else ''
+        self.chave_seguinte = _chave(objetos[-1], campo) if objetos else ''
+
+    @property
+    def paginator(self):
+        return self
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_previous(self):
+        return self._tem_anterior
+
+    def has_next(self):
+        return self._tem_seguinte
+
+    def has_other_pages(self):
+        return self._tem_anterior or self._tem_seguinte
+
+    def previous_page_number(self):
+        return max(1, self.number - 1)
+
+    def next_page_number(self):
+        return min(self.num_pages, self.number + 1)
+
+
+def paginar_keyset(queryset, campo, total, tamanho=20, depois=None, antes=None, ultima=False, numero=1):
+    """
+    Devolve a PaginaKeyset pedida de `queryset`, ordenado por (-campo, -id).
+
+    `depois`/`antes` são chaves devolvidas numa página anterior
+    (chave_seguinte/chave_anterior); `ultima` pede a última página. `total`
+    (contagem já calculada pelo chamador) serve apenas para o número de
+    páginas e para o tamanho da última; `numero` é o número a mostrar.
+    Chaves inválidas devolvem a primeira página.
+    """
+    try:
+        depois = _ler_chave(depois) if depois else None
+        antes = _ler_chave(antes) if antes else None
+    except (ValueError, TypeError):
+        depois = antes = None
+        ultima = False
+
+    descendente = queryset.order_by(f'-{campo}', '-pk')
+    ascendente = queryset.order_by(campo, 'pk')
+
+    if depois:
+        valor, pk = depois
+        linhas = list(
+            descendente.filter(**{f'{campo}__lte': valor}).exclude(**{campo: valor, 'pk__gte': pk})[:tamanho + 1]
+        )
+        return PaginaKeyset(linhas[:tamanho], max(2, numero), total, tamanho, True, len(linhas) > tamanho, campo)
+
+    if antes:
+        valor, pk = antes
+        linhas = list(
+            ascendente.filter(**{f'{campo}__gte': valor}).exclude(**{campo: valor, 'pk__lte': pk})[:tamanho + 1]
+        )
+        tem_anterior = len(linhas) > tamanho
+        return PaginaKeyset(
+            linhas[:tamanho][::-1], numero if tem_anterior else 1, total, tamanho, tem_anterior, True, campo
+        )
+
+    if ultima and total > tamanho:
+        resto = total % tamanho or tamanho
+        linhas = list(ascendente[:resto])[::-1]
+        return PaginaKeyset(linhas, (total + tamanho - 1) // tamanho, total, tamanho, True, False, campo)
+
+    linhas = list(descendente[:tamanho + 1])
+    return PaginaKeyset(linhas[:tamanho], 1, total, tamanho, False, len(linhas) > tamanho, campo)
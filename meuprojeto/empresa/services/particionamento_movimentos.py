@@ -0,0 +1,283 @@
+"""
+Particionamento mensal do ledger de MovimentoItem (PostgreSQL).
+
+A tabela de movimentos pode ser convertida numa tabela particionada por intervalo
+(RANGE) de data_movimento, com uma partição por mês civil no fuso do
+projecto e uma partição DEFAULT para datas fora das partições existentes.
+As consultas que filtram data_movimento por um intervalo de datas/horas
+(`filtrar_periodo`) só lêem as partições dos meses envolvidos.
+
+A conversão bloqueia a tabela (ACCESS EXCLUSIVE) enquanto copia as linhas e
+não é reversível; por isso não corre com o migrate e é pedida explicitamente
+com `manage.py gerir_particoes_movimentos --converter`.
+
+Restrições do PostgreSQL reflectidas no esquema convertido:
+  * a chave primária física passa a ser (id, data_movimento); para o Django
+    `id` continua a ser a chave (única pela sequência abaixo). A unicidade de
+    `codigo` já é (codigo, data_movimento) no modelo (migração 0127) e a
+    unicidade global dos códigos é garantida pela tabela CodigoMovimento;
+  * `id` usa uma sequência própria (colunas IDENTITY não são suportadas em
+    tabelas particionadas antes do PostgreSQL 17).
+
+As partições antigas podem ser desanexadas e movidas para um esquema de
+arquivo. Depois disso o ledger activo começa na data de corte: os saldos
+anteriores ficam representados pelos snapshots diários (StockSnapshot), que
+a reconciliação usa como saldo de abertura.
+"""
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+import logging
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+TABELA = 'empresa_movimentoitem'
+RESTRICAO_CODIGO = f'{TABELA}_codigo_data_uniq'
+PARTICAO_DEFAULT = f'{TABELA}_default'
+ESQUEMA_ARQUIVO = 'arquivo_movimentos'
+
+Particao = namedtuple('Particao', 'nome mes linhas_estimadas')
+
+
+def disponivel():
+    return connection.vendor == 'postgresql'
+
+
+def _inicio_mes(dia):
+    return date(dia.year, dia.month, 1)
+
+
+def _mes_seguinte(mes):
+    return date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+
+
+def _limite(mes):
+    """Início do mês no fuso do projecto, como literal timestamptz"""
+    return "'%s'" % timezone.make_aware(datetime(mes.year, mes.month, 1)).isoformat()
+
+
+def nome_particao(mes):
+    return f'{TABELA}_p{mes:%Y%m}'
+
+
+def filtrar_periodo(queryset, data_inicio=None, data_fim=None, campo='data_movimento'):
+    """
+    Filtra `campo` pelos dias [data_inicio, data_fim] com limites de data/hora
+    (>= início do primeiro dia, < início do dia seguinte ao último). Ao
+    contrário de `campo__date__range`, que converte cada linha para data, a
+    comparação directa permite ao PostgreSQL excluir partições e usar os
+    índices sobre o campo.
+    """
+    if data_inicio:
+        queryset = queryset.filter(**{
+            f'{campo}__gte': timezone.make_aware(datetime.combine(data_inicio, datetime.min.time()))
+        })
+    if data_fim:
+        queryset = queryset.filter(**{
+            f'{campo}__lt': timezone.make_aware(datetime.combine(data_fim + timedelta(days=1), datetime.min.time()))
+        })
+    return queryset
+
+
+def esta_particionada():
+    if not disponivel():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [TABELA])
+        linha = cursor.fetchone()
+    return bool(linha) and linha[0] == 'p'
+
+
+def listar_particoes():
+    """Partições anexadas (mes=None para a DEFAULT), por ordem de mês"""
+    if not esta_particionada():
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname, c.reltuples::bigint
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+            ORDER BY c.relname
+            """,
+            [TABELA],
+        )
+        linhas = cursor.fetchall()
+
+    particoes = []
+    for nome, estimadas in linhas:
+        mes = None
+        if nome != PARTICAO_DEFAULT:
+            mes = datetime.strptime(nome.rsplit('_p', 1)[1], '%Y%m').date()
+        particoes.append(Particao(nome, mes, max(estimadas, 0)))
+    return particoes
+
+
+def data_corte_arquivo(esquema=ESQUEMA_ARQUIVO):
+    """Primeiro dia do ledger activo (mês seguinte à última partição arquivada), ou None"""
+    if not disponivel():
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT max(table_name) FROM information_schema.tables WHERE table_schema = %s AND table_name LIKE %s",
+            [esquema, f'{TABELA}\\_p%'],
+        )
+        ultima = cursor.fetchone()[0]
+    if not ultima:
+        return None
+    return _mes_seguinte(datetime.strptime(ultima.rsplit('_p', 1)[1], '%Y%m').date())
+
+
+def _criar_particao(cursor, mes):
+    """
+    Cria a partição do mês como tabela isolada, move para ela as linhas que
+    estejam na DEFAULT e anexa-a. O ATTACH PARTITION só bloqueia a tabela
+    principal em SHARE UPDATE EXCLUSIVE, pelo que os lançamentos continuam.
+    """
+    nome = nome_particao(mes)
+    inicio, fim = _limite(mes), _limite(_mes_seguinte(mes))
+    cursor.execute(f'CREATE TABLE {nome} (LIKE {TABELA} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    cursor.execute(
+        f"""
+        WITH movidos AS (
+            DELETE FROM {PARTICAO_DEFAULT}
+            WHERE data_movimento >= {inicio} AND data_movimento < {fim}
+            RETURNING *
+        )
+        INSERT INTO {nome} SELECT * FROM movidos
+        """
+    )
+    movidos = cursor.rowcount
+    cursor.execute(f'ALTER TABLE {TABELA} ATTACH PARTITION {nome} FOR VALUES FROM ({inicio}) TO ({fim})')
+    if movidos:
+        logger.warning('Partição %s criada com %s movimentos vindos da partição DEFAULT', nome, movidos)
+    return nome
+
+
+def criar_particoes_futuras(meses=3):
+    """Garante as partições do mês corrente e dos `meses` seguintes. Devolve os nomes criados"""
+    existentes = {p.mes for p in listar_particoes()}
+    mes = _inicio_mes(timezone.localdate())
+    criadas = []
+    for _ in range(meses + 1):
+        if mes not in existentes:
+            with transaction.atomic(), connection.cursor() as cursor:
+                criadas.append(_criar_particao(cursor, mes))
+        mes = _mes_seguinte(mes)
+    return criadas
+
+
+def converter_para_particionada(meses_futuros=3):
+    """
+    Converte a tabela de movimentos numa tabela particionada por mês.
+
+    Numa única transacção: renomeia a tabela actual, cria a tabela
+    particionada com as mesmas colunas, cria as partições desde o mês do
+    primeiro movimento até `meses_futuros` meses à frente (mais a DEFAULT),
+    copia as linhas, remove a tabela antiga e recria chave primária,
+    restrições de unicidade, chaves estrangeiras e índices (estes com os
+    nomes que o Django conhece, propagados a todas as partições). Não faz
+    nada se a tabela já estiver particionada. Devolve True se converteu.
+    """
+    if not disponivel() or esta_particionada():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_constraint WHERE conrelid = to_regclass(%s) AND conname = %s",
+            [TABELA, RESTRICAO_CODIGO],
+        )
+        if cursor.fetchone() is None:
+            raise ValueError(f'Falta a restrição {RESTRICAO_CODIGO}; aplique primeiro as migrações.')
+
+    legado = f'{TABELA}_legado'
+    sequencia = f'{TABELA}_id_seq'
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {TABELA} IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s",
+            [TABELA],
+        )
+        indices = [definicao for _, definicao in cursor.fetchall() if not definicao.startswith('CREATE UNIQUE')]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+            [TABELA],
+        )
+        chaves_estrangeiras = cursor.fetchall()
+        cursor.execute(f'SELECT min(data_movimento) FROM {TABELA}')
+        primeiro = cursor.fetchone()[0]
+
+        cursor.execute(f'ALTER TABLE {TABELA} RENAME TO {legado}')
+        cursor.execute(
+            f'CREATE TABLE {TABELA} (LIKE {legado} INCLUDING CONSTRAINTS) PARTITION BY RANGE (data_movimento)'
+        )
+        cursor.execute(f'CREATE TABLE {PARTICAO_DEFAULT} PARTITION OF {TABELA} DEFAULT')
+
+        mes = _inicio_mes(timezone.localtime(primeiro).date() if primeiro else timezone.localdate())
+        ultimo = _inicio_mes(timezone.localdate())
+        for _ in range(meses_futuros):
+            ultimo = _mes_seguinte(ultimo)
+        while mes <= ultimo:
+            cursor.execute(
+                f'CREATE TABLE {nome_particao(mes)} PARTITION OF {TABELA} '
+                f'FOR VALUES FROM ({_limite(mes)}) TO ({_limite(_mes_seguinte(mes))})'
+            )
+            mes = _mes_seguinte(mes)
+
+        cursor.execute(f'INSERT INTO {TABELA} SELECT * FROM {legado}')
+        cursor.execute(f'DROP TABLE {legado}')
+
+        cursor.execute(f'CREATE SEQUENCE {sequencia} OWNED BY {TABELA}.id')
+        cursor.execute(f"ALTER TABLE {TABELA} ALTER COLUMN id SET DEFAULT nextval('{sequencia}')")
+        cursor.execute(f"SELECT setval('{sequencia}', COALESCE((SELECT max(id) FROM {TABELA}), 0) + 1, false)")
+
+        cursor.execute(f'ALTER TABLE {TABELA} ADD CONSTRAINT {TABELA}_pkey PRIMARY KEY (id, data_movimento)')
+        cursor.execute(
+            f'ALTER TABLE {TABELA} ADD CONSTRAINT {RESTRICAO_CODIGO} UNIQUE (codigo, data_movimento)'
+        )
+        for nome, definicao in chaves_estrangeiras:
+            cursor.execute(f'ALTER TABLE {TABELA} ADD CONSTRAINT {nome} {definicao}')
+        for definicao in indices:
+            cursor.execute(definicao)
+
+    logger.info('Tabela %s convertida em tabela particionada por mês', TABELA)
+    return True
+
+
+def arquivar_particoes(antes_de, esquema=ESQUEMA_ARQUIVO):
+    """
+    Desanexa as partições dos meses anteriores a `antes_de` e move-as para
+    `esquema`, onde continuam consultáveis. Antes de desanexar, actualiza os
+    snapshots diários, que passam a ser o saldo de abertura do ledger activo;
+    só meses já encerrados podem ser arquivados. Devolve os nomes arquivados.
+    """
+    from .stock_snapshots import atualizar_snapshots
+
+    corte = _inicio_mes(antes_de)
+    if corte > _inicio_mes(timezone.localdate()):
+        raise ValueError('Só podem ser arquivados meses já encerrados.')
+    if not esta_particionada():
+        raise ValueError(f'A tabela {TABELA} não está particionada.')
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {PARTICAO_DEFAULT} WHERE data_movimento < {_limite(corte)})')
+        if cursor.fetchone()[0]:
+            raise ValueError('Há movimentos anteriores ao corte na partição DEFAULT; crie primeiro as partições desses meses.')
+
+    atualizar_snapshots()
+
+    arquivadas = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {esquema}')
+        for particao in listar_particoes():
+            if particao.mes is None or particao.mes >= corte:
+                continue
+            cursor.execute(f'ALTER TABLE {TABELA} DETACH PARTITION {particao.nome}')
+            cursor.execute(f'ALTER TABLE {particao.nome} SET SCHEMA {esquema}')
+            arquivadas.append(particao.nome)
+
+    logger.info('Partições arquivadas em %s: %s', esquema, ', '.join(arquivadas) or 'nenhuma')
+    return arquivadas
@@ -0,0 +1,172 @@
+"""
+Recebimento em lote de transferências e ordens de compra.
+
+Um recebimento chega inteiro como {id da linha: quantidade recebida}. As
+linhas do documento são lidas numa só consulta e tudo é validado em memória
+(linhas do documento, quantidades inteiras entre 0 e o solicitado) antes de
+gravar; havendo erros nada é gravado (RecebimentoInvalidoError, com o erro de
+cada linha). Depois, numa transacção com o documento bloqueado, as
+quantidades recebidas vão num bulk_update, o documento passa a RECEBIDA e as
+entradas em stock são lançadas num único lote do ledger.
+"""
+from decimal import Decimal
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from .stock_ledger import lancar_movimentos_em_lote, obter_tipo_movimento
+
+
+logger = logging.getLogger(__name__)
+
+
+class RecebimentoInvalidoError(ValueError):
+    """Linhas do recebimento inválidas: `erros` é {id da linha: mensagem}"""
+
+    def __init__(self, erros):
+        self.erros = erros
+        super().__init__('; '.join(f'linha {linha_id}: {erro}' for linha_id, erro in erros.items()))
+
+
+class DocumentoJaRecebidoError(ValueError):
+    """O documento deixou de estar num estado que permite o recebimento"""
+
+
+def validar_quantidades(linhas, quantidades):
+    """
+    Valida `quantidades` ({id: quantidade}, ids e quantidades podem vir como
+    texto) contra `linhas` ({id: linha com quantidade_solicitada}). Devolve
+    [(linha, quantidade)] das quantidades positivas, por id, ou levanta
+    RecebimentoInvalidoError.
+    """
+    erros, recebidas = {}, []
+    for chave, valor in quantidades.items():
+        try:
+            linha_id = int(chave)
+        except (TypeError, ValueError):
+            erros[chave] = 'Linha inválida'
+            continue
+        linha = linhas.get(linha_id)
+        if linha is None:
+            erros[linha_id] = 'A linha não pertence ao documento'
+            continue
+        try:
+            quantidade = Decimal(str(valor).strip() or '0')
+        except ArithmeticError:
+            erros[linha_id] = 'Quantidade inválida'
+            continue
+        if not quantidade.is_finite() or quantidade != quantidade.to_integral_value():
+            erros[linha_id] = 'A quantidade tem de ser um número inteiro'
+        elif quantidade < 0:
+            erros[linha_id] = 'A quantidade não pode ser negativa'
+        elif quantidade > linha.quantidade_solicitada:
+            erros[linha_id] = f'Recebido {quantidade} acima do solicitado ({linha.quantidade_solicitada})'
+        elif quantidade:
+            recebidas.append((linha, int(quantidade)))
+
+    if erros:
+        raise RecebimentoInvalidoError(erros)
+    return sorted(recebidas, key=lambda par: par[0].pk)
+
+
+def _bloquear(documento, estados):
+    """Relê o estado do documento com a linha bloqueada; outro recebimento concorrente espera"""
+    estado = type(documento).objects.select_for_update().filter(pk=documento.pk).values_list(
+        'status', flat=True
+    ).first()
+    if estado not in estados:
+        raise DocumentoJaRecebidoError(f'{documento.codigo} não pode ser recebido no estado {estado}')
+
+
+def receber_transferencia(transferencia, quantidades, usuario=None):
+    """
+    Recebe na sucursal de destino as `quantidades` ({id do ItemTransferencia:
+    quantidade}) de uma transferência ENVIADA, ao custo médio de cada item na
+    sucursal de origem. As linhas sem item (transferências antigas, por
+    produto) ficam com a quantidade recebida mas não lançam entrada. Devolve
+    os movimentos lançados.
+    """
+    from ..models_stock import ItemTransferencia, StockItem
+
+    linhas = {linha.pk: linha for linha in transferencia.itens.select_related('item')}
+    recebidas = validar_quantidades(linhas, quantidades)
+    if not recebidas:
+        raise RecebimentoInvalidoError({'': 'Nenhum item foi recebido'})
+
+    tipo_entrada = obter_tipo_movimento(
+        'ENT_TRANSF', 'Entrada por Transferência', True, 'Entrada de stock recebida de outra sucursal'
+    )
+    custos_origem = dict(StockItem.objects.filter(
+        sucursal_id=transferencia.sucursal_origem_id,
+        item_id__in=[linha.item_id for linha, _ in recebidas if linha.item_id],
+    ).values_list('item_id', 'custo_medio'))
+    movimentos = []
+    for linha, quantidade in recebidas:
+        linha.quantidade_recebida = quantidade
+        if linha.item:
+            movimentos.append({
+                'item': linha.item,
+                'sucursal': transferencia.sucursal_destino,
+                'tipo_movimento': tipo_entrada,
+                'quantidade': quantidade,
+                'preco_unitario': custos_origem.get(linha.item_id) or linha.item.preco_custo,
+                'referencia': f'Recebimento {transferencia.codigo}',
+                'observacoes': f'Confirmação de recebimento da transferência {transferencia.codigo}',
+            })
+
+    with transaction.atomic():
+        _bloquear(transferencia, ['ENVIADA'])
+        ItemTransferencia.objects.bulk_update([linha for linha, _ in recebidas], ['quantidade_recebida'], batch_size=500)
+
+        transferencia.status = 'RECEBIDA'
+        transferencia.data_recebimento = timezone.now()
+        transferencia.confirmado_por = usuario
+        transferencia.save()
+
+        lancados = lancar_movimentos_em_lote(movimentos, usuario=usuario)
+
+    logger.info('Transferência %s recebida: %s linhas', transferencia.codigo, len(recebidas))
+    return lancados
+
+
+def receber_ordem_compra(ordem_compra, quantidades, usuario=None):
+    """
+    Recebe na sucursal de destino as `quantidades` ({id do ItemOrdemCompra:
+    quantidade}) de uma ordem de compra APROVADA, GUARDADA ou ENVIADA, ao
+    preço da ordem. Devolve os movimentos lançados.
+    """
+    from ..models_stock import ItemOrdemCompra
+
+    linhas = {linha.pk: linha for linha in ordem_compra.itens.select_related('produto')}
+    recebidas = validar_quantidades(linhas, quantidades)
+    if not recebidas:
+        raise RecebimentoInvalidoError({'': 'Nenhum item foi recebido'})
+
+    tipo_entrada = obter_tipo_movimento('ENT_COMPRA', 'Entrada por Compra', True, 'Entrada de stock por compra')
+    movimentos = []
+    for linha, quantidade in recebidas:
+        linha.quantidade_recebida = quantidade
+        if linha.produto:
+            movimentos.append({
+                'item': linha.produto,
+                'sucursal': ordem_compra.sucursal_destino,
+                'tipo_movimento': tipo_entrada,
+                'quantidade': quantidade,
+                'preco_unitario': linha.preco_unitario or Decimal('0'),
+                'referencia': f'Recebimento {ordem_compra.codigo}',
+                'observacoes': f'Recebimento da ordem {ordem_compra.codigo} - Fatura: {ordem_compra.numero_fatura}',
+            })
+
+    with transaction.atomic():
+        _bloquear(ordem_compra, ['APROVADA', 'GUARDADA', 'ENVIADA'])
+        ItemOrdemCompra.objects.bulk_update([linha for linha, _ in recebidas], ['quantidade_recebida'], batch_size=500)
+
+        ordem_compra.status = 'RECEBIDA'
+        ordem_compra.data_recebimento = timezone.now()
+        ordem_compra.save()
+
+        lancados = lancar_movimentos_em_lote(movimentos, usuario=usuario)
+
+    logger.info('Ordem de compra %s recebida: %s linhas', ordem_compra.codigo, len(recebidas))
+    return lancados
@@ -0,0 +1,157 @@
+"""
+Reconciliação entre StockItem e o ledger de MovimentoItem.
+
+O saldo esperado de cada (item, sucursal) é a soma assinada dos seus
+movimentos. A comparação é feita por sucursal e, dentro da sucursal, em
+partições de IDs de item: cada partição custa uma consulta agrupada ao ledger
+e uma leitura de StockItem, pelo que a memória fica limitada ao tamanho da
+partição independentemente do número de movimentos. Se partições antigas do
+ledger tiverem sido arquivadas (services/particionamento_movimentos.py), o
+saldo de abertura na data de corte vem dos snapshots diários.
+"""
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
+import logging
+
+from django.db import transaction
+from django.db.models import Case, F, Max, Min, Sum, When
+
+from .matriz_stock import invalidar_itens
+from .metricas_cache import invalidar
+
+
+logger = logging.getLogger(__name__)
+
+Divergencia = namedtuple('Divergencia', 'item_id sucursal_id saldo_registado saldo_ledger')
+
+
+def _delta_movimento():
+    return Case(
+        When(tipo_movimento__aumenta_estoque=True, then=F('quantidade')),
+        default=F('quantidade') * -1,
+    )
+
+
+def particoes_de_itens(tamanho):
+    """Intervalos [inicio, fim) de IDs de item com `tamanho` IDs cada"""
+    from ..models_stock import Item
+
+    limites = Item.objects.aggregate(minimo=Min('id'), maximo=Max('id'))
+    if limites['minimo'] is None:
+        return []
+    return [
+        (inicio, inicio + tamanho)
+        for inicio in range(limites['minimo'], limites['maximo'] + 1, tamanho)
+    ]
+
+
+def comparar_particao(sucursal_id, item_inicio, item_fim, reparar=False, corte=None):
+    """
+    Compara StockItem com o ledger para uma sucursal e um intervalo de itens.
+
+    Com `reparar`, as linhas de StockItem da partição são bloqueadas
+    (SELECT ... FOR UPDATE) antes de somar o ledger, para que nenhum
+    lançamento concorrente altere o saldo entre a leitura e a correcção, e os
+    saldos divergentes são corrigidos com bulk_update (e as linhas em falta
+    criadas com bulk_create). Com `corte` (primeiro dia do ledger activo), o
+    saldo esperado parte do snapshot da véspera. Devolve a lista de
+    Divergencia encontradas.
+    """
+    from ..models_stock import MovimentoItem, StockItem
+    from .stock_snapshots import saldos_em
+
+    with transaction.atomic():
+        stocks = StockItem.objects.filter(
+            sucursal_id=sucursal_id, item_id__gte=item_inicio, item_id__lt=item_fim
+        )
+        if reparar:
+            stocks = stocks.select_for_update()
+        registados = {stock.item_id: stock for stock in stocks.only('id', 'item_id', 'quantidade_atual', 'custo_medio')}
+
+        esperados = dict(
+            MovimentoItem.objects.filter(
+                sucursal_id=sucursal_id, item_id__gte=item_inicio, item_id__lt=item_fim
+            ).values('item_id').annotate(delta=Sum(_delta_movimento())).values_list('item_id', 'delta')
+        )
+        if corte:
+            for item_id, quantidade in saldos_em(corte - timedelta(days=1), sucursal_ids=[sucursal_id]).filter(
+                item_id__gte=item_inicio, item_id__lt=item_fim
+            ).values_list('item_id', 'quantidade'):
+                esperados[item_id] = (esperados.get(item_id) or 0) + quantidade
+
+        divergencias = []
+        for item_id in registados.keys() | esperados.keys():
+            stock = registados.get(item_id)
+            registado = stock.quantidade_atual if stock else Decimal('0')
+            esperado = Decimal(esperados.get(item_id) or 0)
+            if registado != esperado:
+                divergencias.append(Divergencia(item_id, sucursal_id, registado, esperado))
+
+        if reparar and divergencias:
+            _corrigir(divergencias, registados)
+
+    return divergencias
+
+
+def _corrigir(divergencias, registados):
+    """Repõe os saldos do ledger (chamado com as linhas já bloqueadas)"""
+    from ..models_stock import Item, StockItem
+    from .alertas_stock import sincronizar_stock_baixo
+
+    atualizar = []
+    criar = []
+    for divergencia in divergencias:
+        stock = registados.get(divergencia.item_id)
+        if stock:
+            stock.quantidade_atual = divergencia.saldo_ledger
+            stock.valor_estoque = (divergencia.saldo_ledger * stock.custo_medio).quantize(Decimal('0.01'))
+            atualizar.append(stock)
+        else:
+            criar.append(divergencia)
+
+    if atualizar:
+        StockItem.objects.bulk_update(atualizar, ['quantidade_atual', 'valor_estoque'], batch_size=500)
+
+    if criar:
+        custos = dict(Item.objects.filter(id__in=[d.item_id for d in criar]).values_list('id', 'preco_custo'))
+        StockItem.objects.bulk_create([
+            StockItem(
+                item_id=divergencia.item_id,
+                sucursal_id=divergencia.sucursal_id,
+                quantidade_atual=divergencia.saldo_ledger,
+                quantidade_reservada=0,
+                custo_medio=custos.get(divergencia.item_id) or 0,
+                valor_estoque=divergencia.saldo_ledger * (custos.get(divergencia.item_id) or 0),
+            )
+            for divergencia in criar
+        ], batch_size=500, ignore_conflicts=True)
+
+    # bulk_update/bulk_create não disparam sinais: invalidar as métricas e reavaliar o estado de stock baixo
+    invalidar('stock')
+    invalidar_itens({d.item_id for d in divergencias})
+    sincronizar_stock_baixo(StockItem.objects.filter(
+        sucursal_id__in={d.sucursal_id for d in divergencias},
+        item_id__in=[d.item_id for d in divergencias],
+    ))
+
+
+def reconciliar_sucursal(sucursal_id, particoes, reparar=False, ao_encontrar=None):
+    """
+    Percorre as partições de itens de uma sucursal. Cada lista de
+    divergências é passada a `ao_encontrar` à medida que é encontrada, em vez
+    de acumulada. Devolve (número de divergências, número de partições).
+    """
+    from .particionamento_movimentos import data_corte_arquivo
+
+    corte = data_corte_arquivo()
+    total = 0
+    for item_inicio, item_fim in particoes:
+        divergencias = comparar_particao(sucursal_id, item_inicio, item_fim, reparar=reparar, corte=corte)
+        total += len(divergencias)
+        if divergencias and ao_encontrar:
+            ao_encontrar(divergencias)
+
+    if total:
+        logger.warning('Sucursal %s: %s saldos divergentes do ledger%s', sucursal_id, total, ' (corrigidos)' if reparar else '')
+    return total, len(particoes)
@@ -0,0 +1,162 @@
+"""
+Reservas de stock.
+
+Uma reserva retira quantidade do disponível (quantidade_atual -
+quantidade_reservada) de um StockItem sem a retirar do saldo. Reservar e
+libertar são UPDATEs condicionais únicos sobre StockItem: a reserva só
+acontece se `quantidade_atual - quantidade_reservada >= n` no momento da
+escrita, pelo que duas requisições concorrentes nunca prometem as mesmas
+unidades. Cada reserva fica registada em ReservaStock com um prazo; as
+reservas activas fora de prazo são libertadas por `libertar_expiradas`
+(comando libertar_reservas_expiradas).
+"""
+from datetime import timedelta
+from decimal import Decimal
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .matriz_stock import invalidar_itens
+from .metricas_cache import invalidar
+
+
+logger = logging.getLogger(__name__)
+
+
+def prazo_reserva():
+    return timedelta(hours=getattr(settings, 'STOCK_RESERVA_TTL_HORAS', 72))
+
+
+class ReservaIndisponivelError(ValueError):
+    """Quantidade a reservar superior ao disponível do item na sucursal"""
+
+    def __init__(self, item_id, sucursal_id, quantidade):
+        self.item_id = item_id
+        self.sucursal_id = sucursal_id
+        self.quantidade = quantidade
+        super().__init__(
+            f'Stock disponível insuficiente para reservar {quantidade} unidade(s) '
+            f'(item {item_id}, sucursal {sucursal_id}).'
+        )
+
+
+def _agrupar(linhas):
+    """Soma as quantidades por (item_id, sucursal_id)"""
+    quantidades = {}
+    for item_id, sucursal_id, quantidade in linhas:
+        par = (item_id, sucursal_id)
+        quantidades[par] = quantidades.get(par, Decimal('0')) + Decimal(quantidade)
+    return quantidades
+
+
+def disponivel(item_id, sucursal_id):
+    """Quantidade disponível (saldo menos reservas activas): uma leitura de StockItem"""
+    from ..models_stock import StockItem
+
+    linha = StockItem.objects.filter(item_id=item_id, sucursal_id=sucursal_id).values_list(
+        'quantidade_atual', 'quantidade_reservada'
+    ).first()
+    return linha[0] - linha[1] if linha else Decimal('0')
+
+
+def reservar(linhas, requisicao=None, transferencia=None, usuario=None, prazo=None):
+    """
+    Reserva cada (item_id, sucursal_id, quantidade) de `linhas`, tudo ou nada.
+
+    Os pares são processados por ordem para que lotes concorrentes bloqueiem
+    as linhas de StockItem sempre pela mesma ordem. Levanta
+    ReservaIndisponivelError (e nada fica reservado) se algum par não tiver
+    disponível suficiente. Devolve as ReservaStock criadas.
+    """
+    from ..models_stock import ReservaStock, StockItem
+
+    expira_em = timezone.now() + (prazo or prazo_reserva())
+    quantidades = _agrupar(linhas)
+
+    with transaction.atomic():
+        for (item_id, sucursal_id), quantidade in sorted(quantidades.items()):
+            reservado = StockItem.objects.filter(
+                item_id=item_id,
+                sucursal_id=sucursal_id,
+                quantidade_atual__gte=F('quantidade_reservada') + quantidade,
+            ).update(quantidade_reservada=F('quantidade_reservada') + quantidade)
+            if not reservado:
+                raise ReservaIndisponivelError(item_id, sucursal_id, quantidade)
+
+        reservas = ReservaStock.objects.bulk_create([
+            ReservaStock(
+                item_id=item_id,
+                sucursal_id=sucursal_id,
+                quantidade=quantidade,
+                requisicao=requisicao,
+                transferencia=transferencia,
+                criado_por=usuario,
+                expira_em=expira_em,
+            )
+            for (item_id, sucursal_id), quantidade in sorted(quantidades.items())
+        ])
+        invalidar('stock')
+        invalidar_itens([item_id for item_id, _ in quantidades])
+
+    logger.info('%s reservas criadas (requisição %s, transferência %s)', len(reservas),
+                getattr(requisicao, 'codigo', None), getattr(transferencia, 'codigo', None))
+    return reservas
+
+
+def _fechar(reservas, estado):
+    """
+    Fecha as reservas activas de `reservas` (QuerySet de ReservaStock) e
+    devolve as quantidades ao disponível. As reservas são bloqueadas antes
+    de fechar, pelo que cada uma é libertada uma única vez mesmo com
+    chamadas concorrentes (p.ex. o envio e a expiração). Devolve o número
+    de reservas fechadas.
+    """
+    from ..models_stock import ReservaStock, StockItem
+
+    with transaction.atomic():
+        ativas = list(
+            reservas.filter(estado='ATIVA').select_for_update().values_list('id', 'item_id', 'sucursal_id', 'quantidade')
+        )
+        if not ativas:
+            return 0
+
+        quantidades = _agrupar((item_id, sucursal_id, quantidade) for _, item_id, sucursal_id, quantidade in ativas)
+        for (item_id, sucursal_id), quantidade in sorted(quantidades.items()):
+            StockItem.objects.filter(item_id=item_id, sucursal_id=sucursal_id).update(
+                quantidade_reservada=Greatest(F('quantidade_reservada') - quantidade, Value(Decimal('0')))
+            )
+
+        ReservaStock.objects.filter(id__in=[linha[0] for linha in ativas]).update(
+            estado=estado, data_fecho=timezone.now()
+        )
+        invalidar('stock')
+        invalidar_itens([item_id for item_id, _ in quantidades])
+    return len(ativas)
+
+
+def libertar(reservas):
+    """Liberta reservas activas (requisição rejeitada/cancelada, transferência cancelada)"""
+    return _fechar(reservas, 'LIBERTADA')
+
+
+def consumir(reservas):
+    """
+    Fecha reservas activas porque a quantidade vai sair no lançamento que se
+    segue. Chamado pelo ledger (lancar_movimentos_em_lote com `reservas`) na
+    transacção da saída, que só cabe no disponível depois de a reserva fechar.
+    """
+    return _fechar(reservas, 'CONSUMIDA')
+
+
+def libertar_expiradas(agora=None):
+    """Liberta as reservas activas cujo prazo terminou. Devolve quantas foram libertadas"""
+    from ..models_stock import ReservaStock
+
+    expiradas = _fechar(ReservaStock.objects.filter(expira_em__lt=agora or timezone.now()), 'EXPIRADA')
+    if expiradas:
+        logger.info('%s reservas de stock expiradas libertadas', expiradas)
+    return expiradas
@@ -0,0 +1,115 @@
+"""
+Sequências de documentos.
+
+Atribui os números dos códigos automáticos (MOV0001, REQ0001, COMP0001,
+AJUSTE0001, CONS001, ...) a partir de um contador por chave em
+SequenciaDocumento. Cada reserva é um UPDATE ultimo_valor = ultimo_valor + n
+seguido da leitura do valor, em O(1) e sem ciclos de tentativa.
+
+A linha do contador fica bloqueada até ao fim da transacção de quem reservou,
+por isso a reserva deve ser feita dentro da transacção que grava o documento:
+se a gravação for revertida o número volta ao contador e a sequência não fica
+com buracos.
+
+Os códigos de movimento (MOV) não precisam de ser contínuos e são gerados em
+todos os lançamentos de stock, onde esse bloqueio serializaria as transacções
+umas atrás das outras. Em PostgreSQL vêm de uma SEQUENCE (SEQUENCIAS_SQL):
+nextval não bloqueia nem é revertido, pelo que um lançamento revertido deixa
+um buraco. A unicidade dos códigos é garantida por CodigoMovimento.
+"""
+import re
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.db.models.functions import Length
+
+
+# Chaves servidas por uma SEQUENCE do PostgreSQL (criada na migração 0136)
+SEQUENCIAS_SQL = {'MOV': 'empresa_codigo_mov_seq'}
+
+
+def _sequencia_sql(chave):
+    return SEQUENCIAS_SQL.get(chave) if connection.vendor == 'postgresql' else None
+
+
+def numeros_da_sequencia(sequencia, quantidade=1):
+    """`quantidade` números da SEQUENCE `sequencia`, por ordem; concorrentes podem intercalar-se"""
+    if quantidade < 1:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT nextval(%s) FROM generate_series(1, %s)', [sequencia, quantidade])
+        return sorted(numero for (numero,) in cursor.fetchall())
+
+
+def _incrementar(chave, quantidade):
+    from ..models_base import SequenciaDocumento
+
+    return SequenciaDocumento.objects.filter(chave=chave).update(
+        ultimo_valor=F('ultimo_valor') + quantidade
+    )
+
+
+def reservar_numeros(chave, quantidade=1, semente=None):
+    """
+    Reserva `quantidade` números consecutivos da sequência `chave`.
+
+    Na primeira utilização da chave o contador é criado a partir de
+    `semente()` (o maior número já usado pelos documentos existentes), para
+    não colidir com códigos gerados antes da sequência existir.
+    """
+    from ..models_base import SequenciaDocumento
+
+    if quantidade < 1:
+        return []
+
+    with transaction.atomic():
+        if not _incrementar(chave, quantidade):
+            inicial = semente() if semente else 0
+            try:
+                with transaction.atomic():
+                    SequenciaDocumento.objects.create(chave=chave, ultimo_valor=inicial + quantidade)
+            except IntegrityError:
+                # Outra transacção criou o contador entretanto
+                _incrementar(chave, quantidade)
+
+        ultimo = SequenciaDocumento.objects.filter(chave=chave).values_list('ultimo_valor', flat=True).get()
+
+    return list(range(ultimo - quantidade + 1, ultimo + 1))
+
+
+def maior_numero_existente(queryset, campo, prefixo):
+    """Maior sufixo numérico dos códigos `prefixo` + dígitos já gravados em `campo`"""
+    codigo = queryset.filter(
+        **{f'{campo}__regex': rf'^{re.escape(prefixo)}[0-9]+$'}
+    ).annotate(
+        _tamanho_codigo=Length(campo)
+    ).order_by('-_tamanho_codigo', f'-{campo}').values_list(campo, flat=True).first()
+
+    return int(codigo[len(prefixo):]) if codigo else 0
+
+
+def proximos_codigos(prefixo, quantidade, largura=4, chave=None, existentes=()):
+    """
+    Gera `quantidade` códigos `prefixo` + número com `largura` dígitos.
+
+    `chave` identifica a sequência (por omissão o próprio prefixo) e
+    `existentes` é uma lista de (queryset, campo) onde já há códigos com este
+    prefixo, usada apenas para inicializar o contador.
+    """
+    def semente():
+        return max(
+            [maior_numero_existente(queryset, campo, prefixo) for queryset, campo in existentes],
+            default=0
+        )
+
+    sequencia = _sequencia_sql(chave or prefixo)
+    if sequencia:
+        numeros = numeros_da_sequencia(sequencia, quantidade)
+    else:
+        numeros = reservar_numeros(chave or prefixo, quantidade, semente=semente)
+    return [f"{prefixo}{numero:0{largura}d}" for numero in numeros]
+
+
+def proximo_codigo(prefixo, largura=4, chave=None, existentes=()):
+    """Gera o próximo código `prefixo` + número (ver proximos_codigos)"""
+    return proximos_codigos(prefixo, 1, largura=largura, chave=chave, existentes=existentes)[0]
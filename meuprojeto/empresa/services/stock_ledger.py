@@ -0,0 +1,340 @@
+"""
+Razão (ledger) de stock.
+
+Único ponto de escrita de saldos em StockItem: cada movimento é lançado e o
+saldo (item, sucursal) é actualizado na mesma transacção, com UPDATE
+condicional em SQL (F expressions) em vez de ler, somar em Python e gravar.
+"""
+from collections import defaultdict
+from decimal import Decimal
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, Value, When
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .dados_referencia import tipo_movimento
+from .sequencias import proximos_codigos
+
+
+logger = logging.getLogger(__name__)
+
+# Enviado uma vez por lançamento (unitário ou em lote), dentro da transacção,
+# com `movimentos` = lista de MovimentoItem gravados. Os efeitos secundários
+# (alertas, agregados) devem subscrever este sinal em vez do post_save, que
+# não é disparado por bulk_create.
+movimentos_lancados = Signal()
+
+
+class StockInsuficienteError(ValueError):
+    """Saída superior ao disponível (saldo menos reservas) do item na sucursal"""
+
+    def __init__(self, item_id, sucursal_id, quantidade):
+        self.item_id = item_id
+        self.sucursal_id = sucursal_id
+        self.quantidade = quantidade
+        super().__init__(
+            f'Stock disponível insuficiente para saída de {quantidade} unidade(s) '
+            f'(item {item_id}, sucursal {sucursal_id}).'
+        )
+
+
+def obter_tipo_movimento(codigo, nome, aumenta_estoque, descricao=''):
+    """Obtém o tipo de movimento pelo código (registo de referência), criando-o se não existir"""
+    from ..models_stock import TipoMovimentoStock
+
+    tipo = tipo_movimento(codigo)
+    if tipo is not None:
+        return tipo
+    tipo, _ = TipoMovimentoStock.objects.get_or_create(
+        codigo=codigo,
+        defaults={
+            'nome': nome,
+            'descricao': descricao,
+            'aumenta_estoque': aumenta_estoque,
+        }
+    )
+    return tipo
+
+
+def _valorizacao(delta, custo_unitario):
+    """
+    Expressões do UPDATE de saldo com custo médio ponderado.
+
+    Entradas com custo: custo_medio = (q * custo_medio + delta * custo) / (q + delta),
+    ou o custo da entrada se não havia stock positivo. Saídas (e entradas sem
+    custo) mantêm o custo médio. O valor é sempre quantidade x custo médio,
+    calculado sobre os valores anteriores da linha (semântica do UPDATE).
+    """
+    quantidade = F('quantidade_atual') + delta
+    campos = {
+        'quantidade_atual': quantidade,
+        'valor_estoque': ExpressionWrapper(quantidade * F('custo_medio'), output_field=DecimalField()),
+    }
+    if delta > 0 and custo_unitario is not None:
+        valor_entrada = Value(delta * custo_unitario, output_field=DecimalField())
+        campos['custo_medio'] = Case(
+            When(quantidade_atual__gt=0, then=ExpressionWrapper(
+                (F('quantidade_atual') * F('custo_medio') + valor_entrada) / quantidade,
+                output_field=DecimalField()
+            )),
+            default=Value(custo_unitario, output_field=DecimalField()),
+        )
+        campos['valor_estoque'] = Case(
+            When(quantidade_atual__gt=0, then=ExpressionWrapper(
+                F('quantidade_atual') * F('custo_medio') + valor_entrada,
+                output_field=DecimalField()
+            )),
+            default=valor_entrada,
+        )
+    return campos
+
+
+def aplicar_delta_stock(item_id, sucursal_id, delta, custo_unitario=None, respeitar_reservas=True):
+    """
+    Soma `delta` ao saldo (item, sucursal) num único UPDATE.
+
+    Saídas (delta negativo) só são aplicadas se o disponível cobrir a
+    quantidade (WHERE quantidade_atual - quantidade_reservada >= n): uma saída
+    não leva unidades prometidas a reservas de outros. Caso contrário levanta
+    StockInsuficienteError em vez de deixar o saldo negativo ou o truncar a
+    zero. Uma saída que corresponde a uma reserva consome-a primeiro (ver
+    `lancar_movimentos_em_lote(..., reservas=...)`). Com `respeitar_reservas`
+    False (ajustes de inventário: a contagem física manda no saldo) basta que
+    o saldo não fique negativo. Entradas com `custo_unitario` actualizam o
+    custo médio ponderado e o valor do stock na mesma instrução. Entradas
+    numa linha inexistente criam o StockItem; se outra transacção o criar
+    primeiro, a violação de unicidade é absorvida e o UPDATE repetido.
+    """
+    from ..models_stock import Item, StockItem
+
+    delta = Decimal(delta)
+    if not delta:
+        return
+    if custo_unitario is not None:
+        custo_unitario = Decimal(custo_unitario)
+
+    agora = timezone.now()
+    linhas = StockItem.objects.filter(item_id=item_id, sucursal_id=sucursal_id)
+    if delta < 0 and respeitar_reservas:
+        linhas = linhas.filter(quantidade_atual__gte=F('quantidade_reservada') - delta)
+    elif delta < 0:
+        linhas = linhas.filter(quantidade_atual__gte=-delta)
+
+    if linhas.update(data_atualizacao=agora, **_valorizacao(delta, custo_unitario)):
+        return
+
+    if delta < 0:
+        raise StockInsuficienteError(item_id, sucursal_id, -delta)
+
+    custo = custo_unitario
+    if custo is None:
+        custo = Item.objects.filter(id=item_id).values_list('preco_custo', flat=True).first() or Decimal('0')
+
+    try:
+        with transaction.atomic():
+            StockItem.objects.create(
+                item_id=item_id,
+                sucursal_id=sucursal_id,
+                quantidade_atual=delta,
+                quantidade_reservada=0,
+                custo_medio=custo,
+                valor_estoque=delta * custo,
+            )
+    except IntegrityError:
+        StockItem.objects.filter(item_id=item_id, sucursal_id=sucursal_id).update(
+            data_atualizacao=agora, **_valorizacao(delta, custo_unitario)
+        )
+
+
+def delta_do_movimento(movimento):
+    """Delta assinado que o movimento aplica ao saldo"""
+    if movimento.tipo_movimento.aumenta_estoque:
+        return movimento.quantidade
+    return -movimento.quantidade
+
+
+def custo_da_entrada(movimento):
+    """Custo unitário com que uma entrada é valorizada (None: ao custo médio actual)"""
+    if getattr(movimento, '_ao_custo_medio', False):
+        return None
+    if movimento.tipo_movimento.aumenta_estoque and movimento.preco_unitario:
+        return movimento.preco_unitario
+    return None
+
+
+def _precos_ao_custo_medio(movimentos):
+    """
+    Movimentos lançados sem preço (preco_unitario None) ficam ao custo médio
+    da sucursal: o saldo é actualizado sem custo, pelo que o custo médio não
+    muda, e o movimento regista o custo médio actual (sem saldo, o preço de
+    custo do item), lido com a linha de saldo bloqueada. Chamado dentro da
+    transacção do lançamento.
+    """
+    from ..models_stock import StockItem
+
+    sem_preco = [movimento for movimento in movimentos if movimento.preco_unitario is None]
+    if not sem_preco:
+        return
+    custos = {
+        (item_id, sucursal_id): custo
+        for item_id, sucursal_id, custo in StockItem.objects.select_for_update().filter(
+            item_id__in={movimento.item_id for movimento in sem_preco},
+            sucursal_id__in={movimento.sucursal_id for movimento in sem_preco},
+        ).values_list('item_id', 'sucursal_id', 'custo_medio')
+    }
+    for movimento in sem_preco:
+        movimento.preco_unitario = (
+            custos.get((movimento.item_id, movimento.sucursal_id)) or movimento.item.preco_custo or Decimal('0')
+        )
+        movimento._ao_custo_medio = True
+
+
+def aplicar_movimento(movimento):
+    """Aplica ao saldo da sucursal um movimento já gravado (ver `lancar_movimento`)"""
+    aplicar_delta_stock(
+        movimento.item_id, movimento.sucursal_id, delta_do_movimento(movimento), custo_da_entrada(movimento),
+        respeitar_reservas=getattr(movimento, '_respeitar_reservas', True),
+    )
+
+
+def agrupar_deltas(movimentos):
+    """Soma os deltas dos movimentos por (item_id, sucursal_id)"""
+    deltas = defaultdict(int)
+    for movimento in movimentos:
+        deltas[(movimento.item_id, movimento.sucursal_id)] += delta_do_movimento(movimento)
+    return dict(deltas)
+
+
+def agrupar_lancamentos(movimentos):
+    """
+    Agrupa os movimentos por (item_id, sucursal_id) em entradas valorizadas,
+    entradas sem custo e saídas:
+    {par: [qtd_entrada, valor_entrada, qtd_sem_custo, qtd_saida]}
+    """
+    grupos = defaultdict(lambda: [0, Decimal('0'), 0, 0])
+    for movimento in movimentos:
+        grupo = grupos[(movimento.item_id, movimento.sucursal_id)]
+        custo = custo_da_entrada(movimento)
+        if not movimento.tipo_movimento.aumenta_estoque:
+            grupo[3] += movimento.quantidade
+        elif custo is None:
+            grupo[2] += movimento.quantidade
+        else:
+            grupo[0] += movimento.quantidade
+            grupo[1] += movimento.quantidade * custo
+    return dict(grupos)
+
+
+def _proximos_codigos_movimento(quantidade):
+    """Reserva `quantidade` códigos MOV consecutivos para um lote (uma única reserva na sequência)"""
+    from ..models_stock import codigos_movimento
+
+    return proximos_codigos('MOV', quantidade, existentes=codigos_movimento())
+
+
+def lancar_movimento(item, sucursal, tipo_movimento, quantidade, preco_unitario, usuario=None,
+                     respeitar_reservas=True, **campos):
+    """
+    Regista um MovimentoItem e actualiza o saldo na mesma transacção. Com
+    `preco_unitario` None a entrada fica ao custo médio da sucursal; com
+    `respeitar_reservas` False uma saída pode levar stock reservado (ver
+    `aplicar_delta_stock`).
+
+    O saldo é aplicado pelo post_save de MovimentoItem (ver signals.py); se a
+    actualização falhar (p.ex. stock insuficiente) o movimento é revertido.
+    """
+    from ..models_stock import MovimentoItem, StockItem
+
+    with transaction.atomic():
+        if 'data_movimento' not in campos:
+            # Datado com a linha de saldo bloqueada, como os lotes (ver inventarios.gerar_itens)
+            StockItem.objects.select_for_update().filter(item=item, sucursal=sucursal).exists()
+        movimento = MovimentoItem(
+            item=item,
+            sucursal=sucursal,
+            tipo_movimento=tipo_movimento,
+            quantidade=quantidade,
+            preco_unitario=preco_unitario,
+            usuario=usuario,
+            **campos
+        )
+        movimento._respeitar_reservas = respeitar_reservas
+        _precos_ao_custo_medio([movimento])
+        movimento.save()
+    return movimento
+
+
+def lancar_movimentos_em_lote(linhas, usuario=None, reservas=None, respeitar_reservas=True):
+    """
+    Lança várias linhas de movimento numa única transacção.
+
+    Cada linha é um dict com os campos de MovimentoItem (item, sucursal,
+    tipo_movimento, quantidade, preco_unitario e, opcionalmente, codigo,
+    referencia, observacoes, data_movimento, usuario). Os movimentos são
+    inseridos com bulk_create e os saldos recebem um UPDATE por (item,
+    sucursal) e sentido com as quantidades somadas (as entradas ao custo
+    médio do lote), por ordem de chave para evitar deadlocks entre lotes
+    concorrentes. preco_unitario None lança a linha ao custo médio da
+    sucursal, lido depois desses UPDATEs (já com as entradas do lote). Os
+    efeitos secundários correm uma vez por lote através de
+    `movimentos_lancados`.
+
+    `reservas` (QuerySet de ReservaStock) são as reservas que as saídas do
+    lote cumprem: são consumidas na mesma transacção, antes das saídas, para
+    que a quantidade reservada volte ao disponível de que as saídas precisam.
+    Com `respeitar_reservas` False as saídas só não podem deixar o saldo
+    negativo (ajustes de inventário, ver `aplicar_delta_stock`).
+    """
+    from ..models_stock import CodigoMovimento, MovimentoItem
+    from .reservas_stock import consumir
+
+    movimentos, sem_data = [], []
+    for linha in linhas:
+        campos = dict(linha)
+        campos.setdefault('usuario', usuario)
+        movimentos.append(MovimentoItem(**campos))
+        if 'data_movimento' not in campos:
+            sem_data.append(movimentos[-1])
+
+    if not movimentos:
+        return []
+
+    lancamentos = agrupar_lancamentos(movimentos)
+
+    with transaction.atomic():
+        sem_codigo = [movimento for movimento in movimentos if not movimento.codigo]
+        if sem_codigo:
+            for movimento, codigo in zip(sem_codigo, _proximos_codigos_movimento(len(sem_codigo))):
+                movimento.codigo = codigo
+        CodigoMovimento.registar(movimento.codigo for movimento in movimentos)
+        if reservas is not None:
+            consumir(reservas)
+
+        for item_id, sucursal_id in sorted(lancamentos):
+            entrada, valor_entrada, entrada_sem_custo, saida = lancamentos[(item_id, sucursal_id)]
+            # Entradas primeiro (ao custo médio do lote), depois as saídas
+            if entrada:
+                aplicar_delta_stock(item_id, sucursal_id, entrada, valor_entrada / entrada)
+            if entrada_sem_custo:
+                aplicar_delta_stock(item_id, sucursal_id, entrada_sem_custo)
+            if saida:
+                aplicar_delta_stock(item_id, sucursal_id, -saida, respeitar_reservas=respeitar_reservas)
+
+        # Linhas sem preço ao custo médio já com as entradas do lote aplicadas
+        _precos_ao_custo_medio(movimentos)
+        for movimento in movimentos:
+            movimento.valor_total = movimento.quantidade * movimento.preco_unitario
+
+        # Datados depois de os saldos estarem bloqueados pelos UPDATEs: um snapshot
+        # de inventário tirado antes deles (inventarios.gerar_itens) fica mais cedo
+        agora = timezone.now()
+        for movimento in sem_data:
+            movimento.data_movimento = agora
+
+        MovimentoItem.objects.bulk_create(movimentos, batch_size=500)
+        movimentos_lancados.send(sender=MovimentoItem, movimentos=movimentos)
+
+    logger.info('Lote de %s movimentos lançado (%s saldos actualizados)', len(movimentos), len(lancamentos))
+    return movimentos
@@ -0,0 +1,279 @@
+"""
+Snapshots diários de stock.
+
+Materializa em StockSnapshot o saldo de fecho de cada (item, sucursal) nos
+dias em que houve movimentos, para responder a "qual era o stock em D" sem
+reprocessar MovimentoItem. Os saldos são reconstruídos para trás a partir de
+StockItem (a fonte de verdade), desfazendo os deltas do ledger dia a dia, o
+que dispensa um saldo inicial e mantém os snapshots coerentes com o saldo
+actual mesmo quando há stock anterior aos movimentos registados.
+
+O valor é reconstruído da mesma forma, a partir de StockItem.valor_estoque,
+desfazendo o valor_total dos movimentos: as entradas com preço valem
+quantidade x preço e as restantes (saídas, entradas sem preço) ficam
+registadas ao custo médio do momento (ver stock_ledger), pelo que cada dia
+fica ao custo médio que vigorava nele.
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+import logging
+
+from django.db import connection, transaction
+from django.db.models import Case, F, Max, Min, OuterRef, Subquery, Sum, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+
+def _inicio_do_dia(dia):
+    return timezone.make_aware(datetime.combine(dia, time.min))
+
+
+def _delta_movimento():
+    """Expressão do delta assinado de um MovimentoItem (entrada +, saída -)"""
+    return Case(
+        When(tipo_movimento__aumenta_estoque=True, then=F('quantidade')),
+        default=F('quantidade') * -1,
+    )
+
+
+def _valor_movimento():
+    """Expressão do valor assinado de um MovimentoItem"""
+    return Case(
+        When(tipo_movimento__aumenta_estoque=True, then=F('valor_total')),
+        default=F('valor_total') * -1,
+    )
+
+
+def _deltas_por_dia(movimentos):
+    """{dia: [((item_id, sucursal_id), delta, valor)]} dos `movimentos`"""
+    deltas_por_dia = {}
+    linhas = movimentos.annotate(dia=TruncDate('data_movimento')).values('dia', 'item_id', 'sucursal_id').annotate(
+        delta=Sum(_delta_movimento()), valor=Sum(_valor_movimento()),
+    )
+    for linha in linhas:
+        deltas_por_dia.setdefault(linha['dia'], []).append(
+            ((linha['item_id'], linha['sucursal_id']), linha['delta'], linha['valor'])
+        )
+    return deltas_por_dia
+
+
+def _movimentos_entre(inicio=None, fim=None, ate=None):
+    """Movimentos com data em [inicio, fim] (dias) e, opcionalmente, registados antes de `ate`"""
+    from ..models_stock import MovimentoItem
+
+    movimentos = MovimentoItem.objects.all()
+    if inicio:
+        movimentos = movimentos.filter(data_movimento__gte=_inicio_do_dia(inicio))
+    if fim:
+        movimentos = movimentos.filter(data_movimento__lt=_inicio_do_dia(fim + timedelta(days=1)))
+    if ate:
+        movimentos = movimentos.filter(data_movimento__lt=ate)
+    return movimentos
+
+
+def materializar_snapshots(data_inicio, data_fim=None, dias_por_lote=31):
+    """
+    (Re)gera os snapshots dos dias [data_inicio, data_fim].
+
+    Parte dos saldos actuais, desfaz os movimentos posteriores a data_fim e
+    percorre o período do fim para o início em lotes de `dias_por_lote` dias:
+    uma consulta agrupada por (dia, item, sucursal) por lote e uma escrita
+    em bloco. A memória fica limitada ao número de pares (item, sucursal) e
+    aos movimentos agregados de um lote. Na primeira materialização grava
+    também o saldo de abertura (véspera de data_inicio). O valor recua com o
+    valor dos movimentos e volta a zero quando o saldo chega a zero.
+    """
+    from ..models_stock import StockItem, StockSnapshot
+    from .particionamento_movimentos import data_corte_arquivo
+
+    # Os movimentos de partições arquivadas já não estão no ledger: esses dias não são refeitos
+    corte = data_corte_arquivo()
+    if corte and data_inicio < corte:
+        data_inicio = corte
+    ontem = timezone.localdate() - timedelta(days=1)
+    data_fim = min(data_fim or ontem, ontem)
+    if data_inicio > data_fim:
+        return 0
+
+    marco = timezone.now()
+    saldos = {}
+    valores = {}
+    for item_id, sucursal_id, quantidade, valor in StockItem.objects.values_list(
+        'item_id', 'sucursal_id', 'quantidade_atual', 'valor_estoque'
+    ):
+        saldos[(item_id, sucursal_id)] = quantidade
+        valores[(item_id, sucursal_id)] = valor
+
+    def recuar(par, delta, valor):
+        """Do fecho de um dia para o fecho da véspera"""
+        saldos[par] = saldos.get(par, Decimal('0')) - delta
+        valores[par] = valores.get(par, Decimal('0')) - valor if saldos[par] else Decimal('0')
+
+    posteriores = _deltas_por_dia(_movimentos_entre(inicio=data_fim + timedelta(days=1), ate=marco))
+    for dia in sorted(posteriores, reverse=True):
+        for linha in posteriores[dia]:
+            recuar(*linha)
+
+    abertura = not StockSnapshot.objects.filter(data__lt=data_inicio).exists()
+
+    def snapshot(par, dia):
+        return StockSnapshot(
+            item_id=par[0],
+            sucursal_id=par[1],
+            data=dia,
+            quantidade=saldos.get(par, Decimal('0')),
+            valor=valores.get(par, Decimal('0')),
+        )
+
+    total = 0
+    fim_lote = data_fim
+    while fim_lote >= data_inicio:
+        inicio_lote = max(data_inicio, fim_lote - timedelta(days=dias_por_lote - 1))
+
+        deltas_por_dia = _deltas_por_dia(_movimentos_entre(inicio=inicio_lote, fim=fim_lote))
+
+        snapshots = []
+        for dia in sorted(deltas_por_dia, reverse=True):
+            for linha in deltas_por_dia[dia]:
+                # Saldo de fecho do dia; depois recua para o fecho da véspera
+                snapshots.append(snapshot(linha[0], dia))
+                recuar(*linha)
+
+        with transaction.atomic():
+            StockSnapshot.objects.filter(data__range=(inicio_lote, fim_lote)).delete()
+            StockSnapshot.objects.bulk_create(snapshots, batch_size=1000)
+
+        total += len(snapshots)
+        logger.info('Snapshots de %s a %s: %s linhas', inicio_lote, fim_lote, len(snapshots))
+        fim_lote = inicio_lote - timedelta(days=1)
+
+    if abertura:
+        vespera = data_inicio - timedelta(days=1)
+        snapshots = [snapshot(par, vespera) for par, quantidade in saldos.items() if quantidade]
+        with transaction.atomic():
+            StockSnapshot.objects.filter(data=vespera).delete()
+            StockSnapshot.objects.bulk_create(snapshots, batch_size=1000)
+        total += len(snapshots)
+
+    return total
+
+
+def atualizar_snapshots(dias_por_lote=31):
+    """
+    Materialização incremental (execução nocturna): processa os dias desde o
+    último snapshot até ontem. Sem snapshots, faz o backfill desde o primeiro
+    movimento registado.
+    """
+    from ..models_stock import StockSnapshot
+
+    ultimo = StockSnapshot.objects.aggregate(ultimo=Max('data'))['ultimo']
+    if ultimo:
+        inicio = ultimo + timedelta(days=1)
+    else:
+        primeiro = _movimentos_entre().aggregate(primeiro=Min('data_movimento'))['primeiro']
+        if not primeiro:
+            return 0
+        inicio = timezone.localdate(primeiro)
+
+    return materializar_snapshots(inicio, dias_por_lote=dias_por_lote)
+
+
+def saldos_em(data, sucursal_ids=None, item_ids=None):
+    """
+    Snapshot em vigor na `data` para cada (item, sucursal): o mais recente
+    com data <= `data`. Devolve um QuerySet de StockSnapshot.
+    """
+    from ..models_stock import StockSnapshot
+
+    snapshots = StockSnapshot.objects.filter(data__lte=data)
+    if sucursal_ids is not None:
+        snapshots = snapshots.filter(sucursal_id__in=sucursal_ids)
+    if item_ids is not None:
+        snapshots = snapshots.filter(item_id__in=item_ids)
+
+    if connection.features.can_distinct_on_fields:
+        return snapshots.order_by('item_id', 'sucursal_id', '-data').distinct('item_id', 'sucursal_id')
+
+    mais_recente = StockSnapshot.objects.filter(
+        item_id=OuterRef('item_id'),
+        sucursal_id=OuterRef('sucursal_id'),
+        data__lte=data,
+    ).order_by('-data').values('data')[:1]
+    return snapshots.filter(data=Subquery(mais_recente))
+
+
+def saldo_em(item_id, sucursal_id, data):
+    """Quantidade do item na sucursal no fecho de `data` (hoje ou depois: saldo actual)"""
+    from ..models_stock import StockItem
+
+    if data >= timezone.localdate():
+        quantidade = StockItem.objects.filter(item_id=item_id, sucursal_id=sucursal_id).values_list(
+            'quantidade_atual', flat=True
+        ).first()
+    else:
+        quantidade = saldos_em(data, sucursal_ids=[sucursal_id], item_ids=[item_id]).values_list(
+            'quantidade', flat=True
+        ).first()
+    return quantidade if quantidade is not None else Decimal('0')
+
+
+def serie_diaria(data_inicio, data_fim, sucursal_ids=None, item_ids=None):
+    """
+    Quantidade e valor totais em stock no fecho de cada dia do intervalo.
+
+    Lê o saldo de abertura (véspera) e as alterações do período dos
+    snapshots; os dias a partir de hoje usam os saldos actuais de StockItem.
+    Devolve uma lista de dicts {'data', 'quantidade', 'valor'}.
+    """
+    from ..models_stock import StockItem, StockSnapshot
+
+    hoje = timezone.localdate()
+    vigentes = {
+        (snapshot.item_id, snapshot.sucursal_id): (snapshot.quantidade, snapshot.valor)
+        for snapshot in saldos_em(data_inicio - timedelta(days=1), sucursal_ids, item_ids)
+    }
+    quantidade_total = sum((q for q, _ in vigentes.values()), Decimal('0'))
+    valor_total = sum((v for _, v in vigentes.values()), Decimal('0'))
+
+    alteracoes = StockSnapshot.objects.filter(data__range=(data_inicio, min(data_fim, hoje - timedelta(days=1))))
+    if sucursal_ids is not None:
+        alteracoes = alteracoes.filter(sucursal_id__in=sucursal_ids)
+    if item_ids is not None:
+        alteracoes = alteracoes.filter(item_id__in=item_ids)
+    por_dia = {}
+    for dia, item_id, sucursal_id, quantidade, valor in alteracoes.values_list(
+        'data', 'item_id', 'sucursal_id', 'quantidade', 'valor'
+    ):
+        por_dia.setdefault(dia, []).append(((item_id, sucursal_id), quantidade, valor))
+
+    actual = None
+    serie = []
+    dia = data_inicio
+    while dia <= data_fim:
+        if dia >= hoje:
+            if actual is None:
+                stocks = StockItem.objects.all()
+                if sucursal_ids is not None:
+                    stocks = stocks.filter(sucursal_id__in=sucursal_ids)
+                if item_ids is not None:
+                    stocks = stocks.filter(item_id__in=item_ids)
+                actual = stocks.aggregate(
+                    quantidade=Sum('quantidade_atual'),
+                    valor=Sum('valor_estoque'),
+                )
+            quantidade_total = actual['quantidade'] or Decimal('0')
+            valor_total = actual['valor'] or Decimal('0')
+        else:
+            for par, quantidade, valor in por_dia.get(dia, []):
+                quantidade_anterior, valor_anterior = vigentes.get(par, (Decimal('0'), Decimal('0')))
+                quantidade_total += quantidade - quantidade_anterior
+                valor_total += valor - valor_anterior
+                vigentes[par] = (quantidade, valor)
+
+        serie.append({'data': dia, 'quantidade': quantidade_total, 'valor': valor_total})
+        dia += timedelta(days=1)
+
+    return serie
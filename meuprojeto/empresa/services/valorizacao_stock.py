@@ -0,0 +1,122 @@
+"""
+Valorização do stock ao custo médio ponderado.
+
+O ledger (services/stock_ledger.py) mantém StockItem.custo_medio e
+StockItem.valor_estoque a cada lançamento. Este módulo recalcula ambos a
+partir do histórico de MovimentoItem, para a carga inicial ou para corrigir
+desvios, e fornece os totais de valor lidos directamente de StockItem.
+"""
+from decimal import Decimal
+import logging
+
+from django.db import transaction
+from django.db.models import Case, F, Sum, When
+
+from .matriz_stock import invalidar_itens
+from .metricas_cache import invalidar
+
+
+logger = logging.getLogger(__name__)
+
+
+def valor_em_stock(sucursal_ids=None):
+    """Valor total do stock (uma soma sobre StockItem.valor_estoque)"""
+    from ..models_stock import StockItem
+
+    stocks = StockItem.objects.all()
+    if sucursal_ids is not None:
+        stocks = stocks.filter(sucursal_id__in=sucursal_ids)
+    return stocks.aggregate(total=Sum('valor_estoque'))['total'] or Decimal('0')
+
+
+def custo_medio_por_replay(quantidade_inicial, custo_inicial, movimentos):
+    """
+    Custo médio após aplicar `movimentos` (tuplos (aumenta_estoque, quantidade,
+    preco_unitario) por ordem cronológica) a um saldo inicial valorizado a
+    `custo_inicial`. Mesmas regras do ledger: entradas com preço recalculam a
+    média; saídas e entradas sem preço mantêm-na.
+    """
+    quantidade = Decimal(quantidade_inicial)
+    custo = Decimal(custo_inicial)
+    for aumenta_estoque, qtd, preco in movimentos:
+        if not aumenta_estoque:
+            quantidade -= qtd
+            continue
+        if preco:
+            if quantidade > 0:
+                custo = (quantidade * custo + qtd * preco) / (quantidade + qtd)
+            else:
+                custo = Decimal(preco)
+        quantidade += qtd
+    return custo
+
+
+def recalcular_valorizacao(item_ids=None, sucursal_ids=None, lote=1000):
+    """
+    Recalcula custo médio e valor de cada StockItem a partir do ledger.
+
+    O saldo anterior ao primeiro movimento (stock existente sem movimento
+    registado) é valorizado ao preço de custo do item. Os movimentos são lidos
+    em streaming por (item, sucursal, data) e as linhas gravadas com
+    bulk_update em lotes de `lote`. Devolve o número de StockItem actualizados.
+    """
+    from ..models_stock import MovimentoItem, StockItem
+
+    stocks = StockItem.objects.select_related('item')
+    movimentos = MovimentoItem.objects.all()
+    if item_ids is not None:
+        stocks = stocks.filter(item_id__in=item_ids)
+        movimentos = movimentos.filter(item_id__in=item_ids)
+    if sucursal_ids is not None:
+        stocks = stocks.filter(sucursal_id__in=sucursal_ids)
+        movimentos = movimentos.filter(sucursal_id__in=sucursal_ids)
+
+    deltas = {
+        (linha['item_id'], linha['sucursal_id']): linha['delta']
+        for linha in movimentos.values('item_id', 'sucursal_id').annotate(delta=Sum(Case(
+            When(tipo_movimento__aumenta_estoque=True, then=F('quantidade')),
+            default=F('quantidade') * -1,
+        )))
+    }
+
+    historico = movimentos.order_by('item_id', 'sucursal_id', 'data_movimento', 'id').values_list(
+        'item_id', 'sucursal_id', 'tipo_movimento__aumenta_estoque', 'quantidade', 'preco_unitario'
+    ).iterator(chunk_size=lote)
+
+    atualizados = 0
+    pendentes = []
+
+    def gravar():
+        with transaction.atomic():
+            StockItem.objects.bulk_update(pendentes, ['custo_medio', 'valor_estoque'])
+            invalidar('stock')
+            invalidar_itens({stock.item_id for stock in pendentes})
+        pendentes.clear()
+
+    # Ambas as sequências estão ordenadas por (item, sucursal): avança em paralelo
+    proximo = next(historico, None)
+    for stock in stocks.order_by('item_id', 'sucursal_id').iterator(chunk_size=lote):
+        par = (stock.item_id, stock.sucursal_id)
+        while proximo is not None and proximo[:2] < par:
+            proximo = next(historico, None)
+
+        movimentos_par = []
+        while proximo is not None and proximo[:2] == par:
+            movimentos_par.append(proximo[2:])
+            proximo = next(historico, None)
+
+        abertura = stock.quantidade_atual - deltas.get(par, 0)
+        custo = custo_medio_por_replay(abertura, stock.item.preco_custo or 0, movimentos_par)
+
+        stock.custo_medio = custo.quantize(Decimal('0.0001'))
+        stock.valor_estoque = (stock.quantidade_atual * custo).quantize(Decimal('0.01'))
+        pendentes.append(stock)
+        atualizados += 1
+        if len(pendentes) >= lote:
+            gravar()
+
+    if pendentes:
+        gravar()
+
+    logger.info('Valorização recalculada para %s linhas de stock', atualizados)
+    return atualizados
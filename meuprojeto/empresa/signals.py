@@ -1,7 +1,14 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from .models_rh import AvaliacaoDesempenho, CriterioAvaliado
-from .models_stock import MovimentoItem, StockItem
+from .models_stock import (
+    ItemRequisicaoCompraExterna, ItemRequisicaoStock, MovimentoItem, RequisicaoCompraExterna, RequisicaoStock,
+    TransferenciaStock,
+)
+from .services.indice_requisicoes import marcar as marcar_requisicao
+from .services.movimentos_diarios import acumular_movimentos
+from .services.reservas_stock import libertar
+from .services.stock_ledger import aplicar_movimento, movimentos_lancados
 
 
 @receiver(post_save, sender=CriterioAvaliado)
@@ -114,37 +121,43 @@ def actualizar_estoque_apos_movimento_material_OLD(sender, instance, created, **
 @receiver(post_save, sender=MovimentoItem)
 def actualizar_estoque_apos_movimento_item(sender, instance, created, **kwargs):
     """
-    Actualiza o estoque automaticamente quando um movimento de item é registrado
+    Actualiza o estoque automaticamente quando um movimento de item é registrado.
+    
+    O saldo é actualizado pelo ledger com um UPDATE condicional (sem ler e
+    gravar o StockItem em Python). Os erros não são engolidos: corre dentro da
+    transacção de MovimentoItem.save(), pelo que um saldo insuficiente reverte
+    também o movimento.
     """
-    try:
-        if created:  # Só executa quando o movimento é criado (não editado)
-            item = instance.item
-            sucursal = instance.sucursal
-            quantidade = instance.quantidade
-            tipo_movimento = instance.tipo_movimento
-            
-            # Obter ou criar o registro de estoque da sucursal
-            stock_item, created_stock = StockItem.objects.get_or_create(
-                item=item,
-                sucursal=sucursal,
-                defaults={'quantidade_atual': 0, 'quantidade_reservada': 0}
-            )
-            
-            # Actualizar a quantidade baseada no tipo de movimento
-            if tipo_movimento.aumenta_estoque:
-                # Entrada: aumenta o estoque
-                stock_item.quantidade_atual += quantidade
-            else:
-                # Saída: diminui o estoque
-                stock_item.quantidade_atual -= quantidade
-                # Garantir que não fique negativo
-                if stock_item.quantidade_atual < 0:
-                    stock_item.quantidade_atual = 0
-            
-            stock_item.save()
-            
-    except Exception as e:
-        # Log do erro mas não interrompe o processo
-        print(f"ERRO ao actualizar estoque para movimento unificado {instance.id}: {e}")
-        import traceback
-        traceback.print_exc()
+    if created:  # Só executa quando o movimento é criado (não editado)
+        aplicar_movimento(instance)
+        movimentos_lancados.send(sender=sender, movimentos=[instance])
+
+
+@receiver(movimentos_lancados, sender=MovimentoItem)
+def acumular_movimentos_diarios(sender, movimentos, **kwargs):
+    """Soma os movimentos lançados aos totais diários (MovimentoDiario), na mesma transacção"""
+    acumular_movimentos(movimentos)
+
+
+@receiver(pre_delete, sender=RequisicaoStock)
+@receiver(pre_delete, sender=TransferenciaStock)
+def libertar_reservas_do_documento(sender, instance, **kwargs):
+    """
+    As reservas são apagadas em cascata com o documento: as activas devolvem
+    antes a quantidade ao disponível, senão ficaria reservada para sempre.
+    """
+    libertar(instance.reservas.all())
+
+
+@receiver([post_save, post_delete], sender=RequisicaoStock)
+@receiver([post_save, post_delete], sender=RequisicaoCompraExterna)
+def indexar_requisicao(sender, instance, **kwargs):
+    """Reindexa a requisição no índice unificado (IndiceRequisicao) depois do commit"""
+    marcar_requisicao('INTERNA' if sender is RequisicaoStock else 'EXTERNA', instance.pk)
+
+
+@receiver([post_save, post_delete], sender=ItemRequisicaoStock)
+@receiver([post_save, post_delete], sender=ItemRequisicaoCompraExterna)
+def indexar_requisicao_do_item(sender, instance, **kwargs):
+    """Os itens mudam o número de itens e o valor da requisição no índice"""
+    marcar_requisicao('INTERNA' if sender is ItemRequisicaoStock else 'EXTERNA', instance.requisicao_id)
@@ -6,44 +6,71 @@ from datetime import timedelta
 from django.contrib.auth.models import User
 
 from .models_stock import (
-    NotificacaoStock, StockItem, MovimentoItem, 
+    NotificacaoStock, StockItem, MovimentoItem, Item,
     RequisicaoStock, RequisicaoCompraExterna
 )
+from .services.alertas_stock import sincronizar_stock_baixo
+from .services.stock_ledger import movimentos_lancados
 
 logger = logging.getLogger(__name__)
 
 @receiver(post_save, sender=StockItem)
 def verificar_estoque_baixo(sender, instance, created, **kwargs):
-    """Verifica se o estoque está baixo após atualização"""
+    """Actualiza o estado de stock baixo após gravação (só as transições notificam)"""
     try:
-        if instance.item and instance.item.estoque_minimo:
-            if instance.quantidade_atual <= instance.item.estoque_minimo:
-                # Criar notificação de estoque baixo
-                NotificacaoStock.objects.create(
-                    tipo='stock_baixo',
-                    titulo=f'Estoque Baixo: {instance.item.nome}',
-                    mensagem=f'O item {instance.item.nome} ({instance.item.codigo}) está com estoque baixo na sucursal {instance.sucursal.nome}. Quantidade atual: {instance.quantidade_atual}, Mínimo: {instance.item.estoque_minimo}',
-                    url=f'/stock/requisicoes/verificar-stock-baixo/',
-                    usuario_destinatario=None  # Notificação geral
-                )
-                logger.info(f"Alerta de estoque baixo criado para {instance.item.nome}")
+        sincronizar_stock_baixo(StockItem.objects.filter(pk=instance.pk))
     except Exception as e:
         logger.error(f"Erro ao verificar estoque baixo: {e}")
 
-@receiver(post_save, sender=MovimentoItem)
-def verificar_movimentacao_sem_usuario(sender, instance, created, **kwargs):
-    """Verifica se a movimentação foi criada sem usuário"""
+@receiver(post_save, sender=Item)
+def verificar_estoque_baixo_item(sender, instance, created, **kwargs):
+    """O estoque mínimo do item pode ter mudado: reavaliar os seus stocks"""
+    if created:
+        return
     try:
-        if created and not instance.usuario:
-            # Criar notificação de auditoria
-            NotificacaoStock.objects.create(
-                tipo='movimentacao_sem_usuario',
-                titulo='Movimentação sem Usuário',
-                mensagem=f'Movimentação {instance.codigo} foi registrada sem usuário responsável. Item: {instance.item.nome}, Quantidade: {instance.quantidade}',
-                url=f'/stock/movimentos/',
-                usuario_destinatario=None  # Notificação geral
-            )
-            logger.info(f"Alerta de movimentação sem usuário criado para {instance.codigo}")
+        sincronizar_stock_baixo(StockItem.objects.filter(item_id=instance.pk))
+    except Exception as e:
+        logger.error(f"Erro ao verificar estoque baixo do item: {e}")
+
+@receiver(movimentos_lancados, sender=MovimentoItem)
+def verificar_estoque_baixo_movimentos(sender, movimentos, **kwargs):
+    """Actualiza o estado de stock baixo dos saldos alterados por um lançamento"""
+    try:
+        sincronizar_stock_baixo(StockItem.objects.filter(
+            item_id__in={m.item_id for m in movimentos},
+            sucursal_id__in={m.sucursal_id for m in movimentos},
+        ))
+    except Exception as e:
+        logger.error(f"Erro ao verificar estoque baixo: {e}")
+
+@receiver(movimentos_lancados, sender=MovimentoItem)
+def verificar_movimentacao_sem_usuario(sender, movimentos, **kwargs):
+    """Verifica se as movimentações lançadas (unitárias ou em lote) não têm usuário"""
+    try:
+        sem_usuario = [m for m in movimentos if not m.usuario_id]
+        if not sem_usuario:
+            return
+        
+        # Uma única notificação de auditoria por lançamento
+        if len(sem_usuario) == 1:
+            movimento = sem_usuario[0]
+            titulo = 'Movimentação sem Usuário'
+            mensagem = f'Movimentação {movimento.codigo} foi registrada sem usuário responsável. Item: {movimento.item.nome}, Quantidade: {movimento.quantidade}'
+        else:
+            codigos = ', '.join(m.codigo for m in sem_usuario[:10])
+            if len(sem_usuario) > 10:
+                codigos += ', ...'
+            titulo = f'{len(sem_usuario)} Movimentações sem Usuário'
+            mensagem = f'{len(sem_usuario)} movimentações foram registradas sem usuário responsável: {codigos}'
+        
+        NotificacaoStock.objects.create(
+            tipo='movimentacao_sem_usuario',
+            titulo=titulo,
+            mensagem=mensagem,
+            url=f'/stock/movimentos/',
+            usuario_destinatario=None  # Notificação geral
+        )
+        logger.info(f"Alerta de movimentação sem usuário criado ({len(sem_usuario)} movimentos)")
     except Exception as e:
         logger.error(f"Erro ao verificar movimentação sem usuário: {e}")
 
@@ -87,9 +114,7 @@ def criar_alertas_sistema():
     """Função para criar alertas do sistema (chamada manual ou por cron)"""
     try:
         # Verificar estoque baixo geral
-        estoque_baixo_count = StockItem.objects.filter(
-            quantidade_atual__lte=F('item__estoque_minimo')
-        ).count()
+        estoque_baixo_count = StockItem.objects.filter(abaixo_minimo=True).count()
         
         if estoque_baixo_count > 0:
             NotificacaoStock.objects.create(
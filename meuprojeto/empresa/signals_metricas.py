@@ -0,0 +1,60 @@
+"""
+Invalidação do cache de métricas (services/metricas_cache): cada gravação ou
+remoção num modelo sobe a versão do domínio de métricas a que pertence. Os
+blocos da matriz itens × sucursais (services/matriz_stock) são renovados só
+para os itens gravados ou movimentados.
+"""
+from django.db.models.signals import post_delete, post_save
+
+from .models_base import Sucursal
+from .models_stock import (
+    CategoriaProduto, Fornecedor, Item, MovimentoItem, NotificacaoStock, RastreamentoEntrega,
+    Receita, RequisicaoCompraExterna, RequisicaoStock, StockItem, TipoMovimentoStock, Transportadora,
+)
+from .services.matriz_stock import invalidar_itens
+from .services.metricas_cache import invalidar
+from .services.stock_ledger import movimentos_lancados
+
+
+DOMINIO_POR_MODELO = {
+    Item: 'catalogo',
+    Fornecedor: 'catalogo',
+    Receita: 'catalogo',
+    CategoriaProduto: 'catalogo',
+    StockItem: 'stock',
+    MovimentoItem: 'movimentos',
+    TipoMovimentoStock: 'movimentos',
+    NotificacaoStock: 'notificacoes',
+    RequisicaoStock: 'requisicoes',
+    RequisicaoCompraExterna: 'requisicoes',
+    RastreamentoEntrega: 'logistica',
+    Transportadora: 'logistica',
+    Sucursal: 'sucursais',
+}
+
+
+def invalidar_metricas_modelo(sender, **kwargs):
+    invalidar(DOMINIO_POR_MODELO[sender])
+
+
+for modelo in DOMINIO_POR_MODELO:
+    post_save.connect(invalidar_metricas_modelo, sender=modelo, dispatch_uid=f'metricas_save_{modelo.__name__}')
+    post_delete.connect(invalidar_metricas_modelo, sender=modelo, dispatch_uid=f'metricas_delete_{modelo.__name__}')
+
+
+def invalidar_matriz_item(sender, instance, **kwargs):
+    invalidar_itens([instance.pk if sender is Item else instance.item_id])
+
+
+for modelo in (Item, StockItem):
+    post_save.connect(invalidar_matriz_item, sender=modelo, dispatch_uid=f'matriz_save_{modelo.__name__}')
+    post_delete.connect(invalidar_matriz_item, sender=modelo, dispatch_uid=f'matriz_delete_{modelo.__name__}')
+
+
+def invalidar_metricas_lancamento(sender, movimentos, **kwargs):
+    """Os lançamentos usam bulk_create e UPDATEs nos saldos, que não disparam post_save"""
+    invalidar('movimentos', 'stock')
+    invalidar_itens({movimento.item_id for movimento in movimentos})
+
+
+movimentos_lancados.connect(invalidar_metricas_lancamento, sender=MovimentoItem, dispatch_uid='metricas_lancamento')
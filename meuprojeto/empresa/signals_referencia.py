@@ -0,0 +1,16 @@
+"""
+Invalidação do registo de dados de referência (services/dados_referencia):
+cada gravação ou remoção num modelo descarta os conjuntos que dependem dele.
+"""
+from django.db.models.signals import post_delete, post_save
+
+from .services.dados_referencia import conjuntos_do_modelo, invalidar, modelos_registados
+
+
+def invalidar_referencia_modelo(sender, **kwargs):
+    invalidar(*conjuntos_do_modelo(sender))
+
+
+for modelo in modelos_registados():
+    post_save.connect(invalidar_referencia_modelo, sender=modelo, dispatch_uid=f'referencia_save_{modelo.__name__}')
+    post_delete.connect(invalidar_referencia_modelo, sender=modelo, dispatch_uid=f'referencia_delete_{modelo.__name__}')
@@ -0,0 +1,83 @@
+"""
+Totais guardados dos documentos (DocumentoQuerySet em models_stock): as
+gravações e remoções de itens recalculam, com um UPDATE, os totais do
+documento a que pertencem. A gravação do próprio documento também os
+recalcula, para que uma instância carregada antes de os itens mudarem não
+reponha valores antigos.
+
+Os totais a preço de custo (requisições internas e transferências) seguem o
+Item.preco_custo enquanto o documento está em aberto; depois de fechado
+ficam com o valor da altura.
+
+Os contadores de progresso dos inventários (InventarioQuerySet) seguem a
+mesma regra: gravar ou remover um ItemInventario, ou o próprio inventário,
+recalcula-os.
+
+Estes receivers ligam-se antes dos de signals.py (ver apps.py): o índice de
+requisições lê os totais guardados e, fora de uma transacção, é reindexado
+logo no signal.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models_stock import (
+    InventarioFisico, Item, ItemInventario, ItemOrdemCompra, ItemRequisicaoCompraExterna, ItemRequisicaoStock,
+    ItemTransferencia, OrdemCompra, RequisicaoCompraExterna, RequisicaoStock, TransferenciaStock,
+)
+from .services.indice_requisicoes import marcar as marcar_requisicao
+
+
+DOCUMENTO_DO_ITEM = {
+    ItemOrdemCompra: (OrdemCompra, 'ordem_compra_id'),
+    ItemTransferencia: (TransferenciaStock, 'transferencia_id'),
+    ItemRequisicaoStock: (RequisicaoStock, 'requisicao_id'),
+    ItemRequisicaoCompraExterna: (RequisicaoCompraExterna, 'requisicao_id'),
+}
+
+# Documentos a preço de custo cujos totais ainda acompanham o preço do item
+STATUS_FECHADOS = {
+    RequisicaoStock: ['ATENDIDA', 'CANCELADA', 'REJEITADA'],
+    TransferenciaStock: ['RECEBIDA', 'CANCELADA'],
+}
+
+
+@receiver([post_save, post_delete], sender=ItemOrdemCompra)
+@receiver([post_save, post_delete], sender=ItemTransferencia)
+@receiver([post_save, post_delete], sender=ItemRequisicaoStock)
+@receiver([post_save, post_delete], sender=ItemRequisicaoCompraExterna)
+def recalcular_totais_do_item(sender, instance, **kwargs):
+    documento, campo = DOCUMENTO_DO_ITEM[sender]
+    documento.objects.filter(pk=getattr(instance, campo)).recalcular_totais()
+
+
+@receiver(post_save, sender=OrdemCompra)
+@receiver(post_save, sender=TransferenciaStock)
+@receiver(post_save, sender=RequisicaoStock)
+@receiver(post_save, sender=RequisicaoCompraExterna)
+def recalcular_totais_do_documento(sender, instance, **kwargs):
+    sender.objects.filter(pk=instance.pk).recalcular_totais()
+
+
+@receiver(post_save, sender=Item)
+def recalcular_totais_a_preco_de_custo(sender, instance, created, **kwargs):
+    """O preço de custo do item entra nos totais das requisições e transferências em aberto"""
+    if created:
+        return
+    for documento, fechados in STATUS_FECHADOS.items():
+        abertos = documento.objects.filter(itens__item=instance).exclude(status__in=fechados)
+        if documento is RequisicaoStock:
+            abertos = list(abertos.values_list('pk', flat=True).distinct())
+        documento.objects.filter(pk__in=abertos).recalcular_totais()
+        if documento is RequisicaoStock:
+            for requisicao_id in abertos:
+                marcar_requisicao('INTERNA', requisicao_id)
+
+
+@receiver([post_save, post_delete], sender=ItemInventario)
+def recalcular_progresso_do_item(sender, instance, **kwargs):
+    InventarioFisico.objects.filter(pk=instance.inventario_id).recalcular_progresso()
+
+
+@receiver(post_save, sender=InventarioFisico)
+def recalcular_progresso_do_inventario(sender, instance, **kwargs):
+    sender.objects.filter(pk=instance.pk).recalcular_progresso()
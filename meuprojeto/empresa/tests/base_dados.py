@@ -0,0 +1,118 @@
+"""
+Apoio aos testes que precisam da base de dados (contagem de consultas,
+lançamentos reais no ledger). Os restantes testes usam duplos e não a tocam.
+
+A base de teste é criada uma vez por processo com as definições activas (a
+da produção é PostgreSQL) e destruída no fim; se o servidor não estiver
+acessível, os testes que a usam são saltados.
+"""
+import atexit
+from datetime import date, time, timedelta
+from decimal import Decimal
+import unittest
+
+import django
+from django.test import TestCase
+
+
+_estado = {}
+
+
+def preparar_base_de_dados():
+    """Cria a base de teste na primeira chamada (SkipTest se não houver servidor)"""
+    if 'erro' in _estado:
+        raise unittest.SkipTest(f'Base de dados de teste indisponível: {_estado["erro"]}')
+    if 'configuracao' in _estado:
+        return
+
+    django.setup()
+    from django.db import OperationalError
+    from django.test.utils import (
+        setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+    )
+
+    setup_test_environment()
+    try:
+        _estado['configuracao'] = setup_databases(verbosity=0, interactive=False)
+    except OperationalError as erro:
+        teardown_test_environment()
+        _estado['erro'] = erro
+        raise unittest.SkipTest(f'Base de dados de teste indisponível: {erro}')
+
+    def destruir():
+        teardown_databases(_estado['configuracao'], verbosity=0)
+        teardown_test_environment()
+
+    atexit.register(destruir)
+
+
+class BaseDadosTestCase(TestCase):
+    """TestCase do Django sobre a base de teste criada por `preparar_base_de_dados`"""
+
+    @classmethod
+    def setUpClass(cls):
+        preparar_base_de_dados()
+        super().setUpClass()
+
+    def setUp(self):
+        from django.core.cache import cache
+        from meuprojeto.empresa.services import dados_referencia
+
+        cache.clear()
+        dados_referencia.limpar()
+
+
+HORARIO = {
+    'duracao_almoco': timedelta(hours=1), 'horas_trabalho_dia': timedelta(hours=8),
+    'hora_inicio_expediente': time(8), 'hora_fim_expediente': time(17),
+}
+
+
+def criar_empresa():
+    """A empresa dos testes, sem a sucursal sede criada automaticamente (as sucursais são explícitas)"""
+    from django.db.models.signals import post_save
+    from meuprojeto.empresa.models_base import DadosEmpresa, criar_sucursal_sede_automaticamente
+
+    empresa = DadosEmpresa.objects.first()
+    if empresa is None:
+        post_save.disconnect(criar_sucursal_sede_automaticamente, sender=DadosEmpresa)
+        try:
+            empresa = DadosEmpresa.objects.create(
+                nome='Empresa de Teste', nuit='123456789', alvara='A1', data_constituicao=date(2020, 1, 1),
+                provincia='MP', cidade='Maputo', bairro='Centro', endereco='Rua 1', telefone='+258841234567',
+                email='empresa@teste.co.mz', **HORARIO,
+            )
+        finally:
+            post_save.connect(criar_sucursal_sede_automaticamente, sender=DadosEmpresa)
+    return empresa
+
+
+def criar_sucursal(nome='Sucursal de teste'):
+    from meuprojeto.empresa.models_base import Sucursal
+
+    return Sucursal.objects.create(
+        empresa_sede=criar_empresa(), nome=nome, responsavel='Responsável', provincia='MP', cidade='Maputo',
+        bairro='Centro', endereco='Rua 1', telefone='+258841234567', email='sucursal@teste.co.mz',
+        data_abertura=date(2020, 1, 1), **HORARIO,
+    )
+
+
+def criar_item(nome='Item de teste', preco_custo=Decimal('10.00'), tipo='MATERIAL'):
+    from meuprojeto.empresa.models_stock import CategoriaProduto, Item
+
+    categoria = CategoriaProduto.objects.first() or CategoriaProduto.objects.create(nome='Categoria', tipo='PRODUTO')
+    return Item.objects.create(
+        tipo=tipo, nome=nome, categoria=categoria, preco_custo=preco_custo, estoque_minimo=5, estoque_maximo=100,
+    )
+
+
+def criar_administrador(username='admin'):
+    """Utilizador com acesso a todas as sucursais e ao stock"""
+    from django.contrib.auth.models import User
+    from meuprojeto.empresa.models_rh import PerfilUsuario
+
+    usuario = User.objects.create_superuser(username, f'{username}@teste.co.mz', 'senha')
+    PerfilUsuario.objects.update_or_create(
+        usuario=usuario, defaults={'is_admin_geral': True, 'permissoes_stock': True},
+    )
+    return usuario
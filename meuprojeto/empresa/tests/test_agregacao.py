@@ -0,0 +1,104 @@
+import unittest
+from decimal import Decimal
+
+from django.urls import reverse
+
+from meuprojeto.empresa.tests.base_dados import BaseDadosTestCase, criar_administrador, criar_item, criar_sucursal
+
+
+class FakeQuerySet:
+    """Regista os aggregate() em vez de os executar"""
+
+    def __init__(self):
+        self.consultas = []
+
+    def aggregate(self, **expressoes):
+        self.consultas.append(('aggregate', expressoes))
+        return {nome: 0 for nome in expressoes}
+
+
+class ContarPorFiltroTests(unittest.TestCase):
+    def test_junta_contagens_num_unico_aggregate(self):
+        from django.db.models import Avg, Count, Q
+        from meuprojeto.empresa.services.agregacao import contar_por_filtro
+
+        queryset = FakeQuerySet()
+        resultado = contar_por_filtro(queryset, total=None, pendentes=Q(status='PENDENTE'), media=Avg('nota'))
+
+        self.assertEqual(resultado, {'total': 0, 'pendentes': 0, 'media': 0})
+        self.assertEqual(len(queryset.consultas), 1)
+        expressoes = queryset.consultas[0][1]
+        self.assertIsNone(expressoes['total'].filter)
+        self.assertIsNotNone(expressoes['pendentes'].filter)
+        self.assertIsInstance(expressoes['pendentes'], Count)
+
+    def test_somar_contagens_trata_nulos(self):
+        from meuprojeto.empresa.services.agregacao import somar_contagens
+
+        self.assertEqual(somar_contagens({'total': 2, 'media': None}, {'total': 3}), {'total': 5, 'media': 0})
+
+
+class ConsultasPorPaginaTests(BaseDadosTestCase):
+    """
+    Número de consultas de cada página com painéis de contagens (agregação
+    condicional, services/agregacao), com caches frios. Uma subida denuncia
+    uma contagem (ou uma consulta por linha) de volta à página.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        from meuprojeto.empresa.models_stock import NotificacaoStock, RequisicaoStock
+        from meuprojeto.empresa.services.stock_ledger import lancar_movimentos_em_lote, obter_tipo_movimento
+
+        cls.usuario = criar_administrador()
+        origem, destino = criar_sucursal('Origem'), criar_sucursal('Destino')
+        itens = [criar_item(f'Item {n}') for n in range(3)]
+        entrada = obter_tipo_movimento('ENT_COMPRA', 'Entrada por Compra', True)
+        saida = obter_tipo_movimento('SAIDA', 'Saída de Stock', False)
+        lancar_movimentos_em_lote(
+            [
+                {'item': item, 'sucursal': sucursal, 'tipo_movimento': entrada, 'quantidade': 10,
+                 'preco_unitario': Decimal('2')}
+                for item in itens for sucursal in (origem, destino)
+            ]
+            + [{'item': itens[0], 'sucursal': origem, 'tipo_movimento': saida, 'quantidade': 8,
+                'preco_unitario': None}],
+            usuario=cls.usuario,
+        )
+        for n in range(3):
+            NotificacaoStock.objects.create(
+                tipo='STOCK_BAIXO', titulo=f'Aviso {n}', mensagem='Stock baixo', usuario_destinatario=cls.usuario,
+            )
+            RequisicaoStock.objects.create(sucursal_origem=origem, sucursal_destino=destino, criado_por=cls.usuario)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.usuario)
+
+    def _pagina(self, nome, consultas):
+        with self.assertNumQueries(consultas):
+            resposta = self.client.get(reverse(nome))
+        self.assertEqual(resposta.status_code, 200)
+
+    def test_operacoes_logisticas(self):
+        self._pagina('stock:logistica:operacoes_list', 5)
+
+    def test_avaliacoes(self):
+        self._pagina('rh:avaliacoes', 7)
+
+    def test_requisicoes(self):
+        self._pagina('stock:requisicoes:list', 6)
+
+    def test_dashboard_de_stock(self):
+        self._pagina('stock:dashboard_old', 13)
+
+    def test_notificacoes(self):
+        self._pagina('stock:notificacoes_list', 6)
+
+    def test_graficos_de_entidade(self):
+        from meuprojeto.empresa.models_stock import Item
+        from meuprojeto.empresa.views_stock import get_chart_data_for_entity
+
+        with self.assertNumQueries(3):
+            dados = get_chart_data_for_entity(Item)
+        self.assertEqual((dados['ativos'], dados['categorias_count']), (3, 1))
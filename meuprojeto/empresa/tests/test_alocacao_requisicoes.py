@@ -0,0 +1,64 @@
+import unittest
+from decimal import Decimal
+
+
+class AlocarTests(unittest.TestCase):
+    def test_menor_numero_de_sucursais(self):
+        from meuprojeto.empresa.services.alocacao_requisicoes import alocar
+
+        disponibilidade = {
+            1: {10: Decimal('5'), 20: Decimal('5')},
+            2: {20: Decimal('3'), 30: Decimal('9')},
+            3: {20: Decimal('4')},
+        }
+
+        plano = alocar({1: 5, 2: 3, 3: 4}, disponibilidade)
+
+        self.assertEqual(plano, {20: {1: 5, 2: 3, 3: 4}})
+
+    def test_preferidas_primeiro(self):
+        from meuprojeto.empresa.services.alocacao_requisicoes import alocar
+
+        disponibilidade = {1: {10: Decimal('5'), 20: Decimal('5')}, 2: {20: Decimal('3')}}
+
+        plano = alocar({1: 5, 2: 3}, disponibilidade, preferidas=[10])
+
+        self.assertEqual(plano, {20: {1: 5, 2: 3}})
+
+    def test_preferidas_desempatam_planos_minimos(self):
+        from meuprojeto.empresa.services.alocacao_requisicoes import alocar
+
+        disponibilidade = {1: {10: Decimal('5'), 20: Decimal('5')}, 2: {10: Decimal('3'), 20: Decimal('3')}}
+
+        self.assertEqual(alocar({1: 5, 2: 3}, disponibilidade, preferidas=[20]), {20: {1: 5, 2: 3}})
+        self.assertEqual(alocar({1: 5, 2: 3}, disponibilidade, preferidas=[10]), {10: {1: 5, 2: 3}})
+
+    def test_cobertura_minima_onde_o_guloso_falha(self):
+        from meuprojeto.empresa.services.alocacao_requisicoes import alocar
+
+        # O guloso escolheria 30 (3 linhas) e precisaria de mais duas; 10 e 20 chegam
+        d = Decimal('1')
+        disponibilidade = {
+            1: {10: d, 30: d}, 2: {10: d, 30: d}, 3: {10: d}, 4: {20: d, 30: d}, 5: {20: d}, 6: {20: d, 30: d},
+        }
+
+        plano = alocar({item_id: 1 for item_id in disponibilidade}, disponibilidade)
+
+        self.assertEqual(set(plano), {10, 20})
+
+    def test_divide_linha_sem_sucursal_suficiente(self):
+        from meuprojeto.empresa.services.alocacao_requisicoes import alocar
+
+        disponibilidade = {1: {10: Decimal('4'), 20: Decimal('2.5'), 30: Decimal('1')}, 2: {20: Decimal('1')}}
+
+        plano = alocar({1: 6, 2: 1}, disponibilidade)
+
+        self.assertEqual(plano, {20: {2: 1, 1: 2}, 10: {1: 4}})
+
+    def test_falta_stock(self):
+        from meuprojeto.empresa.services.alocacao_requisicoes import AlocacaoIncompletaError, alocar
+
+        with self.assertRaises(AlocacaoIncompletaError) as contexto:
+            alocar({1: 5, 2: 1}, {1: {10: Decimal('4.9')}, 2: {10: Decimal('1')}})
+
+        self.assertEqual(contexto.exception.faltas, {1: 1})
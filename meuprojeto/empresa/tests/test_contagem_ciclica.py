@@ -0,0 +1,26 @@
+import unittest
+from datetime import date
+from decimal import Decimal
+
+
+class ContagemCiclicaTests(unittest.TestCase):
+    def test_classes_abc_pelo_valor_acumulado(self):
+        from meuprojeto.empresa.services.contagem_ciclica import classes_abc
+
+        valores = {1: Decimal('700'), 2: Decimal('150'), 3: Decimal('100'), 4: Decimal('50'), 5: Decimal('0')}
+        self.assertEqual(classes_abc(valores), {1: 'A', 2: 'A', 3: 'B', 4: 'C', 5: 'C'})
+        self.assertEqual(classes_abc({1: Decimal('0')}), {1: 'C'})
+
+    def test_classe_xyz_e_intervalo(self):
+        from meuprojeto.empresa.services.contagem_ciclica import INTERVALO_DIAS, classe_xyz, intervalo_de_contagem
+
+        self.assertEqual(classe_xyz([10] * 12), ('X', Decimal('0.000')))
+        self.assertEqual(classe_xyz([0] * 11 + [12])[0], 'Z')
+        self.assertEqual(classe_xyz([0] * 12), ('Z', None))
+        self.assertEqual(intervalo_de_contagem('A', 'Z'), INTERVALO_DIAS['A'] // 2)
+        self.assertEqual(intervalo_de_contagem('C', 'Z'), INTERVALO_DIAS['C'])
+
+    def test_meses_completos_antes_do_mes_actual(self):
+        from meuprojeto.empresa.services.contagem_ciclica import _meses
+
+        self.assertEqual(_meses(date(2026, 3, 17), 3), [date(2025, 12, 1), date(2026, 1, 1), date(2026, 2, 1)])
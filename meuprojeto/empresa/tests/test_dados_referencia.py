@@ -0,0 +1,68 @@
+import unittest
+from unittest import mock
+
+from django.test import override_settings
+
+
+class DadosReferenciaTests(unittest.TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from meuprojeto.empresa.services import dados_referencia
+
+        configuracao = override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-referencia'}},
+            REFERENCIA_VERIFICACAO=5,
+        )
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        cache.clear()
+        dados_referencia.limpar()
+
+        self.cargas = 0
+
+        def carregar():
+            self.cargas += 1
+            return {'por_codigo': {'X': self.cargas}}
+
+        dados_referencia.conjunto('teste', 'empresa.Feriado')(carregar)
+        self.addCleanup(dados_referencia._CONJUNTOS.pop, 'teste')
+        self.relogio = mock.patch('meuprojeto.empresa.services.dados_referencia.time.monotonic', return_value=100.0)
+        self.monotonic = self.relogio.start()
+        self.addCleanup(self.relogio.stop)
+
+    def test_carrega_uma_vez_por_processo(self):
+        from meuprojeto.empresa.services.dados_referencia import dados
+
+        dados('teste')
+        self.monotonic.return_value = 200.0
+        dados('teste')
+
+        self.assertEqual(self.cargas, 1)
+
+    def test_carimbo_de_outro_processo_recarrega_depois_da_verificacao(self):
+        from django.core.cache import cache
+        from meuprojeto.empresa.services.dados_referencia import _chave_carimbo, dados
+
+        dados('teste')
+        cache.incr(_chave_carimbo('teste'))  # gravação noutro processo
+
+        self.monotonic.return_value = 102.0
+        self.assertEqual(dados('teste')['por_codigo']['X'], 1)
+        self.monotonic.return_value = 106.0
+        self.assertEqual(dados('teste')['por_codigo']['X'], 2)
+
+    def test_invalidar_descarta_a_copia_local(self):
+        from meuprojeto.empresa.services.dados_referencia import dados, invalidar
+
+        dados('teste')
+        with mock.patch('meuprojeto.empresa.services.dados_referencia.transaction.on_commit', lambda f: f()):
+            invalidar('teste')
+
+        self.assertEqual(dados('teste')['por_codigo']['X'], 2)
+
+    def test_modelo_invalida_os_seus_conjuntos(self):
+        from types import SimpleNamespace
+        from meuprojeto.empresa.services.dados_referencia import conjuntos_do_modelo
+
+        sucursal = SimpleNamespace(_meta=SimpleNamespace(label='empresa.Sucursal'))
+        self.assertEqual(sorted(conjuntos_do_modelo(sucursal)), ['departamentos', 'sucursais'])
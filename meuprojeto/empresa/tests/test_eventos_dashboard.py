@@ -0,0 +1,28 @@
+import asyncio
+import threading
+import unittest
+
+
+class EventosDashboardTests(unittest.TestCase):
+    def test_publicar_de_outra_thread_acorda_a_ligacao(self):
+        from meuprojeto.empresa.services.eventos_dashboard import cancelar, publicar, subscrever
+
+        async def ligar():
+            fila = subscrever()
+            try:
+                threading.Thread(target=publicar, args=(['stock', 'movimentos'],)).start()
+                return await asyncio.wait_for(fila.get(), timeout=2)
+            finally:
+                cancelar(fila)
+
+        self.assertEqual(asyncio.run(ligar()), ('stock', 'movimentos'))
+
+    def test_fila_cheia_descarta_o_evento_mais_antigo(self):
+        from meuprojeto.empresa.services.eventos_dashboard import LIMITE_FILA, _entregar
+
+        fila = asyncio.Queue(maxsize=LIMITE_FILA)
+        for n in range(LIMITE_FILA + 1):
+            _entregar(fila, (n,))
+
+        self.assertEqual(fila.qsize(), LIMITE_FILA)
+        self.assertEqual(fila.get_nowait(), (1,))
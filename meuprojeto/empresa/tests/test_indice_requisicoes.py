@@ -0,0 +1,51 @@
+import unittest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest import mock
+
+
+class CursorTests(unittest.TestCase):
+    def test_cursor_ida_e_volta(self):
+        from meuprojeto.empresa.services.indice_requisicoes import codificar_cursor, descodificar_cursor
+
+        data = datetime(2026, 10, 17, 9, 30, 15, 123456, tzinfo=timezone.utc)
+        cursor = codificar_cursor(SimpleNamespace(data_criacao=data, pk=42))
+
+        self.assertEqual(descodificar_cursor(cursor), (data, 42))
+
+    def test_cursor_invalido(self):
+        from meuprojeto.empresa.services.indice_requisicoes import descodificar_cursor
+
+        for cursor in ('', 'abc', '1.2.3', '9' * 30 + '.1', None):
+            self.assertIsNone(descodificar_cursor(cursor))
+
+
+class MarcarTests(unittest.TestCase):
+    def setUp(self):
+        from meuprojeto.empresa.services import indice_requisicoes
+
+        indice_requisicoes._pendentes.marcadas = {}
+        self.callbacks = []
+        patcher = mock.patch.object(indice_requisicoes.transaction, 'on_commit', side_effect=self.callbacks.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(indice_requisicoes, 'indexar')
+        self.indexar = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reindexa_cada_requisicao_uma_vez_no_commit(self):
+        from meuprojeto.empresa.services.indice_requisicoes import marcar
+
+        marcar('INTERNA', 1)
+        marcar('INTERNA', 1)
+        marcar('INTERNA', 2)
+        marcar('EXTERNA', 1)
+        self.indexar.assert_not_called()
+
+        for callback in self.callbacks:
+            callback()
+
+        self.assertEqual(
+            sorted((c.args[0], sorted(c.args[1])) for c in self.indexar.call_args_list),
+            [('EXTERNA', [1]), ('INTERNA', [1, 2])],
+        )
@@ -0,0 +1,72 @@
+import unittest
+from decimal import Decimal
+from types import SimpleNamespace
+
+from meuprojeto.empresa.tests.base_dados import BaseDadosTestCase, criar_administrador, criar_item, criar_sucursal
+
+
+class InventariosTests(unittest.TestCase):
+    def test_validar_quantidade(self):
+        from meuprojeto.empresa.services.inventarios import validar_quantidade
+
+        self.assertEqual(validar_quantidade(' 7 '), 7)
+        self.assertEqual(validar_quantidade(0), 0)
+        for valor in ('-1', 'abc', '1.5', ''):
+            with self.assertRaises(ValueError):
+                validar_quantidade(valor)
+
+    def test_recontagem_ate_ao_limite_de_contagens(self):
+        from meuprojeto.empresa.services.inventarios import MAX_CONTAGENS, aplicar_contagem
+
+        linha = SimpleNamespace(quantidade_sistema=10, numero_contagem=0)
+        aplicar_contagem(linha, 8)
+        self.assertEqual((linha.numero_contagem, linha.diferenca), (1, -2))
+        self.assertTrue(linha.precisa_recontagem)
+        self.assertFalse(linha.contagem_finalizada)
+
+        aplicar_contagem(linha, 10)
+        self.assertFalse(linha.precisa_recontagem)
+
+        for _ in range(MAX_CONTAGENS - 2):
+            aplicar_contagem(linha, 9)
+        self.assertTrue(linha.contagem_finalizada)
+        self.assertFalse(linha.precisa_recontagem)
+        self.assertEqual(linha.diferenca, -1)
+
+    def test_diferenca_para_o_esperado_com_os_movimentos_desde_o_snapshot(self):
+        from meuprojeto.empresa.services.inventarios import aplicar_contagem
+
+        linha = SimpleNamespace(quantidade_sistema=10, numero_contagem=0)
+        aplicar_contagem(linha, 7, variacao=-3)
+        self.assertEqual((linha.variacao_stock, linha.diferenca), (-3, 0))
+        self.assertFalse(linha.precisa_recontagem)
+
+        aplicar_contagem(linha, 0, variacao=-12)
+        self.assertEqual(linha.diferenca, 0)
+
+
+class ConcluirComReservasTests(BaseDadosTestCase):
+    def test_ajuste_negativo_leva_stock_reservado(self):
+        from django.utils import timezone
+        from meuprojeto.empresa.models_stock import StockItem
+        from meuprojeto.empresa.services.inventarios import concluir, criar_inventario, registar_contagens
+        from meuprojeto.empresa.services.reservas_stock import reservar
+        from meuprojeto.empresa.services.stock_ledger import lancar_movimento, obter_tipo_movimento
+
+        usuario, sucursal, item = criar_administrador(), criar_sucursal(), criar_item()
+        entrada = obter_tipo_movimento('ENT_COMPRA', 'Entrada por Compra', True)
+        lancar_movimento(item, sucursal, entrada, 10, Decimal('2'))
+        reservar([(item.id, sucursal.id, 8)])
+
+        inventario = criar_inventario(
+            nome='Contagem', sucursal=sucursal, data_inicio=timezone.now(), observacoes='',
+            usuario_responsavel=usuario, usuario_criador=usuario,
+        )
+        linha = inventario.itens_inventario.get()
+        registar_contagens(inventario, {linha.id: 5}, usuario)
+        ajustes = concluir(inventario, usuario, gerar_ajustes=True, aplicar=True)
+
+        stock = StockItem.objects.get(item=item, sucursal=sucursal)
+        self.assertEqual([ajuste.diferenca for ajuste in ajustes], [-5])
+        self.assertEqual((stock.quantidade_atual, stock.quantidade_reservada), (5, 8))
+        self.assertEqual(inventario.status, 'CONCLUIDO')
@@ -0,0 +1,24 @@
+import unittest
+from array import array
+from decimal import Decimal
+
+
+class MatrizStockTests(unittest.TestCase):
+    def test_blocos_consecutivos_juntos_num_intervalo(self):
+        from meuprojeto.empresa.services.matriz_stock import ITENS_POR_BLOCO as n, intervalos
+
+        self.assertEqual(intervalos([3, 0, 1, 1]), [(0, 2 * n - 1), (3 * n, 4 * n - 1)])
+        self.assertEqual(intervalos([]), [])
+
+    def test_linhas_do_bloco_pelas_sucursais_pedidas(self):
+        from meuprojeto.empresa.services.matriz_stock import linhas_do_bloco
+
+        itens = [(10, 'A', 'Item A', 'PRODUTO'), (11, 'B', 'Item B', 'MATERIAL')]
+        valores = array('q', [5000, 4000, 5000, 1000, 1000, 1000, 0, 0, 0, 7500, 2000, 7001])
+        bloco = ((1, 2), itens, valores)
+
+        self.assertEqual(list(linhas_do_bloco(bloco, [2, 9, 1], depois=10)), [
+            (itens[1], [Decimal('7.5'), 0, 0], [Decimal('2'), 0, 0], [Decimal('70.01'), 0, 0]),
+        ])
+        self.assertEqual(list(linhas_do_bloco(bloco, [1]))[0], (itens[0], [5], [4], [50]))
+        self.assertEqual(str(list(linhas_do_bloco(bloco, [2]))[1][3][0]), '70.01')
@@ -0,0 +1,69 @@
+import unittest
+from unittest import mock
+
+from django.test import override_settings
+
+
+class MetricasCacheTests(unittest.TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from meuprojeto.empresa.services.metricas_cache import reiniciar_estatisticas
+
+        configuracao = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-metricas',
+        }})
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        cache.clear()
+        reiniciar_estatisticas()
+        self.calculos = 0
+
+    def _calcular(self):
+        self.calculos += 1
+        return {'total': self.calculos}
+
+    def test_segundo_pedido_vem_do_cache(self):
+        from meuprojeto.empresa.services.metricas_cache import estatisticas, obter
+
+        self.assertEqual(obter('teste', self._calcular, ['stock']), {'total': 1})
+        self.assertEqual(obter('teste', self._calcular, ['stock']), {'total': 1})
+
+        self.assertEqual(self.calculos, 1)
+        self.assertEqual(estatisticas()['teste'], {'acertos': 1, 'falhas': 1, 'taxa_acerto': 0.5})
+
+    def test_invalidar_so_recalcula_metricas_do_dominio(self):
+        from meuprojeto.empresa.services.metricas_cache import invalidar, obter
+
+        obter('stock', self._calcular, ['stock', 'catalogo'])
+        obter('logistica', self._calcular, ['logistica'])
+        # fora de transacção on_commit executa de imediato
+        with mock.patch('meuprojeto.empresa.services.metricas_cache.transaction.on_commit', lambda f: f()):
+            invalidar('catalogo')
+
+        self.assertEqual(obter('stock', self._calcular, ['stock', 'catalogo']), {'total': 3})
+        self.assertEqual(obter('logistica', self._calcular, ['logistica']), {'total': 2})
+
+    def test_variante_separa_valores(self):
+        from meuprojeto.empresa.services.metricas_cache import obter
+
+        obter('notificacoes', self._calcular, ['notificacoes'], variante=1)
+        self.assertEqual(obter('notificacoes', self._calcular, ['notificacoes'], variante=2), {'total': 2})
+
+    def test_dominio_desconhecido(self):
+        from meuprojeto.empresa.services.metricas_cache import invalidar
+
+        with self.assertRaises(ValueError):
+            invalidar('inexistente')
+
+    def test_validadores_mudam_so_com_o_dominio(self):
+        from meuprojeto.empresa.services.metricas_cache import _incrementar, alterado_em, versoes
+
+        antes = versoes(['stock', 'catalogo'])
+        with mock.patch('meuprojeto.empresa.services.metricas_cache.time.time', return_value=2_000_000_000):
+            _incrementar(['logistica'])
+        self.assertEqual(versoes(['stock', 'catalogo']), antes)
+
+        with mock.patch('meuprojeto.empresa.services.metricas_cache.time.time', return_value=2_000_000_000):
+            _incrementar(['catalogo'])
+        self.assertNotEqual(versoes(['stock', 'catalogo']), antes)
+        self.assertEqual(alterado_em(['stock', 'catalogo']).timestamp(), 2_000_000_000)
@@ -0,0 +1,24 @@
+import unittest
+from types import SimpleNamespace
+
+
+class ValidarQuantidadesTests(unittest.TestCase):
+    def linhas(self):
+        return {1: SimpleNamespace(pk=1, quantidade_solicitada=5), 2: SimpleNamespace(pk=2, quantidade_solicitada=3)}
+
+    def test_devolve_as_quantidades_positivas_por_linha(self):
+        from meuprojeto.empresa.services.recebimentos import validar_quantidades
+
+        linhas = self.linhas()
+        recebidas = validar_quantidades(linhas, {'2': '3', '1': 5.0})
+
+        self.assertEqual(recebidas, [(linhas[1], 5), (linhas[2], 3)])
+        self.assertEqual(validar_quantidades(linhas, {'1': '', 2: 0}), [])
+
+    def test_erros_de_todas_as_linhas_de_uma_vez(self):
+        from meuprojeto.empresa.services.recebimentos import RecebimentoInvalidoError, validar_quantidades
+
+        with self.assertRaises(RecebimentoInvalidoError) as contexto:
+            validar_quantidades(self.linhas(), {'1': 6, '2': '1.5', '3': 1, 'x': 1, 4: -1})
+
+        self.assertEqual(set(contexto.exception.erros), {1, 2, 3, 'x', 4})
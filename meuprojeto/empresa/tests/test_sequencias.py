@@ -0,0 +1,37 @@
+import unittest
+from unittest import mock
+
+
+class SequenciasTests(unittest.TestCase):
+    def test_proximos_codigos_formata_numeros_reservados(self):
+        from meuprojeto.empresa.services import sequencias
+
+        with mock.patch.object(sequencias, 'reservar_numeros', return_value=[9, 10, 11]) as reservar:
+            codigos = sequencias.proximos_codigos('REQ', 3)
+
+        self.assertEqual(codigos, ['REQ0009', 'REQ0010', 'REQ0011'])
+        self.assertEqual(reservar.call_args.args, ('REQ', 3))
+
+    def test_codigos_mov_vem_da_sequence_sem_contador(self):
+        from meuprojeto.empresa.services import sequencias
+
+        with mock.patch.object(sequencias, '_sequencia_sql', return_value='empresa_codigo_mov_seq'), \
+                mock.patch.object(sequencias, 'numeros_da_sequencia', return_value=[7, 12]) as nextval, \
+                mock.patch.object(sequencias, 'reservar_numeros') as reservar:
+            codigos = sequencias.proximos_codigos('MOV', 2)
+
+        self.assertEqual(codigos, ['MOV0007', 'MOV0012'])
+        self.assertEqual(nextval.call_args.args, ('empresa_codigo_mov_seq', 2))
+        reservar.assert_not_called()
+
+    def test_semente_usa_maior_numero_entre_tabelas(self):
+        from meuprojeto.empresa.services import sequencias
+
+        maiores = {'ordens': 12, 'requisicoes': 40}
+        with mock.patch.object(sequencias, 'maior_numero_existente', side_effect=lambda qs, campo, prefixo: maiores[qs]), \
+                mock.patch.object(sequencias, 'reservar_numeros', side_effect=lambda chave, n, semente: [semente() + 1]):
+            codigo = sequencias.proximo_codigo(
+                'COMP', existentes=[('ordens', 'codigo'), ('requisicoes', 'codigo')]
+            )
+
+        self.assertEqual(codigo, 'COMP0041')
@@ -0,0 +1,108 @@
+import unittest
+from decimal import Decimal
+from types import SimpleNamespace
+
+from meuprojeto.empresa.tests.base_dados import BaseDadosTestCase, criar_item, criar_sucursal
+
+
+def _movimento(item_id, sucursal_id, quantidade, aumenta_estoque):
+    return SimpleNamespace(
+        item_id=item_id,
+        sucursal_id=sucursal_id,
+        quantidade=quantidade,
+        tipo_movimento=SimpleNamespace(aumenta_estoque=aumenta_estoque),
+    )
+
+
+class StockLedgerTests(unittest.TestCase):
+    def test_delta_do_movimento_respeita_sentido_do_tipo(self):
+        from meuprojeto.empresa.services.stock_ledger import delta_do_movimento
+
+        self.assertEqual(delta_do_movimento(_movimento(1, 1, 5, True)), 5)
+        self.assertEqual(delta_do_movimento(_movimento(1, 1, 5, False)), -5)
+
+    def test_agrupar_deltas_soma_por_item_e_sucursal(self):
+        from meuprojeto.empresa.services.stock_ledger import agrupar_deltas
+
+        deltas = agrupar_deltas([
+            _movimento(1, 1, 10, True),
+            _movimento(1, 1, 3, False),
+            _movimento(1, 2, 4, True),
+            _movimento(2, 1, 7, False),
+        ])
+
+        self.assertEqual(deltas, {(1, 1): 7, (1, 2): 4, (2, 1): -7})
+
+    def test_entradas_ao_custo_medio_nao_sao_valorizadas(self):
+        from decimal import Decimal
+        from meuprojeto.empresa.services.stock_ledger import agrupar_lancamentos
+
+        compra = _movimento(1, 1, 10, True)
+        compra.preco_unitario = Decimal('4')
+        ajuste = _movimento(1, 1, 5, True)
+        ajuste.preco_unitario, ajuste._ao_custo_medio = Decimal('5.5'), True
+
+        self.assertEqual(agrupar_lancamentos([compra, ajuste]), {(1, 1): [10, Decimal('40'), 5, 0]})
+
+    def test_custo_medio_por_replay_pondera_entradas_e_ignora_saidas(self):
+        from decimal import Decimal
+        from meuprojeto.empresa.services.valorizacao_stock import custo_medio_por_replay
+
+        custo = custo_medio_por_replay(0, Decimal('5'), [
+            (True, 10, Decimal('10')),
+            (True, 10, Decimal('20')),
+            (False, 5, Decimal('10')),
+            (True, 5, Decimal('30')),
+            (True, 3, Decimal('0')),
+        ])
+
+        self.assertEqual(custo, Decimal('18.75'))
+
+    def test_agrupar_por_dia_soma_por_dia_sucursal_tipo_e_sentido(self):
+        from datetime import date, datetime, timezone
+        from decimal import Decimal
+        from meuprojeto.empresa.services.movimentos_diarios import agrupar_por_dia
+
+        def movimento(item_id, sucursal_id, quantidade, aumenta_estoque, dia, valor):
+            m = _movimento(item_id, sucursal_id, quantidade, aumenta_estoque)
+            m.data_movimento = datetime(2025, 3, dia, 10, tzinfo=timezone.utc)
+            m.valor_total = Decimal(valor)
+            return m
+
+        totais = agrupar_por_dia([
+            movimento(1, 1, 2, True, 1, '10'),
+            movimento(2, 1, 3, True, 1, '5'),
+            movimento(1, 1, 1, False, 1, '4'),
+            movimento(3, 1, 4, True, 1, '8'),
+            movimento(1, 1, 5, True, 2, '20'),
+        ], {1: 'PRODUTO', 2: 'PRODUTO', 3: 'MATERIAL'})
+
+        self.assertEqual(totais, {
+            (date(2025, 3, 1), 1, 'PRODUTO', True): [2, Decimal('5'), Decimal('15')],
+            (date(2025, 3, 1), 1, 'PRODUTO', False): [1, Decimal('1'), Decimal('4')],
+            (date(2025, 3, 1), 1, 'MATERIAL', True): [1, Decimal('4'), Decimal('8')],
+            (date(2025, 3, 2), 1, 'PRODUTO', True): [1, Decimal('5'), Decimal('20')],
+        })
+
+
+class LoteMistoTests(BaseDadosTestCase):
+    def test_saidas_sem_preco_ao_custo_medio_das_entradas_do_lote(self):
+        from meuprojeto.empresa.models_stock import MovimentoDiario, StockItem
+        from meuprojeto.empresa.services.stock_ledger import lancar_movimentos_em_lote, obter_tipo_movimento
+
+        sucursal, item = criar_sucursal(), criar_item(preco_custo=Decimal('10.00'))
+        entrada = obter_tipo_movimento('ENT_COMPRA', 'Entrada por Compra', True)
+        saida = obter_tipo_movimento('SAIDA', 'Saída de Stock', False)
+        linha = {'item': item, 'sucursal': sucursal}
+
+        movimentos = lancar_movimentos_em_lote(
+            [dict(linha, tipo_movimento=entrada, quantidade=3, preco_unitario=Decimal('2')) for _ in range(50)]
+            + [dict(linha, tipo_movimento=saida, quantidade=1, preco_unitario=None) for _ in range(50)]
+        )
+
+        stock = StockItem.objects.get(item=item, sucursal=sucursal)
+        self.assertEqual((stock.quantidade_atual, stock.custo_medio, stock.valor_estoque), (100, 2, 200))
+        self.assertEqual({movimento.preco_unitario for movimento in movimentos[50:]}, {Decimal('2')})
+        self.assertEqual(
+            MovimentoDiario.objects.get(sucursal=sucursal, aumenta_estoque=False).valor, Decimal('50') * 2
+        )
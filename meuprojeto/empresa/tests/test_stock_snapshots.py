@@ -0,0 +1,39 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from meuprojeto.empresa.tests.base_dados import BaseDadosTestCase, criar_item, criar_sucursal
+
+
+class MaterializarSnapshotsTests(BaseDadosTestCase):
+    def test_cada_dia_ao_seu_custo_medio(self):
+        from django.utils import timezone
+        from meuprojeto.empresa.models_stock import StockSnapshot
+        from meuprojeto.empresa.services.stock_ledger import lancar_movimentos_em_lote, obter_tipo_movimento
+        from meuprojeto.empresa.services.stock_snapshots import materializar_snapshots
+
+        sucursal, item = criar_sucursal(), criar_item()
+        entrada = obter_tipo_movimento('ENT_COMPRA', 'Entrada por Compra', True)
+        saida = obter_tipo_movimento('SAIDA', 'Saída de Stock', False)
+        hoje = timezone.localdate()
+
+        def lancar(dias_antes, tipo, quantidade, preco=None):
+            linha = {'item': item, 'sucursal': sucursal, 'tipo_movimento': tipo, 'quantidade': quantidade,
+                     'preco_unitario': preco}
+            if dias_antes:
+                linha['data_movimento'] = timezone.make_aware(
+                    datetime.combine(hoje - timedelta(days=dias_antes), time(12))
+                )
+            lancar_movimentos_em_lote([linha])
+
+        lancar(3, entrada, 10, Decimal('2'))  # 10 a 2
+        lancar(2, saida, 4)                   # 6 a 2
+        lancar(1, entrada, 6, Decimal('4'))   # 12 a 3
+        lancar(0, entrada, 12, Decimal('5'))  # 24 a 4 (hoje, fora dos snapshots)
+        lancar(0, saida, 4)
+
+        materializar_snapshots(hoje - timedelta(days=3))
+
+        self.assertEqual(
+            list(StockSnapshot.objects.filter(item=item).order_by('data').values_list('quantidade', 'valor')),
+            [(10, 20), (6, 12), (12, 36)],
+        )
@@ -62,6 +62,7 @@ urlpatterns = [
     path('ordem-compra/<int:id>/print/', views_requisicoes.ordem_compra_print, name='ordem_compra_print'),
     path('ordem-compra/<int:id>/receive/', views_requisicoes.ordem_compra_receive, name='ordem_compra_receive'),
     path('ordem-compra/<int:id>/confirm-items/', views_requisicoes.ordem_compra_confirm_items, name='ordem_compra_confirm_items'),
+    path('ordem-compra/<int:id>/receber-lote/', views_requisicoes.ordem_compra_receber_lote, name='ordem_compra_receber_lote'),
     path('ordem-compra/<int:id>/receipt-note/', views_requisicoes.ordem_compra_receipt_note, name='ordem_compra_receipt_note'),
     
     # URLs de envio de email
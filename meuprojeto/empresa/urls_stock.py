@@ -76,6 +76,9 @@ urlpatterns = [
     path('dashboard/chart-estoque-sucursal/', views_dashboard.dashboard_chart_estoque_sucursal, name='dashboard_chart_estoque_sucursal'),
     path('dashboard/chart-categorias/', views_dashboard.dashboard_chart_categorias, name='dashboard_chart_categorias'),
     path('dashboard/chart-tendencias/', views_dashboard.dashboard_chart_tendencias, name='dashboard_chart_tendencias'),
+    path('dashboard/matriz-sucursais/', views_dashboard.dashboard_matriz_sucursais, name='dashboard_matriz_sucursais'),
+    path('dashboard/metricas-cache/', views_dashboard.dashboard_metricas_cache, name='dashboard_metricas_cache'),
+    path('dashboard/eventos/', views_dashboard.dashboard_eventos, name='dashboard_eventos'),
     
     # Notificações
     path('notificacoes/', views_notificacoes.notificacoes_list, name='notificacoes_list'),
@@ -21,6 +21,7 @@ urlpatterns = [
     
     # Receber transferência
     path('<int:id>/receber/', views_transferencias.transferencia_receber, name='receber'),
+    path('<int:id>/receber-lote/', views_transferencias.transferencia_receber_lote, name='receber_lote'),
     
     # Cancelar transferência
     path('<int:id>/cancelar/', views_transferencias.transferencia_cancelar, name='cancelar'),
@@ -30,6 +31,8 @@ urlpatterns = [
     
     # Verificar stock por sucursais
     path('verificar-stock/', views_transferencias.verificar_stock_sucursais, name='verificar_stock'),
+    path('matriz-stock/', views_transferencias.matriz_stock_api, name='matriz_stock'),
+    path('matriz-stock.csv', views_transferencias.matriz_stock_csv, name='matriz_stock_csv'),
     
     # Documentos impressíveis
     path('<int:id>/guia-transferencia/', views_transferencias.guia_transferencia, name='guia_transferencia'),
@@ -2,7 +2,7 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
 from django.db.models import Q, Count, Case, When, IntegerField, Sum, Avg
-from django.http import JsonResponse, HttpResponse
+from django.http import Http404, JsonResponse, HttpResponse
 from django.core.exceptions import ValidationError
 from django.contrib import messages
 from django.utils import timezone
@@ -24,6 +24,8 @@ import tempfile
 import os
 from .models_rh import Funcionario, Departamento, Cargo, Presenca, TipoPresenca, Feriado, HorasExtras, Salario, BeneficioSalarial, DescontoSalarial, Treinamento, AvaliacaoDesempenho, CriterioAvaliacao, CriterioAvaliado, FolhaSalarial, FuncionarioFolha, Promocao, DepartamentoSucursal, TransferenciaFuncionario, InscricaoTreinamento
 from .models_base import Sucursal
+from .services import dados_referencia
+from .services.agregacao import estatisticas_avaliacoes
 
 # =============================================================================
 # UTILITÁRIOS PARA PDF
@@ -707,7 +709,7 @@ def rh_calendario_presencas(request, template_name='rh/presencas/calendario.html
     from django.core.serializers import serialize
     
     # Serializar os tipos de presença para JSON
-    tipos_presenca = TipoPresenca.objects.all()
+    tipos_presenca = dados_referencia.tipos_presenca(ativos=False)
     tipos_presenca_json = json.dumps([{
         'id': tp.id,
         'nome': tp.nome,
@@ -943,7 +945,7 @@ def rh_marcar_dias_uteis(request):
             ano = int(request.POST.get('ano'))
             
             funcionario = get_object_or_404(Funcionario, id=funcionario_id)
-            tipo_presente = get_object_or_404(TipoPresenca, codigo='PR')
+            tipo_presente = _tipo_presenca_ou_404('PR')
             
             # Calcular dias úteis do mês
             dias_uteis = calcular_dias_uteis(ano, mes)
@@ -997,7 +999,7 @@ def rh_marcar_finais_semana(request):
             tipo_codigo = request.POST.get('tipo_codigo', 'AU')
             
             funcionario = get_object_or_404(Funcionario, id=funcionario_id)
-            tipo_presenca = get_object_or_404(TipoPresenca, codigo=tipo_codigo)
+            tipo_presenca = _tipo_presenca_ou_404(tipo_codigo)
             
             # Calcular finais de semana do mês
             finais_semana = calcular_finais_semana(ano, mes)
@@ -1298,7 +1300,7 @@ def rh_salarios(request):
     
     # Dados para filtros
     funcionarios = Funcionario.objects.filter(status='AT').order_by('nome_completo')
-    departamentos = Departamento.objects.filter(ativo=True).order_by('nome')
+    departamentos = dados_referencia.departamentos_ativos()
     status_choices = Salario.STATUS_CHOICES
     
     context = {
@@ -1314,6 +1316,13 @@ def rh_salarios(request):
 # FUNÇÕES AUXILIARES
 # =============================================================================
 
+def _tipo_presenca_ou_404(codigo):
+    """TipoPresenca pelo código (registo de referência)"""
+    tipo = dados_referencia.tipo_presenca(codigo)
+    if tipo is None:
+        raise Http404(f'Tipo de presença {codigo} não encontrado')
+    return tipo
+
 def calcular_dias_uteis(ano, mes):
     """Calcula os dias úteis de um mês (segunda a sexta, excluindo feriados)"""
     # Obter todos os dias do mês
@@ -1325,13 +1334,7 @@ def calcular_dias_uteis(ano, mes):
             dias_mes.append(data)
     
     # Remover feriados ativos
-    feriados = Feriado.objects.filter(
-        data__year=ano,
-        data__month=mes,
-        ativo=True
-    ).values_list('data', flat=True)
-    
-    dias_uteis = [dia for dia in dias_mes if dia not in feriados]
+    dias_uteis = [dia for dia in dias_mes if not dados_referencia.e_feriado(dia)]
     return dias_uteis
 
 def calcular_finais_semana(ano, mes):
@@ -1703,9 +1706,9 @@ def rh_funcionario_add(request):
             if not nome_completo or not sucursal_id or not departamento_id or not cargo_id:
                 messages.error(request, 'Preencha todos os campos obrigatórios.')
                 # Buscar dados para os dropdowns
-                sucursais = Sucursal.objects.filter(ativa=True).order_by('nome')
-                departamentos = Departamento.objects.filter(ativo=True).order_by('nome')
-                cargos = Cargo.objects.filter(ativo=True).order_by('nome')
+                sucursais = dados_referencia.sucursais_ativas()
+                departamentos = dados_referencia.departamentos_ativos()
+                cargos = dados_referencia.cargos_ativos()
                 
                 # Buscar benefícios e descontos disponíveis
                 from meuprojeto.empresa.models_rh import BeneficioSalarial, DescontoSalarial
@@ -1725,9 +1728,9 @@ def rh_funcionario_add(request):
             if Funcionario.objects.filter(nuit=nuit).exists():
                 messages.error(request, 'Este NUIT já está sendo usado por outro funcionário.')
                 # Buscar dados para os dropdowns
-                sucursais = Sucursal.objects.filter(ativa=True).order_by('nome')
-                departamentos = Departamento.objects.filter(ativo=True).order_by('nome')
-                cargos = Cargo.objects.filter(ativo=True).order_by('nome')
+                sucursais = dados_referencia.sucursais_ativas()
+                departamentos = dados_referencia.departamentos_ativos()
+                cargos = dados_referencia.cargos_ativos()
                 
                 # Buscar benefícios e descontos disponíveis
                 from meuprojeto.empresa.models_rh import BeneficioSalarial, DescontoSalarial
@@ -1790,9 +1793,9 @@ def rh_funcionario_add(request):
         except Exception as e:
             messages.error(request, f'Erro ao adicionar funcionário: {e}')
             # Buscar dados para os dropdowns
-            sucursais = Sucursal.objects.filter(ativa=True).order_by('nome')
-            departamentos = Departamento.objects.filter(ativo=True).order_by('nome')
-            cargos = Cargo.objects.filter(ativo=True).order_by('nome')
+            sucursais = dados_referencia.sucursais_ativas()
+            departamentos = dados_referencia.departamentos_ativos()
+            cargos = dados_referencia.cargos_ativos()
             
             # Buscar benefícios e descontos disponíveis
             from meuprojeto.empresa.models_rh import BeneficioSalarial, DescontoSalarial
@@ -1809,9 +1812,9 @@ def rh_funcionario_add(request):
             return render(request, 'rh/funcionarios/form.html', context)
     
     # Buscar dados para os dropdowns
-    sucursais = Sucursal.objects.filter(ativa=True).order_by('nome')
-    departamentos = Departamento.objects.filter(ativo=True).order_by('nome')
-    cargos = Cargo.objects.filter(ativo=True).order_by('nome')
+    sucursais = dados_referencia.sucursais_ativas()
+    departamentos = dados_referencia.departamentos_ativos()
+    cargos = dados_referencia.cargos_ativos()
     
     # Buscar benefícios e descontos disponíveis
     from meuprojeto.empresa.models_rh import BeneficioSalarial, DescontoSalarial
@@ -1853,9 +1856,9 @@ def rh_funcionario_edit(request, id):
                 # Renderizar o template com os dados atuais em vez de redirecionar
                 context = {
                     'funcionario': funcionario,
-                    'sucursais': Sucursal.objects.filter(ativa=True).order_by('nome'),
-                    'departamentos': Departamento.objects.filter(ativo=True).order_by('nome'),
-                    'cargos': Cargo.objects.filter(ativo=True).order_by('nome'),
+                    'sucursais': dados_referencia.sucursais_ativas(),
+                    'departamentos': dados_referencia.departamentos_ativos(),
+                    'cargos': dados_referencia.cargos_ativos(),
                     'beneficios_disponiveis': BeneficioSalarial.objects.filter(ativo=True).order_by('nome'),
                     'descontos_disponiveis': DescontoSalarial.objects.filter(ativo=True).order_by('nome'),
                 }
@@ -1867,9 +1870,9 @@ def rh_funcionario_edit(request, id):
                 # Renderizar o template com os dados atuais em vez de redirecionar
                 context = {
                     'funcionario': funcionario,
-                    'sucursais': Sucursal.objects.filter(ativa=True).order_by('nome'),
-                    'departamentos': Departamento.objects.filter(ativo=True).order_by('nome'),
-                    'cargos': Cargo.objects.filter(ativo=True).order_by('nome'),
+                    'sucursais': dados_referencia.sucursais_ativas(),
+                    'departamentos': dados_referencia.departamentos_ativos(),
+                    'cargos': dados_referencia.cargos_ativos(),
                     'beneficios_disponiveis': BeneficioSalarial.objects.filter(ativo=True).order_by('nome'),
                     'descontos_disponiveis': DescontoSalarial.objects.filter(ativo=True).order_by('nome'),
                 }
@@ -1942,9 +1945,9 @@ def rh_funcionario_edit(request, id):
             messages.error(request, f'Erro ao atualizar funcionário: {e}')
     
     # Buscar dados para os dropdowns
-    sucursais = Sucursal.objects.filter(ativa=True).order_by('nome')
-    departamentos = Departamento.objects.filter(ativo=True).order_by('nome')
-    cargos = Cargo.objects.filter(ativo=True).order_by('nome')
+    sucursais = dados_referencia.sucursais_ativas()
+    departamentos = dados_referencia.departamentos_ativos()
+    cargos = dados_referencia.cargos_ativos()
     
     # Buscar benefícios e descontos disponíveis
     from meuprojeto.empresa.models_rh import BeneficioSalarial, DescontoSalarial
@@ -2900,7 +2903,7 @@ def rh_marcar_feriados_automaticos(request):
                 ano = int(request.POST.get('ano'))
             
             funcionario = get_object_or_404(Funcionario, id=funcionario_id)
-            tipo_feriado = get_object_or_404(TipoPresenca, codigo='FD')  # FD = Feriado
+            tipo_feriado = _tipo_presenca_ou_404('FD')  # FD = Feriado
             
             # Obter todos os feriados ativos para o mês/ano especificado
             from django.db.models.functions import ExtractMonth, ExtractYear
@@ -3800,8 +3803,7 @@ def treinamento_inscrever(request, treinamento_id):
         funcionarios = funcionarios.order_by('nome_completo')
         
         # Obter departamentos para o dropdown
-        from meuprojeto.empresa.models import Departamento
-        departamentos = Departamento.objects.filter(ativo=True).order_by('nome')
+        departamentos = dados_referencia.departamentos_ativos()
         
         context = {
             'treinamento': treinamento,
@@ -3989,28 +3991,12 @@ def rh_avaliacoes(request):
     anos = sorted([ano for ano in todos_anos if ano is not None], reverse=True)
     
     # Obter departamentos e cargos para os dropdowns
-    from meuprojeto.empresa.models import Departamento, Cargo
-    departamentos = Departamento.objects.filter(ativo=True).order_by('nome')
-    cargos = Cargo.objects.filter(ativo=True).order_by('nome')
+    departamentos = dados_referencia.departamentos_ativos()
+    cargos = dados_referencia.cargos_ativos()
     
     # Calcular estatísticas (usando todas as avaliações, não apenas as filtradas)
-    todas_avaliacoes = AvaliacaoDesempenho.objects.all()
-    
-    stats = {
-        'total_avaliacoes': todas_avaliacoes.count(),
-        'planejadas': todas_avaliacoes.filter(status='PLANEJADA').count(),
-        'em_andamento': todas_avaliacoes.filter(status='EM_ANDAMENTO').count(),
-        'concluidas': todas_avaliacoes.filter(status='CONCLUIDA').count(),
-        'canceladas': todas_avaliacoes.filter(status='CANCELADA').count(),
-    }
-    
-    # Calcular nota média das avaliações concluídas
-    from django.db import models
-    avaliacoes_com_nota = todas_avaliacoes.filter(status='CONCLUIDA').exclude(nota_geral__isnull=True)
-    if avaliacoes_com_nota.exists():
-        stats['nota_media'] = avaliacoes_com_nota.aggregate(avg_nota=models.Avg('nota_geral'))['avg_nota']
-    else:
-        stats['nota_media'] = 0
+    # e nota média das concluídas, numa única consulta
+    stats = estatisticas_avaliacoes(AvaliacaoDesempenho.objects.all())
     
     # Calcular percentagens
     total = stats['total_avaliacoes']
@@ -4111,8 +4097,8 @@ def avaliacao_add_batch(request):
     
     # Buscar dados para o formulário
     funcionarios = Funcionario.objects.filter(status='AT').order_by('nome_completo')
-    departamentos = Departamento.objects.filter(ativo=True).order_by('nome')
-    cargos = Cargo.objects.filter(ativo=True).order_by('nome')
+    departamentos = dados_referencia.departamentos_ativos()
+    cargos = dados_referencia.cargos_ativos()
     
     context = {
         'funcionarios': funcionarios,
@@ -6107,7 +6093,7 @@ def relatorio_pdf(request):
             except Exception as e:
                 messages.error(request, f'Erro ao gerar relatório: {str(e)}')
     
-    sucursais = Sucursal.objects.filter(ativa=True).order_by('nome')
+    sucursais = dados_referencia.sucursais_ativas()
     context = {
         'sucursais': sucursais,
         'tipos_relatorio': [
@@ -6270,7 +6256,7 @@ def rh_folha_edit(request, folha_id):
                 except Exception as e:
                     messages.error(request, f'Erro ao salvar: {str(e)}')
         
-        sucursais = Sucursal.objects.filter(ativa=True).order_by('nome')
+        sucursais = dados_referencia.sucursais_ativas()
         context = {
             'folha': folha,
             'sucursais': sucursais,
@@ -7186,7 +7172,7 @@ def rh_promocao_add(request):
                 messages.error(request, f'Erro ao salvar: {str(e)}')
     
     funcionarios = Funcionario.objects.filter(status='AT').order_by('nome_completo')
-    cargos = Cargo.objects.filter(ativo=True).order_by('nome')
+    cargos = dados_referencia.cargos_ativos()
     tipo_choices = Promocao.TIPO_CHOICES
     
     context = {
@@ -7247,7 +7233,7 @@ def rh_promocao_edit(request, promocao_id):
                     messages.error(request, f'Erro ao salvar: {str(e)}')
         
         funcionarios = Funcionario.objects.filter(status='AT').order_by('nome_completo')
-        cargos = Cargo.objects.filter(ativo=True).order_by('nome')
+        cargos = dados_referencia.cargos_ativos()
         tipo_choices = Promocao.TIPO_CHOICES
         
         context = {
@@ -7512,7 +7498,7 @@ def rh_marcar_finais_semana_automaticos(request):
                 ano = int(request.POST.get('ano') or date.today().year)
             
             funcionario = get_object_or_404(Funcionario, id=funcionario_id)
-            tipo_folga = get_object_or_404(TipoPresenca, codigo='FG')
+            tipo_folga = _tipo_presenca_ou_404('FG')
             
             # Obter configuração de dias de trabalho da sucursal
             sucursal = funcionario.sucursal
@@ -7664,7 +7650,7 @@ def rh_horarios_expediente(request, sucursal_id=None):
             messages.error(request, f'Erro ao atualizar horários: {str(e)}')
     
     # Obter todas as sucursais para o seletor
-    sucursais = Sucursal.objects.filter(ativa=True).order_by('nome')
+    sucursais = dados_referencia.sucursais_ativas()
     
     # Determinar quais dias estão ativos baseado no dias_trabalho_semana
     dias_ativos = []
@@ -7724,7 +7710,7 @@ def rh_transferencias(request):
         'funcionario_id': funcionario_id,
         'sucursal_id': sucursal_id,
         'funcionarios': Funcionario.objects.filter(status='AT').order_by('nome_completo'),
-        'sucursais': Sucursal.objects.filter(ativa=True).order_by('nome'),
+        'sucursais': dados_referencia.sucursais_ativas(),
         'status_choices': TransferenciaFuncionario.STATUS_CHOICES,
     }
     return render(request, 'rh/transferencias/main.html', context)
@@ -7776,8 +7762,8 @@ def rh_transferencia_add(request):
     
     context = {
         'funcionarios': Funcionario.objects.filter(status='AT').select_related('sucursal', 'departamento', 'cargo').order_by('nome_completo'),
-        'sucursais': Sucursal.objects.filter(ativa=True).order_by('nome'),
-        'cargos': Cargo.objects.filter(ativo=True).order_by('nome'),
+        'sucursais': dados_referencia.sucursais_ativas(),
+        'cargos': dados_referencia.cargos_ativos(),
     }
     return render(request, 'rh/transferencias/form.html', context)
 
@@ -7818,8 +7804,8 @@ def rh_transferencia_edit(request, transferencia_id):
     
     context = {
         'transferencia': transferencia,
-        'sucursais': Sucursal.objects.filter(ativa=True).order_by('nome'),
-        'cargos': Cargo.objects.filter(ativo=True).order_by('nome'),
+        'sucursais': dados_referencia.sucursais_ativas(),
+        'cargos': dados_referencia.cargos_ativos(),
     }
     return render(request, 'rh/transferencias/form.html', context)
 
@@ -10,6 +10,7 @@ import logging
 
 from .models_stock import NotificacaoStock
 from .decorators import require_stock_access
+from .services.metricas_cache import invalidar
 from .signals_alertas import criar_alertas_sistema, limpar_notificacoes_antigas
 
 logger = logging.getLogger(__name__)
@@ -107,6 +108,7 @@ def alertas_marcar_todos_lidos(request):
                 lida=True,
                 data_leitura=timezone.now()
             )
+            invalidar('notificacoes')
             
             messages.success(request, f"{alertas_atualizados} alertas marcados como lidos!")
             return redirect('stock:alertas_gerenciar')
@@ -1,17 +1,26 @@
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
-from django.db.models import Count, Sum, Q, F, Case, When
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.db.models import Count, Sum
 from django.utils import timezone
+from asgiref.sync import sync_to_async
 from datetime import datetime, timedelta
+import asyncio
 import json
 import logging
+import time
 
-from .models_stock import (
-    StockItem, Item, MovimentoItem, NotificacaoStock, 
-    Fornecedor, CategoriaProduto, Receita
+from .models_stock import StockItem, CategoriaProduto, Receita
+from .decorators import require_stock_access, resposta_condicional, get_user_sucursais
+from .services.analise_sucursais import COLUNAS_MATRIZ, matriz_sucursais
+from .services.eventos_dashboard import (
+    calcular_painel, cancelar, duracao_ligacao, formatar_evento, intervalo_eventos, paineis_validos,
+    subscrever, versoes_paineis,
 )
-from .decorators import require_stock_access, get_user_sucursais
+from .services.metricas_cache import estatisticas, metricas_dashboard_executivo
+from .services.movimentos_diarios import serie_movimentos
+from .services.stock_snapshots import serie_diaria
 
 logger = logging.getLogger(__name__)
 
@@ -27,37 +36,8 @@ def dashboard_executivo(request):
         # Período padrão (últimos 30 dias)
         data_limite = timezone.now() - timedelta(days=30)
         
-        # Estatísticas principais
-        stats = {
-            'total_produtos': Item.objects.filter(status='ATIVO', tipo='PRODUTO').count(),
-            'total_materiais': Item.objects.filter(status='ATIVO', tipo='MATERIAL').count(),
-            'total_fornecedores': Fornecedor.objects.filter(status='ATIVO').count(),
-            'total_movimentos': MovimentoItem.objects.filter(
-                data_movimento__gte=data_limite,
-                sucursal_id__in=sucursais_ids
-            ).count(),
-            'total_notificacoes': NotificacaoStock.objects.filter(
-                Q(usuario_destinatario=request.user) | Q(usuario_destinatario__isnull=True),
-                lida=False
-            ).count(),
-        }
-        
-        # Estoque baixo
-        estoque_baixo = StockItem.objects.filter(
-            sucursal_id__in=sucursais_ids,
-            quantidade_atual__lt=F('item__estoque_minimo')
-        ).count()
-        
-        stats['estoque_baixo'] = estoque_baixo
-        
-        # Valor total do estoque
-        valor_total_estoque = StockItem.objects.filter(
-            sucursal_id__in=sucursais_ids
-        ).aggregate(
-            total=Sum(F('quantidade_atual') * F('item__preco_custo'))
-        )['total'] or 0
-        
-        stats['valor_total_estoque'] = valor_total_estoque
+        # Estatísticas principais (cache de métricas)
+        stats = metricas_dashboard_executivo(request.user, sucursais_ids)
         
         context = {
             'stats': stats,
@@ -73,57 +53,25 @@ def dashboard_executivo(request):
 
 @login_required
 @require_stock_access
+@resposta_condicional('movimentos', 'sucursais', max_age=60)
 def dashboard_chart_movimentacoes(request):
     """Dados para gráfico de movimentações por dia"""
     try:
         # Parâmetros
-        dias = int(request.GET.get('dias', 30))
+        dias = max(1, int(request.GET.get('dias', 30)))
         tipo_item = request.GET.get('tipo_item', '')
         
         # Obter sucursais permitidas
         sucursais_permitidas = get_user_sucursais(request, for_modification=False)
         sucursais_ids = [s.id for s in sucursais_permitidas]
         
-        # Data limite
-        data_limite = timezone.now() - timedelta(days=dias)
-        
-        # Query base
-        movimentos = MovimentoItem.objects.filter(
-            data_movimento__gte=data_limite,
-            sucursal_id__in=sucursais_ids
-        )
-        
-        # Filtrar por tipo de item se especificado
-        if tipo_item:
-            movimentos = movimentos.filter(item__tipo=tipo_item)
-        
-        # Agrupar por dia
-        movimentos_por_dia = movimentos.extra(
-            select={'dia': 'DATE(data_movimento)'}
-        ).values('dia').annotate(
-            total=Count('id'),
-            entrada=Sum(Case(When(tipo_movimento__aumenta_estoque=True, then=1), default=0)),
-            saida=Sum(Case(When(tipo_movimento__aumenta_estoque=False, then=1), default=0))
-        ).order_by('dia')
+        # Totais diários (MovimentoDiario), com zeros nos dias sem movimentos
+        serie = serie_movimentos(dias, sucursais_ids, tipo_item=tipo_item or None)
         
         # Preparar dados para o gráfico
-        labels = []
-        dados_entrada = []
-        dados_saida = []
-        
-        # Criar lista completa de dias
-        for i in range(dias):
-            data = (timezone.now() - timedelta(days=dias-i-1)).date()
-            labels.append(data.strftime('%d/%m'))
-            
-            # Buscar dados para este dia
-            dia_data = next((item for item in movimentos_por_dia if item['dia'] == data), None)
-            if dia_data:
-                dados_entrada.append(dia_data['entrada'] or 0)
-                dados_saida.append(dia_data['saida'] or 0)
-            else:
-                dados_entrada.append(0)
-                dados_saida.append(0)
+        labels = [dia.strftime('%d/%m') for dia, _, _ in serie]
+        dados_entrada = [entradas for _, entradas, _ in serie]
+        dados_saida = [saidas for _, _, saidas in serie]
         
         return JsonResponse({
             'labels': labels,
@@ -151,6 +99,7 @@ def dashboard_chart_movimentacoes(request):
 
 @login_required
 @require_stock_access
+@resposta_condicional('stock', 'requisicoes', 'sucursais', 'catalogo', max_age=60)
 def dashboard_chart_estoque_sucursal(request):
     """Dados para gráfico de estoque por sucursal"""
     try:
@@ -158,34 +107,8 @@ def dashboard_chart_estoque_sucursal(request):
         sucursais_permitidas = get_user_sucursais(request, for_modification=False)
         sucursais_ids = [s.id for s in sucursais_permitidas]
         
-        # Dados por sucursal
-        dados_sucursal = []
-        
-        for sucursal in sucursais_permitidas:
-            # Contar itens por tipo
-            produtos = StockItem.objects.filter(
-                sucursal=sucursal,
-                item__tipo='PRODUTO'
-            ).count()
-            
-            materiais = StockItem.objects.filter(
-                sucursal=sucursal,
-                item__tipo='MATERIAL'
-            ).count()
-            
-            # Valor total
-            valor_total = StockItem.objects.filter(
-                sucursal=sucursal
-            ).aggregate(
-                total=Sum(F('quantidade_atual') * F('item__preco_custo'))
-            )['total'] or 0
-            
-            dados_sucursal.append({
-                'sucursal': sucursal.nome,
-                'produtos': produtos,
-                'materiais': materiais,
-                'valor_total': float(valor_total)
-            })
+        # Itens em stock por sucursal (matriz por sucursal, do cache)
+        dados_sucursal = matriz_sucursais(sucursais_ids)
         
         # Preparar dados para gráfico de pizza
         labels = [item['sucursal'] for item in dados_sucursal]
@@ -226,6 +149,7 @@ def dashboard_chart_estoque_sucursal(request):
 
 @login_required
 @require_stock_access
+@resposta_condicional('stock', 'catalogo', 'sucursais', max_age=60)
 def dashboard_chart_categorias(request):
     """Dados para gráfico de distribuição por categorias"""
     try:
@@ -241,7 +165,7 @@ def dashboard_chart_categorias(request):
         ).annotate(
             total_itens=Count('id'),
             total_quantidade=Sum('quantidade_atual'),
-            valor_total=Sum(F('quantidade_atual') * F('item__preco_custo'))
+            valor_total=Sum('valor_estoque')
         ).order_by('-total_quantidade')[:10]  # Top 10 categorias
         
         labels = []
@@ -281,73 +205,46 @@ def dashboard_chart_categorias(request):
 
 @login_required
 @require_stock_access
+@resposta_condicional('stock', 'movimentos', 'sucursais', max_age=60)
 def dashboard_chart_tendencias(request):
     """Dados para gráfico de tendências de estoque"""
     try:
         # Parâmetros
-        dias = int(request.GET.get('dias', 30))
+        dias = max(1, int(request.GET.get('dias', 30)))
         
         # Obter sucursais permitidas
         sucursais_permitidas = get_user_sucursais(request, for_modification=False)
         sucursais_ids = [s.id for s in sucursais_permitidas]
         
-        # Data limite
-        data_limite = timezone.now() - timedelta(days=dias)
-        
-        # Movimentações por dia
-        movimentos_por_dia = MovimentoItem.objects.filter(
-            data_movimento__gte=data_limite,
-            sucursal_id__in=sucursais_ids
-        ).extra(
-            select={'dia': 'DATE(data_movimento)'}
-        ).values('dia').annotate(
-            entrada_valor=Sum(Case(
-                When(tipo_movimento__aumenta_estoque=True, 
-                     then=F('quantidade') * F('preco_unitario')), 
-                default=0
-            )),
-            saida_valor=Sum(Case(
-                When(tipo_movimento__aumenta_estoque=False, 
-                     then=F('quantidade') * F('preco_unitario')), 
-                default=0
-            ))
-        ).order_by('dia')
+        # Posição diária lida dos snapshots (hoje: saldos actuais)
+        data_fim = timezone.localdate()
+        data_inicio = data_fim - timedelta(days=dias - 1)
+        serie = serie_diaria(data_inicio, data_fim, sucursal_ids=sucursais_ids)
         
         # Preparar dados
-        labels = []
-        dados_entrada = []
-        dados_saida = []
-        
-        for i in range(dias):
-            data = (timezone.now() - timedelta(days=dias-i-1)).date()
-            labels.append(data.strftime('%d/%m'))
-            
-            dia_data = next((item for item in movimentos_por_dia if item['dia'] == data), None)
-            if dia_data:
-                dados_entrada.append(float(dia_data['entrada_valor'] or 0))
-                dados_saida.append(float(dia_data['saida_valor'] or 0))
-            else:
-                dados_entrada.append(0)
-                dados_saida.append(0)
+        labels = [ponto['data'].strftime('%d/%m') for ponto in serie]
+        dados_valor = [float(ponto['valor']) for ponto in serie]
+        dados_quantidade = [float(ponto['quantidade']) for ponto in serie]
         
         return JsonResponse({
             'labels': labels,
             'datasets': [
                 {
-                    'label': 'Valor Entradas (MT)',
-                    'data': dados_entrada,
-                    'backgroundColor': 'rgba(34, 197, 94, 0.2)',
-                    'borderColor': 'rgba(34, 197, 94, 1)',
+                    'label': 'Valor em Estoque (MT)',
+                    'data': dados_valor,
+                    'backgroundColor': 'rgba(59, 130, 246, 0.2)',
+                    'borderColor': 'rgba(59, 130, 246, 1)',
                     'borderWidth': 2,
                     'fill': True
                 },
                 {
-                    'label': 'Valor Saídas (MT)',
-                    'data': dados_saida,
-                    'backgroundColor': 'rgba(239, 68, 68, 0.2)',
-                    'borderColor': 'rgba(239, 68, 68, 1)',
+                    'label': 'Quantidade em Estoque',
+                    'data': dados_quantidade,
+                    'backgroundColor': 'rgba(34, 197, 94, 0.2)',
+                    'borderColor': 'rgba(34, 197, 94, 1)',
                     'borderWidth': 2,
-                    'fill': True
+                    'fill': False,
+                    'hidden': True
                 }
             ]
         })
@@ -355,3 +252,92 @@ def dashboard_chart_tendencias(request):
     except Exception as e:
         logger.error(f"Erro no gráfico de tendências: {e}")
         return JsonResponse({'error': str(e)})
+
+@login_required
+@require_stock_access
+def dashboard_metricas_cache(request):
+    """Acertos/falhas do cache de métricas neste processo (só administradores)"""
+    if not request.user.is_superuser:
+        return JsonResponse({'error': 'Acesso negado'}, status=403)
+    return JsonResponse({'metricas': estatisticas()})
+
+@login_required
+@require_stock_access
+@resposta_condicional('stock', 'requisicoes', 'sucursais', 'catalogo', max_age=60)
+def dashboard_matriz_sucursais(request):
+    """Indicadores por sucursal (stock e requisições) partilhados pelos gráficos"""
+    try:
+        sucursais_ids = [s.id for s in get_user_sucursais(request, for_modification=False)]
+        linhas = [
+            {**linha, 'valor_estoque': float(linha['valor_estoque'])}
+            for linha in matriz_sucursais(sucursais_ids)
+        ]
+        return JsonResponse({'colunas': list(COLUNAS_MATRIZ), 'sucursais': linhas})
+    except Exception as e:
+        logger.error(f"Erro na matriz por sucursal: {e}")
+        return JsonResponse({'error': str(e)})
+
+
+def _sucursais_eventos(request):
+    """Sucursais visíveis, ou None sem acesso ao stock (mesma regra de require_stock_access)"""
+    perfil = getattr(request.user, 'perfil', None)
+    if perfil is None or not perfil.permissoes_stock:
+        return None
+    return [s.id for s in get_user_sucursais(request, for_modification=False)]
+
+
+async def _fluxo_eventos(usuario, sucursais_ids, paineis):
+    """Envia cada painel ao ligar e sempre que a versão dos seus domínios muda"""
+    fila = subscrever()
+    try:
+        yield 'retry: 5000\n\n'
+        enviadas = {}
+        fim = time.monotonic() + duracao_ligacao()
+        while True:
+            actuais = await sync_to_async(versoes_paineis)(paineis)
+            alterados = [nome for nome in paineis if actuais[nome] != enviadas.get(nome)]
+            for nome in alterados:
+                dados = await sync_to_async(calcular_painel)(nome, usuario, sucursais_ids)
+                yield formatar_evento(nome, dados, actuais[nome])
+            if not alterados:
+                yield ': keep-alive\n\n'
+            enviadas = actuais
+
+            restante = fim - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                await asyncio.wait_for(fila.get(), timeout=min(intervalo_eventos(), restante))
+            except asyncio.TimeoutError:
+                pass
+    except Exception as e:
+        logger.error(f"Erro no stream de eventos do dashboard: {e}")
+    finally:
+        cancelar(fila)
+
+
+@login_required
+async def dashboard_eventos(request):
+    """
+    Server-Sent Events dos painéis em ?paineis= (executivo, notificacoes,
+    logistica, graficos). Só em ASGI: em WSGI responde 204 e a página
+    continua com polling.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+
+    sucursais_ids = await sync_to_async(_sucursais_eventos)(request)
+    if sucursais_ids is None:
+        return JsonResponse({'error': 'Acesso negado'}, status=403)
+
+    paineis = paineis_validos(request.GET.get('paineis', '').split(','))
+    if not paineis:
+        return JsonResponse({'error': 'Nenhum painel válido'}, status=400)
+
+    usuario = await request.auser()
+    response = StreamingHttpResponse(
+        _fluxo_eventos(usuario, sucursais_ids, paineis), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
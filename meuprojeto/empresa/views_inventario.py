@@ -17,9 +17,11 @@ import logging
 logger = logging.getLogger(__name__)
 
 from .decorators import require_stock_access
+from .services.agregacao import contar_por_filtro
+from .services.inventarios import InventarioFechadoError, concluir, criar_inventario, registar_contagens
+from .services.stock_ledger import StockInsuficienteError
 from .models_stock import (
-    InventarioFisico, ItemInventario, AjusteInventario, HistoricoContagem,
-    Item, Sucursal, StockItem, MovimentoItem, TipoMovimentoStock
+    InventarioFisico, ItemInventario, AjusteInventario, HistoricoContagem, Sucursal
 )
 from django.contrib.auth.models import User
 
@@ -36,10 +38,10 @@ def inventario_list(request):
     data_fim = request.GET.get('data_fim', '').strip()
     ordenar = request.GET.get('ordenar', '-data_criacao').strip()
     
-    # Buscar inventários
+    # Buscar inventários (o progresso vem dos contadores guardados)
     inventarios = InventarioFisico.objects.select_related(
         'sucursal', 'usuario_responsavel', 'usuario_criador'
-    ).prefetch_related('itens_inventario')
+    )
     
     # Aplicar filtros
     if search_query:
@@ -72,10 +74,13 @@ def inventario_list(request):
     inventarios_page = paginator.get_page(page_number)
     
     # Contadores para estatísticas
-    total_inventarios = InventarioFisico.objects.count()
-    inventarios_planejados = InventarioFisico.objects.filter(status='PLANEJADO').count()
-    inventarios_andamento = InventarioFisico.objects.filter(status='EM_ANDAMENTO').count()
-    inventarios_concluidos = InventarioFisico.objects.filter(status='CONCLUIDO').count()
+    estatisticas = contar_por_filtro(
+        InventarioFisico.objects.all(),
+        total_inventarios=None,
+        inventarios_planejados=Q(status='PLANEJADO'),
+        inventarios_andamento=Q(status='EM_ANDAMENTO'),
+        inventarios_concluidos=Q(status='CONCLUIDO'),
+    )
     
     # Dados para filtros
     sucursais = Sucursal.objects.all()
@@ -88,10 +93,7 @@ def inventario_list(request):
         'data_inicio': data_inicio,
         'data_fim': data_fim,
         'ordenar': ordenar,
-        'total_inventarios': total_inventarios,
-        'inventarios_planejados': inventarios_planejados,
-        'inventarios_andamento': inventarios_andamento,
-        'inventarios_concluidos': inventarios_concluidos,
+        **estatisticas,
         'sucursais': sucursais,
     }
     
@@ -147,8 +149,8 @@ def inventario_create(request):
                 data_fim_tz = timezone.make_aware(data_fim_dt)
                 logger.info(f"Data fim convertida: {data_fim_tz}")
             
-            logger.info("Criando inventário...")
-            inventario = InventarioFisico.objects.create(
+            logger.info("Criando inventário e itens (saldos actuais da sucursal)...")
+            inventario = criar_inventario(
                 nome=nome,
                 sucursal=sucursal,
                 data_inicio=data_inicio_tz,
@@ -157,20 +159,8 @@ def inventario_create(request):
                 observacoes=observacoes,
                 usuario_criador=request.user
             )
-            logger.info(f"Inventário criado com sucesso: {inventario.codigo}")
-            
-            logger.info("Adicionando itens ao inventário...")
-            stock_items = StockItem.objects.filter(sucursal=sucursal).select_related('item')
-            logger.info(f"Encontrados {stock_items.count()} itens de stock na sucursal")
             
-            for stock_item in stock_items:
-                ItemInventario.objects.create(
-                    inventario=inventario,
-                    item=stock_item.item,
-                    quantidade_sistema=stock_item.quantidade_atual
-                )
-            
-            logger.info(f"Inventário {inventario.codigo} criado com sucesso!")
+            logger.info(f"Inventário {inventario.codigo} criado com sucesso! {inventario.total_itens} itens")
             messages.success(request, f'Inventário {inventario.codigo} criado com sucesso!')
             return redirect('stock:inventario:detail', id=inventario.pk)
             
@@ -342,80 +332,38 @@ def inventario_update_item(request, id, item_id):
         messages.warning(request, f'Item {item_inventario.item.nome} já atingiu o limite de 3 contagens.')
         return redirect('stock:inventario:detail', id=inventario.id)
     
+    quantidade_contada = request.POST.get('quantidade_contada', '').strip()
+    observacoes = request.POST.get('observacoes', '').strip()
+    
+    if not quantidade_contada:
+        messages.error(request, 'Quantidade é obrigatória.')
+        return redirect('stock:inventario:detail', id=inventario.id)
+    
     try:
-        quantidade_contada = request.POST.get('quantidade_contada', '').strip()
-        observacoes = request.POST.get('observacoes', '').strip()
-        
-        if quantidade_contada:
-            quantidade = int(quantidade_contada)
-            if quantidade < 0:
-                messages.error(request, 'Quantidade não pode ser negativa.')
-                return redirect('stock:inventario:detail', id=inventario.id)
-            
-            # Incrementar número da contagem
-            item_inventario.numero_contagem += 1
-            
-            # Atualizar dados da contagem atual
-            item_inventario.quantidade_contada = quantidade
-            item_inventario.observacoes = observacoes
-            item_inventario.data_contagem = timezone.now()
-            item_inventario.usuario_contador = request.user
-            
-            # Calcular diferença
-            diferenca = quantidade - item_inventario.quantidade_sistema
-            item_inventario.diferenca = diferenca
-            
-            # Marcar como finalizado se atingiu 3 contagens
-            if item_inventario.numero_contagem >= 3:
-                item_inventario.contagem_finalizada = True
-                item_inventario.precisa_recontagem = False
-            else:
-                item_inventario.contagem_finalizada = False
-                # Verificar se precisa recontagem (se há diferença e ainda não atingiu 3 contagens)
-                if diferenca != 0:
-                    item_inventario.precisa_recontagem = True
-                else:
-                    item_inventario.precisa_recontagem = False
-            
-            # Salvar item do inventário
-            item_inventario.save()
-            
-            # Criar registro no histórico de contagens
-            from .models_stock import HistoricoContagem
-            HistoricoContagem.objects.create(
-                item_inventario=item_inventario,
-                numero_contagem=item_inventario.numero_contagem,
-                quantidade_contada=quantidade,
-                diferenca=diferenca,
-                observacoes=observacoes,
-                data_contagem=timezone.now(),
-                usuario_contador=request.user
-            )
-            
-            # Atualizar status do inventário para "Em Andamento"
-            if inventario.status == 'PLANEJADO':
-                inventario.status = 'EM_ANDAMENTO'
-                inventario.save()
-            
-            # Mensagem baseada no número da contagem
-            if item_inventario.numero_contagem == 1:
-                messages.success(request, f'1ª contagem de {item_inventario.item.nome}: {quantidade}')
-            elif item_inventario.numero_contagem == 2:
-                messages.success(request, f'2ª contagem de {item_inventario.item.nome}: {quantidade}')
-            else:
-                messages.success(request, f'3ª contagem de {item_inventario.item.nome}: {quantidade} (FINALIZADA)')
-            
-            # Aviso se há diferença e ainda pode recontar
-            if diferenca != 0 and item_inventario.numero_contagem < 3:
-                messages.warning(request, f'Diferença detectada! Item será incluído na próxima recontagem.')
-            
-        else:
-            messages.error(request, 'Quantidade é obrigatória.')
-            
-    except ValueError:
-        messages.error(request, 'Quantidade deve ser um número válido.')
-    except Exception as e:
-        messages.error(request, f'Erro ao atualizar contagem: {str(e)}')
+        contagem = registar_contagens(
+            inventario, {item_inventario.id: quantidade_contada}, usuario=request.user, observacoes=observacoes
+        )
+    except InventarioFechadoError as e:
+        messages.error(request, str(e))
+        return redirect('stock:inventario:detail', id=inventario.id)
+    
+    if contagem.erros:
+        messages.error(request, f'{item_inventario.item.nome}: {contagem.erros[item_inventario.id]}.')
+        return redirect('stock:inventario:detail', id=inventario.id)
+    
+    item_inventario = contagem.contados[0]
+    
+    # Mensagem baseada no número da contagem
+    if item_inventario.numero_contagem == 1:
+        messages.success(request, f'1ª contagem de {item_inventario.item.nome}: {item_inventario.quantidade_contada}')
+    elif item_inventario.numero_contagem == 2:
+        messages.success(request, f'2ª contagem de {item_inventario.item.nome}: {item_inventario.quantidade_contada}')
+    else:
+        messages.success(request, f'3ª contagem de {item_inventario.item.nome}: {item_inventario.quantidade_contada} (FINALIZADA)')
+    
+    # Aviso se há diferença e ainda pode recontar
+    if item_inventario.precisa_recontagem:
+        messages.warning(request, f'Diferença detectada! Item será incluído na próxima recontagem.')
     
     return redirect('stock:inventario:detail', id=inventario.id)
 
@@ -494,26 +442,8 @@ def inventario_finalizar(request, id):
                 return redirect('stock:inventario:detail', id=inventario.id)
         
         # Se chegou até aqui, todos os itens estão prontos para finalização
-        # Criar ajustes apenas para itens que realmente têm diferenças finais
-        itens_com_diferenca_final = inventario.itens_inventario.exclude(diferenca=0)
-        
-        ajustes_criados = 0
-        for item_inv in itens_com_diferenca_final:
-            AjusteInventario.objects.create(
-                inventario=inventario,
-                item=item_inv.item,
-                sucursal=inventario.sucursal,
-                quantidade_anterior=item_inv.quantidade_sistema,
-                quantidade_nova=item_inv.quantidade_contada,
-                motivo=f"Inventário físico {inventario.codigo} - {item_inv.numero_contagem}ª contagem",
-                usuario_ajuste=request.user
-            )
-            ajustes_criados += 1
-        
-        # Finalizar inventário
-        inventario.status = 'CONCLUIDO'
-        inventario.data_fim = timezone.now()
-        inventario.save()
+        # Criar ajustes (por aprovar) apenas para itens que realmente têm diferenças finais
+        ajustes_criados = len(concluir(inventario, request.user))
         
         if ajustes_criados > 0:
             messages.success(request, f'Inventário finalizado com sucesso! {ajustes_criados} ajustes criados para itens com diferenças.')
@@ -705,132 +635,114 @@ def inventario_relatorio(request, id):
     return render(request, 'stock/inventario/relatorio.html', context)
 
 
+def _quantidades_da_contagem(request):
+    """
+    {id do ItemInventario: quantidade} da contagem submetida: corpo JSON
+    {"quantidades": {id: quantidade}} ou campos quantidade_<id> do formulário.
+    Devolve (quantidades, número de campos deixados em branco).
+    """
+    if request.content_type == 'application/json':
+        quantidades = json.loads(request.body).get('quantidades', {})
+    else:
+        quantidades = {
+            chave[len('quantidade_'):]: valor for chave, valor in request.POST.items() if chave.startswith('quantidade_')
+        }
+    preenchidas = {chave: valor for chave, valor in quantidades.items() if str(valor).strip()}
+    return preenchidas, len(quantidades) - len(preenchidas)
+
+
+def _mensagens_de_erro(request, erros):
+    """Uma mensagem por linha recusada (as primeiras 20), com o nome do item"""
+    nomes = dict(ItemInventario.objects.filter(
+        id__in=[chave for chave in erros if isinstance(chave, int)]
+    ).values_list('id', 'item__nome'))
+    for chave, erro in list(erros.items())[:20]:
+        messages.error(request, f'{nomes.get(chave, f"Linha {chave}")}: {erro}.')
+    if len(erros) > 20:
+        messages.error(request, f'... e mais {len(erros) - 20} linha(s) recusadas.')
+
+
 @login_required
 @require_stock_access
 @require_http_methods(["POST"])
 def inventario_submeter_contagem(request, id):
-    """Submeter contagem de todos os itens e verificar diferenças"""
+    """
+    Submeter contagem de todos os itens e verificar diferenças. Aceita o
+    formulário ou JSON (a página envia JSON, que não tem o limite de campos
+    dos formulários); com JSON a resposta é JSON.
+    """
     inventario = get_object_or_404(InventarioFisico, id=id)
+    responder_json = request.content_type == 'application/json'
+    
+    def concluir_pedido(**dados):
+        if responder_json:
+            return JsonResponse({'status': 'success', 'action': 'reload', **dados})
+        return redirect('stock:inventario:detail', id=inventario.id)
     
     if inventario.status not in ['PLANEJADO', 'EM_ANDAMENTO']:
         messages.error(request, 'Não é possível editar inventários concluídos ou cancelados.')
-        return redirect('stock:inventario:detail', id=inventario.id)
+        return concluir_pedido()
     
     try:
-        itens_inventario = inventario.itens_inventario.all()
-        itens_com_dados = []
-        itens_sem_dados = []
-        
-        # Processar cada item
-        for item_inv in itens_inventario:
-            quantidade_key = f'quantidade_{item_inv.id}'
-            quantidade_contada = request.POST.get(quantidade_key, '').strip()
-            
-            if quantidade_contada:
-                try:
-                    quantidade = int(quantidade_contada)
-                    if quantidade < 0:
-                        messages.error(request, f'Quantidade não pode ser negativa para {item_inv.item.nome}.')
-                        continue
-                    
-                    # Incrementar número da contagem
-                    item_inv.numero_contagem += 1
-                    
-                    # Atualizar dados da contagem atual
-                    item_inv.quantidade_contada = quantidade
-                    item_inv.data_contagem = timezone.now()
-                    item_inv.usuario_contador = request.user
-                    
-                    # Calcular diferença
-                    diferenca = quantidade - item_inv.quantidade_sistema
-                    item_inv.diferenca = diferenca
-                    
-                    # Marcar como finalizado se atingiu 3 contagens
-                    if item_inv.numero_contagem >= 3:
-                        item_inv.contagem_finalizada = True
-                        item_inv.precisa_recontagem = False
-                    else:
-                        item_inv.contagem_finalizada = False
-                        # Verificar se precisa recontagem (se há diferença e ainda não atingiu 3 contagens)
-                        if diferenca != 0:
-                            item_inv.precisa_recontagem = True
-                        else:
-                            item_inv.precisa_recontagem = False
-                    
-                    # Salvar item do inventário
-                    item_inv.save()
-                    
-                    # Criar registro no histórico de contagens
-                    from .models_stock import HistoricoContagem
-                    HistoricoContagem.objects.create(
-                        item_inventario=item_inv,
-                        numero_contagem=item_inv.numero_contagem,
-                        quantidade_contada=quantidade,
-                        diferenca=diferenca,
-                        data_contagem=timezone.now(),
-                        usuario_contador=request.user
-                    )
-                    
-                    itens_com_dados.append(item_inv)
-                    
-                except ValueError:
-                    messages.error(request, f'Quantidade inválida para {item_inv.item.nome}.')
-            else:
-                itens_sem_dados.append(item_inv)
-        
-        # Atualizar status do inventário para "Em Andamento"
-        if inventario.status == 'PLANEJADO':
-            inventario.status = 'EM_ANDAMENTO'
-            inventario.save()
-        
-        # Verificar se há diferenças
-        itens_com_diferenca = [item for item in itens_com_dados if item.diferenca != 0]
-        itens_sem_diferenca = [item for item in itens_com_dados if item.diferenca == 0]
-        
-        if itens_sem_dados:
-            messages.warning(request, f'{len(itens_sem_dados)} item(s) não foram contados.')
-        
-        # Verificar se todos os itens atingiram 3 contagens
-        todos_itens_finalizados = all(item.numero_contagem >= 3 for item in itens_com_dados)
-        
-        if todos_itens_finalizados:
-            # Todos os itens atingiram 3 contagens - verificar se há diferenças
-            if itens_com_diferenca:
-                # Há diferenças na última contagem - perguntar sobre ajuste de stock
-                return JsonResponse({
-                    'status': 'success',
-                    'message': f'Todas as 3 contagens foram realizadas!',
-                    'action': 'ask_stock_adjustment',
-                    'items_with_differences': len(itens_com_diferenca),
-                    'inventario_id': inventario.id
-                })
-            else:
-                # Não há diferenças - finalizar diretamente
-                inventario.status = 'CONCLUIDO'
-                inventario.data_fim = timezone.now()
-                inventario.save()
-                
-                messages.success(request, f'Inventário finalizado! Todas as 3 contagens foram realizadas.')
-        elif itens_com_diferenca:
-            # Há diferenças - marcar para recontagem
-            for item in itens_com_diferenca:
-                if item.numero_contagem < 3:
-                    item.precisa_recontagem = True
-                    item.save()
-            
-            messages.warning(request, f'Contagem submetida! {len(itens_com_diferenca)} item(s) com diferenças serão recontados.')
+        quantidades, em_branco = _quantidades_da_contagem(request)
+    except (ValueError, AttributeError):
+        return JsonResponse({'status': 'error', 'message': 'JSON inválido'}, status=400)
+    
+    try:
+        contagem = registar_contagens(inventario, quantidades, usuario=request.user)
+    except InventarioFechadoError as e:
+        messages.error(request, str(e))
+        return concluir_pedido()
+    
+    _mensagens_de_erro(request, contagem.erros)
+    itens_com_dados = contagem.contados
+    
+    # Verificar se há diferenças
+    itens_com_diferenca = [item for item in itens_com_dados if item.diferenca != 0]
+    
+    if em_branco:
+        messages.warning(request, f'{em_branco} item(s) não foram contados.')
+    
+    if not itens_com_dados:
+        return concluir_pedido()
+    
+    # Verificar se todos os itens atingiram 3 contagens
+    todos_itens_finalizados = all(item.contagem_finalizada for item in itens_com_dados)
+    
+    if todos_itens_finalizados and itens_com_diferenca:
+        # Há diferenças na última contagem - perguntar sobre ajuste de stock
+        return JsonResponse({
+            'status': 'success',
+            'message': f'Todas as 3 contagens foram realizadas!',
+            'action': 'ask_stock_adjustment',
+            'items_with_differences': len(itens_com_diferenca),
+            'inventario_id': inventario.id
+        })
+    elif itens_com_diferenca:
+        # Há diferenças - os itens já ficaram marcados para recontagem
+        messages.warning(request, f'Contagem submetida! {len(itens_com_diferenca)} item(s) com diferenças serão recontados.')
+    elif inventario.itens_contados < inventario.total_itens:
+        messages.success(request, f'Contagem submetida! {inventario.itens_contados} de {inventario.total_itens} item(s) contados.')
+    else:
+        # Todas as linhas contadas: só finaliza se nenhuma de contagens anteriores ficou com diferença
+        pendentes = contar_por_filtro(
+            inventario.itens_inventario.all(),
+            recontagem=Q(precisa_recontagem=True),
+            diferenca=Q(contagem_finalizada=True) & ~Q(diferenca=0),
+        )
+        if pendentes['recontagem']:
+            messages.warning(request, f'Contagem submetida! {pendentes["recontagem"]} item(s) com diferenças ainda por recontar.')
+        elif pendentes['diferenca']:
+            messages.warning(request, f'Contagem submetida! {pendentes["diferenca"]} item(s) ficaram com diferenças após 3 contagens: finalize o inventário.')
         else:
             # Não há diferenças - pode finalizar
-            inventario.status = 'CONCLUIDO'
-            inventario.data_fim = timezone.now()
-            inventario.save()
-            
-            messages.success(request, f'Inventário finalizado! Todos os {len(itens_sem_diferenca)} item(s) estão conforme o sistema.')
-        
-    except Exception as e:
-        messages.error(request, f'Erro ao submeter contagem: {str(e)}')
+            concluir(inventario, request.user, gerar_ajustes=False)
+            if todos_itens_finalizados:
+                messages.success(request, f'Inventário finalizado! Todas as 3 contagens foram realizadas.')
+            else:
+                messages.success(request, f'Inventário finalizado! Todos os {inventario.total_itens} item(s) estão conforme o sistema.')
     
-    return redirect('stock:inventario:detail', id=inventario.id)
+    return concluir_pedido()
 
 
 @login_required
@@ -902,59 +814,18 @@ def inventario_finalizar_com_ajuste(request, id):
         messages.error(request, 'Não é possível editar inventários concluídos ou cancelados.')
         return redirect('stock:inventario:detail', id=inventario.id)
     
+    ajustar_stock = request.POST.get('ajustar_stock') == 'true'
+    
     try:
-        ajustar_stock = request.POST.get('ajustar_stock') == 'true'
-        
-        # Finalizar inventário
-        inventario.status = 'CONCLUIDO'
-        inventario.data_fim = timezone.now()
-        inventario.save()
-        
-        if ajustar_stock:
-            # Ajustar stock para todos os itens com diferenças
-            itens_com_diferenca = inventario.itens_inventario.filter(diferenca__ne=0)
-            
-            for item_inv in itens_com_diferenca:
-                # Criar ajuste de inventário
-                AjusteInventario.objects.create(
-                    inventario=inventario,
-                    item=item_inv.item,
-                    sucursal=inventario.sucursal,
-                    quantidade_anterior=item_inv.quantidade_sistema,
-                    quantidade_nova=item_inv.quantidade_contada,
-                    diferenca=item_inv.diferenca,
-                    observacoes=f'Ajuste automático após inventário {inventario.codigo}',
-                    usuario_responsavel=request.user
-                )
-                
-                # Atualizar stock
-                stock_item, created = StockItem.objects.get_or_create(
-                    item=item_inv.item,
-                    sucursal=inventario.sucursal,
-                    defaults={'quantidade': 0}
-                )
-                
-                stock_item.quantidade = item_inv.quantidade_contada
-                stock_item.save()
-                
-                # Criar movimento de stock
-                MovimentoItem.objects.create(
-                    item=item_inv.item,
-                    sucursal=inventario.sucursal,
-                    tipo_movimento=TipoMovimentoStock.objects.get(codigo='AJUSTE_INVENTARIO'),
-                    quantidade=item_inv.diferenca,
-                    quantidade_anterior=item_inv.quantidade_sistema,
-                    quantidade_final=item_inv.quantidade_contada,
-                    observacoes=f'Ajuste automático após inventário {inventario.codigo}',
-                    usuario_responsavel=request.user,
-                    data_movimento=timezone.now()
-                )
-            
-            messages.success(request, f'Inventário finalizado! Stock ajustado para {itens_com_diferenca.count()} item(s) com diferenças.')
-        else:
-            messages.success(request, f'Inventário finalizado! Stock mantido conforme sistema.')
-        
-    except Exception as e:
+        # Com ajuste: ajustes aprovados e lançados no ledger num único lote
+        ajustes = concluir(inventario, request.user, gerar_ajustes=ajustar_stock, aplicar=ajustar_stock)
+    except (InventarioFechadoError, StockInsuficienteError) as e:
         messages.error(request, f'Erro ao finalizar inventário: {str(e)}')
+        return redirect('stock:inventario:detail', id=inventario.id)
+    
+    if ajustar_stock:
+        messages.success(request, f'Inventário finalizado! Stock ajustado para {len(ajustes)} item(s) com diferenças.')
+    else:
+        messages.success(request, f'Inventário finalizado! Stock mantido conforme sistema.')
     
     return redirect('stock:inventario:detail', id=inventario.id)
@@ -12,7 +12,7 @@ from django.http import JsonResponse
 from datetime import timedelta
 import logging
 
-from .decorators import require_stock_access
+from .decorators import require_stock_access, resposta_condicional
 from .models_stock import (
     Transportadora, RastreamentoEntrega, EventoRastreamento
 )
@@ -22,6 +22,8 @@ from .services.logistica_sync import (
     criar_evento_rastreamento,
 )
 from .services import logistica_ops
+from .services.agregacao import estatisticas_operacoes_logisticas
+from .services.metricas_cache import metricas_logistica
 
 # Utilitários movidos para services/logistica_sync.py
 
@@ -89,25 +91,10 @@ def logistica_dashboard(request):
 
 @login_required
 @require_stock_access
+@resposta_condicional('logistica', max_age=30)
 def logistica_dashboard_data(request):
-    """API para dados do dashboard"""
-    user_sucursais_ids = get_user_sucursais_ids(request.user)
-    
-    # Métricas de logística
-    metricas = {
-        'transportadoras_ativas': Transportadora.objects.filter(status='ATIVA').count(),
-        'entregas_em_andamento': RastreamentoEntrega.objects.filter(
-            status_atual__in=['COLETADO', 'EM_TRANSITO', 'EM_DISTRIBUICAO']
-        ).count(),
-        'entregas_concluidas': RastreamentoEntrega.objects.filter(
-            status_atual='ENTREGUE'
-        ).count(),
-        'entregas_pendentes': RastreamentoEntrega.objects.filter(
-            status_atual='PREPARANDO'
-        ).count(),
-    }
-    
-    return JsonResponse(metricas)
+    """API para dados do dashboard (contadores do cache de métricas)"""
+    return JsonResponse(metricas_logistica())
 
 # =============================================================================
 # VIEWS DE RASTREAMENTO
@@ -938,17 +925,7 @@ def operacoes_logistica_list(request):
     page_obj = paginator.get_page(page_number)
     
     # Estatísticas (baseadas em todas as notificações, não apenas as filtradas)
-    todas_notificacoes = NotificacaoLogisticaUnificada.objects.all()
-    stats = {
-        'total': todas_notificacoes.count(),
-        'pendentes': todas_notificacoes.filter(status='PENDENTE').count(),
-        'atribuidas': todas_notificacoes.filter(status='ATRIBUIDA').count(),
-        'em_andamento': todas_notificacoes.filter(status__in=['COLETADA', 'EM_TRANSITO']).count(),
-        'concluidas': todas_notificacoes.filter(status='CONCLUIDA').count(),
-        'urgentes': todas_notificacoes.filter(prioridade='URGENTE').count(),
-        'transferencias': todas_notificacoes.filter(tipo_operacao='TRANSFERENCIA').count(),
-        'coletas': todas_notificacoes.filter(tipo_operacao='COLETA').count(),
-    }
+    stats = estatisticas_operacoes_logisticas(NotificacaoLogisticaUnificada.objects.all())
     
     context = {
         'page_obj': page_obj,
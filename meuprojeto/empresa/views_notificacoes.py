@@ -11,6 +11,8 @@ import logging
 
 from .models_stock import NotificacaoStock, StockItem, Item, MovimentoItem
 from .decorators import require_stock_access
+from .services.agregacao import estatisticas_notificacoes
+from .services.metricas_cache import invalidar
 
 logger = logging.getLogger(__name__)
 
@@ -47,23 +49,15 @@ def notificacoes_list(request):
         page_number = request.GET.get('page')
         page_obj = paginator.get_page(page_number)
         
-        # Estatísticas
-        total_notificacoes = notificacoes.count()
-        nao_lidas = notificacoes.filter(lida=False).count()
-        criticas_count = notificacoes.filter(
-            lida=False,
-            tipo__in=['stock_baixo', 'error', 'warning'],
-            prioridade__gte=3
-        ).count()
+        # Estatísticas (uma consulta)
+        estatisticas = estatisticas_notificacoes(notificacoes)
         
         # Tipos de notificação disponíveis
         tipos_disponiveis = NotificacaoStock.TIPOS_NOTIFICACAO
         
         context = {
             'page_obj': page_obj,
-            'total_notificacoes': total_notificacoes,
-            'nao_lidas': nao_lidas,
-            'criticas_count': criticas_count,
+            **estatisticas,
             'tipos_disponiveis': tipos_disponiveis,
             'filtro_tipo': tipo,
             'filtro_lida': lida,
@@ -147,6 +141,7 @@ def notificacao_marcar_todas_lidas(request):
         
         agora = timezone.now()
         notificacoes.update(lida=True, data_leitura=agora)
+        invalidar('notificacoes')
         
         return JsonResponse({'success': True, 'count': notificacoes.count()})
         
@@ -201,7 +196,7 @@ def criar_notificacao_stock_baixo():
     """Criar notificações para itens com estoque baixo"""
     try:
         itens_estoque_baixo = StockItem.objects.filter(
-            quantidade_atual__lt=F('item__estoque_minimo')
+            abaixo_minimo=True
         ).select_related('item', 'sucursal')
         
         for stock in itens_estoque_baixo:
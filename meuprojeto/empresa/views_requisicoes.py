@@ -1,7 +1,6 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.http import Http404
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
 from django.db.models import Q, Sum, F, Count
 from django.http import JsonResponse, HttpResponseBadRequest
 from django.contrib import messages
@@ -10,16 +9,23 @@ from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_protect, csrf_exempt
 from django.db import transaction
 from decimal import Decimal
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
 from .models_stock import (
-        RequisicaoStock, ItemRequisicaoStock, RequisicaoCompraExterna, ItemRequisicaoCompraExterna, Item, StockItem, Sucursal, OrdemCompra, ItemOrdemCompra, TransferenciaStock, TipoMovimentoStock, MovimentoItem, HistoricoEnvioEmail
+        RequisicaoStock, ItemRequisicaoStock, RequisicaoCompraExterna, ItemRequisicaoCompraExterna, IndiceRequisicao, Item, StockItem, Sucursal, OrdemCompra, ItemOrdemCompra, TransferenciaStock, HistoricoEnvioEmail
 )
 from .models_base import Sucursal
-from .decorators import require_stock_access, require_sucursal_access, get_user_sucursais
+from .decorators import require_stock_access, require_sucursal_access, resposta_condicional, get_user_sucursais
+from .services import indice_requisicoes
 from .services.email_service import EmailService
+from .services.alocacao_requisicoes import (
+    AlocacaoIncompletaError, criar_transferencias, matriz_disponibilidade, ordenar_plano, planear,
+)
+from .services.recebimentos import DocumentoJaRecebidoError, RecebimentoInvalidoError, receber_ordem_compra
+from .services.reservas_stock import ReservaIndisponivelError, libertar, reservar
 
 # =============================================================================
 # VIEWS DE REQUISIÇÕES DE STOCK
@@ -28,84 +34,46 @@ from .services.email_service import EmailService
 @login_required
 @require_stock_access
 def requisicoes_list(request):
-    """Lista de requisições de stock"""
+    """
+    Lista de requisições de stock (internas e de compra externa).
+
+    Lê do índice unificado (IndiceRequisicao): o painel é uma consulta e a
+    página outra, paginada por cursor (`depois`/`antes`) sobre os dois tipos.
+    """
     # Obter parâmetros de filtro
     search_query = request.GET.get('search', '').strip()
     status = request.GET.get('status', '').strip()
     sucursal_id = request.GET.get('sucursal', '').strip()
-    
-    # Buscar requisições de stock
-    requisicoes_stock = RequisicaoStock.objects.select_related(
-        'sucursal_origem', 'sucursal_destino', 'criado_por', 'aprovado_por'
-    ).prefetch_related('itens').order_by('-data_criacao')
-    
-    # Buscar requisições de compra externa
-    requisicoes_compra = RequisicaoCompraExterna.objects.select_related(
-        'sucursal_solicitante', 'criado_por'
-    ).prefetch_related('itens').order_by('-data_criacao')
-    
-    # Aplicar filtros às requisições de stock
-    if search_query:
-        requisicoes_stock = requisicoes_stock.filter(
-            Q(codigo__icontains=search_query) |
-            Q(sucursal_origem__nome__icontains=search_query) |
-            Q(sucursal_destino__nome__icontains=search_query) |
-            Q(observacoes__icontains=search_query)
-        )
-    
-    if status:
-        requisicoes_stock = requisicoes_stock.filter(status=status)
-    
-    if sucursal_id:
-        requisicoes_stock = requisicoes_stock.filter(
-            Q(sucursal_origem_id=sucursal_id) | Q(sucursal_destino_id=sucursal_id)
-        )
-    
-    # Aplicar filtros às requisições de compra externa
-    if search_query:
-        requisicoes_compra = requisicoes_compra.filter(
-            Q(codigo__icontains=search_query) |
-            Q(sucursal_solicitante__nome__icontains=search_query) |
-            Q(observacoes__icontains=search_query)
-        )
-    
-    if status:
-        requisicoes_compra = requisicoes_compra.filter(status=status)
-    
-    if sucursal_id:
-        requisicoes_compra = requisicoes_compra.filter(sucursal_solicitante_id=sucursal_id)
-    
-    # Estatísticas
-    total_requisicoes_stock = requisicoes_stock.count()
-    total_requisicoes_compra = requisicoes_compra.count()
-    total_requisicoes = total_requisicoes_stock + total_requisicoes_compra
-    
-    requisicoes_pendentes = requisicoes_stock.filter(status='PENDENTE').count() + requisicoes_compra.filter(status='PENDENTE').count()
-    requisicoes_aprovadas = requisicoes_stock.filter(status='APROVADA').count() + requisicoes_compra.filter(status='APROVADA').count()
-    requisicoes_atendidas = requisicoes_stock.filter(status='ATENDIDA').count() + requisicoes_compra.filter(status='FINALIZADA').count()
-    
-    # Combinar requisições para paginação
-    from itertools import chain
-    todas_requisicoes = list(chain(requisicoes_stock, requisicoes_compra))
-    
-    # Paginação
-    paginator = Paginator(todas_requisicoes, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    if sucursal_id and not sucursal_id.isdigit():
+        sucursal_id = ''
+
+    requisicoes = indice_requisicoes.filtrar(
+        IndiceRequisicao.objects.all(), search_query, status, sucursal_id
+    )
+
+    # Estatísticas (uma consulta)
+    estatisticas = indice_requisicoes.estatisticas(requisicoes)
+
+    # Página por cursor
+    linhas, cursor_anterior, cursor_seguinte = indice_requisicoes.pagina(
+        requisicoes.select_related('sucursal', 'sucursal_destino', 'criado_por'),
+        depois=request.GET.get('depois', ''),
+        antes=request.GET.get('antes', ''),
+    )
     
     # Obter sucursais para o filtro
     sucursais = Sucursal.objects.all().order_by('nome')
     
     context = {
-        'requisicoes': page_obj,
-        'requisicoes_stock': requisicoes_stock,
-        'requisicoes_compra': requisicoes_compra,
-        'total_requisicoes': total_requisicoes,
-        'total_requisicoes_stock': total_requisicoes_stock,
-        'total_requisicoes_compra': total_requisicoes_compra,
-        'requisicoes_pendentes': requisicoes_pendentes,
-        'requisicoes_aprovadas': requisicoes_aprovadas,
-        'requisicoes_atendidas': requisicoes_atendidas,
+        'requisicoes': linhas,
+        'cursor_anterior': cursor_anterior,
+        'cursor_seguinte': cursor_seguinte,
+        'total_requisicoes': estatisticas['total'],
+        'total_requisicoes_stock': estatisticas['total_internas'],
+        'total_requisicoes_compra': estatisticas['total_externas'],
+        'requisicoes_pendentes': estatisticas['pendentes'],
+        'requisicoes_aprovadas': estatisticas['aprovadas'],
+        'requisicoes_atendidas': estatisticas['atendidas'],
         'sucursais': sucursais,
         'search_query': search_query,
         'status': status,
@@ -250,20 +218,13 @@ def requisicao_detail(request, id):
             'sucursal_origem', 'sucursal_destino', 'criado_por', 'aprovado_por'
         ).prefetch_related('itens__item').get(id=id)
         
-        # Buscar transferência associada se existir
-        transferencia_associada = None
-        try:
-            from .models_stock import TransferenciaStock
-            codigo_transferencia = f"TRF{requisicao.codigo}"
-            transferencia_associada = TransferenciaStock.objects.get(
-                codigo=codigo_transferencia
-            )
-        except TransferenciaStock.DoesNotExist:
-            pass
+        # Buscar transferências associadas (uma por sucursal fornecedora)
+        transferencias_associadas = list(_transferencias_da_requisicao(requisicao))
         
         context = {
             'requisicao': requisicao,
-            'transferencia_associada': transferencia_associada,
+            'transferencia_associada': transferencias_associadas[0] if transferencias_associadas else None,
+            'transferencias_associadas': transferencias_associadas,
         }
         return render(request, 'stock/requisicoes/detail.html', context)
         
@@ -588,7 +549,8 @@ def ordem_compra_confirm_tipo(request, id):
                     if 'prioridade_manual' in request.session:
                         del request.session['prioridade_manual']
                 else:
-                    # Prioridade automática baseada no valor da ordem
+                    # Prioridade automática baseada no valor da ordem (total guardado pelos itens)
+                    ordem_compra.refresh_from_db(fields=['valor_total'])
                     valor_total = ordem_compra.valor_total
                     if valor_total > 50000:
                         prioridade = 'ALTA'
@@ -690,78 +652,24 @@ def ordem_compra_confirm_items(request, id):
         return redirect('stock:requisicoes:ordem_compra_preview', id=id)
     
     if request.method == 'POST':
-        # Processar itens recebidos
-        itens_recebidos = []
-        for item in ordem_compra.itens.all():
-            quantidade_recebida = request.POST.get(f'quantidade_recebida_{item.id}')
-            estado_item = request.POST.get(f'estado_item_{item.id}')
-            
-            if quantidade_recebida and estado_item:
-                quantidade_recebida = int(quantidade_recebida)
-                if quantidade_recebida > 0:
-                    # Atualizar item
-                    item.quantidade_recebida = quantidade_recebida
-                    item.save()
-                    
-                    itens_recebidos.append({
-                        'item': item,
-                        'quantidade': quantidade_recebida,
-                        'estado': estado_item
-                    })
-        
-        if itens_recebidos:
-            # Verificar se já existem movimentos para esta ordem
-            movimentos_existentes = MovimentoItem.objects.filter(
-                observacoes__icontains=f'Recebimento da ordem {ordem_compra.codigo}'
-            ).count()
-            
-            if movimentos_existentes > 0:
-                messages.error(request, f'Já existem movimentos registrados para a ordem {ordem_compra.codigo}. Recebimento duplo não permitido.')
-                return redirect('stock:requisicoes:ordem_compra_preview', id=id)
-            
-            # Atualizar stock da empresa
-            sucursal_destino = ordem_compra.sucursal_destino
-            
-            for item_data in itens_recebidos:
-                item = item_data['item']
-                quantidade = item_data['quantidade']
-                
-                if item.produto:
-                    # Atualizar stock do produto usando modelo unificado
-                    stock_item, created = StockItem.objects.get_or_create(
-                        sucursal=sucursal_destino,
-                        item=item.produto,
-                        defaults={'quantidade_atual': 0}
-                    )
-                    stock_item.quantidade_atual += quantidade
-                    stock_item.save()
-                    
-                    # Criar movimento de entrada usando modelo unificado
-                    MovimentoItem.objects.create(
-                        item=item.produto,  # item agora aponta para Item unificado
-                        sucursal=sucursal_destino,
-                        tipo_movimento=TipoMovimentoStock.objects.get(codigo='ENT_COMPRA'),
-                        quantidade=quantidade,
-                        preco_unitario=item.preco_unitario,
-                        observacoes=f'Recebimento da ordem {ordem_compra.codigo} - Fatura: {ordem_compra.numero_fatura}',
-                        usuario=request.user
-                    )
-            
-            # Verificar tipo de recebimento (já definido anteriormente)
-            tipo_recebimento = request.POST.get('tipo_recebimento', 'ENTREGA')
-            
-            # Marcar ordem como recebida
-            ordem_compra.status = 'RECEBIDA'
-            ordem_compra.data_recebimento = timezone.now()
-            ordem_compra.save()
-            
-            # A notificação logística já foi criada no ordem_compra_confirm_tipo
-            # Não é necessário criar novamente aqui
-            messages.success(request, f'Stock recebido com sucesso! {len(itens_recebidos)} itens processados.')
-            
+        # Linhas com quantidade e estado indicados; o recebimento é validado e lançado num só lote
+        quantidades = {
+            item_id: request.POST.get(f'quantidade_recebida_{item_id}')
+            for item_id in ordem_compra.itens.values_list('id', flat=True)
+            if request.POST.get(f'quantidade_recebida_{item_id}') and request.POST.get(f'estado_item_{item_id}')
+        }
+        try:
+            receber_ordem_compra(ordem_compra, quantidades, usuario=request.user)
+        except RecebimentoInvalidoError as e:
+            for erro in e.erros.values():
+                messages.error(request, erro)
+        except DocumentoJaRecebidoError:
+            messages.error(request, f'A ordem {ordem_compra.codigo} já foi recebida. Recebimento duplo não permitido.')
             return redirect('stock:requisicoes:ordem_compra_preview', id=id)
         else:
-            messages.error(request, 'Nenhum item foi processado.')
+            # A notificação logística já foi criada no ordem_compra_confirm_tipo
+            messages.success(request, f'Stock recebido com sucesso! {len(quantidades)} itens processados.')
+            return redirect('stock:requisicoes:ordem_compra_preview', id=id)
     
     context = {
         'ordem_compra': ordem_compra,
@@ -776,6 +684,38 @@ def ordem_compra_confirm_items(request, id):
     return render(request, 'stock/requisicoes/ordem_compra_confirm_items.html', context)
 
 
+@login_required
+@require_stock_access
+@require_http_methods(["POST"])
+def ordem_compra_receber_lote(request, id):
+    """
+    API: recebe a ordem de compra inteira de uma vez. O corpo é JSON
+    {id do item da ordem: quantidade recebida}.
+    """
+    ordem_compra = get_object_or_404(OrdemCompra.objects.select_related('sucursal_destino'), id=id)
+    
+    try:
+        quantidades = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'JSON inválido'}, status=400)
+    if not isinstance(quantidades, dict):
+        return JsonResponse({'success': False, 'error': 'Esperado {linha: quantidade}'}, status=400)
+    
+    try:
+        movimentos = receber_ordem_compra(ordem_compra, quantidades, usuario=request.user)
+    except RecebimentoInvalidoError as e:
+        return JsonResponse({'success': False, 'erros': {str(k): v for k, v in e.erros.items()}}, status=400)
+    except DocumentoJaRecebidoError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=409)
+    
+    return JsonResponse({
+        'success': True,
+        'codigo': ordem_compra.codigo,
+        'status': ordem_compra.status,
+        'movimentos': len(movimentos),
+    })
+
+
 @login_required
 @require_stock_access
 def ordem_compra_receipt_note(request, id):
@@ -1132,6 +1072,42 @@ def requisicao_submit(request, id):
     return redirect('stock:requisicoes:detail', id=id)
 
 
+def _quantidades_por_item(itens, campo):
+    """{item_id: quantidade} dos itens da requisição com `campo` > 0"""
+    quantidades = {}
+    for item_requisicao in itens:
+        quantidade = getattr(item_requisicao, campo)
+        if item_requisicao.item_id and quantidade > 0:
+            quantidades[item_requisicao.item_id] = quantidades.get(item_requisicao.item_id, 0) + quantidade
+    return quantidades
+
+
+def _mensagem_faltas(erro, itens):
+    """Texto de AlocacaoIncompletaError com os nomes dos itens"""
+    nomes = {i.item_id: i.item.nome for i in itens if i.item_id}
+    faltas = ', '.join(
+        f'{nomes.get(item_id, item_id)} (faltam {quantidade})' for item_id, quantidade in sorted(erro.faltas.items())
+    )
+    return f'Stock disponível insuficiente em todas as sucursais para: {faltas}.'
+
+
+def _transferencia_da_guia(request, requisicao):
+    """A transferência da requisição indicada em ?transferencia=<código>, ou a principal"""
+    transferencias = _transferencias_da_requisicao(requisicao)
+    codigo = request.GET.get('transferencia', '').strip()
+    if codigo:
+        transferencias = transferencias.filter(codigo=codigo)
+    return transferencias.first()
+
+
+def _transferencias_da_requisicao(requisicao):
+    """Transferências geradas pela requisição (TRF<código> e TRF<código>-N), a principal primeiro"""
+    codigo = f"TRF{requisicao.codigo}"
+    return TransferenciaStock.objects.filter(
+        Q(codigo=codigo) | Q(codigo__startswith=f"{codigo}-")
+    ).select_related('sucursal_origem').order_by('id')
+
+
 @login_required
 @require_stock_access
 @require_http_methods(["POST"])
@@ -1143,13 +1119,40 @@ def requisicao_approve(request, id):
         messages.error(request, 'Apenas requisições pendentes podem ser aprovadas.')
         return redirect('stock:requisicoes:detail', id=id)
     
+    itens = list(requisicao.itens.filter(item__isnull=False).select_related('item'))
+    try:
+        # Sucursais fornecedoras: o menor número que cobre todas as linhas
+        plano = planear(requisicao, _quantidades_por_item(itens, 'quantidade_solicitada'))
+    except AlocacaoIncompletaError as e:
+        messages.error(request, _mensagem_faltas(e, itens))
+        return redirect('stock:requisicoes:detail', id=id)
+    if not plano:
+        messages.error(request, 'Nenhuma sucursal tem stock dos itens desta requisição.')
+        return redirect('stock:requisicoes:detail', id=id)
+    
     try:
         with transaction.atomic():
+            # Reservar as quantidades solicitadas em cada sucursal fornecedora
+            reservar(
+                [
+                    (item_id, sucursal_id, quantidade)
+                    for sucursal_id, linhas in plano.items()
+                    for item_id, quantidade in linhas.items()
+                ],
+                requisicao=requisicao,
+                usuario=request.user,
+            )
+            
+            requisicao.sucursal_destino_id = ordenar_plano(plano)[0]
             requisicao.status = 'APROVADA'
             requisicao.aprovado_por = request.user
             requisicao.data_aprovacao = timezone.now()
             requisicao.save()
             
+    except ReservaIndisponivelError as e:
+        item = next((i.item for i in itens if i.item_id == e.item_id), None)
+        sucursal = Sucursal.objects.filter(id=e.sucursal_id).first()
+        messages.error(request, f'Stock disponível insuficiente em {sucursal.nome if sucursal else e.sucursal_id} para reservar {e.quantidade} unidades de {item.nome if item else e.item_id}.')
     except Exception as e:
         logger.error(f"Erro ao aprovar requisição: {e}")
         messages.error(request, 'Erro ao aprovar requisição.')
@@ -1169,8 +1172,10 @@ def requisicao_reject(request, id):
         return redirect('stock:requisicoes:detail', id=id)
     
     try:
-        requisicao.status = 'REJEITADA'
-        requisicao.save()
+        with transaction.atomic():
+            libertar(requisicao.reservas.all())
+            requisicao.status = 'REJEITADA'
+            requisicao.save()
     except Exception as e:
         logger.error(f"Erro ao rejeitar requisição: {e}")
         messages.error(request, 'Erro ao rejeitar requisição.')
@@ -1190,8 +1195,10 @@ def requisicao_cancel(request, id):
         return redirect('stock:requisicoes:detail', id=id)
     
     try:
-        requisicao.status = 'CANCELADA'
-        requisicao.save()
+        with transaction.atomic():
+            libertar(requisicao.reservas.all())
+            requisicao.status = 'CANCELADA'
+            requisicao.save()
     except Exception as e:
         logger.error(f"Erro ao cancelar requisição: {e}")
         messages.error(request, 'Erro ao cancelar requisição.')
@@ -1259,6 +1266,7 @@ def requisicao_add_item_form(request, id):
 
 # API para buscar itens disponíveis
 @login_required
+@resposta_condicional('stock', 'catalogo', max_age=0)
 def api_itens_disponiveis(request):
     """API para buscar itens disponíveis em uma sucursal"""
     sucursal_id = request.GET.get('sucursal_id')
@@ -1282,7 +1290,7 @@ def api_itens_disponiveis(request):
                 'tipo': item.tipo,
                 'unidade_medida': item.unidade_medida,
                 'preco_custo': float(item.preco_custo),
-                'quantidade_disponivel': float(stock.quantidade_atual) if stock else 0,
+                'quantidade_disponivel': float(stock.quantidade_disponivel) if stock else 0,
             })
         
         return JsonResponse({'itens': itens_data})
@@ -1294,6 +1302,7 @@ def api_itens_disponiveis(request):
 
 # API para buscar stock de um item específico em uma sucursal
 @login_required
+@resposta_condicional('stock', 'catalogo', 'sucursais', max_age=0)
 def api_stock_item_sucursal(request):
     """API para buscar stock de um item específico em uma sucursal"""
     item_id = request.GET.get('item_id')
@@ -1347,7 +1356,7 @@ def compra_externa_list(request):
         # Buscar requisições de compra externa
         requisicoes = RequisicaoCompraExterna.objects.select_related(
             'sucursal_solicitante', 'criado_por'
-        ).prefetch_related('itens__item').order_by('-data_criacao')
+        ).with_totals().order_by('-data_criacao')
         
         # Aplicar filtros se necessário
         status_filter = request.GET.get('status')
@@ -1385,7 +1394,7 @@ def ordens_compra_list(request):
         # Buscar todas as ordens de compra
         ordens = OrdemCompra.objects.select_related(
             'fornecedor', 'sucursal_destino', 'requisicao_origem', 'criado_por'
-        ).prefetch_related('itens').order_by('-data_criacao')
+        ).order_by('-data_criacao')
         
         # Aplicar filtros
         status_filter = request.GET.get('status', '')
@@ -1407,7 +1416,7 @@ def ordens_compra_list(request):
             ordens = ordens.filter(fornecedor_id=fornecedor_filter)
         
         # Paginação
-        paginator = Paginator(ordens, 20)
+        paginator = Paginator(ordens.with_totals(), 20)
         page_number = request.GET.get('page')
         page_obj = paginator.get_page(page_number)
         
@@ -1794,17 +1803,9 @@ def requisicao_edit_quantidade_atendida(request, id, item_id):
     item_requisicao = get_object_or_404(ItemRequisicaoStock, id=item_id, requisicao=requisicao)
     
     # Verificar se já existe uma transferência associada que foi recebida
-    try:
-        from .models_stock import TransferenciaStock
-        codigo_transferencia = f"TRF{requisicao.codigo}"
-        transferencia = TransferenciaStock.objects.get(codigo=codigo_transferencia)
-        
-        if transferencia.status == 'RECEBIDA':
-            messages.error(request, 'Não é possível editar quantidades de uma transferência já recebida.')
-            return redirect('stock:requisicoes:detail', id=requisicao.id)
-    except TransferenciaStock.DoesNotExist:
-        # Não há transferência ainda, pode editar
-        pass
+    if _transferencias_da_requisicao(requisicao).filter(status='RECEBIDA').exists():
+        messages.error(request, 'Não é possível editar quantidades de uma transferência já recebida.')
+        return redirect('stock:requisicoes:detail', id=requisicao.id)
     
     if request.method == 'POST':
         try:
@@ -1834,13 +1835,8 @@ def requisicao_edit_quantidade_atendida(request, id, item_id):
             return redirect('stock:requisicoes:detail', id=requisicao.id)
     
     # Verificar status da transferência para passar ao template
-    transferencia_status = None
-    try:
-        codigo_transferencia = f"TRF{requisicao.codigo}"
-        transferencia = TransferenciaStock.objects.get(codigo=codigo_transferencia)
-        transferencia_status = transferencia.status
-    except TransferenciaStock.DoesNotExist:
-        transferencia_status = None
+    transferencia = _transferencias_da_requisicao(requisicao).first()
+    transferencia_status = transferencia.status if transferencia else None
     
     context = {
         'requisicao': requisicao,
@@ -1861,49 +1857,48 @@ def requisicao_transfer_preview(request, id):
         return redirect('stock:requisicoes:detail', id=id)
     
     # Buscar itens com quantidade atendida
-    itens_com_atendimento = requisicao.itens.filter(quantidade_atendida__gt=0)
+    itens_com_atendimento = list(requisicao.itens.filter(quantidade_atendida__gt=0).select_related('item'))
     
-    if not itens_com_atendimento.exists():
+    if not itens_com_atendimento:
         messages.error(request, 'Nenhum item com quantidade atendida encontrado.')
         return redirect('stock:requisicoes:detail', id=id)
     
-    # Analisar stock disponível para cada item
-    from .models_stock import StockItem
-    analise_stock = []
+    # Disponível de todos os itens em todas as sucursais (excluindo a solicitante) e plano de fornecimento
+    quantidades = _quantidades_por_item(itens_com_atendimento, 'quantidade_atendida')
+    disponibilidade = matriz_disponibilidade(
+        list(quantidades), excluir_sucursal_id=requisicao.sucursal_origem_id, requisicao=requisicao
+    )
+    try:
+        plano = planear(requisicao, quantidades, disponibilidade)
+    except AlocacaoIncompletaError as e:
+        plano, faltas = {}, e.faltas
+    else:
+        faltas = {}
+    sucursais = Sucursal.objects.in_bulk(plano)
     
+    analise_stock = []
     for item_requisicao in itens_com_atendimento:
-        item_obj = item_requisicao.item or item_requisicao.produto
-        quantidade_necessaria = item_requisicao.quantidade_atendida
-        
-        # Buscar stock disponível em todas as sucursais (excluindo a solicitante)
-        stocks_disponiveis = StockItem.objects.filter(
-            item=item_obj
-        ).exclude(
-            sucursal=requisicao.sucursal_origem
-        ).order_by('-quantidade_atual')
-        
-        # Determinar sucursal fornecedora (a que tem mais stock)
-        sucursal_fornecedora = stocks_disponiveis.first().sucursal if stocks_disponiveis.exists() else None
-        stock_disponivel = stocks_disponiveis.first().quantidade_atual if stocks_disponiveis.exists() else 0
-        
+        fornecedoras = [
+            {'sucursal': sucursais[sucursal_id], 'quantidade': plano[sucursal_id][item_requisicao.item_id]}
+            for sucursal_id in ordenar_plano(plano) if item_requisicao.item_id in plano[sucursal_id]
+        ]
         analise_stock.append({
-            'item': item_obj,
-            'quantidade_necessaria': quantidade_necessaria,
-            'sucursal_fornecedora': sucursal_fornecedora,
-            'stock_disponivel': stock_disponivel,
-            'pode_atender': stock_disponivel >= quantidade_necessaria,
-            'todas_sucursais': stocks_disponiveis
+            'item': item_requisicao.item,
+            'quantidade_necessaria': item_requisicao.quantidade_atendida,
+            'sucursal_fornecedora': fornecedoras[0]['sucursal'] if fornecedoras else None,
+            'sucursais_fornecedoras': fornecedoras,
+            'stock_disponivel': sum(d for d in disponibilidade.get(item_requisicao.item_id, {}).values() if d > 0),
+            'pode_atender': item_requisicao.item_id not in faltas,
         })
     
-    # Verificar se todas as sucursais fornecedoras são as mesmas
-    sucursais_fornecedoras = [item['sucursal_fornecedora'] for item in analise_stock if item['sucursal_fornecedora']]
-    sucursal_fornecedora_unica = sucursais_fornecedoras[0] if len(set(sucursais_fornecedoras)) == 1 else None
+    sucursais_fornecedoras = [sucursais[sucursal_id] for sucursal_id in ordenar_plano(plano)]
     
     context = {
         'requisicao': requisicao,
         'analise_stock': analise_stock,
-        'sucursal_fornecedora_unica': sucursal_fornecedora_unica,
-        'pode_executar': all(item['pode_atender'] for item in analise_stock),
+        'sucursal_fornecedora_unica': sucursais_fornecedoras[0] if len(sucursais_fornecedoras) == 1 else None,
+        'sucursais_fornecedoras': sucursais_fornecedoras,
+        'pode_executar': not faltas,
     }
     
     return render(request, 'stock/requisicoes/transfer_preview.html', context)
@@ -1919,10 +1914,8 @@ def requisicao_guia_transferencia(request, id):
         messages.error(request, 'Apenas requisições atendidas podem gerar guias de transferência.')
         return redirect('stock:requisicoes:detail', id=id)
     
-    # Buscar transferência associada
-    from .models_stock import TransferenciaStock
-    codigo_transferencia = f"TRF{requisicao.codigo}"
-    transferencia = TransferenciaStock.objects.filter(codigo=codigo_transferencia).first()
+    # Buscar transferência associada (?transferencia=<código> para as restantes sucursais fornecedoras)
+    transferencia = _transferencia_da_guia(request, requisicao)
     
     if not transferencia:
         messages.error(request, 'Transferência não encontrada. Execute a transferência primeiro.')
@@ -1962,10 +1955,8 @@ def requisicao_guia_transferencia_preview(request, id):
         messages.error(request, 'Apenas requisições atendidas podem gerar guias de transferência.')
         return redirect('stock:requisicoes:detail', id=id)
     
-    # Buscar transferência associada
-    from .models_stock import TransferenciaStock
-    codigo_transferencia = f"TRF{requisicao.codigo}"
-    transferencia = TransferenciaStock.objects.filter(codigo=codigo_transferencia).first()
+    # Buscar transferência associada (?transferencia=<código> para as restantes sucursais fornecedoras)
+    transferencia = _transferencia_da_guia(request, requisicao)
     
     if not transferencia:
         messages.error(request, 'Transferência não encontrada. Execute a transferência primeiro.')
@@ -2005,10 +1996,8 @@ def requisicao_guia_recebimento_preview(request, id):
         messages.error(request, 'Apenas requisições atendidas podem gerar guias de recebimento.')
         return redirect('stock:requisicoes:detail', id=id)
     
-    # Buscar transferência associada
-    from .models_stock import TransferenciaStock
-    codigo_transferencia = f"TRF{requisicao.codigo}"
-    transferencia = TransferenciaStock.objects.filter(codigo=codigo_transferencia).first()
+    # Buscar transferência associada (?transferencia=<código> para as restantes sucursais fornecedoras)
+    transferencia = _transferencia_da_guia(request, requisicao)
     
     if not transferencia:
         messages.error(request, 'Transferência não encontrada.')
@@ -2049,10 +2038,8 @@ def requisicao_guia_recebimento(request, id):
         messages.error(request, 'Apenas requisições atendidas podem gerar guias de recebimento.')
         return redirect('stock:requisicoes:detail', id=id)
     
-    # Buscar transferência associada
-    from .models_stock import TransferenciaStock
-    codigo_transferencia = f"TRF{requisicao.codigo}"
-    transferencia = TransferenciaStock.objects.filter(codigo=codigo_transferencia).first()
+    # Buscar transferência associada (?transferencia=<código> para as restantes sucursais fornecedoras)
+    transferencia = _transferencia_da_guia(request, requisicao)
     
     if not transferencia:
         messages.error(request, 'Transferência não encontrada.')
@@ -2113,200 +2100,71 @@ def requisicao_transfer_stock(request, id):
             logger.info(f"Itens com quantidade atendida encontrados ✓")
             
             # Verificar se já existe uma transferência para esta requisição
-            from .models_stock import TransferenciaStock, ItemTransferencia, MovimentoItem, TipoMovimentoStock
-            
-            codigo_transferencia = f"TRF{requisicao.codigo}"
-            logger.info(f"Verificando transferência existente com código: {codigo_transferencia}")
-            
-            transferencia_existente = TransferenciaStock.objects.filter(
-                codigo=codigo_transferencia
-            ).first()
-            
-            if transferencia_existente:
-                if transferencia_existente.status == 'RASCUNHO':
-                    logger.info(f"Transferência em rascunho encontrada, deletando para reprocessar: {transferencia_existente.codigo}")
-                    transferencia_existente.delete()
-                else:
-                    logger.warning(f"Transferência já existe: {transferencia_existente.codigo}, Status: {transferencia_existente.status}")
-                    messages.warning(request, f'Já existe uma transferência para esta requisição: {transferencia_existente.codigo}')
-                    return redirect('stock:requisicoes:detail', id=requisicao.id)
-            
-            logger.info(f"Nenhuma transferência existente encontrada ✓")
-            
-            # Buscar tipo de movimento para transferência
-            tipo_transferencia = TipoMovimentoStock.objects.filter(
-                codigo='TRF_INTERNA'
-            ).first()
-            
-            if not tipo_transferencia:
-                tipo_transferencia = TipoMovimentoStock.objects.create(
-                    nome='Transferência Interna',
-                    codigo='TRF_INTERNA',
-                    descricao='Transferência de stock entre sucursais'
-                )
-            
-            # Criar transferência principal
-            # Para requisições internas, vamos usar a sucursal com maior estoque do primeiro item
-            from .models_stock import StockItem
-            
-            primeiro_item = itens_com_atendimento.first()
-            item_obj = primeiro_item.item or primeiro_item.produto
-            logger.info(f"Primeiro item: {item_obj.nome}, Quantidade atendida: {primeiro_item.quantidade_atendida}")
-            
-            # Buscar sucursal com maior estoque para este item (excluindo a sucursal solicitante)
-            stocks_disponiveis = StockItem.objects.filter(
-                item=item_obj
-            ).exclude(
-                sucursal=requisicao.sucursal_origem  # Excluir a sucursal solicitante
-            ).order_by('-quantidade_atual')
+            transferencias_existentes = list(_transferencias_da_requisicao(requisicao))
+            enviadas = [t for t in transferencias_existentes if t.status != 'RASCUNHO']
+            if enviadas:
+                logger.warning(f"Transferência já existe: {enviadas[0].codigo}, Status: {enviadas[0].status}")
+                messages.warning(request, f'Já existe uma transferência para esta requisição: {enviadas[0].codigo}')
+                return redirect('stock:requisicoes:detail', id=requisicao.id)
             
-            logger.info(f"Stocks disponíveis encontrados: {stocks_disponiveis.count()}")
+            for transferencia_existente in transferencias_existentes:
+                logger.info(f"Transferência em rascunho encontrada, deletando para reprocessar: {transferencia_existente.codigo}")
+                transferencia_existente.delete()
             
-            if not stocks_disponiveis.exists():
-                logger.error(f"Nenhum estoque disponível para {item_obj.nome}")
-                messages.error(request, f'Nenhum estoque disponível para {item_obj.nome}.')
+            # Sucursais fornecedoras: as reservas da aprovação e, para o que
+            # faltar, o menor número de sucursais que cobre todas as linhas
+            itens_requisicao = list(itens_com_atendimento.select_related('item'))
+            try:
+                plano = planear(requisicao, _quantidades_por_item(itens_requisicao, 'quantidade_atendida'))
+            except AlocacaoIncompletaError as e:
+                logger.error(f"Stock insuficiente para a requisição {requisicao.codigo}: {e.faltas}")
+                messages.error(request, _mensagem_faltas(e, itens_requisicao))
                 return redirect('stock:requisicoes:detail', id=requisicao.id)
             
-            sucursal_fornecedora = stocks_disponiveis.first().sucursal
-            logger.info(f"Sucursal fornecedora: {sucursal_fornecedora.nome}")
-            logger.info(f"Sucursal destino: {requisicao.sucursal_origem.nome}")
+            logger.info(f"Plano de fornecimento: {len(plano)} sucursal(is) para {len(itens_requisicao)} linhas")
             
-            logger.info(f"Criando transferência com código: {codigo_transferencia}")
-            transferencia = TransferenciaStock.objects.create(
-                codigo=codigo_transferencia,
-                sucursal_origem=sucursal_fornecedora,  # Sucursal que fornece
-                sucursal_destino=requisicao.sucursal_origem,  # Sucursal que recebe (quem solicitou)
-                observacoes=f"Transferência baseada na requisição {requisicao.codigo}",
-                criado_por=request.user
-            )
-            logger.info(f"Transferência criada com sucesso: {transferencia.id}")
-            
-            # Criar itens da transferência e movimentos de stock
-            logger.info(f"Criando itens da transferência...")
-            for item_requisicao in itens_com_atendimento:
-                if item_requisicao.quantidade_atendida > 0:
-                    logger.info(f"Processando item: {item_requisicao.item or item_requisicao.produto}, Quantidade: {item_requisicao.quantidade_atendida}")
-                    
-                    # Criar item da transferência
-                    item_transferencia = ItemTransferencia.objects.create(
-                        transferencia=transferencia,
-                        item=item_requisicao.item or item_requisicao.produto,
-                        quantidade_solicitada=item_requisicao.quantidade_atendida,
-                        quantidade_recebida=0,  # Será atualizada quando confirmar recebimento
-                        observacoes=f"Transferência para requisição {requisicao.codigo}"
-                    )
-                    logger.info(f"Item da transferência criado: {item_transferencia.id}")
-                    
-                    # Criar movimento de saída (sucursal fornecedora)
-                    item_obj = item_requisicao.item or item_requisicao.produto
-                    preco_custo = item_obj.preco_custo if hasattr(item_obj, 'preco_custo') else 0
-                    
-                    # Buscar tipo de movimento para saída
-                    tipo_saida = TipoMovimentoStock.objects.filter(
-                        codigo='SAIDA'
-                    ).first()
-                    
-                    if not tipo_saida:
-                        tipo_saida = TipoMovimentoStock.objects.create(
-                            nome='Saída de Stock',
-                            codigo='SAIDA',
-                            descricao='Saída de stock da sucursal',
-                            aumenta_estoque=False
-                        )
-                    
-                    # Movimento de SAÍDA (sucursal fornecedora)
-                    MovimentoItem.objects.create(
-                        codigo=f"MOV{transferencia.codigo}{item_transferencia.id}S",
-                        item=item_obj,
-                        tipo_movimento=tipo_saida,
-                        sucursal=sucursal_fornecedora,  # Sucursal que fornece
-                        quantidade=item_requisicao.quantidade_atendida,
-                        preco_unitario=preco_custo,
-                        valor_total=preco_custo * item_requisicao.quantidade_atendida,
-                        referencia=f"Transferência {transferencia.codigo}",
-                        observacoes=f"Saída para requisição {requisicao.codigo}",
-                        usuario=request.user
-                    )
-                    
-                    # Buscar tipo de movimento para entrada
-                    tipo_entrada = TipoMovimentoStock.objects.filter(
-                        codigo='ENT_COMPRA'
-                    ).first()
-                    
-                    if not tipo_entrada:
-                        tipo_entrada = TipoMovimentoStock.objects.create(
-                            nome='Entrada por Compra',
-                            codigo='ENT_COMPRA',
-                            descricao='Entrada de stock por compra',
-                            aumenta_estoque=True
-                        )
-                    
-                    # Movimento de ENTRADA (sucursal destino)
-                    MovimentoItem.objects.create(
-                        codigo=f"MOV{transferencia.codigo}{item_transferencia.id}E",
-                        item=item_obj,
-                        tipo_movimento=tipo_entrada,  # ENT_COMPRA (aumenta estoque)
-                        sucursal=requisicao.sucursal_origem,  # Sucursal que recebe (quem solicitou)
-                        quantidade=item_requisicao.quantidade_atendida,
-                        preco_unitario=preco_custo,
-                        valor_total=preco_custo * item_requisicao.quantidade_atendida,
-                        referencia=f"Transferência {transferencia.codigo}",
-                        observacoes=f"Entrada da requisição {requisicao.codigo}",
-                        usuario=request.user
-                    )
-            
-            # Marcar transferência como enviada (aguardando recebimento)
-            logger.info(f"Marcando transferência como ENVIADA...")
-            transferencia.status = 'ENVIADA'
-            transferencia.data_envio = timezone.now()
-            transferencia.save()
-            logger.info(f"Transferência marcada como ENVIADA ✓")
+            # Transferências, movimentos e estado da requisição numa só transacção
+            with transaction.atomic():
+                transferencias = criar_transferencias(requisicao, plano, usuario=request.user)
             
-            # Criar notificação para logística
-            logger.info(f"Criando notificação para logística...")
-            from .models_stock import NotificacaoLogisticaUnificada
+                # Criar notificação para logística (uma por transferência)
+                from .models_stock import NotificacaoLogisticaUnificada
             
-            # Verificar se já existe notificação para esta transferência
-            if not hasattr(transferencia, 'notificacao_logistica_unificada'):
-                # Determinar prioridade (manual ou baseada no valor)
-                prioridade_manual = request.session.get('prioridade_manual', '')
-                if prioridade_manual:
-                    prioridade = prioridade_manual
-                    # Limpar da session após uso
-                    if 'prioridade_manual' in request.session:
-                        del request.session['prioridade_manual']
-                else:
-                    # Prioridade automática baseada no valor e urgência
-                    valor_total = transferencia.valor_total
-                    if valor_total > 10000:  # Transferências de alto valor
-                        prioridade = 'ALTA'
-                    elif valor_total > 5000:
-                        prioridade = 'NORMAL'
+                # Prioridade manual (escolhida no preview) vale para todas
+                prioridade_manual = request.session.pop('prioridade_manual', '')
+                for transferencia_criada in transferencias:
+                    if prioridade_manual:
+                        prioridade = prioridade_manual
                     else:
-                        prioridade = 'BAIXA'
+                        # Prioridade automática baseada no valor
+                        valor_total = transferencia_criada.valor_total
+                        if valor_total > 10000:  # Transferências de alto valor
+                            prioridade = 'ALTA'
+                        elif valor_total > 5000:
+                            prioridade = 'NORMAL'
+                        else:
+                            prioridade = 'BAIXA'
                 
-                # Criar notificação unificada
-                notificacao = NotificacaoLogisticaUnificada.objects.create(
-                    tipo_operacao='TRANSFERENCIA',
-                    transferencia=transferencia,
-                    status='PENDENTE',
-                    prioridade=prioridade,
-                    usuario_notificacao=request.user,
-                    observacoes=f'Transferência automática da requisição {requisicao.codigo}'
-                )
-                logger.info(f"Notificação criada: {notificacao.id} ✓")
-            else:
-                logger.info(f"Notificação já existe para esta transferência ✓")
+                    notificacao = NotificacaoLogisticaUnificada.objects.create(
+                        tipo_operacao='TRANSFERENCIA',
+                        transferencia=transferencia_criada,
+                        status='PENDENTE',
+                        prioridade=prioridade,
+                        usuario_notificacao=request.user,
+                        observacoes=f'Transferência automática da requisição {requisicao.codigo}'
+                    )
+                    logger.info(f"Notificação criada: {notificacao.id} ✓")
             
-            # Marcar requisição como atendida
-            logger.info(f"Marcando requisição como ATENDIDA...")
-            requisicao.status = 'ATENDIDA'
-            requisicao.data_atendimento = timezone.now()
-            requisicao.save()
-            logger.info(f"Requisição marcada como ATENDIDA ✓")
+                # Marcar requisição como atendida
+                logger.info(f"Marcando requisição como ATENDIDA...")
+                requisicao.status = 'ATENDIDA'
+                requisicao.data_atendimento = timezone.now()
+                requisicao.save()
+                logger.info(f"Requisição marcada como ATENDIDA ✓")
             
             logger.info(f"=== TRANSFERÊNCIA CONCLUÍDA COM SUCESSO ===")
-            messages.success(request, f'Transferência de stock criada com sucesso! Código: {transferencia.codigo}')
+            codigos = ', '.join(t.codigo for t in transferencias)
+            messages.success(request, f'Transferência de stock criada com sucesso! Código(s): {codigos}')
             return redirect('stock:requisicoes:detail', id=requisicao.id)
             
         except Exception as e:
@@ -2393,6 +2251,7 @@ def compra_externa_delete(request, id):
 
 
 @login_required
+@resposta_condicional('stock', 'catalogo', 'sucursais', max_age=0)
 def api_stock_por_sucursal(request):
     """API para buscar stock de um item específico em todas as sucursais"""
     item_id = request.GET.get('item_id')
@@ -2412,7 +2271,7 @@ def api_stock_por_sucursal(request):
             stocks_data.append({
                 'sucursal_id': stock.sucursal.id,
                 'sucursal_nome': stock.sucursal.nome,
-                'quantidade_disponivel': float(stock.quantidade_atual),
+                'quantidade_disponivel': float(stock.quantidade_disponivel),
                 'quantidade_reservada': float(stock.quantidade_reservada),
                 'estoque_minimo': float(item.estoque_minimo),
                 'estoque_maximo': float(item.estoque_maximo),
@@ -2495,8 +2354,6 @@ def api_sugestao_quantidade(request):
 @require_stock_access
 def verificar_stock_baixo(request):
     """Verificar itens com stock baixo por sucursal"""
-    from django.db.models import F
-    
     # Obter parâmetros de filtro
     sucursal_id = request.GET.get('sucursal', '').strip()
     
@@ -2504,7 +2361,7 @@ def verificar_stock_baixo(request):
     itens_stock_baixo = StockItem.objects.select_related(
         'item', 'sucursal'
     ).filter(
-        quantidade_atual__lte=F('item__estoque_minimo')
+        abaixo_minimo=True
     ).order_by('sucursal__nome', 'item__tipo', 'item__nome')
     
     # Aplicar filtro de sucursal se especificado
@@ -2525,7 +2382,7 @@ def verificar_stock_baixo(request):
         
         sucursais_com_stock_baixo[sucursal.id]['itens'].append(stock_item)
         sucursais_com_stock_baixo[sucursal.id]['total_itens'] += 1
-        sucursais_com_stock_baixo[sucursal.id]['valor_total'] += stock_item.item.preco_custo * stock_item.quantidade_atual
+        sucursais_com_stock_baixo[sucursal.id]['valor_total'] += stock_item.valor_estoque
     
     # Estatísticas gerais
     total_sucursais_afetadas = len(sucursais_com_stock_baixo)
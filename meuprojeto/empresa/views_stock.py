@@ -22,7 +22,11 @@ from .models_stock import (
     Item, MovimentoItem
 )
 from .models_base import Sucursal
-from .decorators import require_stock_access, require_sucursal_access, get_user_sucursais
+from .decorators import require_stock_access, require_sucursal_access, resposta_condicional, get_user_sucursais
+from .services.agregacao import contar_por_filtro, estatisticas_estado
+from .services.analise_sucursais import matriz_sucursais
+from .services.metricas_cache import metricas_dashboard_stock, metricas_stock_main
+from .services.particionamento_movimentos import filtrar_periodo
 
 # =============================================================================
 # HELPER FUNCTIONS
@@ -31,23 +35,18 @@ from .decorators import require_stock_access, require_sucursal_access, get_user_
 def get_chart_data_for_entity(entity_model, status_field='status', categoria_field='categoria'):
     """Helper function to get chart data for any entity (Produto, Material, etc.)"""
     try:
-        # Status data
-        ativos = entity_model.objects.filter(**{status_field: 'ATIVO'}).count()
-        inativos = entity_model.objects.filter(**{status_field: 'INATIVO'}).count()
-        pendentes = entity_model.objects.filter(**{status_field: 'PENDENTE'}).count()
-        
-        # Estoque baixo (if applicable)
-        estoque_baixo = 0
-        if hasattr(entity_model, 'quantidade_atual') and hasattr(entity_model, 'estoque_minimo'):
-            estoque_baixo = entity_model.objects.filter(
-                quantidade_atual__lte=F('estoque_minimo')
-            ).count()
+        # Status data e estoque baixo (if applicable), numa única consulta
+        estado = estatisticas_estado(
+            entity_model.objects.all(),
+            status_field=status_field,
+            com_estoque_baixo=hasattr(entity_model, 'quantidade_atual') and hasattr(entity_model, 'estoque_minimo'),
+        )
         
         # Top categorias
         if categoria_field:
             # Para o modelo Item unificado, contar usando o campo 'categoria'
             top_categorias = CategoriaProduto.objects.annotate(
-                total_items=Count('item')
+                total_items=Count('itens')
             ).filter(
                 Q(tipo='PRODUTO') | Q(tipo='AMBOS') | Q(tipo='TODOS'),
                 ativa=True
@@ -60,10 +59,7 @@ def get_chart_data_for_entity(entity_model, status_field='status', categoria_fie
             categorias_data = json.dumps([], cls=DjangoJSONEncoder)
         
         return {
-            'ativos': ativos,
-            'inativos': inativos,
-            'pendentes': pendentes,
-            'estoque_baixo': estoque_baixo,
+            **estado,
             'categorias_count': CategoriaProduto.objects.filter(ativa=True).count(),
             'categorias_labels': categorias_labels,
             'categorias_data': categorias_data,
@@ -91,67 +87,10 @@ def stock_main(request):
     try:
         # Usuários podem ver todas as sucursais
         sucursais_permitidas = get_user_sucursais(request, for_modification=False)
-        
-        # Contadores de notificações
-        from .models_stock import NotificacaoStock
-        total_notificacoes = NotificacaoStock.objects.filter(
-            Q(usuario_destinatario=request.user) | Q(usuario_destinatario__isnull=True)
-        ).count()
-        
-        notificacoes_nao_lidas = NotificacaoStock.objects.filter(
-            Q(usuario_destinatario=request.user) | Q(usuario_destinatario__isnull=True),
-            lida=False
-        ).count()
-        
-        # Período para movimentações (últimos 30 dias)
-        from django.utils import timezone
-        from datetime import timedelta
-        data_limite = timezone.now() - timedelta(days=30)
-        
-        # Métricas de Logística
-        from .models_stock import RastreamentoEntrega
-        
-        # Rastreamentos em trânsito
-        rastreamentos_em_transito = RastreamentoEntrega.objects.filter(
-            status_atual__in=['COLETADO', 'EM_TRANSITO', 'EM_DISTRIBUICAO']
-        ).count()
-        
-        # Entregas pendentes (últimos 7 dias)
-        from datetime import timedelta
-        data_limite_entregas = timezone.now() - timedelta(days=7)
-        entregas_pendentes = RastreamentoEntrega.objects.filter(
-            status_atual='PENDENTE',
-            data_criacao__gte=data_limite_entregas
-        ).count()
 
-        context = {
-            # Contadores principais - estatísticas gerais
-            'total_produtos': Item.objects.filter(status='ATIVO', tipo='PRODUTO').count(),
-            'total_materiais': Item.objects.filter(status='ATIVO', tipo='MATERIAL').count(),
-            'total_fornecedores': Fornecedor.objects.filter(status='ATIVO').count(),
-            'total_movimentos': MovimentoItem.objects.filter(data_movimento__gte=data_limite).count(),
-            
-            # Contadores de notificações
-            'total_notificacoes': total_notificacoes,
-            'notificacoes_nao_lidas': notificacoes_nao_lidas,
-            
-            # Dados adicionais para contexto
-            'total_receitas': Receita.objects.filter(status='ATIVA').count(),
-            'total_categorias': CategoriaProduto.objects.filter(ativa=True).count(),
-            'sucursais': sucursais_permitidas,
-            'produtos_baixo_estoque': StockItem.objects.select_related('item').filter(
-                item__tipo='PRODUTO',
-                quantidade_atual__lte=F('item__estoque_minimo')
-            ).count(),
-            'materiais_baixo_estoque': StockItem.objects.select_related('item').filter(
-                item__tipo='MATERIAL',
-                quantidade_atual__lte=F('item__estoque_minimo')
-            ).count(),
-            
-            # Métricas de Logística
-            'rastreamentos_em_transito': rastreamentos_em_transito,
-            'entregas_pendentes': entregas_pendentes,
-        }
+        # Contadores (produtos, movimentos, notificações, stock baixo, logística) do cache de métricas
+        context = metricas_stock_main(request.user)
+        context['sucursais'] = sucursais_permitidas
         return render(request, 'stock/main.html', context)
     except Exception as e:
         logger.error(f"Erro na página principal do stock: {e}")
@@ -1113,6 +1052,7 @@ def stock_produto_sucursal(request, sucursal_id, produto_id):
 # =============================================================================
 
 @login_required
+@resposta_condicional('catalogo', max_age=60)
 def api_produtos_search(request):
     """API para busca de produtos"""
     try:
@@ -1138,12 +1078,13 @@ def api_produtos_search(request):
                 'categoria': produto.categoria.nome if produto.categoria else '',
             })
         
-        return JsonResponse({'results': results}, cls=DjangoJSONEncoder)
+        return JsonResponse({'results': results}, encoder=DjangoJSONEncoder)
     except Exception as e:
         logger.error(f"Erro na API de busca de produtos: {e}")
         return JsonResponse({'error': 'Erro interno do servidor'}, status=500)
 
 @login_required
+@resposta_condicional('catalogo', max_age=60)
 def api_fornecedores_search(request):
     """API para busca de fornecedores"""
     try:
@@ -1166,7 +1107,7 @@ def api_fornecedores_search(request):
                 'tipo': fornecedor.get_tipo_display(),
             })
         
-        return JsonResponse({'results': results}, cls=DjangoJSONEncoder)
+        return JsonResponse({'results': results}, encoder=DjangoJSONEncoder)
     except Exception as e:
         logger.error(f"Erro na API de busca de fornecedores: {e}")
         return JsonResponse({'error': 'Erro interno do servidor'}, status=500)
@@ -1175,64 +1116,25 @@ def api_fornecedores_search(request):
 @login_required
 def stock_dashboard(request):
     """Dashboard executivo com métricas importantes"""
-    from .models_stock import (
-        RequisicaoCompraExterna, RequisicaoStock, MovimentoItem, 
-        StockItem, Item, Sucursal
-    )
-    from django.db.models import Count, Sum, Q, F
-    from datetime import datetime, timedelta
-    from django.utils import timezone
-    
-    # Período de análise (últimos 30 dias)
-    hoje = timezone.now()
-    ultimos_30_dias = hoje - timedelta(days=30)
-    
-    # Métricas de Requisições
-    total_requisicoes = RequisicaoStock.objects.count() + RequisicaoCompraExterna.objects.count()
-    requisicoes_pendentes = (
-        RequisicaoStock.objects.filter(status='PENDENTE').count() + 
-        RequisicaoCompraExterna.objects.filter(status='PENDENTE').count()
-    )
-    requisicoes_aprovadas = (
-        RequisicaoStock.objects.filter(status='APROVADA').count() + 
-        RequisicaoCompraExterna.objects.filter(status='APROVADA').count()
-    )
-    requisicoes_finalizadas = (
-        RequisicaoStock.objects.filter(status='ATENDIDA').count() + 
-        RequisicaoCompraExterna.objects.filter(status='FINALIZADA').count()
-    )
-    
-    # Métricas de Movimentações
-    total_movimentacoes = MovimentoItem.objects.count()
-    movimentacoes_entrada = MovimentoItem.objects.filter(
-        tipo_movimento__nome__icontains='entrada'
-    ).count()
-    movimentacoes_saida = MovimentoItem.objects.filter(
-        tipo_movimento__nome__icontains='saída'
-    ).count()
-    
-    # Valor total em movimentações (últimos 30 dias)
-    valor_movimentacoes = MovimentoItem.objects.filter(
-        data_movimento__gte=ultimos_30_dias
-    ).aggregate(total=Sum('valor_total'))['total'] or 0
-    
-    # Itens com stock baixo
-    itens_stock_baixo = StockItem.objects.filter(
-        quantidade_atual__lte=F('item__estoque_minimo')
-    ).count()
+    from .models_stock import MovimentoItem
     
-    # Requisições por sucursal
-    requisicoes_por_sucursal = []
-    for sucursal in Sucursal.objects.all():
-        count_internas = RequisicaoStock.objects.filter(sucursal_origem=sucursal).count()
-        count_externas = RequisicaoCompraExterna.objects.filter(sucursal_solicitante=sucursal).count()
-        if count_internas > 0 or count_externas > 0:
-            requisicoes_por_sucursal.append({
-                'sucursal': sucursal.nome,
-                'total': count_internas + count_externas,
-                'internas': count_internas,
-                'externas': count_externas
-            })
+    # Contadores do cache de métricas; as movimentações recentes são sempre lidas
+    metricas = metricas_dashboard_stock()
+    itens_stock_baixo = metricas['itens_stock_baixo']
+    requisicoes_antigas = metricas['requisicoes_antigas']
+    movimentacoes_sem_usuario = metricas['movimentacoes_sem_usuario']
+    
+    # Requisições por sucursal (matriz por sucursal, do cache)
+    requisicoes_por_sucursal = [
+        {
+            'sucursal': linha['sucursal'],
+            'total': linha['requisicoes_feitas'],
+            'internas': linha['requisicoes_internas'],
+            'externas': linha['requisicoes_externas'],
+        }
+        for linha in matriz_sucursais()
+        if linha['requisicoes_feitas'] > 0
+    ]
     
     # Movimentações recentes (últimas 10)
     movimentacoes_recentes = MovimentoItem.objects.select_related(
@@ -1253,17 +1155,6 @@ def stock_dashboard(request):
         })
     
     # Requisições pendentes há muito tempo
-    requisicoes_antigas = (
-        RequisicaoStock.objects.filter(
-            status='PENDENTE',
-            data_criacao__lt=hoje - timedelta(days=7)
-        ).count() +
-        RequisicaoCompraExterna.objects.filter(
-            status='PENDENTE',
-            data_criacao__lt=hoje - timedelta(days=7)
-        ).count()
-    )
-    
     if requisicoes_antigas > 0:
         alertas.append({
             'tipo': 'danger',
@@ -1274,7 +1165,6 @@ def stock_dashboard(request):
         })
     
     # Movimentações sem usuário
-    movimentacoes_sem_usuario = MovimentoItem.objects.filter(usuario__isnull=True).count()
     if movimentacoes_sem_usuario > 0:
         alertas.append({
             'tipo': 'info',
@@ -1285,15 +1175,7 @@ def stock_dashboard(request):
         })
     
     context = {
-        'total_requisicoes': total_requisicoes,
-        'requisicoes_pendentes': requisicoes_pendentes,
-        'requisicoes_aprovadas': requisicoes_aprovadas,
-        'requisicoes_finalizadas': requisicoes_finalizadas,
-        'total_movimentacoes': total_movimentacoes,
-        'movimentacoes_entrada': movimentacoes_entrada,
-        'movimentacoes_saida': movimentacoes_saida,
-        'valor_movimentacoes': valor_movimentacoes,
-        'itens_stock_baixo': itens_stock_baixo,
+        **metricas,
         'requisicoes_por_sucursal': requisicoes_por_sucursal,
         'movimentacoes_recentes': movimentacoes_recentes,
         'alertas': alertas,
@@ -1305,10 +1187,17 @@ def stock_dashboard(request):
 # Placeholder views para funcionalidades futuras
 @login_required
 def stock_movimentos(request):
-    """Lista de movimentações de stock (SISTEMA UNIFICADO)"""
-    from .models_stock import MovimentoItem, TipoMovimentoStock, Sucursal
-    from django.db.models import Count, Sum, Q, F
-    from django.core.paginator import Paginator
+    """
+    Lista de movimentações de stock (SISTEMA UNIFICADO).
+
+    As estatísticas vêm de uma única agregação condicional e a listagem é
+    paginada por chave (data_movimento, id), com os dados do item anotados
+    na própria consulta: cada pedido lê apenas uma página de movimentos.
+    """
+    from .models_stock import Item, MovimentoItem, Sucursal
+    from .services.paginacao import paginar_keyset
+    from django.db.models import Count, Sum, Q, F, Value, CharField
+    from django.db.models.functions import Lower
     from datetime import datetime
     
     # Obter parâmetros de filtro
@@ -1320,9 +1209,7 @@ def stock_movimentos(request):
     tipo_item = request.GET.get('tipo_item', '').strip()  # 'produto', 'material', ou ''
     
     # Buscar movimentações do sistema unificado
-    movimentos = MovimentoItem.objects.select_related(
-        'item', 'sucursal', 'tipo_movimento', 'usuario'
-    ).order_by('-data_movimento')
+    movimentos = MovimentoItem.objects.all()
     
     # Aplicar filtros
     if search_query:
@@ -1342,91 +1229,77 @@ def stock_movimentos(request):
     if data_inicio:
         try:
             data_inicio_obj = datetime.strptime(data_inicio, '%Y-%m-%d').date()
-            movimentos = movimentos.filter(data_movimento__date__gte=data_inicio_obj)
+            movimentos = filtrar_periodo(movimentos, data_inicio=data_inicio_obj)
         except ValueError:
             pass
     
     if data_fim:
         try:
             data_fim_obj = datetime.strptime(data_fim, '%Y-%m-%d').date()
-            movimentos = movimentos.filter(data_movimento__date__lte=data_fim_obj)
+            movimentos = filtrar_periodo(movimentos, data_fim=data_fim_obj)
         except ValueError:
             pass
     
     if tipo_item:
         movimentos = movimentos.filter(item__tipo__iexact=tipo_item)
     
-    # Adicionar informações extras para compatibilidade com template
-    for movimento in movimentos:
-        movimento.item_tipo = movimento.item.tipo.lower()  # 'produto' ou 'material'
-        movimento.item_nome = movimento.item.nome
-        movimento.item_codigo = movimento.item.codigo
-        movimento.item_especifico = movimento.item.get_tipo_especifico_display()
-    
-    all_movements = list(movimentos)
-    
-    # Estatísticas (baseadas nos filtros aplicados)
-    total_movimentos = len(all_movements)
-    movimentos_entrada = len([m for m in all_movements if 'entrada' in m.tipo_movimento.nome.lower()])
-    movimentos_saida = len([m for m in all_movements if 'saída' in m.tipo_movimento.nome.lower()])
-    movimentos_ajuste = len([m for m in all_movements if 'ajuste' in m.tipo_movimento.nome.lower()])
-    
-    # Valor total movimentado
-    valor_total = sum(m.valor_total for m in all_movements)
-    
-    # Paginação manual
-    page_number = int(request.GET.get('page', 1))
-    items_per_page = 20
-    start_index = (page_number - 1) * items_per_page
-    end_index = start_index + items_per_page
-    
-    page_movements = all_movements[start_index:end_index]
-    
-    # Criar objeto de paginação manual
-    class ManualPage:
-        def __init__(self, objects, page_number, items_per_page, total_count):
-            self.object_list = objects
-            self.number = page_number
-            self.paginator = ManualPaginator(total_count, items_per_page)
-        
-        def __iter__(self):
-            return iter(self.object_list)
-        
-        def has_other_pages(self):
-            return self.paginator.num_pages > 1
-        
-        def has_previous(self):
-            return self.number > 1
-        
-        def has_next(self):
-            return self.number < self.paginator.num_pages
-        
-        @property
-        def previous_page_number(self):
-            return self.number - 1 if self.has_previous() else None
-        
-        @property
-        def next_page_number(self):
-            return self.number + 1 if self.has_next() else None
+    # Estatísticas (baseadas nos filtros aplicados) numa única consulta
+    estatisticas = movimentos.aggregate(
+        total=Count('id'),
+        entrada=Count('id', filter=Q(tipo_movimento__nome__icontains='entrada')),
+        saida=Count('id', filter=Q(tipo_movimento__nome__icontains='saída')),
+        ajuste=Count('id', filter=Q(tipo_movimento__nome__icontains='ajuste')),
+        valor_total=Sum('valor_total'),
+    )
+    total_movimentos = estatisticas['total']
+    
+    # Informações do item para o template, calculadas em SQL
+    tipo_especifico = [
+        When(item__tipo='PRODUTO', item__produto_tipo=valor, then=Value(nome))
+        for valor, nome in Item.PRODUTO_TIPO_CHOICES
+    ] + [
+        When(~Q(item__tipo='PRODUTO') & Q(item__material_tipo=valor), then=Value(nome))
+        for valor, nome in Item.MATERIAL_TIPO_CHOICES
+    ]
+    listagem = movimentos.select_related('sucursal', 'tipo_movimento', 'usuario').annotate(
+        item_tipo=Lower('item__tipo'),
+        item_nome=F('item__nome'),
+        item_codigo=F('item__codigo'),
+        item_especifico=Case(*tipo_especifico, default=Value('N/A'), output_field=CharField()),
+    )
     
-    class ManualPaginator:
-        def __init__(self, total_count, items_per_page):
-            self.count = total_count
-            self.per_page = items_per_page
-            self.num_pages = (total_count + items_per_page - 1) // items_per_page
+    # Paginação por chave (data_movimento, id)
+    try:
+        numero_pagina = int(request.GET.get('pagina', 1))
+    except ValueError:
+        numero_pagina = 1
+    page_obj = paginar_keyset(
+        listagem,
+        'data_movimento',
+        total=total_movimentos,
+        tamanho=20,
+        depois=request.GET.get('depois'),
+        antes=request.GET.get('antes'),
+        ultima=request.GET.get('ultima') == '1',
+        numero=numero_pagina,
+    )
     
-    page_obj = ManualPage(page_movements, page_number, items_per_page, total_movimentos)
+    # Filtros actuais para as ligações de paginação
+    filtros = request.GET.copy()
+    for chave in ('depois', 'antes', 'ultima', 'pagina', 'page'):
+        filtros.pop(chave, None)
     
     # Obter sucursais para o filtro
     sucursais = Sucursal.objects.all().order_by('nome')
     
     context = {
         'movimentos': page_obj,
+        'filtros_query': filtros.urlencode(),
         'total_movimentos': total_movimentos,
-        'movimentos_entrada': movimentos_entrada,
-        'movimentos_saida': movimentos_saida,
-        'movimentos_ajuste': movimentos_ajuste,
-        'valor_total': valor_total,
+        'movimentos_entrada': estatisticas['entrada'],
+        'movimentos_saida': estatisticas['saida'],
+        'movimentos_ajuste': estatisticas['ajuste'],
+        'valor_total': estatisticas['valor_total'] or 0,
         'sucursais': sucursais,
         'search_query': search_query,
         'tipo': tipo,
@@ -1444,8 +1317,8 @@ def stock_movimentos(request):
 @require_http_methods(["GET", "POST"])
 def stock_movimento_add(request):
     """Adicionar movimentação de stock unificada"""
-    from .models_stock import MovimentoItem, Item, TipoMovimentoStock, Sucursal, StockItem
-    from django.db import transaction
+    from .models_stock import Item, TipoMovimentoStock, Sucursal, StockItem
+    from .services.stock_ledger import lancar_movimentos_em_lote, StockInsuficienteError
     from django.contrib import messages
     from decimal import Decimal
     from django.core.exceptions import ValidationError
@@ -1487,59 +1360,31 @@ def stock_movimento_add(request):
             return redirect('stock:movimento_add')
         
         try:
-            with transaction.atomic():
-                sucursal = Sucursal.objects.get(id=sucursal_id)
-                tipo_movimento = TipoMovimentoStock.objects.get(id=tipo_movimento_id)
-                
-                if tipo_item == 'produto':
-                    produto = Item.objects.get(id=produto_id, tipo='PRODUTO')
-                    
-                    # Verificar se há estoque suficiente para saída
-                    if not tipo_movimento.aumenta_estoque:
-                        estoque_atual = StockItem.objects.filter(
-                            item=produto, 
-                            sucursal=sucursal
-                        ).first()
-                        
-                        if not estoque_atual or estoque_atual.quantidade_atual < int(quantidade):
-                            messages.error(request, f'Estoque insuficiente. Disponível: {estoque_atual.quantidade_atual if estoque_atual else 0} unidades.')
-                            return redirect('stock:movimento_add')
-                    
-                    # Criar movimento de produto
-                    movimento = MovimentoStock(
-                        produto=produto,
-                        sucursal=sucursal,
-                        tipo_movimento=tipo_movimento,
-                        quantidade=int(quantidade),
-                        preco_unitario=Decimal(preco_unitario),
-                        referencia=referencia,
-                        observacoes=observacoes,
-                        usuario=request.user
-                    )
-                    movimento.save()
-                    
-                    # Movimento registrado com sucesso
-                    
-                else:  # material
-                    material = Item.objects.get(id=material_id, tipo='MATERIAL')
-                    
-                    # Criar movimento de material
-                    movimento = MovimentoItem(
-                        material=material,
-                        sucursal=sucursal,
-                        tipo_movimento=tipo_movimento,
-                        quantidade=int(quantidade),
-                        preco_unitario=Decimal(preco_unitario),
-                        referencia=referencia,
-                        observacoes=observacoes,
-                        usuario=request.user
-                    )
-                    movimento.save()
-                    
-                    # Movimento registrado com sucesso
-                
-                return redirect('stock:movimentos')
-                
+            sucursal = Sucursal.objects.get(id=sucursal_id)
+            tipo_movimento = TipoMovimentoStock.objects.get(id=tipo_movimento_id)
+            
+            if tipo_item == 'produto':
+                item = Item.objects.get(id=produto_id, tipo='PRODUTO')
+            else:  # material
+                item = Item.objects.get(id=material_id, tipo='MATERIAL')
+            
+            # O ledger valida o saldo na própria actualização (sem leitura prévia)
+            lancar_movimentos_em_lote([{
+                'item': item,
+                'sucursal': sucursal,
+                'tipo_movimento': tipo_movimento,
+                'quantidade': int(quantidade),
+                'preco_unitario': Decimal(preco_unitario),
+                'referencia': referencia,
+                'observacoes': observacoes,
+            }], usuario=request.user)
+            
+            return redirect('stock:movimentos')
+            
+        except StockInsuficienteError:
+            estoque_atual = StockItem.objects.filter(item_id=item.id, sucursal_id=sucursal.id).first()
+            messages.error(request, f'Estoque insuficiente. Disponível: {estoque_atual.quantidade_atual if estoque_atual else 0} unidades.')
+            return redirect('stock:movimento_add')
         except ValidationError as e:
             messages.error(request, f'Erro de validação: {str(e)}')
         except Exception as e:
@@ -1762,13 +1607,11 @@ def stock_relatorios(request):
     
     # Itens com estoque baixo
     produtos_estoque_baixo = StockItem.objects.filter(
-        item__tipo='PRODUTO',
-        quantidade_atual__lt=F('item__estoque_minimo')
+        abaixo_minimo=True, item__tipo='PRODUTO'
     ).count()
     
     materiais_estoque_baixo = StockItem.objects.filter(
-        item__tipo='MATERIAL',
-        quantidade_atual__lt=F('item__estoque_minimo')
+        abaixo_minimo=True, item__tipo='MATERIAL'
     ).count()
     
     total_estoque_baixo = produtos_estoque_baixo + materiais_estoque_baixo
@@ -1816,10 +1659,10 @@ def relatorio_movimentacoes(request):
         data_fim = datetime.now().strftime('%Y-%m-%d')
     
     # Filtrar movimentações
-    movimentacoes = MovimentoItem.objects.select_related(
-        'item', 'tipo_movimento', 'sucursal'
-    ).filter(
-        data_movimento__date__range=[data_inicio, data_fim]
+    movimentacoes = filtrar_periodo(
+        MovimentoItem.objects.select_related('item', 'tipo_movimento', 'sucursal'),
+        data_inicio=datetime.strptime(data_inicio, '%Y-%m-%d').date(),
+        data_fim=datetime.strptime(data_fim, '%Y-%m-%d').date(),
     ).order_by('-data_movimento')
     
     if tipo_movimento:
@@ -1850,16 +1693,12 @@ def relatorio_estoque_minimo(request):
     
     # Itens com estoque abaixo do mínimo
     itens_baixo_estoque = StockItem.objects.select_related('item', 'sucursal').filter(
-        quantidade_atual__lt=models.F('item__estoque_minimo'),
-        item__estoque_minimo__gt=0
+        abaixo_minimo=True
     ).order_by('item__nome')
     
     # Estatísticas
     total_itens_baixo = itens_baixo_estoque.count()
-    valor_total_baixo = sum(
-        item.item.preco_custo * item.quantidade_atual 
-        for item in itens_baixo_estoque
-    )
+    valor_total_baixo = itens_baixo_estoque.aggregate(total=models.Sum('valor_estoque'))['total'] or 0
     
     context = {
         'itens_baixo_estoque': itens_baixo_estoque,
@@ -1876,12 +1715,24 @@ def relatorio_ordens_compra(request):
     """Relatório de Ordens de Compra"""
     from .models_stock import OrdemCompra
     
-    # Filtrar ordens de compra
-    ordens = OrdemCompra.objects.select_related('fornecedor', 'sucursal_destino').order_by('-data_criacao')
-    
-    # Estatísticas
-    total_ordens = ordens.count()
-    valor_total_ordens = sum(ordem.valor_total for ordem in ordens)
+    # Filtrar ordens de compra (totais guardados nas ordens, número de itens anotado)
+    ordens = OrdemCompra.objects.select_related(
+        'fornecedor', 'sucursal_destino'
+    ).with_totals().order_by('-data_criacao')
+    
+    # Estatísticas numa consulta
+    estatisticas = contar_por_filtro(OrdemCompra.objects.all(), total_ordens=None, valor_total=Sum('valor_total'))
+    total_ordens = estatisticas['total_ordens']
+    valor_total_ordens = estatisticas['valor_total'] or 0
+    
+    # Valor por fornecedor
+    ordens_por_fornecedor = list(
+        OrdemCompra.objects.values('fornecedor__nome').annotate(
+            total=Count('id'), valor_total=Sum('valor_total')
+        ).order_by('-valor_total')
+    )
+    for fornecedor in ordens_por_fornecedor:
+        fornecedor['percentual'] = (fornecedor['valor_total'] / valor_total_ordens * 100) if valor_total_ordens else 0
     
     # Agrupar por status
     ordens_por_status = {}
@@ -1894,8 +1745,10 @@ def relatorio_ordens_compra(request):
     context = {
         'ordens': ordens,
         'ordens_por_status': ordens_por_status,
+        'ordens_por_fornecedor': ordens_por_fornecedor,
         'total_ordens': total_ordens,
         'valor_total_ordens': valor_total_ordens,
+        'valor_total': valor_total_ordens,
         'data_relatorio': timezone.now(),
     }
     
@@ -1939,10 +1792,17 @@ def relatorio_transferencias(request):
     # Transferências entre sucursais
     transferencias = TransferenciaStock.objects.select_related(
         'sucursal_origem', 'sucursal_destino', 'criado_por'
-    ).order_by('-data_criacao')
-    
-    # Estatísticas
-    total_transferencias = transferencias.count()
+    ).with_totals().order_by('-data_criacao')
+    
+    # Estatísticas numa consulta
+    estatisticas = contar_por_filtro(
+        TransferenciaStock.objects.all(),
+        total_transferencias=None,
+        transferencias_pendentes=Q(status__in=['RASCUNHO', 'PENDENTE', 'ENVIADA']),
+        transferencias_concluidas=Q(status='RECEBIDA'),
+        valor_total=Sum('valor_total'),
+    )
+    total_transferencias = estatisticas['total_transferencias']
     
     # Agrupar por sucursal origem
     transferencias_por_origem = {}
@@ -1956,6 +1816,9 @@ def relatorio_transferencias(request):
         'transferencias': transferencias,
         'transferencias_por_origem': transferencias_por_origem,
         'total_transferencias': total_transferencias,
+        'transferencias_pendentes': estatisticas['transferencias_pendentes'],
+        'transferencias_concluidas': estatisticas['transferencias_concluidas'],
+        'valor_total': estatisticas['valor_total'] or 0,
         'data_relatorio': timezone.now(),
     }
     
@@ -1964,18 +1827,40 @@ def relatorio_transferencias(request):
 @login_required
 @require_stock_access
 def relatorio_estoque_atual(request):
-    """Relatório de Estoque Atual"""
+    """Relatório de Estoque Atual (ou de fecho de um dia passado, com ?data=AAAA-MM-DD)"""
     from .models_stock import StockItem, Item, Sucursal
+    from .services.stock_snapshots import saldos_em
+    from datetime import datetime
     
-    # Obter todos os itens com stock
-    itens_stock = StockItem.objects.select_related('item', 'sucursal').filter(
-        quantidade_atual__gt=0
-    ).order_by('item__nome')
+    # Data de posição: dias anteriores a hoje são lidos dos snapshots diários
+    data_posicao = None
+    if request.GET.get('data'):
+        try:
+            data_posicao = datetime.strptime(request.GET['data'], '%Y-%m-%d').date()
+        except ValueError:
+            messages.error(request, 'Data inválida. Use o formato AAAA-MM-DD.')
+        if data_posicao and data_posicao >= timezone.localdate():
+            data_posicao = None
+    
+    if data_posicao:
+        itens_stock = [
+            snapshot for snapshot in saldos_em(data_posicao).select_related('item', 'sucursal')
+            if snapshot.quantidade > 0
+        ]
+        itens_stock.sort(key=lambda snapshot: snapshot.item.nome)
+        for snapshot in itens_stock:
+            snapshot.quantidade_atual = snapshot.quantidade
+            snapshot.valor_estoque = snapshot.valor
+    else:
+        # Obter todos os itens com stock
+        itens_stock = StockItem.objects.select_related('item', 'sucursal').filter(
+            quantidade_atual__gt=0
+        ).order_by('item__nome')
     
     # Estatísticas
-    total_itens = itens_stock.count()
+    total_itens = len(itens_stock)
     total_sucursais = Sucursal.objects.count()
-    valor_total = sum(item.item.preco_custo * item.quantidade_atual for item in itens_stock)
+    valor_total = sum(item.valor_estoque for item in itens_stock)
     
     # Agrupar por sucursal e calcular valores
     estoque_por_sucursal = {}
@@ -1989,7 +1874,7 @@ def relatorio_estoque_atual(request):
             }
         
         # Adicionar valor total calculado
-        item.valor_total = item.item.preco_custo * item.quantidade_atual
+        item.valor_total = item.valor_estoque
         estoque_por_sucursal[sucursal_nome]['itens'].append(item)
         estoque_por_sucursal[sucursal_nome]['total_valor'] += item.valor_total
         estoque_por_sucursal[sucursal_nome]['total_itens'] += 1
@@ -2000,6 +1885,7 @@ def relatorio_estoque_atual(request):
         'total_itens': total_itens,
         'total_sucursais': total_sucursais,
         'valor_total': valor_total,
+        'data_posicao': data_posicao,
         'data_relatorio': timezone.now(),
     }
     
@@ -3,16 +3,24 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.core.paginator import Paginator
 from django.db.models import Q, Sum, F, Count
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_http_methods
+from django.db import transaction
 from django.utils import timezone
 from decimal import Decimal
+import csv
+import json
 
 from .models_stock import (
-    TransferenciaStock, ItemTransferencia, Item, StockItem, 
-    MovimentoItem, TipoMovimentoStock
+    TransferenciaStock, ItemTransferencia, Item, StockItem
 )
 from .models_base import Sucursal
-from .decorators import require_stock_access, get_user_sucursais
+from .decorators import require_stock_access, resposta_condicional, get_user_sucursais
+from .services import matriz_stock
+from .services.analise_sucursais import matriz_sucursais
+from .services.reservas_stock import ReservaIndisponivelError, libertar, reservar
+from .services.recebimentos import DocumentoJaRecebidoError, RecebimentoInvalidoError, receber_transferencia
+from .services.stock_ledger import StockInsuficienteError, lancar_movimentos_em_lote, obter_tipo_movimento
 
 
 # =============================================================================
@@ -57,8 +65,8 @@ def transferencias_list(request):
             Q(sucursal_origem_id=sucursal_id) | Q(sucursal_destino_id=sucursal_id)
         )
     
-    # Paginação
-    paginator = Paginator(transferencias, 20)
+    # Paginação (número de itens anotado, valores guardados na transferência)
+    paginator = Paginator(transferencias.with_totals(), 20)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
@@ -261,32 +269,42 @@ def transferencia_add_item(request, id):
             item = Item.objects.get(id=item_id)
             quantidade = int(quantidade)
             
-            # Verificar se já existe item para este produto/material
-            item_existente = ItemTransferencia.objects.filter(
-                transferencia=transferencia,
-                item=item
-            ).first()
-            
-            if item_existente:
-                item_existente.quantidade_solicitada += quantidade
-                item_existente.observacoes = observacoes
-                item_existente.save()
-                messages.success(request, f'Quantidade atualizada para {item.nome}.')
-            else:
-                ItemTransferencia.objects.create(
+            with transaction.atomic():
+                # Reservar na origem: a mesma unidade não pode ser prometida a duas transferências
+                reservar(
+                    [(item.id, transferencia.sucursal_origem_id, quantidade)],
                     transferencia=transferencia,
-                    item=item,
-                    quantidade_solicitada=quantidade,
-                    observacoes=observacoes
+                    usuario=request.user,
                 )
-            
-            # Promover transferência de RASCUNHO para PENDENTE se for o primeiro item
-            if transferencia.status == 'RASCUNHO':
-                transferencia.status = 'PENDENTE'
-                transferencia.save()
+                
+                # Verificar se já existe item para este produto/material
+                item_existente = ItemTransferencia.objects.filter(
+                    transferencia=transferencia,
+                    item=item
+                ).first()
+                
+                if item_existente:
+                    item_existente.quantidade_solicitada += quantidade
+                    item_existente.observacoes = observacoes
+                    item_existente.save()
+                    messages.success(request, f'Quantidade atualizada para {item.nome}.')
+                else:
+                    ItemTransferencia.objects.create(
+                        transferencia=transferencia,
+                        item=item,
+                        quantidade_solicitada=quantidade,
+                        observacoes=observacoes
+                    )
+                
+                # Promover transferência de RASCUNHO para PENDENTE se for o primeiro item
+                if transferencia.status == 'RASCUNHO':
+                    transferencia.status = 'PENDENTE'
+                    transferencia.save()
             
             return redirect('stock:transferencias:detail', id=id)
             
+        except ReservaIndisponivelError:
+            messages.error(request, f'Stock disponível insuficiente de {item.nome} em {transferencia.sucursal_origem.nome} para {quantidade} unidades.')
         except Item.DoesNotExist:
             messages.error(request, 'Item não encontrado.')
         except ValueError:
@@ -333,6 +351,7 @@ def transferencia_confirmar_envio(request, id):
         return redirect('stock:transferencias:detail', id=id)
     
     # Verificar se há estoque suficiente para todos os itens
+    saidas = []
     for item_transferencia in transferencia.itens.all():
         # Usar item se disponível (sistema unificado), senão usar produto (sistema antigo)
         if item_transferencia.item:
@@ -351,11 +370,36 @@ def transferencia_confirmar_envio(request, id):
         if not stock_origem or stock_origem.quantidade_atual < item_transferencia.quantidade_solicitada:
             messages.error(request, f'Estoque insuficiente para {item_obj.nome}. Disponível: {stock_origem.quantidade_atual if stock_origem else 0}')
             return redirect('stock:transferencias:detail', id=id)
+        saidas.append({
+            'item': stock_origem.item,
+            'sucursal': transferencia.sucursal_origem,
+            'quantidade': item_transferencia.quantidade_solicitada,
+            'preco_unitario': None,  # ao custo médio da origem
+            'referencia': f'Transferência {transferencia.codigo}',
+            'observacoes': f'Envio da transferência {transferencia.codigo} para {transferencia.sucursal_destino.nome}',
+        })
     
-    # Confirmar envio
-    transferencia.status = 'ENVIADA'
-    transferencia.data_envio = timezone.now()
-    transferencia.save()
+    # Confirmar envio: a saída da origem consome as reservas da transferência;
+    # a entrada no destino é lançada no recebimento
+    tipo_saida = obter_tipo_movimento(
+        'SAI_TRANSF', 'Saída por Transferência', False, 'Saída de stock enviada para outra sucursal'
+    )
+    try:
+        with transaction.atomic():
+            # Um segundo envio concorrente espera e encontra a transferência já enviada
+            if not TransferenciaStock.objects.select_for_update().filter(pk=transferencia.pk, status='PENDENTE').exists():
+                messages.error(request, 'Esta transferência já foi processada.')
+                return redirect('stock:transferencias:detail', id=id)
+            lancar_movimentos_em_lote(
+                [{**saida, 'tipo_movimento': tipo_saida} for saida in saidas],
+                usuario=request.user,
+                reservas=transferencia.reservas.all(),
+            )
+            transferencia.status = 'ENVIADA'
+            transferencia.data_envio = timezone.now()
+            transferencia.save()
+    except StockInsuficienteError as e:
+        messages.error(request, str(e))
     
     return redirect('stock:transferencias:detail', id=id)
 
@@ -391,74 +435,44 @@ def transferencia_apagar(request, id):
     return redirect('stock:transferencias:list')
 
 
+def _pode_receber(request, transferencia):
+    """Administradores ou utilizadores que podem modificar a sucursal de destino"""
+    if hasattr(request.user, 'perfil') and request.user.perfil.pode_acessar_todas_sucursais:
+        return True
+    sucursais_permitidas = get_user_sucursais(request, for_modification=True)
+    return transferencia.sucursal_destino_id in [s.id for s in sucursais_permitidas]
+
+
+def _quantidades_do_formulario(post, prefixo='quantidade_recebida_'):
+    """{id da linha: quantidade} dos campos `<prefixo><id>` do formulário"""
+    return {chave[len(prefixo):]: valor for chave, valor in post.items() if chave.startswith(prefixo)}
+
+
 @login_required
 @require_stock_access
 def transferencia_receber(request, id):
     """Receber transferência"""
-    transferencia = get_object_or_404(TransferenciaStock, id=id)
-    
-    # Verificar se é administrador
-    is_admin = request.user.perfil.pode_acessar_todas_sucursais if hasattr(request.user, 'perfil') else False
+    transferencia = get_object_or_404(TransferenciaStock.objects.select_related('sucursal_destino'), id=id)
     
     # Verificar permissões
-    if not is_admin:
-        sucursais_permitidas = get_user_sucursais(request, for_modification=True)
-        if transferencia.sucursal_destino.id not in [s.id for s in sucursais_permitidas]:
-            messages.error(request, 'Você não tem permissão para receber esta transferência.')
-            return redirect('stock:transferencias:detail', id=id)
+    if not _pode_receber(request, transferencia):
+        messages.error(request, 'Você não tem permissão para receber esta transferência.')
+        return redirect('stock:transferencias:detail', id=id)
     
     if transferencia.status != 'ENVIADA':
         messages.error(request, 'Esta transferência não está pronta para recebimento.')
         return redirect('stock:transferencias:detail', id=id)
     
     if request.method == 'POST':
-        # Processar recebimento
-        itens_recebidos = []
-        for item in transferencia.itens.all():
-            quantidade_recebida = request.POST.get(f'quantidade_recebida_{item.id}')
-            if quantidade_recebida:
-                try:
-                    quantidade_recebida = int(quantidade_recebida)
-                    if quantidade_recebida > 0:
-                        item.quantidade_recebida = quantidade_recebida
-                        item.save()
-                        itens_recebidos.append(item)
-                except ValueError:
-                    continue
-        
-        if not itens_recebidos:
-            messages.error(request, 'Nenhum item foi recebido.')
-            return redirect('stock:transferencias:detail', id=id)
-        
-        # Confirmar recebimento
-        transferencia.status = 'RECEBIDA'
-        transferencia.data_recebimento = timezone.now()
-        transferencia.confirmado_por = request.user
-        transferencia.save()
-        
-        # Criar movimentações para auditoria (o signal atualizará o stock automaticamente)
-        tipo_saida = TipoMovimentoStock.objects.filter(aumenta_estoque=False).first()
-        tipo_entrada = TipoMovimentoStock.objects.filter(aumenta_estoque=True).first()
-        
-        for item in itens_recebidos:
-            # Usar item diretamente do modelo unificado
-            if not item.item:
-                messages.error(request, f'Item não encontrado para {item.transferencia.codigo}')
-                continue
-            item_obj = item.item
-            
-            # Criar movimento de entrada (destino) - apenas entrada, pois a saída já foi criada na origem
-            if tipo_entrada:
-                MovimentoItem.objects.create(
-                    item=item_obj,
-                    sucursal=transferencia.sucursal_destino,
-                    tipo_movimento=tipo_entrada,
-                    quantidade=item.quantidade_recebida,
-                    preco_unitario=item_obj.preco_custo,
-                    referencia=f'Recebimento {transferencia.codigo}',
-                    observacoes=f'Confirmação de recebimento da transferência {transferencia.codigo}',
-                    usuario=request.user
-                )
+        # Recebimento inteiro validado e lançado num só lote
+        try:
+            receber_transferencia(transferencia, _quantidades_do_formulario(request.POST), usuario=request.user)
+        except RecebimentoInvalidoError as e:
+            for erro in e.erros.values():
+                messages.error(request, erro)
+            return redirect('stock:transferencias:receber', id=id)
+        except DocumentoJaRecebidoError:
+            messages.error(request, 'Esta transferência não está pronta para recebimento.')
         
         return redirect('stock:transferencias:detail', id=id)
     
@@ -469,6 +483,40 @@ def transferencia_receber(request, id):
     return render(request, 'stock/transferencias/receber.html', context)
 
 
+@login_required
+@require_stock_access
+@require_http_methods(["POST"])
+def transferencia_receber_lote(request, id):
+    """
+    API: recebe a transferência inteira de uma vez. O corpo é JSON
+    {id do item da transferência: quantidade recebida}.
+    """
+    transferencia = get_object_or_404(TransferenciaStock.objects.select_related('sucursal_destino'), id=id)
+    if not _pode_receber(request, transferencia):
+        return JsonResponse({'success': False, 'error': 'Sem permissão para receber esta transferência'}, status=403)
+    
+    try:
+        quantidades = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'JSON inválido'}, status=400)
+    if not isinstance(quantidades, dict):
+        return JsonResponse({'success': False, 'error': 'Esperado {linha: quantidade}'}, status=400)
+    
+    try:
+        movimentos = receber_transferencia(transferencia, quantidades, usuario=request.user)
+    except RecebimentoInvalidoError as e:
+        return JsonResponse({'success': False, 'erros': {str(k): v for k, v in e.erros.items()}}, status=400)
+    except DocumentoJaRecebidoError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=409)
+    
+    return JsonResponse({
+        'success': True,
+        'codigo': transferencia.codigo,
+        'status': transferencia.status,
+        'movimentos': len(movimentos),
+    })
+
+
 @login_required
 @require_stock_access
 def transferencia_cancelar(request, id):
@@ -485,8 +533,10 @@ def transferencia_cancelar(request, id):
         messages.error(request, 'Esta transferência não pode ser cancelada.')
         return redirect('stock:transferencias:detail', id=id)
     
-    transferencia.status = 'CANCELADA'
-    transferencia.save()
+    with transaction.atomic():
+        libertar(transferencia.reservas.all())
+        transferencia.status = 'CANCELADA'
+        transferencia.save()
     
     messages.success(request, f'Transferência {transferencia.codigo} cancelada.')
     return redirect('stock:transferencias:detail', id=id)
@@ -510,40 +560,31 @@ def verificar_stock_sucursais(request):
         # Usuários normais só veem suas sucursais
         sucursais = sucursais_permitidas
     
+    # Linhas em stock de todas as sucursais numa só consulta, separadas em Python
+    linhas_stock = {}
+    for stock in StockItem.objects.filter(
+        sucursal__in=sucursais,
+        quantidade_atual__gt=0
+    ).select_related('item').order_by('item__tipo', 'item__nome'):
+        linhas_stock.setdefault((stock.sucursal_id, stock.item.tipo), []).append(stock)
+    
+    # Totais e valor (valor_estoque do ledger) da matriz por sucursal
+    totais = {linha['sucursal_id']: linha for linha in matriz_sucursais([s.id for s in sucursais])}
+    
     # Dados de stock por sucursal
     dados_stock = []
     
     for sucursal in sucursais:
-        # Stock unificado de itens
-        itens_stock = StockItem.objects.filter(
-            sucursal=sucursal,
-            quantidade_atual__gt=0
-        ).select_related('item').order_by('item__tipo', 'item__nome')
-        
-        # Separar produtos e materiais
-        produtos_stock = itens_stock.filter(item__tipo='PRODUTO')
-        materiais_stock = itens_stock.filter(item__tipo='MATERIAL')
-        
-        # Calcular totais
-        total_produtos = produtos_stock.count()
-        total_materiais = materiais_stock.count()
-        total_itens = total_produtos + total_materiais
-        
-        # Valor total do stock (aproximado)
-        valor_total = sum(
-            stock.quantidade_atual * stock.item.preco_custo 
-            for stock in itens_stock
-        )
-        
+        linha = totais.get(sucursal.id, {})
         dados_stock.append({
             'sucursal': sucursal,
-            'produtos': produtos_stock,
-            'materiais': materiais_stock,
-            'total_produtos': total_produtos,
-            'total_materiais': total_materiais,
-            'total_itens': total_itens,
-            'valor_total': valor_total,
-            'tem_stock': total_itens > 0
+            'produtos': linhas_stock.get((sucursal.id, 'PRODUTO'), []),
+            'materiais': linhas_stock.get((sucursal.id, 'MATERIAL'), []),
+            'total_produtos': linha.get('produtos', 0),
+            'total_materiais': linha.get('materiais', 0),
+            'total_itens': linha.get('total_itens', 0),
+            'valor_total': linha.get('valor_estoque', 0),
+            'tem_stock': linha.get('total_itens', 0) > 0
         })
     
     # Ordenar por sucursal com stock primeiro
@@ -561,6 +602,81 @@ def verificar_stock_sucursais(request):
     return render(request, 'stock/transferencias/verificar_stock.html', context)
 
 
+def _sucursais_da_matriz(request):
+    """
+    Ids das sucursais pedidas em ?sucursais=1,2 que o utilizador pode ver
+    (todas as que pode ver, sem o parâmetro), ou levanta ValueError
+    """
+    permitidas = {s.id for s in get_user_sucursais(request, for_modification=False)}
+    pedidas = request.GET.get('sucursais', '').strip()
+    if not pedidas:
+        return permitidas
+    return {int(sucursal_id) for sucursal_id in pedidas.split(',')} & permitidas
+
+
+@login_required
+@require_stock_access
+@resposta_condicional('stock', 'catalogo', 'sucursais', max_age=0)
+def matriz_stock_api(request):
+    """
+    API: matriz itens × sucursais (quantidade, disponível, valor), paginada
+    por id do item: ?depois=<cursor>&tamanho=<n, até 1000>&sucursais=1,2.
+    Cada coluna de um item é uma lista com uma posição por sucursal, em texto
+    decimal (quantidades com 3 casas, valor com 2).
+    """
+    try:
+        sucursais_ids = _sucursais_da_matriz(request)
+        depois = int(request.GET.get('depois') or 0)
+        tamanho = min(max(int(request.GET.get('tamanho') or 200), 1), 1000)
+    except ValueError:
+        return JsonResponse({'error': 'Parâmetros inválidos'}, status=400)
+    
+    sucursais, linhas, seguinte = matriz_stock.pagina(sucursais_ids, depois=depois, tamanho=tamanho)
+    return JsonResponse({
+        'sucursais': [{'id': s.id, 'nome': s.nome} for s in sucursais],
+        'colunas': matriz_stock.COLUNAS,
+        'itens': [
+            {'id': item_id, 'codigo': codigo, 'nome': nome, 'tipo': tipo, **dict(zip(matriz_stock.COLUNAS, colunas))}
+            for (item_id, codigo, nome, tipo), *colunas in linhas
+        ],
+        'seguinte': seguinte,
+    })
+
+
+class _Eco:
+    """Ficheiro que devolve o que lhe escrevem, para o csv.writer gerar linhas em streaming"""
+
+    def write(self, valor):
+        return valor
+
+
+def _linhas_csv(sucursais, linhas):
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(['Código', 'Item', 'Tipo'] + [
+        f'{sucursal.nome} - {coluna}' for sucursal in sucursais for coluna in ('Quantidade', 'Disponível', 'Valor')
+    ])
+    for (_, codigo, nome, tipo), quantidades, disponiveis, valores in linhas:
+        celulas = []
+        for quantidade, disponivel, valor in zip(quantidades, disponiveis, valores):
+            celulas += [f'{quantidade:.3f}', f'{disponivel:.3f}', f'{valor:.2f}']
+        yield escritor.writerow([codigo, nome, tipo] + celulas)
+
+
+@login_required
+@require_stock_access
+def matriz_stock_csv(request):
+    """Matriz itens × sucursais completa em CSV, gerada em streaming a partir do cache"""
+    try:
+        sucursais_ids = _sucursais_da_matriz(request)
+    except ValueError:
+        return JsonResponse({'error': 'Parâmetros inválidos'}, status=400)
+    
+    sucursais, linhas = matriz_stock.percorrer(sucursais_ids)
+    response = StreamingHttpResponse(_linhas_csv(sucursais, linhas), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="matriz_stock_{timezone.localdate():%Y%m%d}.csv"'
+    return response
+
+
 @login_required
 @require_stock_access
 def guia_transferencia(request, id):
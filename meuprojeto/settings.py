@@ -85,6 +85,31 @@ DATABASES = {
 }
 
 
+# Cache (métricas das páginas de stock, services/metricas_cache.py)
+# Em ficheiros para ser partilhado pelos vários processos do servidor: as
+# invalidações feitas por um processo são vistas pelos restantes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+}
+
+STOCK_METRICAS_TTL = 300
+
+# Eventos dos dashboards (SSE, só com ASGI): verificação das versões entre
+# eventos e duração máxima de cada ligação, em segundos
+DASHBOARD_SSE_INTERVALO = 15
+DASHBOARD_SSE_DURACAO = 600
+
+# Dados de referência (services/dados_referencia): segundos entre verificações
+# do carimbo partilhado por cada processo
+REFERENCIA_VERIFICACAO = 5
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
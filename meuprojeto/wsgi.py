@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'meuprojeto.settings')
 
 application = get_wsgi_application()
+
+# Pré-carregar os dados de referência (tipos, feriados, sucursais, ...)
+from meuprojeto.empresa.services.dados_referencia import aquecer  # noqa: E402
+
+aquecer()